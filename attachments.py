@@ -0,0 +1,217 @@
+"""
+Application: Maitenotas
+Made by Taksan Tong
+https://github.com/maitelab/maitenotas
+
+Files attached to journals. Fernet has no streaming mode, so a file is cut in
+chunks of a fixed size and every chunk is encrypted (and authenticated) on its
+own. The clear data of a chunk starts with the attachment id, its position and
+a last chunk flag, so chunks can not be moved, swapped between attachments or
+dropped from the end without the reader noticing. Files are written and read a
+few chunks at a time, the memory used does not depend on the size of the file """
+import sqlite3
+import struct
+from typing import Callable, Iterator, List, Tuple
+from cryptography.fernet import Fernet
+from crypto import encrypt_data, decrypt_data, encrypt_text_to_data
+
+# ***************** SQL
+SQL_CREATE_ATTACHMENT_TABLE = """
+CREATE TABLE IF NOT EXISTS attachment (
+    id integer PRIMARY KEY AUTOINCREMENT,
+    journal_id integer NOT NULL,
+    attachment_name blob NOT NULL,
+    size integer NOT NULL,
+    complete integer NOT NULL DEFAULT 0
+); """
+
+SQL_CREATE_ATTACHMENT_JOURNAL_INDEX = """
+CREATE INDEX IF NOT EXISTS attachment_journal
+ON attachment(journal_id); """
+
+SQL_CREATE_ATTACHMENT_CHUNK_TABLE = """
+CREATE TABLE IF NOT EXISTS attachment_chunk (
+    attachment_id integer NOT NULL,
+    seq integer NOT NULL,
+    chunk_data blob NOT NULL,
+    PRIMARY KEY (attachment_id, seq)
+) WITHOUT ROWID; """
+
+SQL_INSERT_ATTACHMENT = """
+INSERT INTO attachment(journal_id,attachment_name,size)
+VALUES(?,?,0)"""
+
+SQL_INSERT_ATTACHMENT_CHUNK = """
+INSERT INTO attachment_chunk(attachment_id,seq,chunk_data)
+VALUES(?,?,?)"""
+
+SQL_COMPLETE_ATTACHMENT = """
+update attachment
+set size=?,complete=1
+where id=?
+"""
+
+SQL_READ_ATTACHMENTS = """
+select id,attachment_name,size
+from attachment
+where journal_id=? and complete=1
+order by id
+"""
+
+SQL_READ_ATTACHMENT_SIZE = """
+select size
+from attachment
+where id=? and complete=1
+"""
+
+SQL_READ_ATTACHMENT_CHUNKS = """
+select seq,chunk_data
+from attachment_chunk
+where attachment_id=? and seq>=?
+order by seq
+limit ?
+"""
+
+SQL_DELETE_ATTACHMENT = """
+delete from attachment
+where id=?
+"""
+
+SQL_DELETE_ATTACHMENT_CHUNKS = """
+delete from attachment_chunk
+where attachment_id=?
+"""
+
+SQL_READ_JOURNAL_ATTACHMENT_IDS = """
+select id
+from attachment
+where journal_id=?
+"""
+
+SQL_READ_ORPHAN_ATTACHMENT_IDS = """
+select id
+from attachment
+where complete=0 or journal_id not in (select id from journal)
+"""
+
+SQL_DELETE_ORPHAN_ATTACHMENT_CHUNKS = """
+delete from attachment_chunk
+where attachment_id not in (select id from attachment)
+"""
+
+SQL_READ_ATTACHMENT_BATCH = """
+select id,attachment_name
+from attachment
+where id>?
+order by id
+limit ?
+"""
+
+SQL_UPDATE_ATTACHMENT_NAME = """
+update attachment
+set attachment_name=?
+where id=?
+"""
+
+SQL_COUNT_ATTACHMENTS_AFTER = """
+select count(*)
+from attachment
+where id>?
+"""
+
+SQL_READ_ATTACHMENT_CHUNK_BATCH = """
+select attachment_id,seq,chunk_data
+from attachment_chunk
+where (attachment_id,seq)>(?,?)
+order by attachment_id,seq
+limit ?
+"""
+
+SQL_UPDATE_ATTACHMENT_CHUNK_DATA = """
+update attachment_chunk
+set chunk_data=?
+where attachment_id=? and seq=?
+"""
+
+SQL_COUNT_ATTACHMENT_CHUNKS_AFTER = """
+select count(*)
+from attachment_chunk
+where (attachment_id,seq)>(?,?)
+"""
+
+# size of the clear data of every chunk but the last one
+CHUNK_BYTES = 1024 * 1024
+# chunks written in one transaction, and read from the database at a time
+WRITE_BATCH_SIZE = 8
+READ_BATCH_SIZE = 4
+# start of the clear data of a chunk: attachment id, position, 1 for the last chunk
+CHUNK_HEADER = struct.Struct(">QIB")
+
+def encrypt_chunk(user_key: Fernet, attachment_id: int, seq: int, last: bool,
+                  chunk: bytes) -> bytes:
+    """encrypt a chunk bound to its attachment and position"""
+    return encrypt_data(CHUNK_HEADER.pack(attachment_id, seq, int(last)) + chunk, user_key)
+
+def decrypt_chunk(user_key: Fernet, attachment_id: int, seq: int,
+                  chunk_data: bytes) -> Tuple[bytes, bool]:
+    """decrypt a chunk, return its data and True for the last one, a chunk that
+    does not belong to this attachment and position is an error"""
+    clear_data = decrypt_data(chunk_data, user_key)
+    chunk_attachment_id, chunk_seq, last = CHUNK_HEADER.unpack_from(clear_data)
+    if chunk_attachment_id != attachment_id or chunk_seq != seq:
+        raise ValueError("chunk " + str(seq) + " of attachment " + str(attachment_id) +
+                         " is out of place")
+    return clear_data[CHUNK_HEADER.size:], bool(last)
+
+def insert_attachment(cur: sqlite3.Cursor, user_key: Fernet, journal_id: int,
+                      attachment_name: str) -> int:
+    """create an attachment without chunks, it is not listed until complete_attachment"""
+    cur.execute(SQL_INSERT_ATTACHMENT,
+                (journal_id, encrypt_text_to_data(attachment_name, user_key)))
+    return cur.lastrowid or 0
+
+def insert_chunks(cur: sqlite3.Cursor, attachment_id: int, chunk_rows: List[Tuple[int, bytes]]
+                  ) -> None:
+    """store encrypted chunks (seq, data) of an attachment"""
+    cur.executemany(SQL_INSERT_ATTACHMENT_CHUNK,
+                    [(attachment_id, seq, chunk_data) for seq, chunk_data in chunk_rows])
+
+def complete_attachment(cur: sqlite3.Cursor, attachment_id: int, size: int) -> None:
+    """mark an attachment as written"""
+    cur.execute(SQL_COMPLETE_ATTACHMENT, (size, attachment_id))
+
+def iter_attachment(fetch_all: Callable[[str, tuple], list], user_key: Fernet,
+                    attachment_id: int) -> Iterator[bytes]:
+    """clear data of an attachment chunk by chunk, read with fetch_all in small batches,
+    a missing chunk or a missing end is an error"""
+    next_seq = 0
+    while True:
+        rows = fetch_all(SQL_READ_ATTACHMENT_CHUNKS, (attachment_id, next_seq, READ_BATCH_SIZE))
+        if not rows:
+            raise ValueError("attachment " + str(attachment_id) + " is incomplete")
+        for _, chunk_data in rows:
+            # the position in the header tells if a chunk is missing
+            chunk, last = decrypt_chunk(user_key, attachment_id, next_seq, chunk_data)
+            yield chunk
+            if last:
+                return
+            next_seq = next_seq + 1
+
+def delete_attachment(cur: sqlite3.Cursor, attachment_id: int) -> None:
+    """remove an attachment and its chunks"""
+    cur.execute(SQL_DELETE_ATTACHMENT_CHUNKS, (attachment_id,))
+    cur.execute(SQL_DELETE_ATTACHMENT, (attachment_id,))
+
+def delete_journal_attachments(cur: sqlite3.Cursor, journal_id: int) -> None:
+    """remove the attachments of a journal"""
+    for row in cur.execute(SQL_READ_JOURNAL_ATTACHMENT_IDS, (journal_id,)).fetchall():
+        delete_attachment(cur, row[0])
+
+def delete_orphan_attachments(cur: sqlite3.Cursor) -> int:
+    """remove attachments of deleted journals, attachments left incomplete by an
+    interrupted write and chunks without attachment, return the attachments removed"""
+    attachment_ids = [row[0] for row in cur.execute(SQL_READ_ORPHAN_ATTACHMENT_IDS).fetchall()]
+    for attachment_id in attachment_ids:
+        delete_attachment(cur, attachment_id)
+    cur.execute(SQL_DELETE_ORPHAN_ATTACHMENT_CHUNKS)
+    return len(attachment_ids)
@@ -0,0 +1,126 @@
+"""
+Application: Maitenotas
+Made by Taksan Tong
+https://github.com/maitelab/maitenotas
+
+Background saving of journal texts """
+import hashlib
+import threading
+from typing import Callable, Dict
+from instrument import report_exception
+
+# seconds between retries of the texts that could not be saved, while nothing new
+# is submitted
+RETRY_SECONDS = 5.0
+
+def text_hash(text: str) -> bytes:
+    """hash of a text, used to know if it changed since it was saved"""
+    return hashlib.blake2b(text.encode(encoding='UTF-8'), digest_size=16).digest()
+
+class AutosaveEngine:
+    """Saves journal texts in a worker thread.
+    Texts submitted for the same journal before the worker reaches them are coalesced
+    into one save, and a text equal to the last saved one is not written at all.
+    save_function returns False (or raises) when it could not write the text, the
+    text is kept and tried again"""
+    def __init__(self, save_function: Callable[[int, str], bool]):
+        self.condition = threading.Condition()
+        # latest unsaved text of each journal, a text stays here while it is saved
+        self.pending: Dict[int, str] = {}
+        # hash of the text stored in the database for each journal
+        self.saved_hashes: Dict[int, bytes] = {}
+        # texts that could not be saved, waiting for a retry
+        self.failed: Dict[int, str] = {}
+        self.running = True
+        # number of texts written, of texts skipped because they did not change and
+        # of saves that failed
+        self.counters = {"saved": 0, "skipped": 0, "failed": 0}
+        self.worker = threading.Thread(target=self.run, args=(save_function,), name="autosave",
+                                       daemon=True)
+        self.worker.start()
+
+    def mark_saved(self, journal_id: int, text: str) -> None:
+        """remember the text stored in the database, usually right after reading it"""
+        saved_hash = text_hash(text)
+        with self.condition:
+            self.saved_hashes[journal_id] = saved_hash
+
+    def forget(self, journal_id: int) -> None:
+        """drop everything known about a journal, used when it is deleted"""
+        with self.condition:
+            self.pending.pop(journal_id, None)
+            self.failed.pop(journal_id, None)
+            self.saved_hashes.pop(journal_id, None)
+
+    def submit(self, journal_id: int, text: str) -> None:
+        """queue a text to be saved, it replaces any unsaved text of the same journal"""
+        with self.condition:
+            self.pending[journal_id] = text
+            self.failed.pop(journal_id, None)
+            self.condition.notify_all()
+
+    def wait(self, journal_id: int) -> None:
+        """wait until the queued text of a journal is in the database"""
+        with self.condition:
+            while journal_id in self.pending:
+                self.condition.wait()
+
+    def retry_failed(self) -> None:
+        """queue again the texts that could not be saved, called with the condition held"""
+        for journal_id, text in self.failed.items():
+            self.pending.setdefault(journal_id, text)
+        self.failed.clear()
+        self.condition.notify_all()
+
+    def flush(self) -> bool:
+        """try again the texts that failed and wait until every queued text is saved,
+        return False if some text could not be saved"""
+        with self.condition:
+            self.retry_failed()
+            while self.pending:
+                self.condition.wait()
+            return not self.failed
+
+    def stop(self) -> bool:
+        """save everything queued and end the worker thread, return False if some
+        text could not be saved"""
+        saved = self.flush()
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        self.worker.join()
+        return saved
+
+    def run(self, save_function: Callable[[int, str], bool]) -> None:
+        """worker thread loop"""
+        while True:
+            with self.condition:
+                while self.running and not self.pending:
+                    # a wait that times out with failed texts is the time to retry them
+                    if not self.condition.wait(RETRY_SECONDS if self.failed else None) and \
+                            self.failed:
+                        self.retry_failed()
+                if not self.pending:
+                    return
+                journal_id, text = next(iter(self.pending.items()))
+                saved_hash = self.saved_hashes.get(journal_id)
+            new_hash = text_hash(text)
+            saved = new_hash == saved_hash
+            if saved:
+                self.counters["skipped"] += 1
+            else:
+                try:
+                    saved = save_function(journal_id, text)
+                except Exception as exception:
+                    report_exception("autosave.save", exception)
+                self.counters["saved" if saved else "failed"] += 1
+            with self.condition:
+                if saved:
+                    self.saved_hashes[journal_id] = new_hash
+                # a newer text submitted meanwhile stays queued, a journal forgotten
+                # meanwhile is not kept
+                if self.pending.get(journal_id) == text:
+                    del self.pending[journal_id]
+                    if not saved:
+                        self.failed[journal_id] = text
+                self.condition.notify_all()
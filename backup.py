@@ -0,0 +1,611 @@
+"""
+Application: Maitenotas
+Made by Taksan Tong
+https://github.com/maitelab/maitenotas
+
+Incremental backups of a database into a directory. The first backup is a full
+copy of the database file, the next ones are small files with the rows written
+since the previous backup, found with the version that the triggers of sync give
+every changed book and journal and with the tombstones of deleted journals. The
+rows are copied as stored, encrypted, so no password is needed to back up or to
+restore. A manifest lists the chain of files with their versions and hashes,
+restore copies the last full backup and replays the incremental files after it """
+import base64
+import gzip
+import hashlib
+import json
+import os
+import re
+import shutil
+import sqlite3
+import tempfile
+import time
+from typing import Any, BinaryIO, Dict, List, Optional, Set, cast
+import attachments
+import chunks
+import revisions
+import search
+import storage
+import sync
+from transfer import write_record, read_record
+from workingcopy import LOCK_SUFFIX
+
+# ***************** SQL
+SQL_READ_CHANGED_BOOK_ROWS = """
+select *
+from book
+where version>?
+"""
+
+SQL_READ_CHANGED_JOURNAL_ROWS = """
+select *
+from journal
+where version>?
+order by id
+"""
+
+SQL_READ_NEW_CHUNK_ROWS = """
+select *
+from journal_chunk
+where journal_id=? and version>?
+"""
+
+SQL_READ_REVISION_NUMBERS = """
+select revision
+from journal_revision
+where journal_id=?
+order by revision
+"""
+
+SQL_READ_NEW_REVISION_ROWS = """
+select *
+from journal_revision
+where journal_id=? and version>?
+"""
+
+SQL_READ_RESTORED_CHUNKS = """
+select chunk_hash,chunk_data,version
+from journal_chunk
+where journal_id=?
+"""
+
+SQL_INSERT_RESTORED_CHUNK = """
+INSERT INTO journal_chunk(journal_id,seq,chunk_hash,chunk_data)
+VALUES(?,?,?,?)"""
+
+SQL_DELETE_RESTORED_REVISION = """
+delete from journal_revision
+where journal_id=? and revision=?
+"""
+
+SQL_COUNT_RESTORED_CHUNKS = """
+select count(*)
+from journal_chunk
+where journal_id=?
+"""
+
+SQL_COUNT_RESTORED_REVISIONS = """
+select count(*)
+from journal_revision
+where journal_id=?
+"""
+
+SQL_READ_CHANGED_TOMBSTONE_ROWS = """
+select *
+from tombstone
+where version>?
+"""
+
+SQL_READ_COMPLETE_ATTACHMENT_IDS = """
+select id
+from attachment
+where complete=1
+order by id
+"""
+
+SQL_READ_ATTACHMENT_ROW = """
+select *
+from attachment
+where id=?
+"""
+
+SQL_READ_SYNC_PEER_ROWS = """
+select *
+from sync_peer
+"""
+
+SQL_READ_METADATA_ROWS = """
+select *
+from metadata
+where name<>?
+"""
+
+SQL_READ_METADATA_NAMES = """
+select name
+from metadata
+"""
+
+SQL_READ_JOURNAL_ID_BY_UID = """
+select id
+from journal
+where uid=?
+"""
+
+SQL_RESTAMP_BOOK = """
+update book
+set version=?,modified=?,origin=?
+where id=?
+"""
+
+SQL_RESTAMP_JOURNAL = """
+update journal
+set version=?,modified=?,origin=?
+where id=?
+"""
+
+SQL_RESTAMP_CHUNK = """
+update journal_chunk
+set version=?
+where journal_id=? and seq=?
+"""
+
+SQL_RESTAMP_REVISION = """
+update journal_revision
+set version=?
+where journal_id=? and revision=?
+"""
+
+SQL_READ_ALL_ATTACHMENT_IDS = """
+select id
+from attachment
+"""
+
+SQL_COUNT_RESTORED_JOURNALS = """
+select count(*)
+from journal
+"""
+
+# files of a backup directory: the manifest and one file per backup, named by its
+# sequence number, an incremental file is a gzip stream of length prefixed records:
+#   BACKUP_MAGIC, header (json), one record per row, end record with the row count
+MANIFEST_NAME = "backup.json"
+FULL_SUFFIX = ".full"
+INCREMENTAL_SUFFIX = ".incremental"
+TEMPORARY_SUFFIX = ".tmp"
+BACKUP_MAGIC = b"MAITENOTAS-BACKUP-1\n"
+FILE_NAME_FORMAT = "{:06d}{}"
+KIND_FULL = "full"
+KIND_INCREMENTAL = "incremental"
+# small files, the encrypted values do not compress
+GZIP_LEVEL = 6
+# tables an incremental file can write, the columns are checked against the schema
+RESTORED_TABLES = ("book", "journal", "journal_chunk", "journal_revision", "attachment",
+                   "attachment_chunk", "tombstone", "sync_peer", "metadata")
+COLUMN_NAME_PATTERN = re.compile(r"^[a-z_]+$")
+# the tree snapshot is made again when the restored diary is opened, and the search
+# index is rebuilt by the first search
+SKIPPED_METADATA = storage.METADATA_TREE_SNAPSHOT
+# an incremental file has the whole metadata table, the names missing from it were
+# deleted from the database, except these that are not written or are removed later
+KEPT_METADATA = (storage.METADATA_TREE_SNAPSHOT, storage.METADATA_SEARCH_INDEX_READY)
+HASH_BLOCK_BYTES = 1024 * 1024
+
+def file_sha256(file_name: str) -> str:
+    """hash of a backup file"""
+    digest = hashlib.sha256()
+    with open(file_name, "rb") as backup_file:
+        for block in iter(lambda: backup_file.read(HASH_BLOCK_BYTES), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def open_incremental(file_name: str, mode: str) -> BinaryIO:
+    """open an incremental file for reading ("rb") or writing ("wb")"""
+    return cast(BinaryIO, gzip.open(file_name, mode, compresslevel=GZIP_LEVEL))
+
+def sync_file(file_name: str) -> None:
+    """make sure a file is on the disk before it is renamed into the chain"""
+    with open(file_name, "rb+") as written_file:
+        os.fsync(written_file.fileno())
+
+def read_manifest(directory: str) -> Dict[str, Any]:
+    """manifest of a backup directory, empty if there are no backups yet"""
+    manifest_name = os.path.join(directory, MANIFEST_NAME)
+    if not os.path.exists(manifest_name):
+        return {"files": []}
+    with open(manifest_name, "r", encoding="UTF-8") as manifest_file:
+        return json.load(manifest_file)
+
+def write_manifest(directory: str, manifest: Dict[str, Any]) -> None:
+    """replace the manifest, a crash leaves the old one (and an unlisted file)"""
+    manifest_name = os.path.join(directory, MANIFEST_NAME)
+    with open(manifest_name + TEMPORARY_SUFFIX, "w", encoding="UTF-8") as manifest_file:
+        json.dump(manifest, manifest_file, indent=1)
+    sync_file(manifest_name + TEMPORARY_SUFFIX)
+    os.replace(manifest_name + TEMPORARY_SUFFIX, manifest_name)
+
+def key_check(cur: sqlite3.Cursor) -> str:
+    """hash of the password book and of the old key of an unfinished change of password,
+    it changes with the password and when the change finishes: a change of password
+    encrypts every row again without new versions, the next backup must be full"""
+    digest = hashlib.sha256()
+    row = cur.execute(storage.SQL_READ_BOOK_NAME, (storage.PASSWORD_BOOK_ID,)).fetchone()
+    digest.update(bytes(row[0]) if row is not None else b"")
+    digest.update(storage.read_metadata(cur, storage.METADATA_REKEY_OLD_KEY) or b"")
+    return digest.hexdigest()
+
+def backup_state(cur: sqlite3.Cursor) -> Dict[str, Any]:
+    """what the next incremental backup starts from"""
+    return {"version": sync.read_change_counter(cur), "replica_id": sync.read_replica_id(cur),
+            "key_check": key_check(cur),
+            "attachments": [row[0] for row in
+                            cur.execute(SQL_READ_COMPLETE_ATTACHMENT_IDS).fetchall()]}
+
+def encode_row(table: str, cur: sqlite3.Cursor, row: tuple) -> bytes:
+    """record of a row read by cur with select *, blobs in base64"""
+    values: Dict[str, Any] = {}
+    blob_columns = []
+    for column, value in zip([column[0] for column in cur.description], row):
+        if isinstance(value, bytes):
+            value = base64.b64encode(value).decode("ascii")
+            blob_columns.append(column)
+        values[column] = value
+    return json.dumps({"table": table, "row": values, "blobs": blob_columns}).encode("UTF-8")
+
+class IncrementalWriter:
+    """Writes the records of an incremental backup and counts them"""
+    def __init__(self, backup_file: BinaryIO, cur: sqlite3.Cursor):
+        self.backup_file = backup_file
+        self.cur = cur
+        self.rows = 0
+
+    def write_rows(self, table: str, sql: str, parameters: tuple) -> List[tuple]:
+        """write the rows of a select * on table, return them"""
+        rows = self.cur.execute(sql, parameters).fetchall()
+        # encode_row reads the column names of the last statement of the cursor
+        for row in rows:
+            write_record(self.backup_file, encode_row(table, self.cur, row))
+        self.rows = self.rows + len(rows)
+        return rows
+
+    def write_journal_parts(self, journal_id: int, since: int) -> None:
+        """write the chunks and the revisions of a changed journal: the list of all of
+        them and the rows written after version since, the others are in the backups
+        before this one (a chunk is found by its hash, it may have moved)"""
+        layout = [[seq, base64.b64encode(chunk_hash).decode("ascii")] for seq, chunk_hash in
+                  self.cur.execute(chunks.SQL_READ_CHUNK_HASHES, (journal_id,)).fetchall()]
+        write_record(self.backup_file, json.dumps({"layout": journal_id, "chunks": layout}
+                                                  ).encode("UTF-8"))
+        self.write_rows("journal_chunk", SQL_READ_NEW_CHUNK_ROWS, (journal_id, since))
+        kept = [row[0] for row in
+                self.cur.execute(SQL_READ_REVISION_NUMBERS, (journal_id,)).fetchall()]
+        write_record(self.backup_file, json.dumps({"revisions": journal_id, "kept": kept}
+                                                  ).encode("UTF-8"))
+        self.write_rows("journal_revision", SQL_READ_NEW_REVISION_ROWS, (journal_id, since))
+        self.rows = self.rows + 2
+
+    def write_attachment(self, attachment_id: int) -> None:
+        """write an attachment, its chunks are read a few at a time"""
+        self.write_rows("attachment", SQL_READ_ATTACHMENT_ROW, (attachment_id,))
+        next_seq = 0
+        while True:
+            rows = self.cur.execute(attachments.SQL_READ_ATTACHMENT_CHUNKS,
+                                    (attachment_id, next_seq,
+                                     attachments.READ_BATCH_SIZE)).fetchall()
+            if not rows:
+                return
+            for seq, chunk_data in rows:
+                write_record(self.backup_file, json.dumps(
+                    {"table": "attachment_chunk", "blobs": ["chunk_data"],
+                     "row": {"attachment_id": attachment_id, "seq": seq,
+                             "chunk_data": base64.b64encode(chunk_data).decode("ascii")}}
+                    ).encode("UTF-8"))
+                next_seq = seq + 1
+            self.rows = self.rows + len(rows)
+
+def backup_full(session: storage.StorageSession, file_name: str) -> None:
+    """copy the database to file_name with the backup API of sqlite"""
+    temporary_name = file_name + TEMPORARY_SUFFIX
+    if os.path.exists(temporary_name):
+        os.remove(temporary_name)
+    target = sqlite3.connect(temporary_name)
+    try:
+        with session.lock:
+            conn = session.connect()
+            if conn is None:
+                raise sqlite3.OperationalError("unable to open database " + session.dbfile)
+            conn.backup(target)
+    finally:
+        target.close()
+    sync_file(temporary_name)
+    os.replace(temporary_name, file_name)
+
+def backup_incremental(session: storage.StorageSession, file_name: str, header: Dict[str, Any],
+                       previous_attachments: List[int]) -> Optional[Dict[str, Any]]:
+    """write the rows changed after the version of header, return the state of the
+    database it brings a restore to, None if nothing changed"""
+    temporary_name = file_name + TEMPORARY_SUFFIX
+    # one read transaction, the file is a consistent picture of the changes
+    with session.transaction() as cur:
+        state = backup_state(cur)
+        if state["version"] == header["base_version"] and \
+                state["attachments"] == previous_attachments:
+            return None
+        since = header["base_version"]
+        with open_incremental(temporary_name, "wb") as backup_file:
+            backup_file.write(BACKUP_MAGIC)
+            write_record(backup_file, json.dumps(dict(header, version=state["version"],
+                                                      attachments=state["attachments"])
+                                                 ).encode("UTF-8"))
+            writer = IncrementalWriter(backup_file, cur)
+            writer.write_rows("book", SQL_READ_CHANGED_BOOK_ROWS, (since,))
+            journal_rows = writer.write_rows("journal", SQL_READ_CHANGED_JOURNAL_ROWS, (since,))
+            id_position = [column[0] for column in cur.description].index("id")
+            for journal_row in journal_rows:
+                writer.write_journal_parts(journal_row[id_position], since)
+            writer.write_rows("tombstone", SQL_READ_CHANGED_TOMBSTONE_ROWS, (since,))
+            known_attachments = set(previous_attachments)
+            for attachment_id in state["attachments"]:
+                if attachment_id not in known_attachments:
+                    writer.write_attachment(attachment_id)
+            writer.write_rows("sync_peer", SQL_READ_SYNC_PEER_ROWS, ())
+            writer.write_rows("metadata", SQL_READ_METADATA_ROWS, (SKIPPED_METADATA,))
+            write_record(backup_file, json.dumps({"end": writer.rows}).encode("UTF-8"))
+    sync_file(temporary_name)
+    os.replace(temporary_name, file_name)
+    return state
+
+def backup_database(session: storage.StorageSession, directory: str,
+                    full: bool = False) -> Dict[str, Any]:
+    """back up a database into directory: a full copy the first time, with full, or
+    when the previous backups can not be continued (another database, a new
+    password), otherwise the rows changed since the last backup. Return what was
+    written, the file is None when nothing changed"""
+    os.makedirs(directory, exist_ok=True)
+    manifest = read_manifest(directory)
+    entries = manifest["files"]
+    last = entries[-1] if entries else None
+    sequence = last["sequence"] + 1 if last is not None else 1
+    with session.transaction() as cur:
+        state = backup_state(cur)
+    if last is None or state["replica_id"] != last["replica_id"] or \
+            state["key_check"] != last["key_check"] or state["version"] < last["version"]:
+        full = True
+    started = time.monotonic()
+    if full or last is None:
+        file_name = FILE_NAME_FORMAT.format(sequence, FULL_SUFFIX)
+        backup_full(session, os.path.join(directory, file_name))
+        # the state is read from the copy, the database may have changed meanwhile
+        copy = sqlite3.connect(os.path.join(directory, file_name))
+        try:
+            state = backup_state(copy.cursor())
+        finally:
+            copy.close()
+        kind = KIND_FULL
+    else:
+        file_name = FILE_NAME_FORMAT.format(sequence, INCREMENTAL_SUFFIX)
+        header = {"sequence": sequence, "base_version": last["version"],
+                  "created": int(time.time())}
+        new_state = backup_incremental(session, os.path.join(directory, file_name), header,
+                                       last["attachments"])
+        if new_state is None:
+            return {"file": None, "kind": KIND_INCREMENTAL, "version": last["version"],
+                    "bytes": 0, "seconds": round(time.monotonic() - started, 3)}
+        state = new_state
+        kind = KIND_INCREMENTAL
+    file_path = os.path.join(directory, file_name)
+    entry = dict(state, sequence=sequence, kind=kind, file=file_name,
+                 base_version=last["version"] if kind == KIND_INCREMENTAL and last else None,
+                 size=os.path.getsize(file_path), sha256=file_sha256(file_path),
+                 created=int(time.time()))
+    entries.append(entry)
+    write_manifest(directory, manifest)
+    return {"file": file_name, "kind": kind, "version": state["version"], "bytes": entry["size"],
+            "seconds": round(time.monotonic() - started, 3)}
+
+def check_entry(directory: str, entry: Dict[str, Any]) -> None:
+    """raise ValueError if a file of the chain is missing or was changed"""
+    file_path = os.path.join(directory, entry["file"])
+    if not os.path.exists(file_path):
+        raise ValueError("backup file missing " + entry["file"])
+    if os.path.getsize(file_path) != entry["size"] or file_sha256(file_path) != entry["sha256"]:
+        raise ValueError("backup file changed " + entry["file"])
+
+def chain_to(manifest: Dict[str, Any], sequence: Optional[int]) -> List[Dict[str, Any]]:
+    """files to restore the backup sequence (the last one by default): the last full
+    backup up to it and the incremental files after it"""
+    entries = [entry for entry in manifest["files"]
+               if sequence is None or entry["sequence"] <= sequence]
+    if sequence is not None and (not entries or entries[-1]["sequence"] != sequence):
+        raise ValueError("backup " + str(sequence) + " not found")
+    full_positions = [position for position, entry in enumerate(entries)
+                      if entry["kind"] == KIND_FULL]
+    if not full_positions:
+        raise ValueError("no full backup")
+    chain = entries[full_positions[-1]:]
+    for previous, entry in zip(chain, chain[1:]):
+        if entry["base_version"] != previous["version"]:
+            raise ValueError("backup chain broken at " + entry["file"])
+    return chain
+
+def table_columns(cur: sqlite3.Cursor) -> Dict[str, Set[str]]:
+    """columns of the tables an incremental file can write"""
+    return {table: {row[1] for row in cur.execute(f"PRAGMA table_info({table})").fetchall()}
+            for table in RESTORED_TABLES}
+
+def restore_row(cur: sqlite3.Cursor, columns: Dict[str, Set[str]],
+                record: Dict[str, Any]) -> None:
+    """insert or replace the row of a record, the names come from the file so they
+    are checked against the schema before they go into the statement"""
+    table = record["table"]
+    row = record["row"]
+    if table not in columns or not all(COLUMN_NAME_PATTERN.match(column) and
+                                       column in columns[table] for column in row):
+        raise ValueError("invalid backup record for table " + str(table))
+    names = list(row)
+    values = [base64.b64decode(row[name]) if name in record["blobs"] else row[name]
+              for name in names]
+    cur.execute(f"INSERT OR REPLACE INTO {table}({','.join(names)}) "
+                f"VALUES({','.join('?' * len(names))})", values)
+
+def delete_restored_journal(cur: sqlite3.Cursor, journal_id: int) -> None:
+    """remove a journal deleted after the previous backup"""
+    cur.execute(storage.SQL_DELETE_JOURNAL, (journal_id,))
+    chunks.delete_chunks(cur, journal_id)
+    search.remove_journal(cur, journal_id)
+    revisions.delete_revisions(cur, journal_id)
+    attachments.delete_journal_attachments(cur, journal_id)
+
+def restore_layout(cur: sqlite3.Cursor, journal_id: int, layout: List[list]) -> None:
+    """put back the chunks of a journal that the restored database already has in the
+    positions of layout, the new ones follow in the file"""
+    stored = {bytes(chunk_hash): (chunk_data, version) for chunk_hash, chunk_data, version in
+              cur.execute(SQL_READ_RESTORED_CHUNKS, (journal_id,)).fetchall()}
+    chunks.delete_chunks(cur, journal_id)
+    for seq, encoded_hash in layout:
+        chunk_hash = base64.b64decode(encoded_hash)
+        if chunk_hash in stored:
+            chunk_data, version = stored[chunk_hash]
+            cur.execute(SQL_INSERT_RESTORED_CHUNK, (journal_id, seq, chunk_hash, chunk_data))
+            cur.execute(SQL_RESTAMP_CHUNK, (version, journal_id, seq))
+
+def restore_kept_revisions(cur: sqlite3.Cursor, journal_id: int, kept: List[int]) -> None:
+    """remove the revisions of a journal pruned after the previous backup"""
+    kept_revisions = set(kept)
+    for row in cur.execute(SQL_READ_REVISION_NUMBERS, (journal_id,)).fetchall():
+        if row[0] not in kept_revisions:
+            cur.execute(SQL_DELETE_RESTORED_REVISION, (journal_id, row[0]))
+
+def restore_record(cur: sqlite3.Cursor, columns: Dict[str, Set[str]],
+                   record: Dict[str, Any]) -> None:
+    """apply one row of an incremental file. The inserts fire the triggers of sync,
+    the versions and stamps of the rows are written back after them"""
+    table = record["table"]
+    row = record["row"]
+    if table == "attachment":
+        cur.execute(attachments.SQL_DELETE_ATTACHMENT_CHUNKS, (row["id"],))
+    elif table == "tombstone":
+        for journal_row in cur.execute(SQL_READ_JOURNAL_ID_BY_UID, (row["uid"],)).fetchall():
+            delete_restored_journal(cur, journal_row[0])
+    restore_row(cur, columns, record)
+    if table == "book":
+        cur.execute(SQL_RESTAMP_BOOK, (row["version"], row["modified"], row["origin"], row["id"]))
+    elif table == "journal":
+        cur.execute(SQL_RESTAMP_JOURNAL, (row["version"], row["modified"], row["origin"],
+                                          row["id"]))
+    elif table == "journal_chunk":
+        cur.execute(SQL_RESTAMP_CHUNK, (row["version"], row["journal_id"], row["seq"]))
+    elif table == "journal_revision":
+        cur.execute(SQL_RESTAMP_REVISION, (row["version"], row["journal_id"], row["revision"]))
+
+def replay_incremental(cur: sqlite3.Cursor, file_path: str, entry: Dict[str, Any]) -> int:
+    """apply an incremental file in the transaction of cur, return the records
+    applied, the counters come back with the metadata at the end of the file"""
+    columns = table_columns(cur)
+    rows = 0
+    # journals whose chunks and revisions must all be there at the end
+    expected: List[tuple] = []
+    metadata_names: Set[str] = set(KEPT_METADATA)
+    with open_incremental(file_path, "rb") as backup_file:
+        if backup_file.read(len(BACKUP_MAGIC)) != BACKUP_MAGIC:
+            raise ValueError("not a maitenotas backup " + file_path)
+        header_data = read_record(backup_file)
+        header = json.loads(header_data) if header_data is not None else {}
+        if header.get("sequence") != entry["sequence"] or \
+                header.get("base_version") != entry["base_version"]:
+            raise ValueError("backup file out of place " + file_path)
+        while True:
+            record_data = read_record(backup_file)
+            if record_data is None:
+                raise ValueError("truncated backup " + file_path)
+            record = json.loads(record_data)
+            if "end" in record:
+                break
+            if "layout" in record:
+                restore_layout(cur, record["layout"], record["chunks"])
+                expected.append((SQL_COUNT_RESTORED_CHUNKS, record["layout"],
+                                 len(record["chunks"])))
+            elif "revisions" in record:
+                restore_kept_revisions(cur, record["revisions"], record["kept"])
+                expected.append((SQL_COUNT_RESTORED_REVISIONS, record["revisions"],
+                                 len(record["kept"])))
+            else:
+                restore_record(cur, columns, record)
+                if record["table"] == "metadata":
+                    metadata_names.add(record["row"]["name"])
+            rows = rows + 1
+        if record["end"] != rows:
+            raise ValueError("incomplete backup " + file_path)
+    for sql, journal_id, count in expected:
+        if cur.execute(sql, (journal_id,)).fetchone()[0] != count:
+            raise ValueError("journal " + str(journal_id) + " is incomplete in " + file_path)
+    # metadata deleted after the previous backup, like the key of a finished rekey
+    for metadata_row in cur.execute(SQL_READ_METADATA_NAMES).fetchall():
+        if metadata_row[0] not in metadata_names:
+            cur.execute(storage.SQL_DELETE_METADATA, (metadata_row[0],))
+    # attachments removed after the previous backup
+    kept_attachments = set(header["attachments"])
+    for attachment_row in cur.execute(SQL_READ_ALL_ATTACHMENT_IDS).fetchall():
+        if attachment_row[0] not in kept_attachments:
+            attachments.delete_attachment(cur, attachment_row[0])
+    return rows
+
+def restore_backup(directory: str, destination: str,
+                   sequence: Optional[int] = None) -> Dict[str, Any]:
+    """restore the backup sequence (the last one by default) of directory to a new
+    database file destination, every file used is checked against the manifest"""
+    if os.path.exists(destination):
+        raise FileExistsError("the destination exists " + destination)
+    chain = chain_to(read_manifest(directory), sequence)
+    for entry in chain:
+        check_entry(directory, entry)
+    temporary_name = destination + TEMPORARY_SUFFIX
+    if os.path.exists(temporary_name):
+        os.remove(temporary_name)
+    shutil.copyfile(os.path.join(directory, chain[0]["file"]), temporary_name)
+    rows = 0
+    session = storage.StorageSession(temporary_name, journal_mode="DELETE")
+    try:
+        for entry in chain[1:]:
+            with session.transaction() as cur:
+                rows = rows + replay_incremental(cur, os.path.join(directory, entry["file"]),
+                                                 entry)
+        if len(chain) > 1:
+            with session.transaction() as cur:
+                cur.execute(storage.SQL_DELETE_METADATA, (storage.METADATA_TREE_SNAPSHOT,))
+                cur.execute(storage.SQL_DELETE_METADATA, (storage.METADATA_SEARCH_INDEX_READY,))
+        with session.transaction() as cur:
+            version = sync.read_change_counter(cur)
+    finally:
+        session.close()
+        if os.path.exists(temporary_name + LOCK_SUFFIX):
+            os.remove(temporary_name + LOCK_SUFFIX)
+    if version != chain[-1]["version"]:
+        os.remove(temporary_name)
+        raise ValueError("the restored database does not match backup " +
+                         str(chain[-1]["sequence"]))
+    sync_file(temporary_name)
+    os.replace(temporary_name, destination)
+    return {"sequence": chain[-1]["sequence"], "files": len(chain), "rows": rows,
+            "version": version}
+
+def verify_backup(directory: str) -> Dict[str, Any]:
+    """check every file of the manifest and restore the last backup to a temporary
+    file to check the database it gives"""
+    manifest = read_manifest(directory)
+    failed_files = []
+    for entry in manifest["files"]:
+        try:
+            check_entry(directory, entry)
+        except ValueError as exception:
+            failed_files.append(str(exception))
+    result: Dict[str, Any] = {"files": len(manifest["files"]), "failed_files": failed_files}
+    with tempfile.TemporaryDirectory() as work_dir:
+        restored_name = os.path.join(work_dir, "restored.data")
+        result.update(restore_backup(directory, restored_name))
+        restored = sqlite3.connect(restored_name)
+        try:
+            result["sqlite_check"] = restored.execute("PRAGMA integrity_check").fetchone()[0]
+            result["journals"] = restored.execute(SQL_COUNT_RESTORED_JOURNALS).fetchone()[0]
+        finally:
+            restored.close()
+    return result
@@ -0,0 +1,591 @@
+"""
+Application: Maitenotas
+Made by Taksan Tong
+https://github.com/maitelab/maitenotas
+
+Benchmarks of the storage layer, run with: python benchmark.py --help
+The default run builds a synthetic database and times the main code paths on it,
+the results are printed (or written with --output) as JSON, --compare shows them
+next to the JSON of another run, for example of an older version """
+import argparse
+import importlib
+import json
+import math
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from typing import Callable, Dict, List, NamedTuple
+from cryptography.fernet import Fernet
+import crypto
+from crypto import encrypt_text_to_data, decrypt_data_to_text, generate_user_key,\
+    calibrate_iterations, derive_user_key, new_kdf_parameters, encrypt_data, decrypt_data
+import chunks
+import storage
+import transfer
+from titleindex import TitleIndex
+import headless_wx
+from textloader import TextLoader
+
+def time_operation(operation: Callable[[int], object], repetitions: int) -> float:
+    """run operation repetitions times and return the mean latency in milliseconds"""
+    start = time.perf_counter()
+    for counter in range(repetitions):
+        operation(counter)
+    return (time.perf_counter() - start) * 1000 / repetitions
+
+# vocabulary of the synthetic journals, common words repeat like in real prose
+VOCABULARY = ("the a and to of in it was i we my day today went with at for that this"
+              " but not so very after before home work friend family walk coffee rain"
+              " morning evening night letter garden market river book school doctor"
+              " remember tomorrow yesterday called talked about again really long").split()
+
+def synthetic_text(rng: random.Random, length: int) -> str:
+    """prose like text of about length characters"""
+    sentences: List[str] = []
+    size = 0
+    while size < length:
+        words = [rng.choice(VOCABULARY) for _ in range(rng.randint(5, 18))]
+        sentence = " ".join(words).capitalize() + "."
+        sentences.append(sentence)
+        size = size + len(sentence) + 1
+    return " ".join(sentences)[:length]
+
+# statements of the versions that opened a connection per call
+LEGACY_READ_JOURNAL_TEXT = "select journal_text from journal where id=?"
+LEGACY_UPDATE_JOURNAL_TEXT = "update journal set journal_text=? where id=?"
+
+def legacy_get_journal_text(dbfile: str, user_key: Fernet, journal_id: int) -> str:
+    """read a journal text opening and closing a connection, as before StorageSession"""
+    conn = storage.create_connection(dbfile)
+    if conn is None:
+        return ""
+    try:
+        row = conn.execute(LEGACY_READ_JOURNAL_TEXT, (journal_id,)).fetchone()
+        return decrypt_data_to_text(row[0], user_key)
+    finally:
+        conn.close()
+
+def legacy_update_journal_text(dbfile: str, user_key: Fernet, journal_id: int,
+                               new_journal_text: str) -> None:
+    """update a journal text opening and closing a connection, as before StorageSession"""
+    conn = storage.create_connection(dbfile)
+    if conn is None:
+        return
+    try:
+        encrypted_data = encrypt_text_to_data(new_journal_text, user_key)
+        conn.execute(LEGACY_UPDATE_JOURNAL_TEXT, (encrypted_data, journal_id))
+        conn.commit()
+    finally:
+        conn.close()
+
+def benchmark_session(leaf_count: int = 200, repetitions: int = 200) -> Dict[str, float]:
+    """per operation latency with a connection per call against a StorageSession"""
+    user_key = Fernet(Fernet.generate_key())
+    results = {}
+    with tempfile.TemporaryDirectory() as work_dir:
+        # legacy database keeps the default rollback journal
+        legacy_file = os.path.join(work_dir, "legacy.data")
+        legacy = storage.StorageSession(legacy_file, journal_mode="DELETE")
+        legacy.create_database(user_key, "password")
+        book_id = legacy.create_book(user_key, "book")
+        for counter in range(leaf_count):
+            legacy.create_journal(user_key, book_id, 0, f"leaf {counter}", "text " * 200)
+        legacy.close()
+        results["legacy_get_journal_text_ms"] = time_operation(
+            lambda c: legacy_get_journal_text(legacy_file, user_key, c % leaf_count + 1),
+            repetitions)
+        results["legacy_update_journal_text_ms"] = time_operation(
+            lambda c: legacy_update_journal_text(legacy_file, user_key, c % leaf_count + 1,
+                                                 f"new text {c}"), repetitions)
+
+        session = storage.StorageSession(os.path.join(work_dir, "session.data"))
+        session.create_database(user_key, "password")
+        book_id = session.create_book(user_key, "book")
+        for counter in range(leaf_count):
+            session.create_journal(user_key, book_id, 0, f"leaf {counter}", "text " * 200)
+        # without cache first, the cache is measured on its own below
+        session.cache.configure(0, 0)
+        results["session_get_journal_text_ms"] = time_operation(
+            lambda c: session.get_journal_text(user_key, c % leaf_count + 1), repetitions)
+        session.cache.configure(storage.CACHE_MAX_BYTES, storage.CACHE_MAX_ENTRIES)
+        results["session_update_journal_text_ms"] = time_operation(
+            lambda c: session.update_journal_text(user_key, c % leaf_count + 1,
+                                                  f"new text {c}"), repetitions)
+        results["session_get_journal_text_cached_ms"] = time_operation(
+            lambda c: session.get_journal_text(user_key, c % leaf_count + 1), repetitions)
+        results["session_create_journal_ms"] = time_operation(
+            lambda c: session.create_journal(user_key, book_id, 0, "new", "text"), repetitions)
+        session.close()
+    return results
+
+def benchmark_search(note_count: int = 10000, repetitions: int = 50) -> Dict[str, float]:
+    """latency of search_journals over note_count notes"""
+    user_key = Fernet(Fernet.generate_key())
+    words = ["river", "garden", "letter", "winter", "market", "doctor", "school", "travel"]
+    results = {}
+    with tempfile.TemporaryDirectory() as work_dir:
+        session = storage.StorageSession(os.path.join(work_dir, "search.data"))
+        session.create_database(user_key, "password")
+        book_id = session.create_book(user_key, "book")
+        for counter in range(note_count):
+            text = " ".join(words[(counter * 7 + offset) % len(words)] for offset in range(3))
+            session.create_journal(user_key, book_id, 0, f"note {counter}",
+                                   f"{text} unique{counter}")
+        results["search_one_word_ms"] = time_operation(
+            lambda c: session.search_journals(user_key, f"unique{c}"), repetitions)
+        results["search_two_words_ms"] = time_operation(
+            lambda c: session.search_journals(user_key, f"river unique{c}"), repetitions)
+        session.close()
+    return results
+
+def benchmark_key_derivation(repetitions: int = 3) -> Dict[str, float]:
+    """time to derive the user key with the legacy and the calibrated parameters"""
+    iterations = calibrate_iterations()
+    parameters = new_kdf_parameters(iterations)
+    return {
+        "calibrated_iterations": float(iterations),
+        "legacy_generate_user_key_ms": time_operation(
+            lambda c: generate_user_key("password"), repetitions),
+        "calibrated_derive_user_key_ms": time_operation(
+            lambda c: derive_user_key("password", parameters), repetitions),
+    }
+
+def blob_file_size(work_dir: str, file_name: str, blobs: List[bytes]) -> int:
+    """size of a SQLite file holding blobs, like the journal table does"""
+    dbfile = os.path.join(work_dir, file_name)
+    conn = sqlite3.connect(dbfile)
+    conn.execute("create table blobs (id integer PRIMARY KEY, data blob NOT NULL)")
+    conn.executemany("insert into blobs(data) values(?)", [(blob,) for blob in blobs])
+    conn.commit()
+    conn.close()
+    return os.path.getsize(dbfile)
+
+def benchmark_blob_format(note_count: int = 2000, seed: int = 1) -> Dict[str, float]:
+    """size and throughput of plain Fernet blobs against compressed envelopes,
+    notes sizes follow a long tail from a few words to long prose"""
+    rng = random.Random(seed)
+    user_key = Fernet(Fernet.generate_key())
+    notes = [synthetic_text(rng, int(rng.lognormvariate(7, 1.5)) + 20).encode()
+             for _ in range(note_count)]
+    megabytes = sum(len(note) for note in notes) / (1024 * 1024)
+    results = {"plain_text_mb": megabytes}
+    for blob_format, encrypt, decrypt in (
+            ("fernet", user_key.encrypt, user_key.decrypt),
+            ("envelope", lambda d: encrypt_data(d, user_key),
+             lambda d: decrypt_data(d, user_key))):
+        start = time.perf_counter()
+        blobs = [encrypt(note) for note in notes]
+        results[blob_format + "_encrypt_mb_s"] = megabytes / (time.perf_counter() - start)
+        start = time.perf_counter()
+        for blob in blobs:
+            decrypt(blob)
+        results[blob_format + "_decrypt_mb_s"] = megabytes / (time.perf_counter() - start)
+        results[blob_format + "_blobs_mb"] = sum(len(blob) for blob in blobs) / (1024 * 1024)
+        with tempfile.TemporaryDirectory() as work_dir:
+            results[blob_format + "_db_file_mb"] = blob_file_size(work_dir, blob_format,
+                                                           blobs) / (1024 * 1024)
+    return results
+
+def time_big_note(dbfile: str, layout: str, user_key: Fernet, text: str,
+                  repetitions: int) -> Dict[str, float]:
+    """save after a one line edit and read of a big note"""
+    session = storage.StorageSession(dbfile)
+    session.create_database(user_key, "password")
+    big_id = session.create_journal(user_key, session.create_book(user_key, "book"), 0,
+                                    "big", text)
+    results = {
+        layout + "_update_journal_text_ms": time_operation(
+            lambda c: session.update_journal_text(
+                user_key, big_id, text[:len(text) // 2] + f"edit {c}\n" + text[len(text) // 2:]),
+            repetitions),
+        layout + "_get_journal_text_ms": time_operation(
+            lambda c: session.get_journal_text(user_key, big_id), repetitions)}
+    session.close()
+    return results
+
+def benchmark_chunked_save(line_count: int = 20000, repetitions: int = 5,
+                           seed: int = 1) -> Dict[str, float]:
+    """save of a big note after a one line edit, stored inline and in chunks"""
+    rng = random.Random(seed)
+    user_key = Fernet(Fernet.generate_key())
+    text = "\n".join(synthetic_text(rng, rng.randint(20, 200)) for _ in range(line_count))
+    results = {"note_mb": len(text) / (1024 * 1024)}
+    chunked_min_chars = chunks.CHUNKED_MIN_CHARS
+    with tempfile.TemporaryDirectory() as work_dir:
+        for layout, min_chars in (("inline", len(text) * 2), ("chunked", chunked_min_chars)):
+            chunks.CHUNKED_MIN_CHARS = min_chars
+            results.update(time_big_note(os.path.join(work_dir, layout + ".data"), layout,
+                                         user_key, text, repetitions))
+    chunks.CHUNKED_MIN_CHARS = chunked_min_chars
+    return results
+
+def benchmark_large_note_load(line_count: int = 100000, repetitions: int = 5,
+                              seed: int = 1) -> Dict[str, float]:
+    """time until the first piece of a big note can be shown, against reading
+    and decrypting all of it before showing anything"""
+    rng = random.Random(seed)
+    user_key = Fernet(Fernet.generate_key())
+    text = "\n".join(synthetic_text(rng, rng.randint(20, 200)) for _ in range(line_count))
+    results = {"note_mb": len(text) / (1024 * 1024)}
+    with tempfile.TemporaryDirectory() as work_dir:
+        session = storage.StorageSession(os.path.join(work_dir, "large.data"))
+        session.create_database(user_key, "password")
+        big_id = session.create_journal(user_key, session.create_book(user_key, "book"), 0,
+                                        "big", text)
+        def whole_text(_):
+            session.cache.clear()
+            session.get_journal_text(user_key, big_id)
+        results["whole_text_ms"] = time_operation(whole_text, repetitions)
+        first_piece = threading.Event()
+        def deliver(generation: int, _journal_id: int, _piece: str, _finished: bool):
+            first_piece.set()
+            loader.acknowledge(generation)
+        loader = TextLoader(lambda journal_id: session.iter_journal_text(user_key, journal_id),
+                            deliver)
+        def first_piece_ready(_):
+            first_piece.clear()
+            loader.load(big_id)
+            first_piece.wait()
+            loader.cancel()
+        results["first_piece_ms"] = time_operation(first_piece_ready, repetitions)
+        loader.stop()
+        session.close()
+    return results
+
+def benchmark_batch_decrypt(sizes: tuple = (1000, 10000, 100000)) -> Dict[str, float]:
+    """serial against parallel decryption of leaf names, parallel decryption needs
+    more than one CPU (cpu_count is reported), the first parallel run starts the pool"""
+    user_key = Fernet(Fernet.generate_key())
+    results = {"cpu_count": float(os.cpu_count() or 1)}
+    parallel_min_batch = crypto.PARALLEL_MIN_BATCH
+    crypto.PARALLEL_MIN_BATCH = 0
+    for size in sizes:
+        blobs = [encrypt_text_to_data(f"Leaf name {counter}", user_key)
+                 for counter in range(size)]
+        start = time.perf_counter()
+        crypto.decrypt_data_slice(user_key, blobs)
+        results[f"serial_{size}_ms"] = (time.perf_counter() - start) * 1000
+        start = time.perf_counter()
+        crypto.decrypt_data_batch(blobs, user_key)
+        results[f"parallel_{size}_ms"] = (time.perf_counter() - start) * 1000
+    crypto.PARALLEL_MIN_BATCH = parallel_min_batch
+    crypto.shutdown_decrypt_pool()
+    return results
+
+def elapsed_seconds(operation: Callable[[], object]) -> float:
+    """run operation once and return the seconds it took"""
+    start = time.perf_counter()
+    operation()
+    return time.perf_counter() - start
+
+def benchmark_bulk_transfer(note_count: int = 100000, single_count: int = 1000,
+                            seed: int = 1) -> Dict[str, float]:
+    """import and export of a book of note_count notes in a tree of folders,
+    against creating single_count notes one create_journal call at a time"""
+    rng = random.Random(seed)
+    user_key = Fernet(Fernet.generate_key())
+    results = {}
+    with tempfile.TemporaryDirectory() as work_dir:
+        source = os.path.join(work_dir, "source")
+        for counter in range(note_count):
+            folder = os.path.join(source, f"folder {counter // 1000}")
+            os.makedirs(folder, exist_ok=True)
+            with open(os.path.join(folder, f"note {counter}.md"), "w", encoding='UTF-8') as note:
+                note.write(synthetic_text(rng, rng.randint(200, 2000)))
+
+        session = storage.StorageSession(os.path.join(work_dir, "single.data"))
+        session.create_database(user_key, "password")
+        book_id = session.create_book(user_key, "book")
+        texts = [synthetic_text(rng, rng.randint(200, 2000)) for _ in range(single_count)]
+        results["single_create_journal_ms"] = time_operation(
+            lambda c: session.create_journal(user_key, book_id, 0, f"note {c}", texts[c]),
+            single_count)
+        session.close()
+
+        session = storage.StorageSession(os.path.join(work_dir, "bulk.data"))
+        session.create_database(user_key, "password")
+        book_id = session.create_book(user_key, "book")
+        results["import_directory_s"] = elapsed_seconds(
+            lambda: transfer.import_directory(session, user_key, book_id, 0, source))
+        results["import_directory_per_note_ms"] = \
+            results["import_directory_s"] * 1000 / note_count
+        results["export_directory_s"] = elapsed_seconds(
+            lambda: transfer.export_directory(session, user_key, book_id, 0,
+                                              os.path.join(work_dir, "export")))
+        archive_file = os.path.join(work_dir, "book.archive")
+        results["export_archive_s"] = elapsed_seconds(
+            lambda: transfer.export_archive(session, user_key, book_id, 0, archive_file,
+                                            archive_password="archive password"))
+        results["import_archive_s"] = elapsed_seconds(
+            lambda: transfer.import_archive(session, user_key, book_id, 0, archive_file,
+                                            archive_password="archive password"))
+        session.close()
+    return results
+
+def benchmark_title_index(title_count: int = 100000, repetitions: int = 20,
+                          seed: int = 1) -> Dict[str, float]:
+    """quick switcher over title_count names in a random tree: build of the index,
+    lookups after each key of a query (the worst is the first key), a mistyped
+    query and a rename"""
+    rng = random.Random(seed)
+    leafs = [(rng.randint(0, counter - 1) if counter > 1 and rng.random() < 0.9 else 0,
+              counter, " ".join(rng.choice(VOCABULARY)
+                                for _ in range(rng.randint(1, 4))).capitalize() + f" {counter}")
+             for counter in range(1, title_count + 1)]
+    results = {"build_s": elapsed_seconds(lambda: TitleIndex(leafs))}
+    title_index = TitleIndex(leafs)
+    def find_typed(typed: str) -> Callable[[int], object]:
+        return lambda c: title_index.find(typed, 20)
+    query = "garden river"
+    for length in range(1, len(query) + 1):
+        if query[length - 1] != " ":
+            results[f"find_{length}_keys_ms"] = time_operation(find_typed(query[:length]),
+                                                               repetitions)
+    results["find_typo_ms"] = time_operation(
+        lambda c: title_index.find("mornnig cofee", 20), repetitions)
+    results["rename_ms"] = time_operation(
+        lambda c: title_index.rename_title(c + 1, f"renamed {c}"), repetitions)
+    return results
+
+# ***************** synthetic journal suite
+class SyntheticConfig(NamedTuple):
+    """shape of a synthetic database, the same seed always gives the same database"""
+    node_count: int = 10000
+    # children of every journal, and of the book itself
+    fan_out: int = 10
+    # levels of journals below the book
+    max_depth: int = 4
+    # note sizes follow a log normal distribution with this median (in characters)
+    note_median_chars: int = 1500
+    note_size_sigma: float = 1.0
+    seed: int = 1
+    repetitions: int = 50
+
+SYNTHETIC_PASSWORD = "synthetic password"
+# notes are never bigger than this, whatever the distribution gives
+SYNTHETIC_MAX_NOTE_CHARS = 1024 * 1024
+
+def note_size(rng: random.Random, config: SyntheticConfig) -> int:
+    """random size of a note"""
+    size = rng.lognormvariate(math.log(config.note_median_chars), config.note_size_sigma)
+    return min(SYNTHETIC_MAX_NOTE_CHARS, int(size))
+
+def generate_database(dbfile: str, config: SyntheticConfig) -> Fernet:
+    """create a database of config.node_count journals in a tree of config.fan_out
+    children per journal, return the user key"""
+    if sum(config.fan_out ** depth for depth in range(1, config.max_depth + 1)) < \
+            config.node_count:
+        raise ValueError("the tree can not hold " + str(config.node_count) + " journals")
+    rng = random.Random(config.seed)
+    user_key = generate_user_key(SYNTHETIC_PASSWORD)
+    session = storage.StorageSession(dbfile)
+    session.create_database(user_key, SYNTHETIC_PASSWORD)
+    book_id = session.create_book(user_key, "Synthetic book")
+    with session.transaction() as cur:
+        importer = transfer.JournalImporter(session, user_key, cur, book_id)
+        # breadth first, each journal gets its children before the next level starts
+        parents = [(0, 0)]
+        created = 0
+        while created < config.node_count:
+            parent_id, depth = parents.pop(0)
+            for _ in range(min(config.fan_out, config.node_count - created)):
+                created = created + 1
+                journal_id = importer.add(parent_id, f"Journal {created}",
+                                          synthetic_text(rng, note_size(rng, config)))
+                if depth + 1 < config.max_depth:
+                    parents.append((journal_id, depth + 1))
+        importer.flush()
+    session.close()
+    return user_key
+
+def time_samples(operation: Callable[[int], object], repetitions: int) -> List[float]:
+    """latency in milliseconds of each run of operation"""
+    samples = []
+    for counter in range(repetitions):
+        start = time.perf_counter()
+        operation(counter)
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+def summarize(results: Dict[str, float], name: str, samples: List[float]) -> None:
+    """add the median and 95th percentile of samples to results"""
+    ordered = sorted(samples)
+    results[name + "_median_ms"] = statistics.median(ordered)
+    results[name + "_p95_ms"] = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+def load_headless_application():
+    """import maitenotas with headless_wx standing in for wx"""
+    real_wx = sys.modules.get("wx")
+    sys.modules["wx"] = headless_wx
+    try:
+        return importlib.import_module("maitenotas")
+    finally:
+        if real_wx is None:
+            sys.modules.pop("wx")
+        else:
+            sys.modules["wx"] = real_wx
+
+def expand_all(tree_panel) -> None:
+    """load every journal in the tree, as if the user expanded every item"""
+    pending = [tree_panel.tree.GetRootItem()]
+    while pending:
+        item = pending.pop()
+        tree_panel.load_children(item)
+        pending.extend(child for child in item.children if child.has_children)
+
+def benchmark_tree_panel(dbfile: str, user_key: Fernet, repetitions: int,
+                         results: Dict[str, float]) -> None:
+    """build the tree of TreePanel (first level) and expand it completely"""
+    application = load_headless_application()
+    application.app_data.set_user_key(user_key)
+    database_name = storage.DATABASE_NAME
+    storage.DATABASE_NAME = dbfile
+    tree_panels = []
+    try:
+        session = storage.get_session()
+        def build(_):
+            session.cache.clear()
+            tree_panels.append(application.TreePanel(None))
+        summarize(results, "tree_panel_build", time_samples(build, repetitions))
+        # the writes of the synthetic benchmark left the stored snapshot stale
+        session.tree.load_snapshot(user_key)
+        def build_from_snapshot(_):
+            session.cache.clear()
+            session.tree.load_snapshot(user_key)
+            tree_panels.append(application.TreePanel(None))
+            session.tree.snapshot = None
+        summarize(results, "tree_panel_build_snapshot",
+                  time_samples(build_from_snapshot, repetitions))
+        def build_and_expand(_):
+            session.cache.clear()
+            tree_panel = application.TreePanel(None)
+            expand_all(tree_panel)
+            tree_panels.append(tree_panel)
+        summarize(results, "tree_panel_expand_all",
+                  time_samples(build_and_expand, max(1, repetitions // 10)))
+        results["tree_panel_items"] = float(tree_panels[-1].tree.item_count)
+    finally:
+        storage.close_session()
+        storage.DATABASE_NAME = database_name
+    application.app_data.get_autosave().stop()
+    application.app_data.get_storage_worker().stop()
+
+def benchmark_synthetic(config: SyntheticConfig) -> Dict[str, float]:
+    """latency of the main code paths over a synthetic database"""
+    results: Dict[str, float] = {}
+    rng = random.Random(config.seed + 1)
+    repetitions = config.repetitions
+    with tempfile.TemporaryDirectory() as work_dir:
+        dbfile = os.path.join(work_dir, "synthetic.data")
+        results["generate_database_s"] = elapsed_seconds(
+            lambda: generate_database(dbfile, config))
+        results["database_mb"] = os.path.getsize(dbfile) / (1024 * 1024)
+        summarize(results, "generate_user_key",
+                  time_samples(lambda c: generate_user_key(SYNTHETIC_PASSWORD),
+                               max(1, repetitions // 10)))
+        user_key = generate_user_key(SYNTHETIC_PASSWORD)
+        session = storage.StorageSession(dbfile)
+        summarize(results, "verify_database_password",
+                  time_samples(lambda c: storage.DatabaseKey(session).verify_database_password(
+                      user_key, SYNTHETIC_PASSWORD), repetitions))
+        def tree_leafs_cold(_):
+            session.cache.clear()
+            session.tree.get_tree_leafs(user_key)
+        summarize(results, "get_tree_leafs_cold",
+                  time_samples(tree_leafs_cold, max(1, repetitions // 10)))
+        summarize(results, "get_tree_leafs_warm",
+                  time_samples(lambda c: session.tree.get_tree_leafs(user_key),
+                               max(1, repetitions // 10)))
+        def tree_snapshot_rebuild(_):
+            session.cache.clear()
+            with session.transaction() as cur:
+                storage.increment_tree_generation(cur)
+            session.tree.load_snapshot(user_key)
+        summarize(results, "tree_snapshot_rebuild",
+                  time_samples(tree_snapshot_rebuild, max(1, repetitions // 10)))
+        def tree_snapshot_load(_):
+            session.cache.clear()
+            session.tree.load_snapshot(user_key)
+        summarize(results, "tree_snapshot_load",
+                  time_samples(tree_snapshot_load, max(1, repetitions // 10)))
+        journal_ids = [rng.randint(1, config.node_count) for _ in range(repetitions)]
+        session.cache.clear()
+        summarize(results, "get_journal_text_cold",
+                  time_samples(lambda c: session.get_journal_text(user_key, journal_ids[c]),
+                               repetitions))
+        summarize(results, "get_journal_text_warm",
+                  time_samples(lambda c: session.get_journal_text(user_key, journal_ids[c]),
+                               repetitions))
+        texts = [synthetic_text(rng, note_size(rng, config)) for _ in range(repetitions)]
+        summarize(results, "update_journal_text",
+                  time_samples(lambda c: session.update_journal_text(user_key, journal_ids[c],
+                                                                     texts[c]), repetitions))
+        summarize(results, "create_journal",
+                  time_samples(lambda c: session.create_journal(user_key, 2, journal_ids[c],
+                                                                f"New {c}", texts[c]),
+                               repetitions))
+        session.close()
+        benchmark_tree_panel(dbfile, user_key, max(1, repetitions // 10), results)
+    return results
+
+MICRO_BENCHMARKS = (benchmark_session, benchmark_search, benchmark_key_derivation,
+                    benchmark_blob_format, benchmark_chunked_save, benchmark_large_note_load,
+                    benchmark_batch_decrypt, benchmark_bulk_transfer, benchmark_title_index)
+
+def environment() -> Dict[str, object]:
+    """versions and machine the results were measured with"""
+    return {"python": platform.python_version(), "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(), "cpu_count": os.cpu_count() or 1}
+
+def compare_results(baseline: Dict[str, float], results: Dict[str, float]) -> None:
+    """print the results next to the ones of a baseline run"""
+    print(f"{'result':40} {'baseline':>12} {'current':>12} {'ratio':>8}")
+    for result_name, value in results.items():
+        if result_name in baseline:
+            base_value = baseline[result_name]
+            ratio = value / base_value if base_value else 0.0
+            print(f"{result_name:40} {base_value:12.3f} {value:12.3f} {ratio:8.2f}")
+
+def main() -> None:
+    """run the suite, write the results as JSON and compare them with a baseline"""
+    defaults = SyntheticConfig()
+    parser = argparse.ArgumentParser(description="Maitenotas benchmarks")
+    parser.add_argument("--nodes", type=int, default=defaults.node_count)
+    parser.add_argument("--fan-out", type=int, default=defaults.fan_out)
+    parser.add_argument("--depth", type=int, default=defaults.max_depth)
+    parser.add_argument("--note-median", type=int, default=defaults.note_median_chars)
+    parser.add_argument("--note-sigma", type=float, default=defaults.note_size_sigma)
+    parser.add_argument("--seed", type=int, default=defaults.seed)
+    parser.add_argument("--repetitions", type=int, default=defaults.repetitions)
+    parser.add_argument("--micro", action="store_true",
+                        help="also run the benchmarks of single features")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="JSON file of an earlier run to compare with")
+    arguments = parser.parse_args()
+    config = SyntheticConfig(arguments.nodes, arguments.fan_out, arguments.depth,
+                             arguments.note_median, arguments.note_sigma, arguments.seed,
+                             arguments.repetitions)
+    results = benchmark_synthetic(config)
+    if arguments.micro:
+        for benchmark in MICRO_BENCHMARKS:
+            results.update({f"{benchmark.__name__}.{result_name}": value
+                            for result_name, value in benchmark().items()})
+    report = {"config": config._asdict(), "environment": environment(), "results": results}
+    report_text = json.dumps(report, indent=2)
+    if arguments.output:
+        with open(arguments.output, "w", encoding='UTF-8') as output_file:
+            output_file.write(report_text)
+    else:
+        print(report_text)
+    if arguments.compare:
+        with open(arguments.compare, "r", encoding='UTF-8') as baseline_file:
+            compare_results(json.load(baseline_file)["results"], results)
+
+if __name__ == "__main__":
+    main()
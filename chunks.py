@@ -0,0 +1,203 @@
+"""
+Application: Maitenotas
+Made by Taksan Tong
+https://github.com/maitelab/maitenotas
+
+Chunked storage of large journal texts. The text is cut in chunks at line
+boundaries chosen by the content of the lines, so an edit changes only the
+chunks around it and a save encrypts and writes only those chunks """
+import hashlib
+import hmac
+import sqlite3
+import zlib
+from typing import Callable, Dict, Iterator, List, Set, Tuple
+from cryptography.fernet import Fernet
+from crypto import encrypt_text_to_data, decrypt_data_to_text
+
+# ***************** SQL
+SQL_CREATE_CHUNK_TABLE = """
+CREATE TABLE IF NOT EXISTS journal_chunk (
+    journal_id integer NOT NULL,
+    seq integer NOT NULL,
+    chunk_hash blob NOT NULL,
+    chunk_data blob NOT NULL,
+    PRIMARY KEY (journal_id, seq)
+) WITHOUT ROWID; """
+
+# the version of a chunk is the change counter of sync when it was written, the
+# backups write only the chunks written after the previous backup
+SQL_ADD_CHUNK_VERSION = """
+ALTER TABLE journal_chunk ADD COLUMN version integer NOT NULL DEFAULT 0; """
+
+SQL_CREATE_CHUNK_INSERT_TRIGGER = """
+CREATE TRIGGER IF NOT EXISTS journal_chunk_inserted AFTER INSERT ON journal_chunk
+BEGIN
+    update journal_chunk
+    set version=(select value from metadata where name='change_counter')
+    where journal_id=new.journal_id and seq=new.seq;
+END; """
+
+SQL_READ_CHUNK_HASHES = """
+select seq,chunk_hash
+from journal_chunk
+where journal_id=?
+order by seq
+"""
+
+SQL_READ_CHUNKS = """
+select seq,chunk_data
+from journal_chunk
+where journal_id=? and seq>=?
+order by seq
+limit ?
+"""
+
+SQL_READ_CHUNK_TEXTS = """
+select chunk_hash,chunk_data
+from journal_chunk
+where journal_id=?
+order by seq
+"""
+
+SQL_READ_CHUNK_BATCH = """
+select journal_id,seq,chunk_data
+from journal_chunk
+where (journal_id,seq)>(?,?)
+order by journal_id,seq
+limit ?
+"""
+
+SQL_COUNT_CHUNKS_AFTER = """
+select count(*)
+from journal_chunk
+where (journal_id,seq)>(?,?)
+"""
+
+SQL_INSERT_CHUNK = """
+INSERT INTO journal_chunk(journal_id,seq,chunk_hash,chunk_data)
+VALUES(?,?,?,?)"""
+
+SQL_UPDATE_CHUNK_SEQ = """
+update journal_chunk
+set seq=?
+where journal_id=? and seq=?
+"""
+
+SQL_UPDATE_CHUNK_DATA = """
+update journal_chunk
+set chunk_data=?
+where journal_id=? and seq=?
+"""
+
+SQL_FLIP_CHUNK_SEQ = """
+update journal_chunk
+set seq=-1-seq
+where journal_id=? and seq<0
+"""
+
+SQL_DELETE_CHUNK = """
+delete from journal_chunk
+where journal_id=? and seq=?
+"""
+
+SQL_DELETE_ALL_CHUNKS = """
+delete from journal_chunk
+where journal_id=?
+"""
+
+# texts from this size are stored in chunks, smaller ones in journal.journal_text
+CHUNKED_MIN_CHARS = 256 * 1024
+# a chunk is cut after a line whose crc is a multiple of BOUNDARY_DIVISOR, once the
+# chunk has CHUNK_MIN_CHARS, and always before it grows over CHUNK_MAX_CHARS
+CHUNK_MIN_CHARS = 8 * 1024
+CHUNK_MAX_CHARS = 64 * 1024
+BOUNDARY_DIVISOR = 64
+# chunks read from the database at a time when streaming a text
+READ_BATCH_SIZE = 8
+CHUNK_HASH_LENGTH = 16
+
+def split_text(text: str) -> List[str]:
+    """cut a text in content defined chunks, joining them gives the text again"""
+    chunk_list: List[str] = []
+    current: List[str] = []
+    size = 0
+    for line in text.splitlines(keepends=True):
+        # a line alone bigger than a chunk is cut at fixed positions
+        while size + len(line) > CHUNK_MAX_CHARS:
+            cut = CHUNK_MAX_CHARS - size
+            current.append(line[:cut])
+            chunk_list.append("".join(current))
+            current, size, line = [], 0, line[cut:]
+        current.append(line)
+        size = size + len(line)
+        if size >= CHUNK_MIN_CHARS and \
+                zlib.crc32(line.encode(encoding='UTF-8')) % BOUNDARY_DIVISOR == 0:
+            chunk_list.append("".join(current))
+            current, size = [], 0
+    if current:
+        chunk_list.append("".join(current))
+    return chunk_list
+
+def chunk_hash(hash_key: bytes, chunk: str) -> bytes:
+    """keyed hash of a chunk, compares chunks without decrypting them"""
+    return hmac.new(hash_key, b"chunk:" + chunk.encode(encoding='UTF-8'),
+                    hashlib.sha256).digest()[:CHUNK_HASH_LENGTH]
+
+def write_chunks(cur: sqlite3.Cursor, user_key: Fernet, hash_key: bytes,
+                 journal_id: int, text: str) -> Tuple[Dict[bytes, str], Set[bytes]]:
+    """store a text as chunks, chunks already stored are kept (moved if needed),
+    only new chunks are encrypted, return the chunks added (hash: text) and the
+    hashes of the chunks that are not in the text anymore"""
+    new_chunks = split_text(text)
+    new_hashes = [chunk_hash(hash_key, chunk) for chunk in new_chunks]
+    old_seqs: Dict[bytes, List[int]] = {}
+    for seq, old_hash in cur.execute(SQL_READ_CHUNK_HASHES, (journal_id,)).fetchall():
+        old_seqs.setdefault(bytes(old_hash), []).append(seq)
+    removed_hashes = set(old_seqs) - set(new_hashes)
+    added_chunks = {new_hash: chunk for new_hash, chunk in zip(new_hashes, new_chunks)
+                    if new_hash not in old_seqs}
+    # reuse stored chunks with the same content, preferring the same position
+    reused: Dict[int, int] = {}
+    for seq, new_hash in enumerate(new_hashes):
+        if seq in old_seqs.get(new_hash, []):
+            old_seqs[new_hash].remove(seq)
+            reused[seq] = seq
+    for seq, new_hash in enumerate(new_hashes):
+        if seq not in reused and old_seqs.get(new_hash):
+            reused[seq] = old_seqs[new_hash].pop(0)
+    # moved chunks go to negative positions first so they never collide
+    for seq, old_seq in reused.items():
+        if seq != old_seq:
+            cur.execute(SQL_UPDATE_CHUNK_SEQ, (-1 - seq, journal_id, old_seq))
+    for unused_seqs in old_seqs.values():
+        for old_seq in unused_seqs:
+            cur.execute(SQL_DELETE_CHUNK, (journal_id, old_seq))
+    cur.execute(SQL_FLIP_CHUNK_SEQ, (journal_id,))
+    cur.executemany(SQL_INSERT_CHUNK,
+                    [(journal_id, seq, new_hashes[seq],
+                      encrypt_text_to_data(new_chunks[seq], user_key))
+                     for seq in range(len(new_chunks)) if seq not in reused])
+    return added_chunks, removed_hashes
+
+def iter_chunks(fetch_all: Callable[[str, tuple], list], user_key: Fernet,
+                journal_id: int) -> Iterator[str]:
+    """decrypted chunks of a text in order, read with fetch_all in small batches
+    so the whole encrypted text is never in memory at once"""
+    next_seq = 0
+    while True:
+        rows = fetch_all(SQL_READ_CHUNKS, (journal_id, next_seq, READ_BATCH_SIZE))
+        if not rows:
+            return
+        for seq, chunk_data in rows:
+            yield decrypt_data_to_text(chunk_data, user_key)
+            next_seq = seq + 1
+
+def iter_chunk_texts(cur: sqlite3.Cursor, user_key: Fernet,
+                     journal_id: int) -> Iterator[Tuple[bytes, str]]:
+    """(hash, decrypted text) of every chunk of a journal"""
+    for stored_hash, chunk_data in cur.execute(SQL_READ_CHUNK_TEXTS, (journal_id,)).fetchall():
+        yield bytes(stored_hash), decrypt_data_to_text(chunk_data, user_key)
+
+def delete_chunks(cur: sqlite3.Cursor, journal_id: int) -> None:
+    """remove all the chunks of a journal"""
+    cur.execute(SQL_DELETE_ALL_CHUNKS, (journal_id,))
@@ -5,34 +5,250 @@ https://github.com/maitelab/maitenotas
 
 Functions related to encrypt / decrypt data """
 import base64
+import json
+import os
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
 from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
-from cryptography.fernet import Fernet
+from cryptography.fernet import Fernet, MultiFernet
+from instrument import timed, count_encrypted, count_decrypted, report_exception
 
-def generate_user_key(user_password: str) -> Fernet:
-    """Create a key for encryption purposes"""
+# key derivation function used by all databases so far
+KDF_PBKDF2_SHA256 = "pbkdf2-sha256"
+# iterations of databases created before the parameters were stored
+LEGACY_ITERATIONS = 100000
+# calibration never goes below this number of iterations
+MIN_ITERATIONS = 100000
+# time to unlock a database on the machine that creates it
+TARGET_UNLOCK_SECONDS = 0.5
+SALT_LENGTH = 16
+CALIBRATION_SAMPLE_SECONDS = 0.05
+
+class KdfParameters(NamedTuple):
+    """parameters used to turn the user password into the user key"""
+    algorithm: str
+    salt: bytes
+    iterations: int
+
+class UserKey(Fernet):
+    """Fernet that remembers its key, so a change of key can store the old one
+    (encrypted with the new one) until every row is encrypted again"""
+    def __init__(self, key: bytes):
+        Fernet.__init__(self, key)
+        self.key = key
+
+class RotatingKey(UserKey):
+    """key used while a database moves from old_key to new_key: it encrypts with
+    new_key and decrypts rows of both keys, so the database stays readable"""
+    def __init__(self, new_key: UserKey, old_key: UserKey):
+        UserKey.__init__(self, new_key.key)
+        self.new_key = new_key
+        self.old_key = old_key
+        self.keys = MultiFernet([new_key, old_key])
+
+    def decrypt(self, token, ttl: Optional[int] = None) -> bytes:
+        """decrypt a token of any of the two keys"""
+        return self.keys.decrypt(token, ttl)
+
+    def rotate(self, token: bytes) -> bytes:
+        """token encrypted again with the new key, without decompressing the data"""
+        return self.keys.rotate(token)
+
+@timed("crypto.generate_user_key")
+def generate_user_key(user_password: str, salt: Optional[bytes] = None,
+                      iterations: int = LEGACY_ITERATIONS) -> UserKey:
+    """Create a key for encryption purposes,
+    without salt the password itself is the salt (databases of older versions)"""
     password_provided_bytes = bytes(user_password, 'utf-8')
     password = user_password.encode() # Convert to type bytes
     kdf = PBKDF2HMAC(
         algorithm=hashes.SHA256(),
         length=32,
-        salt=password_provided_bytes,
-        iterations=100000,
+        salt=salt if salt is not None else password_provided_bytes,
+        iterations=iterations,
         backend=default_backend()
     )
     key = base64.urlsafe_b64encode(kdf.derive(password)) # Can only use kdf once
-    fernet_key = Fernet(key)
+    fernet_key = UserKey(key)
     return fernet_key
 
+def derive_user_key(user_password: str, parameters: KdfParameters) -> UserKey:
+    """Create the key for encryption purposes with stored parameters"""
+    if parameters.algorithm != KDF_PBKDF2_SHA256:
+        raise ValueError("unknown key derivation function " + parameters.algorithm)
+    return generate_user_key(user_password, parameters.salt, parameters.iterations)
+
+def legacy_kdf_parameters(user_password: str) -> KdfParameters:
+    """parameters of databases created before the parameters were stored"""
+    return KdfParameters(KDF_PBKDF2_SHA256, bytes(user_password, 'utf-8'), LEGACY_ITERATIONS)
+
+# iterations calibrated by this process for each target, the speed of the machine
+# does not change and every calibration costs a few derivations
+CALIBRATED_ITERATIONS: Dict[float, int] = {}
+
+@timed("crypto.calibrate_iterations")
+def calibrate_iterations(target_seconds: float = TARGET_UNLOCK_SECONDS) -> int:
+    """number of PBKDF2 iterations that takes target_seconds on this machine,
+    measured once per process"""
+    if target_seconds in CALIBRATED_ITERATIONS:
+        return CALIBRATED_ITERATIONS[target_seconds]
+    sample_iterations = 10000
+    while True:
+        start = time.perf_counter()
+        generate_user_key("calibration", os.urandom(SALT_LENGTH), sample_iterations)
+        elapsed = time.perf_counter() - start
+        # short samples are dominated by timer resolution and warm up
+        if elapsed >= CALIBRATION_SAMPLE_SECONDS:
+            break
+        sample_iterations = sample_iterations * 2
+    iterations = int(sample_iterations * target_seconds / elapsed)
+    # round to thousands, it is stored and shown in diagnostics
+    CALIBRATED_ITERATIONS[target_seconds] = max(MIN_ITERATIONS, iterations // 1000 * 1000)
+    return CALIBRATED_ITERATIONS[target_seconds]
+
+def new_kdf_parameters(iterations: int) -> KdfParameters:
+    """parameters for a new database or a new password, with a random salt"""
+    return KdfParameters(KDF_PBKDF2_SHA256, os.urandom(SALT_LENGTH), iterations)
+
+def encode_kdf_parameters(parameters: KdfParameters) -> bytes:
+    """serialize parameters to store them in the database"""
+    return json.dumps({"algorithm": parameters.algorithm, "salt": parameters.salt.hex(),
+                       "iterations": parameters.iterations}).encode(encoding='UTF-8')
+
+def decode_kdf_parameters(data: bytes) -> KdfParameters:
+    """read parameters serialized by encode_kdf_parameters"""
+    values = json.loads(data.decode(encoding='UTF-8'))
+    return KdfParameters(values["algorithm"], bytes.fromhex(values["salt"]),
+                         int(values["iterations"]))
+
+# blobs written by this version are an envelope:
+#   1 byte ENVELOPE_VERSION, 1 byte compression codec, raw (not base64) Fernet token
+# blobs of older versions are a base64 Fernet token, which always starts with "g"
+ENVELOPE_VERSION = 1
+LEGACY_TOKEN_START = ord("g")
+CODEC_NONE = 0
+CODEC_ZLIB = 1
+# data smaller than this is not compressed, the gain does not pay the header
+COMPRESS_MIN_BYTES = 128
+# notes up to this size get the best ratio, bigger ones the fastest level
+# (level 6 is about 10 MB/s on prose, level 1 about 70 MB/s for a 25% bigger output)
+FAST_COMPRESS_MIN_BYTES = 64 * 1024
+COMPRESS_LEVEL = 6
+FAST_COMPRESS_LEVEL = 1
+
+def compress_data(input_data: bytes) -> Tuple[int, bytes]:
+    """compress data with the codec chosen by its size, return (codec, data)"""
+    if len(input_data) < COMPRESS_MIN_BYTES:
+        return CODEC_NONE, input_data
+    if len(input_data) >= FAST_COMPRESS_MIN_BYTES:
+        compressed_data = zlib.compress(input_data, FAST_COMPRESS_LEVEL)
+    else:
+        compressed_data = zlib.compress(input_data, COMPRESS_LEVEL)
+    # random or already compressed data can grow
+    if len(compressed_data) >= len(input_data):
+        return CODEC_NONE, input_data
+    return CODEC_ZLIB, compressed_data
+
+def decompress_data(codec: int, input_data: bytes) -> bytes:
+    """undo compress_data"""
+    if codec == CODEC_NONE:
+        return input_data
+    if codec == CODEC_ZLIB:
+        return zlib.decompress(input_data)
+    raise ValueError("unknown compression codec " + str(codec))
+
+def encrypt_data(input_data: bytes, user_key: Fernet) -> bytes:
+    """Compress and encrypt data into a versioned envelope"""
+    count_encrypted(len(input_data))
+    codec, compressed_data = compress_data(input_data)
+    token = base64.urlsafe_b64decode(user_key.encrypt(compressed_data))
+    return bytes((ENVELOPE_VERSION, codec)) + token
+
+def decrypt_data(input_data: bytes, user_key: Fernet) -> bytes:
+    """Decrypt an envelope or a blob of older versions"""
+    input_data = bytes(input_data)
+    if input_data[0] == LEGACY_TOKEN_START:
+        # plain base64 Fernet token
+        output_data = user_key.decrypt(input_data)
+    elif input_data[0] == ENVELOPE_VERSION:
+        compressed_data = user_key.decrypt(base64.urlsafe_b64encode(input_data[2:]))
+        output_data = decompress_data(input_data[1], compressed_data)
+    else:
+        raise ValueError("unknown blob version " + str(input_data[0]))
+    count_decrypted(len(output_data))
+    return output_data
+
+def rotate_data(input_data: bytes, rotating_key: RotatingKey) -> bytes:
+    """Encrypt an envelope or a blob of older versions again with the new key
+    of rotating_key, keeping its format and compression"""
+    input_data = bytes(input_data)
+    if not input_data:
+        return input_data
+    if input_data[0] == LEGACY_TOKEN_START:
+        return rotating_key.rotate(input_data)
+    if input_data[0] != ENVELOPE_VERSION:
+        raise ValueError("unknown blob version " + str(input_data[0]))
+    token = rotating_key.rotate(base64.urlsafe_b64encode(input_data[2:]))
+    return input_data[:2] + base64.urlsafe_b64decode(token)
+
 def encrypt_text_to_data(input_text: str, user_key: Fernet) -> bytes:
     """Encrypt text"""
     message_data = input_text.encode(encoding='UTF-8')
-    encrypted_data = user_key.encrypt(message_data)
+    encrypted_data = encrypt_data(message_data, user_key)
     return encrypted_data
 
 def decrypt_data_to_text(input_data: bytes, user_key: Fernet) -> str:
     """Decrypt data to clear text"""
-    decrypted_data = user_key.decrypt(input_data)
+    decrypted_data = decrypt_data(input_data, user_key)
     clear_text = decrypted_data.decode(encoding='UTF-8')
     return clear_text
+
+# batches from this size are decrypted by a pool with one process per CPU,
+# smaller ones do not pay the cost of sending the blobs to the processes
+PARALLEL_MIN_BATCH = 4096
+# the pool is created on the first big batch and reused, creating processes is slow
+DECRYPT_POOLS: Dict[str, ProcessPoolExecutor] = {}
+
+def decrypt_data_slice(user_key: Fernet, input_list: List[bytes]) -> List[bytes]:
+    """Decrypt a list of blobs, runs inside the pool processes"""
+    return [decrypt_data(input_data, user_key) for input_data in input_list]
+
+@timed("crypto.decrypt_data_batch")
+def decrypt_data_batch(input_list: Sequence[bytes], user_key: Fernet) -> List[bytes]:
+    """Decrypt many blobs, big batches are split among one process per CPU"""
+    workers = os.cpu_count() or 1
+    if len(input_list) < PARALLEL_MIN_BATCH or workers < 2:
+        return decrypt_data_slice(user_key, list(input_list))
+    slice_size = -(-len(input_list) // workers)
+    slices = [[bytes(input_data) for input_data in input_list[start:start + slice_size]]
+              for start in range(0, len(input_list), slice_size)]
+    try:
+        if "decrypt" not in DECRYPT_POOLS:
+            DECRYPT_POOLS["decrypt"] = ProcessPoolExecutor(workers)
+        parts = DECRYPT_POOLS["decrypt"].map(decrypt_data_slice, [user_key] * len(slices),
+                                             slices)
+        output_list = [output_data for part in parts for output_data in part]
+        # the pool processes have their own counters
+        count_decrypted(sum(len(output_data) for output_data in output_list),
+                        len(output_list))
+        return output_list
+    except Exception as exception:
+        # processes not available (or the key can not be sent to them)
+        report_exception("crypto.decrypt_data_batch", exception)
+        shutdown_decrypt_pool()
+    return decrypt_data_slice(user_key, list(input_list))
+
+def decrypt_data_batch_to_text(input_list: Sequence[bytes], user_key: Fernet) -> List[str]:
+    """Decrypt many blobs to clear texts"""
+    return [decrypted_data.decode(encoding='UTF-8')
+            for decrypted_data in decrypt_data_batch(input_list, user_key)]
+
+def shutdown_decrypt_pool() -> None:
+    """end the processes of the decrypt pool"""
+    pool = DECRYPT_POOLS.pop("decrypt", None)
+    if pool is not None:
+        pool.shutdown()
@@ -0,0 +1,137 @@
+"""
+Application: Maitenotas
+Made by Taksan Tong
+https://github.com/maitelab/maitenotas
+
+Stand-in for the few parts of wx used to build the tree, so TreePanel can run
+without a display or wxPython installed. Used by benchmark.py, never by the
+application itself """
+from typing import Any, List, Optional, Tuple
+
+class TreeItemId:
+    """item of a TreeCtrl"""
+    def __init__(self, text: str = "", valid: bool = True):
+        self.text = text
+        self.valid = valid
+        self.data: Any = None
+        self.children: List["TreeItemId"] = []
+        self.has_children = False
+        self.expanded = False
+
+    def IsOk(self) -> bool: # pylint: disable=invalid-name
+        """wx name, False for the item returned past the last child"""
+        return self.valid
+
+INVALID_ITEM = TreeItemId(valid=False)
+
+class Window:
+    """base of the windows, accepts and ignores what only matters on screen"""
+    def __init__(self, *_args, **_kwargs) -> None:
+        self.events: List[Tuple[Any, Any]] = []
+
+    def Bind(self, event: Any, handler: Any) -> None: # pylint: disable=invalid-name
+        """remember the handler, events are never sent"""
+        self.events.append((event, handler))
+
+    def SetSizerAndFit(self, _sizer: Any) -> None: # pylint: disable=invalid-name
+        """no layout without a screen"""
+
+    def Refresh(self) -> None: # pylint: disable=invalid-name
+        """no painting without a screen"""
+
+class Panel(Window):
+    """wx.Panel"""
+
+class Frame(Window):
+    """wx.Frame"""
+
+class Dialog(Window):
+    """wx.Dialog"""
+
+class BoxSizer:
+    """wx.BoxSizer"""
+    def __init__(self, *_args) -> None:
+        self.windows: List[Any] = []
+
+    def Add(self, window: Any, *_args) -> None: # pylint: disable=invalid-name
+        """add a window"""
+        self.windows.append(window)
+
+class TreeCtrl(Window):
+    """wx.TreeCtrl keeping the items in memory"""
+    def __init__(self, *args, **kwargs) -> None:
+        Window.__init__(self, *args, **kwargs)
+        self.root: Optional[TreeItemId] = None
+        self.selection: Optional[TreeItemId] = None
+        self.item_count = 0
+
+    # pylint: disable=invalid-name
+    def AddRoot(self, text: str) -> TreeItemId:
+        """create the root item"""
+        self.root = TreeItemId(text)
+        self.item_count = 1
+        return self.root
+
+    def GetRootItem(self) -> TreeItemId:
+        """root item"""
+        return self.root or INVALID_ITEM
+
+    def AppendItem(self, parent: TreeItemId, text: str) -> TreeItemId:
+        """add an item after the other children of parent"""
+        item = TreeItemId(text)
+        parent.children.append(item)
+        parent.has_children = True
+        self.item_count = self.item_count + 1
+        return item
+
+    def SetItemData(self, item: TreeItemId, data: Any) -> None:
+        """data of an item"""
+        item.data = data
+
+    def GetItemData(self, item: TreeItemId) -> Any:
+        """data of an item"""
+        return item.data
+
+    def SetItemHasChildren(self, item: TreeItemId, has_children: bool = True) -> None:
+        """show the expand button of an item"""
+        item.has_children = has_children
+
+    def ItemHasChildren(self, item: TreeItemId) -> bool:
+        """True if the item shows the expand button"""
+        return item.has_children
+
+    def GetFirstChild(self, item: TreeItemId) -> Tuple[TreeItemId, int]:
+        """first child and the cookie to get the next ones"""
+        return self.GetNextChild(item, -1)
+
+    def GetNextChild(self, item: TreeItemId, cookie: int) -> Tuple[TreeItemId, int]:
+        """child after the one of cookie"""
+        cookie = cookie + 1
+        if cookie < len(item.children):
+            return item.children[cookie], cookie
+        return INVALID_ITEM, cookie
+
+    def Expand(self, item: TreeItemId) -> None:
+        """nothing to show, the panel loads children in its expanding event"""
+        item.expanded = True
+
+    def IsExpanded(self, item: TreeItemId) -> bool:
+        """True if the children of the item are shown"""
+        return item.expanded
+
+    def EnsureVisible(self, item: TreeItemId) -> None:
+        """nothing to scroll"""
+
+    def SelectItem(self, item: TreeItemId) -> None:
+        """select an item"""
+        self.selection = item
+
+    def GetItemText(self, item: TreeItemId) -> str:
+        """label of an item"""
+        return item.text
+
+def __getattr__(name: str) -> int:
+    """styles, flags and event types are only passed around, any value works"""
+    if name.isupper() or name.startswith("EVT_") or name.startswith("Default"):
+        return 0
+    raise AttributeError(name)
@@ -0,0 +1,230 @@
+"""
+Application: Maitenotas
+Made by Taksan Tong
+https://github.com/maitelab/maitenotas
+
+Instrumentation of the storage and crypto functions: call counts, latency
+histograms, bytes encrypted and decrypted and time spent in SQLite. Operations
+slower than a threshold and errors are logged, and the startup can be profiled """
+import cProfile
+import functools
+import io
+import json
+import pstats
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Callable, Deque, Dict, Iterator, Optional, Tuple
+
+# upper limits in milliseconds of the latency histogram buckets, plus one open bucket
+HISTOGRAM_LIMITS_MS = (0.1, 1.0, 10.0, 100.0, 1000.0)
+# operations slower than this are logged
+SLOW_OPERATION_MS = 250.0
+# slow operations and errors kept to show them in the diagnostics
+MAX_SLOW_OPERATIONS = 100
+MAX_ERRORS = 50
+# file written by the profile of the startup
+PROFILE_FILE = "maitenotas-startup.prof"
+# functions shown in the summary of a profile
+PROFILE_SUMMARY_LINES = 30
+
+class OperationStats:
+    """calls and latencies of one operation"""
+    def __init__(self) -> None:
+        self.count = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.histogram = [0] * (len(HISTOGRAM_LIMITS_MS) + 1)
+
+    def add(self, elapsed_ms: float, failed: bool) -> None:
+        """count one call"""
+        self.count = self.count + 1
+        if failed:
+            self.errors = self.errors + 1
+        self.total_ms = self.total_ms + elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+        bucket = 0
+        while bucket < len(HISTOGRAM_LIMITS_MS) and elapsed_ms > HISTOGRAM_LIMITS_MS[bucket]:
+            bucket = bucket + 1
+        self.histogram[bucket] = self.histogram[bucket] + 1
+
+    def as_dict(self) -> Dict[str, Any]:
+        """values to show or dump"""
+        return {"count": self.count, "errors": self.errors,
+                "total_ms": round(self.total_ms, 3), "max_ms": round(self.max_ms, 3),
+                "mean_ms": round(self.total_ms / self.count, 3) if self.count else 0.0,
+                "histogram": self.histogram}
+
+class Instrumentation:
+    """Collects the statistics of the instrumented operations of all threads"""
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.enabled = True
+        self.slow_threshold_ms = SLOW_OPERATION_MS
+        self.operations: Dict[str, OperationStats] = {}
+        # bytes encrypted and decrypted, and number of blobs
+        self.counters: Dict[str, int] = {}
+        self.slow_operations: Deque[Tuple[str, str, float]] = deque(maxlen=MAX_SLOW_OPERATIONS)
+        self.errors: Deque[Tuple[str, str, str]] = deque(maxlen=MAX_ERRORS)
+
+    def configure(self, enabled: bool, slow_threshold_ms: float = SLOW_OPERATION_MS) -> None:
+        """turn the instrumentation on or off and change the slow operation threshold"""
+        with self.lock:
+            self.enabled = enabled
+            self.slow_threshold_ms = slow_threshold_ms
+
+    def record(self, name: str, elapsed_ms: float, failed: bool = False) -> None:
+        """count one call of an operation"""
+        with self.lock:
+            operation = self.operations.get(name)
+            if operation is None:
+                operation = OperationStats()
+                self.operations[name] = operation
+            operation.add(elapsed_ms, failed)
+            slow = elapsed_ms >= self.slow_threshold_ms
+            if slow:
+                self.slow_operations.append((time.strftime("%H:%M:%S"), name, elapsed_ms))
+        if slow:
+            print(f"slow operation {name}: {elapsed_ms:.1f} ms")
+
+    def count(self, counter: str, amount: int) -> None:
+        """add amount to a counter"""
+        if self.enabled:
+            with self.lock:
+                self.counters[counter] = self.counters.get(counter, 0) + amount
+
+    def count_blobs(self, blobs_counter: str, bytes_counter: str, blobs: int,
+                    size: int) -> None:
+        """add to a counter of blobs and to its counter of bytes, it runs for every
+        blob encrypted or decrypted so both are updated with one lock"""
+        if self.enabled:
+            counters = self.counters
+            with self.lock:
+                counters[blobs_counter] = counters.get(blobs_counter, 0) + blobs
+                counters[bytes_counter] = counters.get(bytes_counter, 0) + size
+
+    def record_error(self, name: str, exception: BaseException) -> None:
+        """remember an error that was handled"""
+        with self.lock:
+            self.errors.append((time.strftime("%H:%M:%S"), name, repr(exception)))
+
+    def reset(self) -> None:
+        """forget everything collected"""
+        with self.lock:
+            self.operations.clear()
+            self.counters.clear()
+            self.slow_operations.clear()
+            self.errors.clear()
+
+    def snapshot(self) -> Dict[str, Any]:
+        """copy of everything collected"""
+        with self.lock:
+            return {"histogram_limits_ms": list(HISTOGRAM_LIMITS_MS),
+                    "slow_threshold_ms": self.slow_threshold_ms,
+                    "operations": {name: operation.as_dict()
+                                   for name, operation in sorted(self.operations.items())},
+                    "counters": dict(sorted(self.counters.items())),
+                    "slow_operations": list(self.slow_operations),
+                    "errors": list(self.errors)}
+
+    def report(self, extra: Optional[Dict[str, Any]] = None) -> str:
+        """everything collected as text, extra values are added at the end"""
+        values = self.snapshot()
+        lines = [f"{'operation':36} {'count':>7} {'errors':>6} {'mean ms':>9} {'max ms':>9}"
+                 "  histogram <=" + "/".join(f"{limit:g}" for limit in HISTOGRAM_LIMITS_MS)
+                 + "/more ms"]
+        for name, operation in values["operations"].items():
+            lines.append(f"{name:36} {operation['count']:7} {operation['errors']:6}"
+                         f" {operation['mean_ms']:9.3f} {operation['max_ms']:9.3f}  "
+                         + "/".join(str(calls) for calls in operation["histogram"]))
+        lines.append("")
+        for counter, value in values["counters"].items():
+            lines.append(f"{counter:36} {value:12}")
+        for title, key in (("slow operations (>= " + str(values["slow_threshold_ms"]) + " ms)",
+                            "slow_operations"), ("errors", "errors")):
+            lines.append("")
+            lines.append(title)
+            lines.extend("  ".join(str(value) for value in entry) for entry in values[key])
+        for name, value in (extra or {}).items():
+            lines.append("")
+            lines.append(f"{name}: {value}")
+        return "\n".join(lines)
+
+    def dump(self, file_name: str, extra: Optional[Dict[str, Any]] = None) -> None:
+        """write everything collected to a JSON file"""
+        values = self.snapshot()
+        values.update(extra or {})
+        with open(file_name, "w", encoding='UTF-8') as dump_file:
+            json.dump(values, dump_file, indent=2)
+
+# statistics of the whole application
+INSTRUMENTATION = Instrumentation()
+
+def timed(name: str) -> Callable[[Callable], Callable]:
+    """decorator recording the calls and latency of a function as operation name"""
+    def decorator(function: Callable) -> Callable:
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not INSTRUMENTATION.enabled:
+                return function(*args, **kwargs)
+            start = time.perf_counter()
+            failed = True
+            try:
+                result = function(*args, **kwargs)
+                failed = False
+                return result
+            finally:
+                INSTRUMENTATION.record(name, (time.perf_counter() - start) * 1000, failed)
+        return wrapper
+    return decorator
+
+@contextmanager
+def measure(name: str) -> Iterator[None]:
+    """record the calls and latency of the with block as operation name"""
+    if not INSTRUMENTATION.enabled:
+        yield
+        return
+    start = time.perf_counter()
+    failed = True
+    try:
+        yield
+        failed = False
+    finally:
+        INSTRUMENTATION.record(name, (time.perf_counter() - start) * 1000, failed)
+
+def count_encrypted(size: int, blobs: int = 1) -> None:
+    """count blobs encrypted and their size before encryption"""
+    INSTRUMENTATION.count_blobs("blobs_encrypted", "bytes_encrypted", blobs, size)
+
+def count_decrypted(size: int, blobs: int = 1) -> None:
+    """count blobs decrypted and their size after decryption"""
+    INSTRUMENTATION.count_blobs("blobs_decrypted", "bytes_decrypted", blobs, size)
+
+def report_exception(name: str, exception: BaseException) -> None:
+    """print an error that was handled and remember it for the diagnostics"""
+    print(str(exception))
+    INSTRUMENTATION.record_error(name, exception)
+
+# profiler of the startup while it runs
+PROFILERS: Dict[str, cProfile.Profile] = {}
+
+def start_profile() -> None:
+    """start profiling the calling thread"""
+    profiler = cProfile.Profile()
+    PROFILERS["startup"] = profiler
+    profiler.enable()
+
+def stop_profile(file_name: str = PROFILE_FILE) -> str:
+    """stop the profile, write it to file_name (readable with pstats or snakeviz)
+    and return a summary of the functions that took more time"""
+    profiler = PROFILERS.pop("startup", None)
+    if profiler is None:
+        return ""
+    profiler.disable()
+    profiler.dump_stats(file_name)
+    summary = io.StringIO()
+    pstats.Stats(profiler, stream=summary).sort_stats("cumulative")\
+        .print_stats(PROFILE_SUMMARY_LINES)
+    return summary.getvalue()
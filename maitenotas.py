@@ -5,16 +5,48 @@ https://github.com/maitelab/maitenotas
 
 Main launcher of the application
 """
+import multiprocessing
+import sys
+import threading
+import time
+from concurrent.futures import Future
 from os import path
+from typing import Any, Callable, Dict, List, Optional
 
 import wx
 
+import storage
 from storage import update_journal_text, update_journal_name, delete_journal, get_book_name,\
-    get_journal_text, get_tree_leafs, create_book, create_database, verify_database_password,\
-    create_journal
-from crypto import generate_user_key
+    get_journal_text, get_child_leafs, create_book, create_database, verify_database_password,\
+    create_journal, close_session, get_leaf_path, search_journals, read_kdf_parameters,\
+    get_cache_statistics, run_maintenance, start_user_key_change, pending_user_key,\
+    resume_user_key_change, iter_journal_text, is_journal_chunked, list_revisions,\
+    restore_revision, add_attachment, list_attachments, export_attachment, remove_attachment,\
+    load_tree_snapshot, save_tree_snapshot, get_expanded_leafs, flush_working_copy,\
+    get_working_copy_statistics, list_recent_journals, find_titles
+from crypto import derive_user_key, new_kdf_parameters, legacy_kdf_parameters,\
+    calibrate_iterations, shutdown_decrypt_pool, UserKey, RotatingKey
+from autosave import AutosaveEngine
+from workingcopy import DatabaseLockedError
+from textloader import TextLoader
+from storageworker import StorageWorker
+from instrument import INSTRUMENTATION, start_profile, stop_profile
 import text_labels
 
+# milliseconds without typing before the text in screen is saved
+AUTOSAVE_DELAY_MS = 1500
+# seconds between updates of a progress dialog
+PROGRESS_PULSE_SECONDS = 0.05
+# command line option to profile the startup, from the password to the tree in screen
+PROFILE_STARTUP_OPTION = "--profile-startup"
+# command line option to keep the diary in memory and write it back from time to time
+WORKING_COPY_OPTION = "--working-copy"
+# milliseconds between checks for changes of the working copy to write back
+WORKING_COPY_CHECK_MS = 1000
+# milliseconds between updates of the list of recently edited leafs
+RECENT_REFRESH_MS = 5000
+DIAGNOSTICS_FILE = "maitenotas-diagnostics.json"
+
 class ApplicationData:
     """Class to hold values needed at the application level"""
     def __init__(self):
@@ -22,6 +54,11 @@ class ApplicationData:
         self.new_database = False
         self.user_key = b''
         self.selected_journal_id = -1
+        self.autosave = AutosaveEngine(save_journal_text)
+        # storage calls of the event handlers, results come back with CallAfter
+        self.storage_worker = StorageWorker(call_in_gui)
+        # summary of the startup profile, None when the startup is not profiled
+        self.startup_profile = None
 
     def get_next_wx_python_id(self) -> int:
         """get next wx id for GUI elements"""
@@ -36,11 +73,11 @@ class ApplicationData:
         """set flag for new database"""
         self.new_database = new_value
 
-    def get_user_key(self) -> bytes:
+    def get_user_key(self) -> UserKey:
         """get user key"""
         return self.user_key
 
-    def set_user_key(self, new_value: bytes) -> None:
+    def set_user_key(self, new_value: UserKey) -> None:
         """set user key"""
         self.user_key = new_value
 
@@ -52,6 +89,54 @@ class ApplicationData:
         """set selected journal id"""
         self.selected_journal_id = new_value
 
+    def get_autosave(self) -> AutosaveEngine:
+        """get autosave engine"""
+        return self.autosave
+
+    def get_storage_worker(self) -> StorageWorker:
+        """get storage worker"""
+        return self.storage_worker
+
+    def get_profile_startup(self) -> bool:
+        """get flag to profile the startup"""
+        return self.startup_profile is not None
+
+    def set_profile_startup(self, new_value: bool) -> None:
+        """set flag to profile the startup"""
+        self.startup_profile = "" if new_value else None
+
+    def get_startup_profile(self) -> str:
+        """get summary of the startup profile"""
+        return self.startup_profile or ""
+
+    def set_startup_profile(self, new_value: str) -> None:
+        """set summary of the startup profile"""
+        self.startup_profile = new_value
+
+def save_journal_text(journal_id: int, journal_text: str) -> bool:
+    """write a journal text, called from the autosave thread, False if it failed"""
+    return update_journal_text(app_data.get_user_key(), journal_id, journal_text)
+
+def call_in_gui(callback: Callable[[Any], None], result: Any) -> None:
+    """run callback(result) in the GUI thread"""
+    wx.CallAfter(callback, result)
+
+def read_journal_to_show(journal_id: int) -> Optional[str]:
+    """text of a journal, None for big texts that are loaded in pieces,
+    called from the storage worker"""
+    # a save of this journal may still be queued
+    app_data.get_autosave().wait(journal_id)
+    if is_journal_chunked(journal_id):
+        return None
+    return get_journal_text(app_data.get_user_key(), journal_id)
+
+def save_selected_text(text_control) -> None:
+    """queue the text in screen for saving, only if the user edited it"""
+    if app_data.get_selected_journal_id()>=1 and text_control.IsModified():
+        app_data.get_autosave().submit(app_data.get_selected_journal_id(),
+                                       text_control.GetValue())
+        text_control.SetModified(False)
+
 app_data = ApplicationData()
 
 class MyTree(wx.TreeCtrl):
@@ -72,37 +157,97 @@ class TreePanel(wx.Panel):
         # get book name, it will become the name of the tree in the user interface
         # for this first version, the bookId is always 2 (because bookId 1 is reserved)
         root_item = self.tree.AddRoot(get_book_name(app_data.get_user_key(),2))
-        leaf_dict = {}
-
-        # read journal data, each journal entry will become a leaf in the user interface
-        leaf_list = get_tree_leafs(app_data.get_user_key())
-        for leaf in leaf_list:
-            parent_id = leaf[0]
-            leaf_id = leaf[1]
-            leaf_label = leaf[2]
-            if parent_id == 0:
-                # parent is rootItem
-                parent_leaf = root_item
-            else:
-                # get parent leaf from dictionary
-                parent_leaf = leaf_dict.get(parent_id)
-            # add new leaf to tree
-            x_item = self.tree.AppendItem(parent_leaf, leaf_label)
-            self.tree.SetItemData(x_item, leaf_id)
-            # add new leaf to dictionary
-            leaf_dict[leaf_id] = x_item
-
-        # show tree
+        # ids of the leafs whose children are already in the tree, leafs are read
+        # from the database only when they are expanded for the first time
+        self.loaded_leafs = set()
+        self.load_children(root_item)
+
+        # show tree, with the leafs that were expanded the last time
         self.tree.Expand(root_item)
+        self.expand_leafs(root_item, set(get_expanded_leafs()))
 
         sizer = wx.BoxSizer()
         sizer.Add(self.tree, 1, wx.EXPAND)
 
+        self.tree.Bind(wx.EVT_TREE_ITEM_EXPANDING, self.on_evt_tree_item_expanding)
         self.tree.Bind(wx.EVT_TREE_SEL_CHANGED, self.on_evt_tree_sel_changed)
         self.tree.Bind(wx.EVT_TREE_END_LABEL_EDIT, self.on_evt_tree_end_label_edit)
         self.SetSizerAndFit(sizer)
         self.text_control = None
         self.selected_item = -1
+        # big texts are decrypted in a worker thread and shown a piece at a time,
+        # the pieces come back to the GUI thread with CallAfter
+        self.text_loader = TextLoader(
+            lambda journal_id: iter_journal_text(app_data.get_user_key(), journal_id),
+            lambda *piece: wx.CallAfter(self.on_text_piece, *piece))
+        self.loaded_pieces = []
+
+    def get_leaf_id(self, item) -> int:
+        """journal id of a tree item, the root item (the book) is leaf 0.
+        The data of a leaf just added is the future of its id until it is created"""
+        leaf_id = self.tree.GetItemData(item)
+        if isinstance(leaf_id, Future):
+            leaf_id = leaf_id.result()
+            self.tree.SetItemData(item, leaf_id)
+        return leaf_id or 0
+
+    def load_children(self, item):
+        """read the children of a tree item from the database, only the first time"""
+        leaf_id = self.get_leaf_id(item)
+        if leaf_id in self.loaded_leafs:
+            return
+        self.loaded_leafs.add(leaf_id)
+        # each journal entry will become a leaf in the user interface
+        for child_id, child_label, has_children in get_child_leafs(app_data.get_user_key(),
+                                                                   2, leaf_id):
+            x_item = self.tree.AppendItem(item, child_label)
+            self.tree.SetItemData(x_item, child_id)
+            # show the expand button without reading the grandchildren yet
+            self.tree.SetItemHasChildren(x_item, has_children)
+
+    def expand_leafs(self, item, expanded: set):
+        """expand the children of a tree item whose ids are in expanded, and their own"""
+        child, cookie = self.tree.GetFirstChild(item)
+        while child.IsOk():
+            if self.get_leaf_id(child) in expanded:
+                self.load_children(child)
+                self.tree.Expand(child)
+                self.expand_leafs(child, expanded)
+            child, cookie = self.tree.GetNextChild(item, cookie)
+
+    def get_expanded_leafs(self, item=None) -> list:
+        """ids of the expanded leafs under a tree item, parents first"""
+        if item is None:
+            item = self.tree.GetRootItem()
+        expanded = []
+        child, cookie = self.tree.GetFirstChild(item)
+        while child.IsOk():
+            if self.tree.IsExpanded(child):
+                expanded.append(self.get_leaf_id(child))
+                expanded.extend(self.get_expanded_leafs(child))
+            child, cookie = self.tree.GetNextChild(item, cookie)
+        return expanded
+
+    def on_evt_tree_item_expanding(self, event):
+        """event when a tree item is about to be expanded"""
+        item = event.GetItem()
+        if item.IsOk():
+            self.load_children(item)
+        event.Skip()
+
+    def select_leaf(self, journal_id: int):
+        """expand the tree down to a journal and select it"""
+        item = self.tree.GetRootItem()
+        for leaf_id in get_leaf_path(journal_id):
+            self.load_children(item)
+            child, cookie = self.tree.GetFirstChild(item)
+            while child.IsOk() and self.get_leaf_id(child) != leaf_id:
+                child, cookie = self.tree.GetNextChild(item, cookie)
+            if not child.IsOk():
+                return
+            item = child
+        self.tree.EnsureVisible(item)
+        self.tree.SelectItem(item)
 
     def set_text_control(self, text_control):
         """set text control"""
@@ -110,26 +255,65 @@ class TreePanel(wx.Panel):
 
     def on_evt_tree_sel_changed(self, event):
         """event when a tree selection changes"""
-        # before we continue... update the previously selected item
-        # save current text before exit application
-        if app_data.get_selected_journal_id()>=1:
-            text_in_screen = self.text_control.GetValue()
-            update_journal_text(app_data.get_user_key(), app_data.get_selected_journal_id(),
-                                text_in_screen)
+        # before we continue... save the previously selected item if it was edited
+        save_selected_text(self.text_control)
         # now continue changing the selected item
         item = event.GetItem()
         if item.IsOk():
             self.selected_item = item
-            item_data = self.tree.GetItemData(item)
+            item_data = self.get_leaf_id(item)
             if item_data:
                 print (item_data)
-                # get journal text from leaf data (which is also the journal id in the database)
-                journal_text = get_journal_text(app_data.get_user_key(), item_data)
-                self.text_control.SetValue(journal_text)
-                # set global journal id for future reference
-                app_data.set_selected_journal_id(item_data)
+                # a big text still loading for the previous leaf is not needed anymore
+                self.text_loader.cancel()
+                self.loaded_pieces = []
+                # nothing is saved and the text is read only until all of it is in
+                # screen, so a partial text never replaces the stored one
+                app_data.set_selected_journal_id(-1)
+                self.text_control.ChangeValue("")
+                self.text_control.SetEditable(False)
+                # get journal text from leaf data (which is also the journal id in the
+                # database) in the storage worker, moving fast over the tree only reads
+                # the last leaf selected
+                app_data.get_storage_worker().submit(
+                    lambda: read_journal_to_show(item_data),
+                    lambda journal_text: self.on_text_read(item_data, journal_text),
+                    coalesce_key="select")
         event.Skip()
 
+    def on_text_read(self, journal_id: int, journal_text: Optional[str]):
+        """show the text of the selected leaf, runs in the GUI thread"""
+        if not self.text_control or not self.selected_item or \
+                self.get_leaf_id(self.selected_item) != journal_id:
+            return
+        if journal_text is None:
+            self.text_loader.load(journal_id)
+            return
+        # ChangeValue does not send EVT_TEXT, so loading a text does not save it
+        self.text_control.ChangeValue(journal_text)
+        self.text_control.SetEditable(True)
+        app_data.get_autosave().mark_saved(journal_id, journal_text)
+        # set global journal id for future reference
+        app_data.set_selected_journal_id(journal_id)
+
+    def on_text_piece(self, generation: int, journal_id: int, piece: str, finished: bool):
+        """show the next piece of a big text, runs in the GUI thread"""
+        if not self.text_loader.is_current(generation):
+            return
+        if piece:
+            # keep the caret (and the view) where the user left it
+            position = self.text_control.GetInsertionPoint()
+            self.text_control.AppendText(piece)
+            self.text_control.SetInsertionPoint(position)
+            self.loaded_pieces.append(piece)
+        if finished:
+            app_data.get_autosave().mark_saved(journal_id, "".join(self.loaded_pieces))
+            self.loaded_pieces = []
+            self.text_control.SetModified(False)
+            self.text_control.SetEditable(True)
+            app_data.set_selected_journal_id(journal_id)
+        self.text_loader.acknowledge(generation)
+
     def on_evt_tree_end_label_edit(self, event):
         """event when a tree edit occurs"""
         item = event.GetItem()
@@ -137,8 +321,14 @@ class TreePanel(wx.Panel):
             new_label = event.GetLabel()
             # print (self.tree.GetItemText(item))
             print (new_label)
-            # update label in database
-            update_journal_name(app_data.get_user_key(), self.tree.GetItemData(item), new_label)
+            # update label in database, a leaf just added gets its id in the worker
+            # before this call runs, and only the last of quick renames is written
+            leaf_id = self.tree.GetItemData(item)
+            app_data.get_storage_worker().submit(
+                lambda: update_journal_name(
+                    app_data.get_user_key(),
+                    leaf_id.result() if isinstance(leaf_id, Future) else leaf_id, new_label),
+                coalesce_key=("name", leaf_id))
         event.Skip()
 
     def add_leaf(self):
@@ -146,27 +336,287 @@ class TreePanel(wx.Panel):
         if self.selected_item:
             # first add leaf in database because we need the new generated id
             # remember that in this version bookId is always 2
-            parent_leaf_id = self.tree.GetItemData(self.selected_item)
-            new_leaf_id = create_journal(app_data.get_user_key(), 2, parent_leaf_id,
-                                         text_labels.NEW_LEAF, "")
+            parent_leaf_id = self.get_leaf_id(self.selected_item)
+            # children already in the database must be in the tree before the new one
+            self.load_children(self.selected_item)
             new_leaf = self.tree.AppendItem(self.selected_item, text_labels.NEW_LEAF)
-            self.tree.SetItemData(new_leaf, new_leaf_id)
+            # the leaf is shown at once, its data is the future of the new id
+            self.tree.SetItemData(new_leaf, app_data.get_storage_worker().submit(
+                lambda: create_journal(app_data.get_user_key(), 2, parent_leaf_id,
+                                       text_labels.NEW_LEAF, "")))
             self.tree.Refresh()
 
     def remove_leaf(self):
         """remove leaf from tree"""
         if self.selected_item:
-            leaf_id = self.tree.GetItemData(self.selected_item)
-            self.tree.Delete(self.selected_item)
-            # now also delete that leaf in database
-            delete_journal(leaf_id)
+            leaf_id = self.get_leaf_id(self.selected_item)
+            # the text in screen belongs to the deleted leaf, do not save it
+            app_data.set_selected_journal_id(-1)
+            self.text_loader.cancel()
+            # delete that leaf and the leafs under it in database
+            app_data.get_storage_worker().submit(lambda: delete_journal(leaf_id),
+                                                 self.on_leafs_deleted)
+            # now also delete it in the tree, that selects another leaf
+            deleted_item = self.selected_item
+            self.selected_item = None
+            self.tree.Delete(deleted_item)
             self.tree.Refresh()
 
+    def on_leafs_deleted(self, deleted_ids: List[int]):
+        """forget the leafs deleted in the database, runs in the GUI thread"""
+        for deleted_id in deleted_ids:
+            app_data.get_autosave().forget(deleted_id)
+            self.loaded_leafs.discard(deleted_id)
+
     def rename_leaf(self):
         """rename leaf"""
         if self.selected_item:
             self.tree.EditLabel(self.selected_item)
 
+    def show_history(self):
+        """list the older versions of the selected leaf and restore the one chosen"""
+        journal_id = app_data.get_selected_journal_id()
+        if journal_id < 1:
+            return
+        # the text in screen goes to the history too
+        save_selected_text(self.text_control)
+        app_data.get_autosave().wait(journal_id)
+        revision_list = list_revisions(journal_id)
+        if not revision_list:
+            wx.MessageBox(text_labels.NO_REVISIONS, text_labels.HISTORY,
+                          wx.OK | wx.ICON_INFORMATION)
+            return
+        dialog = wx.SingleChoiceDialog(
+            self, text_labels.CHOOSE_REVISION, text_labels.HISTORY,
+            [time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(saved_at))
+             for _, saved_at, _, _ in revision_list])
+        accepted = dialog.ShowModal() == wx.ID_OK
+        selection = dialog.GetSelection()
+        dialog.Destroy()
+        if not accepted or wx.MessageBox(text_labels.RESTORE_REVISION, text_labels.HISTORY,
+                                         wx.YES_NO | wx.ICON_QUESTION) != wx.YES:
+            return
+        journal_text = restore_revision(app_data.get_user_key(), journal_id,
+                                        revision_list[selection][0])
+        if journal_text is not None and journal_id == app_data.get_selected_journal_id():
+            self.text_control.ChangeValue(journal_text)
+            app_data.get_autosave().mark_saved(journal_id, journal_text)
+
+    def attach_file(self) -> None:
+        """add a file chosen by the user to the selected leaf"""
+        journal_id = app_data.get_selected_journal_id()
+        if journal_id < 1:
+            return
+        dialog = wx.FileDialog(self, text_labels.ATTACH_FILE,
+                               style=wx.FD_OPEN | wx.FD_FILE_MUST_EXIST)
+        accepted = dialog.ShowModal() == wx.ID_OK
+        file_name = dialog.GetPath()
+        dialog.Destroy()
+        if not accepted:
+            return
+        state: Dict[str, int] = {}
+        if not run_with_progress(self, text_labels.ENCRYPTING_FILE,
+                                 lambda: add_attachment(
+                                     app_data.get_user_key(), journal_id, file_name,
+                                     lambda done, size: state.update(done=done, rows=size)),
+                                 state):
+            wx.MessageBox(text_labels.ATTACHMENT_FAILED, "Error", wx.OK | wx.ICON_ERROR)
+
+    def choose_attachment(self, message: str) -> Optional[Any]:
+        """(id, name, size) of an attachment of the selected leaf chosen by the user"""
+        journal_id = app_data.get_selected_journal_id()
+        if journal_id < 1:
+            return None
+        attachment_list = list_attachments(app_data.get_user_key(), journal_id)
+        if not attachment_list:
+            wx.MessageBox(text_labels.NO_ATTACHMENTS, text_labels.ATTACHMENTS,
+                          wx.OK | wx.ICON_INFORMATION)
+            return None
+        dialog = wx.SingleChoiceDialog(
+            self, message, text_labels.ATTACHMENTS,
+            [f"{name} ({max(1, size // 1024)} KB)" for _, name, size in attachment_list])
+        accepted = dialog.ShowModal() == wx.ID_OK
+        selection = dialog.GetSelection()
+        dialog.Destroy()
+        return attachment_list[selection] if accepted else None
+
+    def save_attachment(self) -> None:
+        """write an attachment of the selected leaf to a file chosen by the user"""
+        attachment = self.choose_attachment(text_labels.CHOOSE_ATTACHMENT_TO_SAVE)
+        if attachment is None:
+            return
+        dialog = wx.FileDialog(self, text_labels.SAVE_TO_FILE, defaultFile=attachment[1],
+                               style=wx.FD_SAVE | wx.FD_OVERWRITE_PROMPT)
+        accepted = dialog.ShowModal() == wx.ID_OK
+        file_name = dialog.GetPath()
+        dialog.Destroy()
+        if not accepted:
+            return
+        state: Dict[str, int] = {}
+        if not run_with_progress(self, text_labels.DECRYPTING_FILE,
+                                 lambda: export_attachment(
+                                     app_data.get_user_key(), attachment[0], file_name,
+                                     lambda done, size: state.update(done=done, rows=size)),
+                                 state):
+            wx.MessageBox(text_labels.ATTACHMENT_FAILED, "Error", wx.OK | wx.ICON_ERROR)
+
+    def remove_attachment(self):
+        """remove an attachment of the selected leaf"""
+        attachment = self.choose_attachment(text_labels.CHOOSE_ATTACHMENT_TO_REMOVE)
+        if attachment is not None and \
+                wx.MessageBox(text_labels.REMOVE_ATTACHMENT, text_labels.ATTACHMENTS,
+                              wx.YES_NO | wx.ICON_QUESTION) == wx.YES:
+            remove_attachment(attachment[0])
+
+class SearchPanel(wx.Panel):
+    """search box and list of the journals found"""
+    def __init__(self, parent, tree_panel):
+        wx.Panel.__init__(self, parent)
+        self.tree_panel = tree_panel
+        self.result_ids = []
+
+        self.search_control = wx.SearchCtrl(self, style=wx.TE_PROCESS_ENTER)
+        self.search_control.SetDescriptiveText(text_labels.SEARCH)
+        self.result_list = wx.ListBox(self)
+
+        sizer = wx.BoxSizer(wx.VERTICAL)
+        sizer.Add(self.search_control, 0, wx.EXPAND)
+        sizer.Add(self.result_list, 1, wx.EXPAND)
+
+        self.search_control.Bind(wx.EVT_SEARCHCTRL_SEARCH_BTN, self.on_evt_search)
+        self.search_control.Bind(wx.EVT_TEXT_ENTER, self.on_evt_search)
+        self.result_list.Bind(wx.EVT_LISTBOX, self.on_evt_result_selected)
+        self.SetSizerAndFit(sizer)
+
+    def on_evt_search(self, _event):
+        """event when the user asks for a search, it runs in the storage worker"""
+        query = self.search_control.GetValue()
+        app_data.get_storage_worker().submit(
+            lambda: search_journals(app_data.get_user_key(), query),
+            self.on_search_results, coalesce_key="search")
+
+    def on_search_results(self, result_list):
+        """show the journals found, runs in the GUI thread"""
+        if not self.result_list:
+            return
+        self.result_ids = [journal_id for journal_id, _ in result_list]
+        self.result_list.Set([journal_name for _, journal_name in result_list])
+
+    def on_evt_result_selected(self, event):
+        """event when a search result is selected, show it in the tree"""
+        selection = event.GetSelection()
+        if 0 <= selection < len(self.result_ids):
+            self.tree_panel.select_leaf(self.result_ids[selection])
+
+class RecentPanel(wx.Panel):
+    """list of the journals edited last, read from the index of modification times"""
+    def __init__(self, parent, tree_panel):
+        wx.Panel.__init__(self, parent)
+        self.tree_panel = tree_panel
+        self.recent_ids = []
+        self.recent_labels = []
+
+        title = wx.StaticText(self, label=text_labels.RECENTLY_EDITED)
+        self.recent_list = wx.ListBox(self)
+
+        sizer = wx.BoxSizer(wx.VERTICAL)
+        sizer.Add(title, 0, wx.EXPAND)
+        sizer.Add(self.recent_list, 1, wx.EXPAND)
+
+        self.recent_list.Bind(wx.EVT_LISTBOX, self.on_evt_recent_selected)
+        self.SetSizerAndFit(sizer)
+
+        # edits, renames and syncs all change the list, it is read again from time to time
+        self.refresh_timer = wx.Timer(self)
+        self.Bind(wx.EVT_TIMER, lambda _event: self.refresh(), self.refresh_timer)
+        self.refresh_timer.Start(RECENT_REFRESH_MS)
+        self.refresh()
+
+    def refresh(self):
+        """read the list again in the storage worker"""
+        app_data.get_storage_worker().submit(
+            lambda: list_recent_journals(app_data.get_user_key()),
+            self.on_recent_journals, coalesce_key="recent")
+
+    def on_recent_journals(self, recent_journals):
+        """show the journals edited last, runs in the GUI thread"""
+        if not self.recent_list:
+            return
+        labels = [time.strftime("%Y-%m-%d %H:%M", time.localtime(modified / 1000)) + "  " +
+                  journal_name for _, journal_name, _, modified in recent_journals]
+        # the selection is kept while nothing changed
+        if labels != self.recent_labels:
+            self.recent_ids = [journal_id for journal_id, _, _, _ in recent_journals]
+            self.recent_labels = labels
+            self.recent_list.Set(labels)
+
+    def on_evt_recent_selected(self, event):
+        """event when a recent journal is selected, show it in the tree"""
+        selection = event.GetSelection()
+        if 0 <= selection < len(self.recent_ids):
+            self.tree_panel.select_leaf(self.recent_ids[selection])
+
+class JumpDialog(wx.Dialog):
+    """box for words of a leaf name and list of the leafs found as the user types,
+    the leaf chosen is in journal_id"""
+    def __init__(self, parent):
+        wx.Dialog.__init__(self, parent, title=text_labels.JUMP_TO_LEAF, size=(700, 450),
+                           style=wx.DEFAULT_DIALOG_STYLE | wx.RESIZE_BORDER)
+        self.journal_id = 0
+        self.result_ids = []
+
+        self.query_control = wx.TextCtrl(self, style=wx.TE_PROCESS_ENTER)
+        self.query_control.SetHint(text_labels.TYPE_LEAF_NAME)
+        self.result_list = wx.ListBox(self)
+
+        sizer = wx.BoxSizer(wx.VERTICAL)
+        sizer.Add(self.query_control, 0, wx.EXPAND | wx.ALL, 4)
+        sizer.Add(self.result_list, 1, wx.EXPAND | wx.ALL, 4)
+        self.SetSizer(sizer)
+
+        self.query_control.Bind(wx.EVT_TEXT, self.on_evt_text)
+        self.query_control.Bind(wx.EVT_TEXT_ENTER, lambda _event: self.choose_leaf())
+        self.result_list.Bind(wx.EVT_LISTBOX_DCLICK, lambda _event: self.choose_leaf())
+        self.Bind(wx.EVT_CHAR_HOOK, self.on_evt_char_hook)
+        self.query_control.SetFocus()
+
+    def on_evt_text(self, _event):
+        """event when the words change, the leafs are found in the storage worker and
+        only the last words typed are looked up"""
+        query = self.query_control.GetValue()
+        app_data.get_storage_worker().submit(
+            lambda: find_titles(app_data.get_user_key(), query),
+            self.on_titles_found, coalesce_key="jump")
+
+    def on_titles_found(self, result_list):
+        """show the path of each leaf found, runs in the GUI thread"""
+        if not self.result_list:
+            return
+        self.result_ids = [journal_id for journal_id, _, _ in result_list]
+        self.result_list.Set([path for _, _, path in result_list])
+        if self.result_ids:
+            self.result_list.SetSelection(0)
+
+    def on_evt_char_hook(self, event):
+        """the arrows move in the list while the cursor stays in the box"""
+        key_code = event.GetKeyCode()
+        selection = self.result_list.GetSelection()
+        if key_code == wx.WXK_DOWN and selection + 1 < len(self.result_ids):
+            self.result_list.SetSelection(selection + 1)
+        elif key_code == wx.WXK_UP and selection > 0:
+            self.result_list.SetSelection(selection - 1)
+        elif key_code == wx.WXK_ESCAPE:
+            self.EndModal(wx.ID_CANCEL)
+        else:
+            event.Skip()
+
+    def choose_leaf(self):
+        """close the dialog with the selected leaf"""
+        selection = self.result_list.GetSelection()
+        if 0 <= selection < len(self.result_ids):
+            self.journal_id = self.result_ids[selection]
+            self.EndModal(wx.ID_OK)
+
 class MainPanel(wx.Panel):
     """main panel class"""
     def __init__(self, parent):
@@ -185,14 +635,41 @@ class TextPanel(wx.Panel):
         bsizer.Add(self.text_control, 1, wx.EXPAND)
         self.SetSizerAndFit(bsizer)
 
+        # every key restarts the timer, the text is saved when the user stops typing
+        self.autosave_timer = wx.Timer(self)
+        self.Bind(wx.EVT_TIMER, self.on_evt_autosave_timer, self.autosave_timer)
+        self.text_control.Bind(wx.EVT_TEXT, self.on_evt_text)
+
+    def on_evt_text(self, event):
+        """event when the text changes"""
+        self.autosave_timer.StartOnce(AUTOSAVE_DELAY_MS)
+        event.Skip()
+
+    def on_evt_autosave_timer(self, _event):
+        """event when the user stopped typing"""
+        save_selected_text(self.text_control)
+
     def get_text_control(self):
         """get text control"""
         return self.text_control
 
+def open_diary() -> bool:
+    """open the diary file, False if another instance keeps it in a working copy
+    or (for a working copy) has it open"""
+    try:
+        return not storage.WORKING_COPY or storage.get_session().connect() is not None
+    except DatabaseLockedError:
+        return False
+
 class MainFrame(wx.Frame):
     """main frame"""
     def __init__(self):
         wx.Frame.__init__(self, None, title="Maitenotas")
+        # every instance locks the diary file, a working copy keeps the others out
+        if not open_diary():
+            wx.MessageBox(text_labels.DIARY_IN_USE, "Error", wx.OK | wx.ICON_ERROR)
+            self.Destroy()
+            return
         # ask for user password
         user_password = ""
         if app_data.get_new_database():
@@ -243,10 +720,19 @@ class MainFrame(wx.Frame):
                 dlg_pass.Destroy()
                 self.Close()
 
-        # verify database connection
-        app_data.set_user_key(generate_user_key(user_password))
+        if app_data.get_profile_startup():
+            start_profile()
+
+        # verify database connection, the key derivation is slow on purpose
+        # so it runs in a worker thread while a progress dialog is shown
         if app_data.get_new_database():
-            database_access = create_database(app_data.get_user_key(), user_password)
+            kdf_parameters = run_with_progress(
+                self, text_labels.CREATING_KEY, lambda: new_kdf_parameters(calibrate_iterations()))
+            app_data.set_user_key(run_with_progress(
+                self, text_labels.CREATING_KEY, lambda: derive_user_key(user_password,
+                                                                        kdf_parameters)))
+            database_access = create_database(app_data.get_user_key(), user_password,
+                                              kdf_parameters)
             if database_access is False:
                 wx.MessageBox(text_labels.ERROR_READING_DATA, "Error" ,wx.OK | wx.ICON_ERROR)
                 self.Close()
@@ -260,17 +746,42 @@ class MainFrame(wx.Frame):
             journal_text = text_labels.SAMPLE_TEXT_2 + name_of_first_book
             create_journal(app_data.get_user_key(), book_id, 0, journal_name, journal_text)
         else:
+            stored_parameters = read_kdf_parameters()
+            kdf_parameters = stored_parameters or legacy_kdf_parameters(user_password)
+            app_data.set_user_key(run_with_progress(
+                self, text_labels.OPENING_DIARY, lambda: derive_user_key(user_password,
+                                                                         kdf_parameters)))
             database_access = verify_database_password(app_data.get_user_key(), user_password)
             if database_access is False:
                 wx.MessageBox(text_labels.INVALID_PASSWORD, "Error" ,wx.OK | wx.ICON_ERROR)
                 self.Close()
+            elif stored_parameters is None:
+                # database of an older version: move it to a random salt
+                # and to the iterations calibrated for this machine
+                self.upgrade_user_key(user_password)
+            else:
+                # a change of password interrupted by a crash goes on from where it was
+                user_key = pending_user_key(app_data.get_user_key())
+                if isinstance(user_key, RotatingKey):
+                    app_data.set_user_key(user_key)
+                    self.finish_user_key_change(user_key)
+
+        # the tree is read with one decrypt, or rebuilt if it changed since it was stored
+        if app_data.get_user_key():
+            load_tree_snapshot(app_data.get_user_key())
 
         # create GUI Main panel and sub panels
         panel = MainPanel(self)
         box_sizer = wx.BoxSizer(wx.HORIZONTAL)
 
         self.tree_panel = TreePanel(panel)
-        box_sizer.Add(self.tree_panel, 1, wx.EXPAND | wx.ALL, 1)
+        self.search_panel = SearchPanel(panel, self.tree_panel)
+        self.recent_panel = RecentPanel(panel, self.tree_panel)
+        left_sizer = wx.BoxSizer(wx.VERTICAL)
+        left_sizer.Add(self.search_panel, 1, wx.EXPAND | wx.ALL, 1)
+        left_sizer.Add(self.recent_panel, 1, wx.EXPAND | wx.ALL, 1)
+        left_sizer.Add(self.tree_panel, 3, wx.EXPAND | wx.ALL, 1)
+        box_sizer.Add(left_sizer, 1, wx.EXPAND)
         text_panel = TextPanel(panel)
         box_sizer.Add(text_panel, 2, wx.EXPAND | wx.ALL, 1)
         panel.SetSizer(box_sizer)
@@ -291,10 +802,20 @@ class MainFrame(wx.Frame):
         application_menu = wx.Menu()
         wx_pythonid_exit=app_data.get_next_wx_python_id()
         wx_id_about=app_data.get_next_wx_python_id()
+        wx_id_diagnostics=app_data.get_next_wx_python_id()
+        wx_id_change_password=app_data.get_next_wx_python_id()
 
         menu_item_about = wx.MenuItem(application_menu, wx_id_about, text_labels.TEXT_ABOUT)
         application_menu.Append(menu_item_about)
         self.Bind(wx.EVT_MENU, show_about_screen, id=wx_id_about)
+        menu_item_diagnostics = wx.MenuItem(application_menu, wx_id_diagnostics,
+                                            text_labels.TEXT_DIAGNOSTICS)
+        application_menu.Append(menu_item_diagnostics)
+        self.Bind(wx.EVT_MENU, self.show_diagnostics, id=wx_id_diagnostics)
+        menu_item_change_password = wx.MenuItem(application_menu, wx_id_change_password,
+                                                text_labels.TEXT_CHANGE_PASSWORD)
+        application_menu.Append(menu_item_change_password)
+        self.Bind(wx.EVT_MENU, self.change_password, id=wx_id_change_password)
         menu_item_exit = wx.MenuItem(application_menu, wx_pythonid_exit, text_labels.TEXT_QUIT)
         application_menu.Append(menu_item_exit)
         self.Bind(wx.EVT_MENU, self.quit_application, id=wx_pythonid_exit)
@@ -304,16 +825,37 @@ class MainFrame(wx.Frame):
         wx_python_d1=app_data.get_next_wx_python_id()
         wx_python_d2=app_data.get_next_wx_python_id()
         wx_python_d3=app_data.get_next_wx_python_id()
+        wx_id_history=app_data.get_next_wx_python_id()
+        wx_id_jump=app_data.get_next_wx_python_id()
+        wx_id_attach_file=app_data.get_next_wx_python_id()
+        wx_id_save_attachment=app_data.get_next_wx_python_id()
+        wx_id_remove_attachment=app_data.get_next_wx_python_id()
         menu_item_add_leaf = wx.MenuItem(tree_menu, wx_python_d1, text_labels.TEXT_ADD_LEAF)
         menu_item_remove_leaf = wx.MenuItem(tree_menu, wx_python_d2, text_labels.TEXT_REMOVE_LEAF)
         menu_item_rename_leaf = wx.MenuItem(tree_menu, wx_python_d3, text_labels.TEXT_RENAME_LEAF)
         tree_menu.Append(menu_item_add_leaf)
         tree_menu.Append(menu_item_remove_leaf)
         tree_menu.Append(menu_item_rename_leaf)
+        tree_menu.Append(wx.MenuItem(tree_menu, wx_id_history, text_labels.TEXT_HISTORY))
+        tree_menu.Append(wx.MenuItem(tree_menu, wx_id_jump, text_labels.TEXT_JUMP_TO_LEAF))
+        tree_menu.AppendSeparator()
+        tree_menu.Append(wx.MenuItem(tree_menu, wx_id_attach_file, text_labels.TEXT_ATTACH_FILE))
+        tree_menu.Append(wx.MenuItem(tree_menu, wx_id_save_attachment,
+                                     text_labels.TEXT_SAVE_ATTACHMENT))
+        tree_menu.Append(wx.MenuItem(tree_menu, wx_id_remove_attachment,
+                                     text_labels.TEXT_REMOVE_ATTACHMENT))
 
         self.Bind(wx.EVT_MENU, self.add_leaf, id=wx_python_d1)
         self.Bind(wx.EVT_MENU, self.remove_leaf, id=wx_python_d2)
         self.Bind(wx.EVT_MENU, self.rename_leaf, id=wx_python_d3)
+        self.Bind(wx.EVT_MENU, self.show_history, id=wx_id_history)
+        self.Bind(wx.EVT_MENU, self.jump_to_leaf, id=wx_id_jump)
+        self.Bind(wx.EVT_MENU, lambda _event: self.tree_panel.attach_file(),
+                  id=wx_id_attach_file)
+        self.Bind(wx.EVT_MENU, lambda _event: self.tree_panel.save_attachment(),
+                  id=wx_id_save_attachment)
+        self.Bind(wx.EVT_MENU, lambda _event: self.tree_panel.remove_attachment(),
+                  id=wx_id_remove_attachment)
 
         menubar.Append(application_menu, text_labels.TEXT_APPLICATION)
         menubar.Append(tree_menu, text_labels.TEXT_TREE)
@@ -322,17 +864,120 @@ class MainFrame(wx.Frame):
         # window close event
         self.Bind(wx.EVT_CLOSE, self.close_window)
 
+        # the changes of a working copy are written back by the storage worker
+        self.flush_timer = wx.Timer(self)
+        self.Bind(wx.EVT_TIMER, self.on_evt_flush_timer, self.flush_timer)
+        if storage.WORKING_COPY:
+            self.flush_timer.Start(WORKING_COPY_CHECK_MS)
+
+        if app_data.get_profile_startup():
+            app_data.set_startup_profile(stop_profile())
+
+    def upgrade_user_key(self, user_password: str):
+        """encrypt a database of an older version with a key from new kdf parameters"""
+        kdf_parameters = run_with_progress(
+            self, text_labels.UPGRADING_DIARY,
+            lambda: new_kdf_parameters(calibrate_iterations()))
+        new_key = run_with_progress(self, text_labels.UPGRADING_DIARY,
+                                    lambda: derive_user_key(user_password, kdf_parameters))
+        self.change_user_key(new_key, kdf_parameters)
+
+    def change_password(self, _event):
+        """ask the current and a new password and encrypt the database with the new one"""
+        passwords = []
+        for label in (text_labels.ENTER_PASSWORD, text_labels.DEFINE_PASSWORD,
+                      text_labels.CONFIRM_PASSWORD):
+            dialog = wx.TextEntryDialog(self, label, text_labels.CHANGE_PASSWORD)
+            accepted = dialog.ShowModal() == wx.ID_OK
+            passwords.append(dialog.GetValue())
+            dialog.Destroy()
+            if not accepted:
+                return
+        user_password, new_password = passwords[0], passwords[1]
+        kdf_parameters = read_kdf_parameters() or legacy_kdf_parameters(user_password)
+        if not run_with_progress(self, text_labels.OPENING_DIARY,
+                                 lambda: verify_database_password(
+                                     derive_user_key(user_password, kdf_parameters),
+                                     user_password)):
+            wx.MessageBox(text_labels.INVALID_PASSWORD, "Error" ,wx.OK | wx.ICON_ERROR)
+            return
+        if new_password != passwords[2]:
+            wx.MessageBox(text_labels.PASSWORDS_DO_NOT_MATCH, "Error" ,wx.OK | wx.ICON_ERROR)
+            return
+        kdf_parameters = run_with_progress(
+            self, text_labels.CREATING_KEY, lambda: new_kdf_parameters(calibrate_iterations()))
+        new_key = run_with_progress(self, text_labels.CREATING_KEY,
+                                    lambda: derive_user_key(new_password, kdf_parameters))
+        save_selected_text(self.text_control)
+        if self.change_user_key(new_key, kdf_parameters, new_password):
+            wx.MessageBox(text_labels.PASSWORD_CHANGED, text_labels.CHANGE_PASSWORD,
+                          wx.OK | wx.ICON_INFORMATION)
+
+    def change_user_key(self, new_key: UserKey, kdf_parameters,
+                        new_password: Optional[str] = None) -> bool:
+        """move the database to new_key, from the first step the database only opens
+        with the new password and the application uses a key that reads both keys"""
+        app_data.get_storage_worker().flush()
+        app_data.get_autosave().flush()
+        rotating_key = start_user_key_change(app_data.get_user_key(), new_key,
+                                             kdf_parameters, new_password)
+        if rotating_key is None:
+            return False
+        app_data.set_user_key(rotating_key)
+        return self.finish_user_key_change(rotating_key)
+
+    def finish_user_key_change(self, rotating_key: RotatingKey) -> bool:
+        """encrypt the rows left with the new key in batches, showing the progress,
+        if it is interrupted the next start goes on"""
+        state: Dict[str, int] = {}
+        if run_with_progress(self, text_labels.ENCRYPTING_DIARY,
+                             lambda: resume_user_key_change(
+                                 rotating_key,
+                                 lambda done, rows: state.update(done=done, rows=rows)),
+                             state):
+            app_data.set_user_key(rotating_key.new_key)
+            return True
+        return False
+
+    def show_diagnostics(self, _event):
+        """show the statistics of the storage and crypto operations"""
+        dialog = DiagnosticsDialog(self)
+        dialog.ShowModal()
+        dialog.Destroy()
+
     def quit_application(self, _event):
         """quit application"""
         self.Close()
 
+    def on_evt_flush_timer(self, _event):
+        """write the changes of the working copy when they are due"""
+        app_data.get_storage_worker().submit(flush_working_copy, coalesce_key="flush")
+
     def close_window(self, _event):
         """close window"""
         # save current text before exit application
-        if app_data.get_selected_journal_id()>=1:
-            text_in_screen = self.text_control.GetValue()
-            update_journal_text(app_data.get_user_key(), app_data.get_selected_journal_id(),
-                                text_in_screen)
+        save_selected_text(self.text_control)
+        self.flush_timer.Stop()
+        self.recent_panel.refresh_timer.Stop()
+        self.tree_panel.text_loader.stop()
+        # renames, new and deleted leafs still queued are written
+        app_data.get_storage_worker().stop()
+        # texts that could not be saved are kept in memory, do not lose them quietly
+        while not app_data.get_autosave().flush():
+            if wx.MessageBox(text_labels.TEXT_NOT_SAVED, "Error",
+                             wx.YES_NO | wx.ICON_ERROR) != wx.YES:
+                break
+        app_data.get_autosave().stop()
+        save_tree_snapshot(app_data.get_user_key(), self.tree_panel.get_expanded_leafs())
+        run_maintenance()
+        # the working copy is the only copy of the last changes, do not lose them quietly
+        while not run_with_progress(self, text_labels.WRITING_DIARY,
+                                    lambda: flush_working_copy(force=True)):
+            if wx.MessageBox(text_labels.DIARY_NOT_WRITTEN, "Error",
+                             wx.YES_NO | wx.ICON_ERROR) != wx.YES:
+                break
+        close_session()
+        shutdown_decrypt_pool()
         print("goodbye!")
         self.Destroy()
 
@@ -348,15 +993,109 @@ class MainFrame(wx.Frame):
         """rename leaf"""
         self.tree_panel.rename_leaf()
 
+    def show_history(self, _event):
+        """older versions of the selected leaf"""
+        self.tree_panel.show_history()
+
+    def jump_to_leaf(self, _event):
+        """find a leaf by its name and select it in the tree"""
+        dialog = JumpDialog(self)
+        if dialog.ShowModal() == wx.ID_OK:
+            self.tree_panel.select_leaf(dialog.journal_id)
+        dialog.Destroy()
+
+def diagnostics_extra() -> Dict[str, Any]:
+    """values shown in the diagnostics besides the instrumented operations"""
+    return {"cache": get_cache_statistics(), "autosave": app_data.get_autosave().counters,
+            "storage_worker": app_data.get_storage_worker().statistics(),
+            "working_copy": get_working_copy_statistics(),
+            "startup_profile": app_data.get_startup_profile()}
+
+class DiagnosticsDialog(wx.Dialog):
+    """statistics of the storage and crypto operations, they can be saved to a file"""
+    def __init__(self, parent):
+        wx.Dialog.__init__(self, parent, title=text_labels.DIAGNOSTICS, size=(900, 600),
+                           style=wx.DEFAULT_DIALOG_STYLE | wx.RESIZE_BORDER)
+        self.text_control = wx.TextCtrl(self, -1, "",
+                                        style=wx.TE_MULTILINE | wx.TE_READONLY | wx.HSCROLL)
+        self.text_control.SetFont(wx.Font(9, wx.FONTFAMILY_TELETYPE, wx.FONTSTYLE_NORMAL,
+                                          wx.FONTWEIGHT_NORMAL))
+        refresh_button = wx.Button(self, -1, text_labels.REFRESH)
+        save_button = wx.Button(self, -1, text_labels.SAVE_TO_FILE)
+        close_button = wx.Button(self, wx.ID_CLOSE)
+
+        button_sizer = wx.BoxSizer(wx.HORIZONTAL)
+        button_sizer.Add(refresh_button, 0, wx.ALL, 4)
+        button_sizer.Add(save_button, 0, wx.ALL, 4)
+        button_sizer.Add(close_button, 0, wx.ALL, 4)
+        sizer = wx.BoxSizer(wx.VERTICAL)
+        sizer.Add(self.text_control, 1, wx.EXPAND | wx.ALL, 4)
+        sizer.Add(button_sizer, 0, wx.ALIGN_RIGHT)
+        self.SetSizer(sizer)
+
+        refresh_button.Bind(wx.EVT_BUTTON, self.on_evt_refresh)
+        save_button.Bind(wx.EVT_BUTTON, self.on_evt_save)
+        close_button.Bind(wx.EVT_BUTTON, lambda _event: self.EndModal(wx.ID_CLOSE))
+        self.on_evt_refresh(None)
+
+    def on_evt_refresh(self, _event):
+        """show the statistics collected until now"""
+        self.text_control.SetValue(INSTRUMENTATION.report(diagnostics_extra()))
+
+    def on_evt_save(self, _event):
+        """write the statistics to a JSON file chosen by the user"""
+        dialog = wx.FileDialog(self, text_labels.SAVE_TO_FILE, defaultFile=DIAGNOSTICS_FILE,
+                               wildcard="JSON (*.json)|*.json",
+                               style=wx.FD_SAVE | wx.FD_OVERWRITE_PROMPT)
+        if dialog.ShowModal() == wx.ID_OK:
+            try:
+                INSTRUMENTATION.dump(dialog.GetPath(), diagnostics_extra())
+            except Exception as exception:
+                wx.MessageBox(str(exception), "Error", wx.OK | wx.ICON_ERROR)
+        dialog.Destroy()
+
+def run_with_progress(parent, message: str, function: Callable[[], Any],
+                      state: Optional[Dict[str, int]] = None) -> Any:
+    """run a slow function in a worker thread and keep the GUI alive with a
+    progress dialog until it ends, return the result of the function.
+    If the function puts "done" and "rows" in state the dialog shows the percentage"""
+    result: Dict[str, Any] = {}
+    worker = threading.Thread(target=lambda: result.update(value=function()), daemon=True)
+    worker.start()
+    dialog = wx.ProgressDialog(text_labels.PLEASE_WAIT, message, parent=parent,
+                               style=wx.PD_APP_MODAL | wx.PD_AUTO_HIDE)
+    while worker.is_alive():
+        # Pulse and Update also process the pending GUI events
+        if state and state.get("rows"):
+            dialog.Update(min(99, 100 * state["done"] // state["rows"]))
+        else:
+            dialog.Pulse()
+        worker.join(PROGRESS_PULSE_SECONDS)
+    dialog.Destroy()
+    return result.get("value")
+
 def show_about_screen(_event):
     """show about window"""
     wx.MessageBox(text_labels.MESSAGE_BOX, text_labels.TEXT_ABOUT ,wx.OK | wx.ICON_INFORMATION)
 
-if __name__ == "__main__":
+def main(dbfile: Optional[str] = None, profile_startup: bool = False,
+         working_copy: bool = False) -> None:
+    """run the application on a database file, by default the application database,
+    working_copy keeps it in memory for slow media"""
+    if dbfile is not None:
+        storage.DATABASE_NAME = dbfile
+    storage.WORKING_COPY = working_copy
+    app_data.set_profile_startup(profile_startup)
     # check if database exists
-    if path.exists("maitenotas.data") is False:
+    if path.exists(storage.DATABASE_NAME) is False:
         app_data.set_new_database(True)
 
     app = wx.App(False)
-    frame = MainFrame()
+    MainFrame()
     app.MainLoop()
+
+if __name__ == "__main__":
+    # the decrypt pool starts processes, a frozen executable needs this to run them
+    multiprocessing.freeze_support()
+    main(profile_startup=PROFILE_STARTUP_OPTION in sys.argv,
+         working_copy=WORKING_COPY_OPTION in sys.argv)
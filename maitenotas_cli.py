@@ -0,0 +1,488 @@
+"""
+Application: Maitenotas
+Made by Taksan Tong
+https://github.com/maitelab/maitenotas
+
+Command line and headless access to any journal database, wx is only imported
+when the gui command starts the application. Run with:
+    python -m maitenotas_cli --help
+Passwords are asked in the terminal, or read from the environment variables
+MAITENOTAS_PASSWORD, MAITENOTAS_NEW_PASSWORD and MAITENOTAS_ARCHIVE_PASSWORD
+so the commands can run from scripts """
+import argparse
+import getpass
+import json
+import multiprocessing
+import os
+import sys
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from cryptography.fernet import Fernet
+from crypto import derive_user_key, legacy_kdf_parameters, new_kdf_parameters,\
+    calibrate_iterations, decrypt_data_to_text, shutdown_decrypt_pool, UserKey, RotatingKey
+from instrument import INSTRUMENTATION
+import backup
+import chunks
+import storage
+import transfer
+
+# ***************** SQL
+SQL_COUNT_BOOKS = """
+select count(*)
+from book
+where id<>?
+"""
+
+SQL_COUNT_JOURNALS = """
+select count(*), coalesce(sum(chunked), 0)
+from journal
+"""
+
+SQL_COUNT_CHUNKS = """
+select count(*)
+from journal_chunk
+"""
+
+SQL_COUNT_SEARCH_ROWS = """
+select count(*)
+from search_index
+"""
+
+SQL_COUNT_REVISIONS = """
+select count(*), coalesce(sum(length(revision_data)), 0)
+from journal_revision
+"""
+
+SQL_COUNT_ATTACHMENTS = """
+select count(*), coalesce(sum(size), 0)
+from attachment
+where complete=1
+"""
+
+SQL_READ_JOURNALS_TO_VERIFY = """
+select id,journal_name,journal_text,chunked
+from journal
+order by id
+"""
+
+# the book of the user, the only one in this version
+USER_BOOK_ID = 2
+PASSWORD_VARIABLE = "MAITENOTAS_PASSWORD"
+NEW_PASSWORD_VARIABLE = "MAITENOTAS_NEW_PASSWORD"
+ARCHIVE_PASSWORD_VARIABLE = "MAITENOTAS_ARCHIVE_PASSWORD"
+# exit codes
+EXIT_ERROR = 1
+EXIT_INVALID_PASSWORD = 2
+
+class InvalidPasswordError(Exception):
+    """the password does not open the database"""
+
+# ***************** headless API
+def open_database(dbfile: str) -> storage.StorageSession:
+    """session of an existing database file, DatabaseLockedError while another
+    instance keeps it in a working copy"""
+    if not os.path.isfile(dbfile):
+        raise FileNotFoundError("database not found " + dbfile)
+    session = storage.StorageSession(dbfile)
+    session.connect()
+    return session
+
+def unlock_database(session: storage.StorageSession, user_password: str) -> UserKey:
+    """derive the user key of a database and verify it, while a change of password
+    is not finished the key reads rows of both keys"""
+    database_key = storage.DatabaseKey(session)
+    kdf_parameters = database_key.read_kdf_parameters() or legacy_kdf_parameters(user_password)
+    user_key = derive_user_key(user_password, kdf_parameters)
+    if not database_key.verify_database_password(user_key, user_password):
+        raise InvalidPasswordError("invalid password for " + session.dbfile)
+    return database_key.pending_user_key(user_key)
+
+def pragma_value(session: storage.StorageSession, pragma: str) -> Any:
+    """value of a PRAGMA that returns one value"""
+    for row in session.fetch_all("PRAGMA " + pragma):
+        return row[0]
+    return None
+
+def database_statistics(session: storage.StorageSession) -> Dict[str, Any]:
+    """sizes and settings of a database, nothing is decrypted so no password is needed"""
+    journal_count, chunked_count = session.fetch_all(SQL_COUNT_JOURNALS)[0]
+    revision_count, revision_bytes = session.fetch_all(SQL_COUNT_REVISIONS)[0]
+    attachment_count, attachment_bytes = session.fetch_all(SQL_COUNT_ATTACHMENTS)[0]
+    kdf_parameters = storage.DatabaseKey(session).read_kdf_parameters()
+    return {
+        "file": session.dbfile,
+        "file_bytes": os.path.getsize(session.dbfile),
+        "schema_version": pragma_value(session, "user_version"),
+        "books": session.fetch_all(SQL_COUNT_BOOKS, (storage.PASSWORD_BOOK_ID,))[0][0],
+        "journals": journal_count,
+        "chunked_journals": chunked_count,
+        "chunks": session.fetch_all(SQL_COUNT_CHUNKS)[0][0],
+        "search_rows": session.fetch_all(SQL_COUNT_SEARCH_ROWS)[0][0],
+        "revisions": revision_count,
+        "revision_bytes": revision_bytes,
+        "attachments": attachment_count,
+        "attachment_bytes": attachment_bytes,
+        "orphan_journals": len(session.fetch_all(storage.SQL_READ_ORPHAN_JOURNALS)),
+        "page_size": pragma_value(session, "page_size"),
+        "pages": pragma_value(session, "page_count"),
+        "free_pages": pragma_value(session, "freelist_count"),
+        "auto_vacuum": pragma_value(session, "auto_vacuum"),
+        "journal_mode": pragma_value(session, "journal_mode"),
+        "kdf": kdf_parameters.algorithm if kdf_parameters else "legacy",
+        "kdf_iterations": kdf_parameters.iterations if kdf_parameters else
+                          legacy_kdf_parameters("").iterations,
+    }
+
+def verify_database(session: storage.StorageSession, user_key: Fernet) -> Dict[str, Any]:
+    """check the SQLite file and decrypt every journal name and text, texts are
+    streamed one at a time, return the counts and the ids that failed"""
+    result: Dict[str, Any] = {"sqlite_check": pragma_value(session, "quick_check"),
+                              "journals": 0, "chunks": 0, "failed_journals": []}
+    with session.transaction() as cur:
+        chunk_cursor = cur.connection.cursor()
+        for journal_id, journal_name, journal_text, chunked in \
+                cur.execute(SQL_READ_JOURNALS_TO_VERIFY):
+            result["journals"] = result["journals"] + 1
+            try:
+                decrypt_data_to_text(journal_name, user_key)
+                if chunked:
+                    for _ in chunks.iter_chunk_texts(chunk_cursor, user_key, journal_id):
+                        result["chunks"] = result["chunks"] + 1
+                else:
+                    decrypt_data_to_text(journal_text, user_key)
+            except Exception:
+                result["failed_journals"].append(journal_id)
+    return result
+
+def finish_rekey(session: storage.StorageSession, user_key: UserKey,
+                 progress: Optional[Callable[[int, int], None]] = None) -> UserKey:
+    """finish a change of password interrupted before, return the key to use"""
+    if not isinstance(user_key, RotatingKey):
+        return user_key
+    if not storage.DatabaseKey(session).resume_user_key_change(user_key, progress):
+        raise RuntimeError("the change of password was not finished, see the error above")
+    return user_key.new_key
+
+def rekey_database(session: storage.StorageSession, user_key: UserKey, new_password: str,
+                   progress: Optional[Callable[[int, int], None]] = None) -> UserKey:
+    """encrypt the database with a key derived from a new password, return the new key.
+    The rows are encrypted again in batches, if it is interrupted the database opens
+    with the new password and the next rekey (or the application) finishes it"""
+    user_key = finish_rekey(session, user_key, progress)
+    kdf_parameters = new_kdf_parameters(calibrate_iterations())
+    new_key = derive_user_key(new_password, kdf_parameters)
+    if not storage.DatabaseKey(session).change_user_key(user_key, new_key, kdf_parameters,
+                                                        new_password, progress):
+        raise RuntimeError("the database was not changed, see the error above")
+    return new_key
+
+# ***************** command line
+def read_password(variable: str, prompt: str, confirm: bool = False) -> str:
+    """password from an environment variable or asked in the terminal"""
+    password = os.environ.get(variable)
+    if password is not None:
+        return password
+    password = getpass.getpass(prompt)
+    if confirm and getpass.getpass("Confirm " + prompt[0].lower() + prompt[1:]) != password:
+        raise InvalidPasswordError("passwords do not match")
+    return password
+
+def print_values(values: Dict[str, Any], as_json: bool) -> None:
+    """print a result as JSON or as one line per value"""
+    if as_json:
+        print(json.dumps(values, indent=2))
+        return
+    for name, value in values.items():
+        print(f"{name:20} {value}")
+
+def open_and_unlock(arguments) -> Tuple[storage.StorageSession, UserKey]:
+    """session and key of the database of the command"""
+    session = open_database(arguments.database)
+    return session, unlock_database(session, read_password(PASSWORD_VARIABLE, "Password: "))
+
+def command_stats(arguments) -> int:
+    """print the statistics of the database"""
+    session = open_database(arguments.database)
+    try:
+        print_values(database_statistics(session), arguments.json)
+    finally:
+        session.close()
+    return 0
+
+def command_export(arguments) -> int:
+    """export the book, or the journals under one journal, to an archive or a directory"""
+    session, user_key = open_and_unlock(arguments)
+    try:
+        if arguments.archive:
+            archive_password = read_password(ARCHIVE_PASSWORD_VARIABLE, "Archive password: ",
+                                             confirm=True)
+            journal_count = transfer.export_archive(session, user_key, USER_BOOK_ID,
+                                                    arguments.parent, arguments.destination,
+                                                    archive_password=archive_password)
+        else:
+            journal_count = transfer.export_directory(session, user_key, USER_BOOK_ID,
+                                                      arguments.parent, arguments.destination)
+    finally:
+        session.close()
+    print(f"{journal_count} journals exported to {arguments.destination}")
+    return 0
+
+def command_import(arguments) -> int:
+    """add the journals of an archive or a directory under the book, or under one journal"""
+    session, user_key = open_and_unlock(arguments)
+    try:
+        if arguments.archive:
+            archive_password = read_password(ARCHIVE_PASSWORD_VARIABLE, "Archive password: ")
+            journal_count = transfer.import_archive(session, user_key, USER_BOOK_ID,
+                                                    arguments.parent, arguments.source,
+                                                    archive_password=archive_password)
+        else:
+            journal_count = transfer.import_directory(session, user_key, USER_BOOK_ID,
+                                                      arguments.parent, arguments.source)
+    finally:
+        session.close()
+    print(f"{journal_count} journals imported from {arguments.source}")
+    return 0
+
+def command_search(arguments) -> int:
+    """print the journals containing all the words of the query"""
+    session, user_key = open_and_unlock(arguments)
+    try:
+        results = session.search_journals(user_key, " ".join(arguments.query))
+    finally:
+        session.close()
+    if arguments.json:
+        print(json.dumps([{"id": journal_id, "name": name} for journal_id, name in results],
+                         indent=2))
+    else:
+        for journal_id, name in results:
+            print(f"{journal_id:8} {name}")
+    return 0
+
+def command_recent(arguments) -> int:
+    """print the journals changed (or created) last"""
+    session, user_key = open_and_unlock(arguments)
+    try:
+        results = session.tree.list_recent_journals(user_key, arguments.limit,
+                                                    arguments.created)
+    finally:
+        session.close()
+    if arguments.json:
+        print(json.dumps([{"id": journal_id, "name": name, "created": created,
+                           "modified": modified}
+                          for journal_id, name, created, modified in results], indent=2))
+    else:
+        for journal_id, name, created, modified in results:
+            shown_time = time.localtime((created if arguments.created else modified) / 1000)
+            print(f"{journal_id:8} {time.strftime('%Y-%m-%d %H:%M', shown_time)} {name}")
+    return 0
+
+def command_verify(arguments) -> int:
+    """check the database file and that every journal can be decrypted"""
+    session, user_key = open_and_unlock(arguments)
+    try:
+        result = verify_database(session, user_key)
+    finally:
+        session.close()
+    print_values(result, arguments.json)
+    return 0 if result["sqlite_check"] == "ok" and not result["failed_journals"] else EXIT_ERROR
+
+def print_progress(done: int, rows: int) -> None:
+    """show the rows encrypted again on the terminal"""
+    print(f"\r{done}/{rows} rows", end="" if done < rows else "\n", file=sys.stderr,
+          flush=True)
+
+def command_rekey(arguments) -> int:
+    """encrypt the database with a new password, or finish an interrupted change"""
+    session, user_key = open_and_unlock(arguments)
+    try:
+        if arguments.resume:
+            finish_rekey(session, user_key, print_progress)
+        else:
+            new_password = read_password(NEW_PASSWORD_VARIABLE, "New password: ",
+                                         confirm=True)
+            rekey_database(session, user_key, new_password, print_progress)
+    finally:
+        session.close()
+    print("password changed")
+    return 0
+
+def print_bytes_progress(done: int, size: int) -> None:
+    """show the megabytes written on the terminal"""
+    print(f"\r{done // (1024 * 1024)}/{size // (1024 * 1024)} MB", end="" if done < size else "\n",
+          file=sys.stderr, flush=True)
+
+def command_attach(arguments) -> int:
+    """attach a file to a journal"""
+    session, user_key = open_and_unlock(arguments)
+    try:
+        attachment_id = storage.AttachmentStore(session).add_attachment(
+            user_key, arguments.journal, arguments.file, print_bytes_progress)
+    finally:
+        session.close()
+    if not attachment_id:
+        return EXIT_ERROR
+    print(f"attachment {attachment_id} added to journal {arguments.journal}")
+    return 0
+
+def command_attachments(arguments) -> int:
+    """print the attachments of a journal"""
+    session, user_key = open_and_unlock(arguments)
+    try:
+        attachment_list = storage.AttachmentStore(session).list_attachments(user_key,
+                                                                            arguments.journal)
+    finally:
+        session.close()
+    if arguments.json:
+        print(json.dumps([{"id": attachment_id, "name": name, "size": size}
+                          for attachment_id, name, size in attachment_list], indent=2))
+    else:
+        for attachment_id, name, size in attachment_list:
+            print(f"{attachment_id:8} {size:14} {name}")
+    return 0
+
+def command_extract(arguments) -> int:
+    """write an attachment to a file"""
+    session, user_key = open_and_unlock(arguments)
+    try:
+        exported = storage.AttachmentStore(session).export_attachment(
+            user_key, arguments.attachment, arguments.destination, print_bytes_progress)
+    finally:
+        session.close()
+    return 0 if exported else EXIT_ERROR
+
+def command_sync(arguments) -> int:
+    """exchange the changes made since the last sync with another copy of the database"""
+    if os.path.realpath(arguments.other) == os.path.realpath(arguments.database):
+        raise ValueError("a database can not be synced with itself")
+    session, user_key = open_and_unlock(arguments)
+    other = open_database(arguments.other)
+    try:
+        result = storage.sync_sessions(session, other, user_key)
+    finally:
+        other.close()
+        session.close()
+    if result is None:
+        return EXIT_ERROR
+    print_values(result, arguments.json)
+    return 0
+
+def command_backup(arguments) -> int:
+    """back up the database to a directory, only the changes after the first time"""
+    session = open_database(arguments.database)
+    try:
+        result = backup.backup_database(session, arguments.directory, arguments.full)
+    finally:
+        session.close()
+    print_values(result, arguments.json)
+    return 0
+
+def command_restore(arguments) -> int:
+    """restore a backup of a directory to a new database file"""
+    print_values(backup.restore_backup(arguments.directory, arguments.destination,
+                                       arguments.sequence), arguments.json)
+    return 0
+
+def command_verify_backup(arguments) -> int:
+    """check the files of a backup directory and the database they restore"""
+    result = backup.verify_backup(arguments.directory)
+    print_values(result, arguments.json)
+    return 0 if result["sqlite_check"] == "ok" and not result["failed_files"] else EXIT_ERROR
+
+def command_gui(arguments) -> int:
+    """start the application, the only command that needs wx"""
+    import maitenotas # pylint: disable=import-outside-toplevel
+    maitenotas.main(arguments.database, arguments.profile_startup, arguments.working_copy)
+    return 0
+
+def build_parser() -> argparse.ArgumentParser:
+    """parser of the command line"""
+    parser = argparse.ArgumentParser(prog="python -m maitenotas_cli",
+                                     description="Maitenotas without the user interface")
+    commands = parser.add_subparsers(dest="command", required=True)
+    command_list: List[Tuple[str, Any, str]] = [
+        ("stats", command_stats, "sizes and settings of the database (no password needed)"),
+        ("export", command_export, "export the journals to a directory or an archive"),
+        ("import", command_import, "add the journals of a directory or an archive"),
+        ("search", command_search, "journals containing all the words"),
+        ("recent", command_recent, "journals changed last"),
+        ("verify", command_verify, "check that every journal can be read"),
+        ("rekey", command_rekey, "change the password"),
+        ("attach", command_attach, "attach a file to a journal"),
+        ("attachments", command_attachments, "list the attachments of a journal"),
+        ("extract", command_extract, "write an attachment to a file"),
+        ("sync", command_sync, "exchange the changes with another copy of the database"),
+        ("backup", command_backup, "back up the database (no password needed)"),
+        ("restore", command_restore, "restore a backup to a new database file"),
+        ("verify-backup", command_verify_backup, "check the files of a backup"),
+        ("gui", command_gui, "start the application"),
+    ]
+    for name, function, help_text in command_list:
+        command = commands.add_parser(name, help=help_text)
+        command.set_defaults(function=function)
+        command.add_argument("--database", default=storage.DATABASE_NAME,
+                             help="database file (default: %(default)s)")
+        if name in ("stats", "search", "recent", "verify", "attachments", "sync", "backup",
+                    "restore", "verify-backup"):
+            command.add_argument("--json", action="store_true", help="print JSON")
+    export_parser = commands.choices["export"]
+    export_parser.add_argument("destination", help="directory, or file with --archive")
+    export_parser.add_argument("--archive", action="store_true",
+                               help="write an archive encrypted with its own password")
+    export_parser.add_argument("--parent", type=int, default=0,
+                               help="export only the journals under this journal id")
+    import_parser = commands.choices["import"]
+    import_parser.add_argument("source", help="directory, or file with --archive")
+    import_parser.add_argument("--archive", action="store_true",
+                               help="read an archive written by export --archive")
+    import_parser.add_argument("--parent", type=int, default=0,
+                               help="add the journals under this journal id")
+    commands.choices["search"].add_argument("query", nargs="+")
+    commands.choices["recent"].add_argument("--limit", type=int,
+                                            default=storage.RECENT_JOURNALS,
+                                            help="journals listed (default: %(default)s)")
+    commands.choices["recent"].add_argument("--created", action="store_true",
+                                            help="the journals created last")
+    commands.choices["attach"].add_argument("journal", type=int, help="journal id")
+    commands.choices["attach"].add_argument("file")
+    commands.choices["attachments"].add_argument("journal", type=int, help="journal id")
+    commands.choices["extract"].add_argument("attachment", type=int, help="attachment id")
+    commands.choices["extract"].add_argument("destination", help="file to write")
+    commands.choices["sync"].add_argument("other", help="the other copy, same password")
+    commands.choices["backup"].add_argument("directory", help="directory of the backups")
+    commands.choices["backup"].add_argument("--full", action="store_true",
+                                            help="copy the whole database")
+    commands.choices["restore"].add_argument("directory", help="directory of the backups")
+    commands.choices["restore"].add_argument("destination", help="new database file")
+    commands.choices["restore"].add_argument("--sequence", type=int,
+                                             help="backup to restore (default: the last one)")
+    commands.choices["verify-backup"].add_argument("directory", help="directory of the backups")
+    commands.choices["rekey"].add_argument("--resume", action="store_true",
+                                           help="only finish an interrupted change")
+    commands.choices["gui"].add_argument("--profile-startup", action="store_true")
+    commands.choices["gui"].add_argument("--working-copy", action="store_true",
+                                         help="keep the diary in memory, for slow media")
+    return parser
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """run a command, return the exit code"""
+    arguments = build_parser().parse_args(argv)
+    if arguments.command != "gui":
+        # the statistics are only shown by the application, and the slow
+        # operation messages would be mixed with the output of the command
+        INSTRUMENTATION.configure(False)
+    try:
+        return arguments.function(arguments)
+    except InvalidPasswordError as exception:
+        print(str(exception), file=sys.stderr)
+        return EXIT_INVALID_PASSWORD
+    except Exception as exception:
+        print(str(exception), file=sys.stderr)
+        return EXIT_ERROR
+    finally:
+        shutdown_decrypt_pool()
+
+if __name__ == "__main__":
+    # the decrypt pool starts processes, a frozen executable needs this to run them
+    multiprocessing.freeze_support()
+    sys.exit(main())
@@ -0,0 +1,240 @@
+"""
+Application: Maitenotas
+Made by Taksan Tong
+https://github.com/maitelab/maitenotas
+
+Revision history of journal texts. Every save keeps the text it replaces as a
+reverse delta: the encrypted edits that turn the newer text back into the older
+one, so the size of a revision follows the size of the change. The current text
+stays in the journal, an older revision is rebuilt from the current text (or the
+nearest full snapshot above it) applying the deltas down to it """
+import difflib
+import json
+import sqlite3
+from typing import List, Optional, Tuple
+from cryptography.fernet import Fernet
+from crypto import encrypt_text_to_data, decrypt_data_to_text
+
+# ***************** SQL
+SQL_CREATE_REVISION_TABLE = """
+CREATE TABLE IF NOT EXISTS journal_revision (
+    journal_id integer NOT NULL,
+    revision integer NOT NULL,
+    saved_at integer NOT NULL,
+    kind integer NOT NULL,
+    revision_data blob NOT NULL,
+    PRIMARY KEY (journal_id, revision)
+) WITHOUT ROWID; """
+
+# the version of a revision is the change counter of sync when it was added, the
+# backups write only the revisions added after the previous backup
+SQL_ADD_REVISION_VERSION = """
+ALTER TABLE journal_revision ADD COLUMN version integer NOT NULL DEFAULT 0; """
+
+SQL_CREATE_REVISION_INSERT_TRIGGER = """
+CREATE TRIGGER IF NOT EXISTS journal_revision_inserted AFTER INSERT ON journal_revision
+BEGIN
+    update journal_revision
+    set version=(select value from metadata where name='change_counter')
+    where journal_id=new.journal_id and revision=new.revision;
+END; """
+
+SQL_READ_LAST_REVISION = """
+select coalesce(max(revision), 0)
+from journal_revision
+where journal_id=?
+"""
+
+SQL_READ_DELTA_CHAIN_SIZE = """
+select coalesce(sum(length(revision_data)), 0)
+from journal_revision
+where journal_id=? and revision>coalesce((select max(revision)
+                                          from journal_revision
+                                          where journal_id=? and kind=0), 0)
+"""
+
+SQL_INSERT_REVISION = """
+INSERT INTO journal_revision(journal_id,revision,saved_at,kind,revision_data)
+VALUES(?,?,?,?,?)"""
+
+SQL_READ_REVISIONS = """
+select revision,saved_at,kind,length(revision_data)
+from journal_revision
+where journal_id=?
+order by revision desc
+"""
+
+SQL_READ_SNAPSHOT_ABOVE = """
+select min(revision)
+from journal_revision
+where journal_id=? and revision>=? and kind=0
+"""
+
+SQL_READ_REVISION_CHAIN = """
+select revision,kind,revision_data
+from journal_revision
+where journal_id=? and revision>=? and revision<=?
+order by revision desc
+"""
+
+SQL_DELETE_JOURNAL_REVISIONS = """
+delete from journal_revision
+where journal_id=?
+"""
+
+SQL_DELETE_OLD_REVISIONS = """
+delete from journal_revision
+where saved_at<? and revision<=(select max(newer.revision)
+                                from journal_revision newer
+                                where newer.journal_id=journal_revision.journal_id)-?
+"""
+
+SQL_DELETE_ORPHAN_REVISIONS = """
+delete from journal_revision
+where journal_id not in (select id from journal)
+"""
+
+SQL_READ_REVISION_BATCH = """
+select journal_id,revision,revision_data
+from journal_revision
+where (journal_id,revision)>(?,?)
+order by journal_id,revision
+limit ?
+"""
+
+SQL_UPDATE_REVISION_DATA = """
+update journal_revision
+set revision_data=?
+where journal_id=? and revision=?
+"""
+
+SQL_COUNT_REVISIONS_AFTER = """
+select count(*)
+from journal_revision
+where (journal_id,revision)>(?,?)
+"""
+
+# kinds of revision
+REVISION_SNAPSHOT = 0
+REVISION_DELTA = 1
+# a revision is stored whole when the deltas since the last snapshot would grow
+# past this many times the size of the text, so rebuilding a revision never reads
+# much more than a few copies of the text (the rule of the Mercurial revlog)
+MAX_CHAIN_FACTOR = 2
+# line diff of the changed middle of two texts up to this many lines, bigger
+# changes are stored as one replacement of the middle
+DIFF_MAX_LINES = 2000
+# retention: revisions older than this are removed, except the last KEEP_MIN_REVISIONS
+# of each journal. Removing the oldest is always safe, they are never a base
+KEEP_SECONDS = 90 * 24 * 3600
+KEEP_MIN_REVISIONS = 20
+
+def common_prefix_length(first: str, second: str) -> int:
+    """number of equal characters at the start of two texts, the slices are
+    compared in C so big texts are fast"""
+    low, high = 0, min(len(first), len(second))
+    while low < high:
+        middle = (low + high + 1) // 2
+        if first[low:middle] == second[low:middle]:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+def common_suffix_length(first: str, second: str, limit: int) -> int:
+    """number of equal characters at the end of two texts, up to limit"""
+    low, high = 0, min(len(first), len(second), limit)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if first[len(first) - middle:len(first) - low] == \
+                second[len(second) - middle:len(second) - low]:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+def make_delta(source: str, target: str) -> List[Tuple[int, int, str]]:
+    """edits (start, end, text) that turn source into target, positions in source"""
+    prefix = common_prefix_length(source, target)
+    suffix = common_suffix_length(source, target, min(len(source), len(target)) - prefix)
+    source_middle = source[prefix:len(source) - suffix]
+    target_middle = target[prefix:len(target) - suffix]
+    source_lines = source_middle.splitlines(keepends=True)
+    target_lines = target_middle.splitlines(keepends=True)
+    if len(source_lines) + len(target_lines) > DIFF_MAX_LINES:
+        return [(prefix, len(source) - suffix, target_middle)]
+    # character position where each line starts
+    source_starts = [prefix]
+    for line in source_lines:
+        source_starts.append(source_starts[-1] + len(line))
+    edits = []
+    matcher = difflib.SequenceMatcher(None, source_lines, target_lines, autojunk=False)
+    for tag, source_first, source_last, target_first, target_last in matcher.get_opcodes():
+        if tag != "equal":
+            edits.append((source_starts[source_first], source_starts[source_last],
+                          "".join(target_lines[target_first:target_last])))
+    return edits
+
+def apply_delta(source: str, edits: List[Tuple[int, int, str]]) -> str:
+    """text made by make_delta edits from source"""
+    pieces = []
+    position = 0
+    for start, end, text in edits:
+        pieces.append(source[position:start])
+        pieces.append(text)
+        position = end
+    pieces.append(source[position:])
+    return "".join(pieces)
+
+def add_revision(cur: sqlite3.Cursor, user_key: Fernet, journal_id: int, old_text: str,
+                 new_text: str, *, saved_at: int) -> None:
+    """keep old_text, just replaced by new_text, as the newest revision of a journal"""
+    revision = cur.execute(SQL_READ_LAST_REVISION, (journal_id,)).fetchone()[0] + 1
+    delta_data = encrypt_text_to_data(json.dumps(make_delta(new_text, old_text),
+                                                 ensure_ascii=False), user_key)
+    chain_size = cur.execute(SQL_READ_DELTA_CHAIN_SIZE, (journal_id, journal_id)).fetchone()[0]
+    if chain_size + len(delta_data) > \
+            MAX_CHAIN_FACTOR * len(old_text.encode(encoding='UTF-8')):
+        cur.execute(SQL_INSERT_REVISION, (journal_id, revision, saved_at, REVISION_SNAPSHOT,
+                                          encrypt_text_to_data(old_text, user_key)))
+    else:
+        cur.execute(SQL_INSERT_REVISION, (journal_id, revision, saved_at, REVISION_DELTA,
+                                          delta_data))
+
+def list_revisions(cur: sqlite3.Cursor, journal_id: int) -> List[Tuple[int, int, int, int]]:
+    """(revision, saved_at, kind, stored bytes) of a journal, newest first"""
+    return cur.execute(SQL_READ_REVISIONS, (journal_id,)).fetchall()
+
+def revision_text(cur: sqlite3.Cursor, user_key: Fernet, journal_id: int, revision: int,
+                  current_text: Optional[str]) -> str:
+    """text of a revision, current_text is the text in the journal, only read
+    when there is no snapshot between it and the revision"""
+    snapshot = cur.execute(SQL_READ_SNAPSHOT_ABOVE, (journal_id, revision)).fetchone()[0]
+    last = snapshot if snapshot is not None else \
+        cur.execute(SQL_READ_LAST_REVISION, (journal_id,)).fetchone()[0]
+    text = current_text or ""
+    found = False
+    for stored_revision, kind, revision_data in \
+            cur.execute(SQL_READ_REVISION_CHAIN, (journal_id, revision, last)).fetchall():
+        decrypted = decrypt_data_to_text(revision_data, user_key)
+        if kind == REVISION_SNAPSHOT:
+            text = decrypted
+        else:
+            text = apply_delta(text, json.loads(decrypted))
+        found = found or stored_revision == revision
+    if not found:
+        raise KeyError("revision " + str(revision) + " of journal " + str(journal_id))
+    return text
+
+def needs_current_text(cur: sqlite3.Cursor, journal_id: int, revision: int) -> bool:
+    """True if rebuilding a revision starts from the text in the journal"""
+    return cur.execute(SQL_READ_SNAPSHOT_ABOVE, (journal_id, revision)).fetchone()[0] is None
+
+def delete_revisions(cur: sqlite3.Cursor, journal_id: int) -> None:
+    """remove the history of a journal"""
+    cur.execute(SQL_DELETE_JOURNAL_REVISIONS, (journal_id,))
+
+def prune_revisions(cur: sqlite3.Cursor, now: int) -> int:
+    """apply the retention policy to every journal, return the revisions removed"""
+    cur.execute(SQL_DELETE_OLD_REVISIONS, (now - KEEP_SECONDS, KEEP_MIN_REVISIONS))
+    return cur.rowcount
@@ -0,0 +1,165 @@
+"""
+Application: Maitenotas
+Made by Taksan Tong
+https://github.com/maitelab/maitenotas
+
+Encrypted full text search. Every word of a journal is stored as a keyed HMAC of
+the word, so the index can be queried without decrypting any journal and
+without revealing the words to someone reading the database file """
+import hashlib
+import hmac
+import re
+import sqlite3
+from typing import Dict, Iterable, List, Set, Tuple
+
+# ***************** SQL
+SQL_CREATE_SEARCH_TABLE = """
+CREATE TABLE IF NOT EXISTS search_index (
+    token_hash blob NOT NULL,
+    journal_id integer NOT NULL,
+    field integer NOT NULL,
+    PRIMARY KEY (token_hash, journal_id, field)
+) WITHOUT ROWID; """
+
+SQL_CREATE_SEARCH_JOURNAL_INDEX = """
+CREATE INDEX IF NOT EXISTS search_index_journal
+ON search_index(journal_id, field); """
+
+SQL_INSERT_SEARCH_TOKEN = """
+INSERT OR IGNORE INTO search_index(token_hash,journal_id,field)
+VALUES(?,?,?)"""
+
+SQL_READ_SEARCH_FIELD = """
+select token_hash
+from search_index
+where journal_id=? and field=?
+"""
+
+SQL_DELETE_SEARCH_TOKEN = """
+delete from search_index
+where token_hash=? and journal_id=? and field=?
+"""
+
+SQL_DELETE_SEARCH_FIELD = """
+delete from search_index
+where journal_id=? and field=?
+"""
+
+SQL_DELETE_SEARCH_CHUNK_FIELDS = """
+delete from search_index
+where journal_id=? and field>=?
+"""
+
+SQL_DELETE_SEARCH_JOURNAL = """
+delete from search_index
+where journal_id=?
+"""
+
+SQL_COUNT_SEARCH_TOKEN = """
+select count(*)
+from search_index
+where token_hash=?
+"""
+
+SQL_DELETE_SEARCH_ALL = """
+delete from search_index
+"""
+
+# fields of a journal that are indexed, the words of a text stored in chunks
+# are indexed per chunk, in a field derived from the hash of the chunk
+FIELD_NAME = 0
+FIELD_TEXT = 1
+FIELD_CHUNK_BASE = 2
+
+# words shorter than this are not indexed, they match almost every journal
+MIN_TOKEN_LENGTH = 2
+MAX_TOKEN_LENGTH = 64
+# bytes of the HMAC kept in the index, enough to make collisions irrelevant
+TOKEN_HASH_LENGTH = 16
+SEARCH_KEY_LENGTH = 32
+# words whose hash is remembered while indexing many new journals
+HASH_CACHE_SIZE = 100000
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+def tokenize(text: str) -> Set[str]:
+    """split a text into the set of lowercase words to index"""
+    # remove duplicates first, a long text repeats the same few thousand words
+    return {token[:MAX_TOKEN_LENGTH] for token in set(TOKEN_PATTERN.findall(text.lower()))
+            if len(token) >= MIN_TOKEN_LENGTH}
+
+def hash_tokens(search_key: bytes, tokens: Iterable[str]) -> List[bytes]:
+    """keyed hash of each token"""
+    return [hmac.digest(search_key, token.encode(encoding='UTF-8'),
+                        hashlib.sha256)[:TOKEN_HASH_LENGTH]
+            for token in tokens]
+
+def index_journal_field(cur: sqlite3.Cursor, search_key: bytes, journal_id: int,
+                        field: int, text: str) -> None:
+    """replace the indexed words of one field of a journal,
+    only the words added or removed since the last time are written"""
+    new_hashes = set(hash_tokens(search_key, tokenize(text)))
+    cur.execute(SQL_READ_SEARCH_FIELD, (journal_id, field))
+    old_hashes = {bytes(row[0]) for row in cur.fetchall()}
+    cur.executemany(SQL_DELETE_SEARCH_TOKEN,
+                    [(token_hash, journal_id, field) for token_hash in old_hashes - new_hashes])
+    cur.executemany(SQL_INSERT_SEARCH_TOKEN,
+                    [(token_hash, journal_id, field) for token_hash in new_hashes - old_hashes])
+
+def index_new_fields(cur: sqlite3.Cursor, search_key: bytes,
+                     fields: Iterable[Tuple[int, int, str]],
+                     hash_cache: Dict[str, bytes]) -> None:
+    """index (journal_id, field, text) of journals just created, nothing is read
+    because they have no indexed words yet. The hashes of the words are kept in
+    hash_cache, many journals share most of their words"""
+    rows = []
+    for journal_id, field, text in fields:
+        for token in tokenize(text):
+            token_hash = hash_cache.get(token)
+            if token_hash is None:
+                if len(hash_cache) >= HASH_CACHE_SIZE:
+                    hash_cache.clear()
+                token_hash = hash_tokens(search_key, (token,))[0]
+                hash_cache[token] = token_hash
+            rows.append((token_hash, journal_id, field))
+    # in key order the inserts touch each page of the index once
+    rows.sort()
+    cur.executemany(SQL_INSERT_SEARCH_TOKEN, rows)
+
+def chunk_field(stored_chunk_hash: bytes) -> int:
+    """field of the words of one chunk, it does not change when the chunk moves"""
+    return FIELD_CHUNK_BASE + int.from_bytes(stored_chunk_hash[:6], 'big')
+
+def remove_journal_field(cur: sqlite3.Cursor, journal_id: int, field: int) -> None:
+    """remove the indexed words of one field of a journal"""
+    cur.execute(SQL_DELETE_SEARCH_FIELD, (journal_id, field))
+
+def remove_journal_chunk_fields(cur: sqlite3.Cursor, journal_id: int) -> None:
+    """remove the indexed words of all the chunks of a journal"""
+    cur.execute(SQL_DELETE_SEARCH_CHUNK_FIELDS, (journal_id, FIELD_CHUNK_BASE))
+
+def remove_journal(cur: sqlite3.Cursor, journal_id: int) -> None:
+    """remove all the indexed words of a journal"""
+    cur.execute(SQL_DELETE_SEARCH_JOURNAL, (journal_id,))
+
+def find_journals(cur: sqlite3.Cursor, search_key: bytes, query: str,
+                  limit: int = 200) -> List[int]:
+    """ids of the journals containing all the words of the query"""
+    token_hashes = hash_tokens(search_key, tokenize(query))
+    if not token_hashes:
+        return []
+    # start from the rarest word and only probe the primary key for the others
+    token_counts = []
+    for token_hash in token_hashes:
+        cur.execute(SQL_COUNT_SEARCH_TOKEN, (token_hash,))
+        token_counts.append((cur.fetchone()[0], token_hash))
+    token_counts.sort()
+    if token_counts[0][0] == 0:
+        return []
+    sql = "select distinct s0.journal_id from search_index s0 where s0.token_hash=?"
+    for other in range(1, len(token_counts)):
+        sql += (f" and exists(select 1 from search_index s{other}"
+                f" where s{other}.token_hash=? and s{other}.journal_id=s0.journal_id)")
+    sql += " order by s0.journal_id limit ?"
+    cur.execute(sql, (*[token_hash for _, token_hash in token_counts], limit))
+    return [row[0] for row in cur.fetchall()]
@@ -4,11 +4,28 @@ Made by Taksan Tong
 https://github.com/maitelab/maitenotas
 
 Functions related to read/write data """
+import json
+import os
 import sqlite3
-from typing import Optional
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Callable, Optional, Iterator, Dict, List, Tuple
 from cryptography.fernet import Fernet
-from crypto import encrypt_text_to_data, decrypt_data_to_text
+from crypto import encrypt_text_to_data, decrypt_data_to_text, encrypt_data, decrypt_data,\
+    decrypt_data_batch_to_text, KdfParameters, encode_kdf_parameters, decode_kdf_parameters,\
+    UserKey, RotatingKey, rotate_data
+from instrument import timed, measure, report_exception
+import attachments
+import chunks
+import revisions
+import search
+import sync
 import text_labels
+from treesnapshot import TreeSnapshot, decode_snapshot
+from titleindex import TitleIndex
+from workingcopy import WorkingCopy, FileLock, DatabaseLockedError, shared_lock
 
 # ***************** SQL
 SQL_CREATE_BOOK_TABLE = """
@@ -26,6 +43,67 @@ CREATE TABLE IF NOT EXISTS journal (
     journal_text blob NOT NULL
 ); """
 
+SQL_CREATE_METADATA_TABLE = """
+CREATE TABLE IF NOT EXISTS metadata (
+    name text PRIMARY KEY,
+    value blob NOT NULL
+); """
+
+SQL_CREATE_JOURNAL_PARENT_INDEX = """
+CREATE INDEX IF NOT EXISTS journal_book_parent
+ON journal(book_id, parent_id); """
+
+SQL_ADD_JOURNAL_CHUNKED = """
+ALTER TABLE journal ADD COLUMN chunked integer NOT NULL DEFAULT 0; """
+
+# the time of the last change of a journal is the modified stamp of sync, kept by
+# its triggers, the time it was created is kept the same way (unless it is given,
+# as by a sync or a restore). Both are in milliseconds since 1970
+SQL_ADD_JOURNAL_CREATED = """
+ALTER TABLE journal ADD COLUMN created integer NOT NULL DEFAULT 0; """
+
+SQL_SET_LEGACY_JOURNAL_CREATED = """
+update journal
+set created=modified
+where created=0
+"""
+
+# journals written before the sync stamps have neither time: both are set to the
+# time of the migration, one millisecond apart in the order of their ids so the
+# lists of recent journals keep the order in which they were created
+SQL_SET_LEGACY_JOURNAL_TIMES = """
+update journal
+set created=case
+        when created<>0 then created
+        when modified<>0 then modified
+        else cast((julianday('now')-2440587.5)*86400000 as integer)-
+            ((select max(id) from journal)-id)
+    end,
+    modified=case
+        when modified<>0 then modified
+        else cast((julianday('now')-2440587.5)*86400000 as integer)-
+            ((select max(id) from journal)-id)
+    end
+where created=0 or modified=0
+"""
+
+SQL_CREATE_JOURNAL_CREATED_TRIGGER = """
+CREATE TRIGGER IF NOT EXISTS journal_created AFTER INSERT ON journal
+WHEN new.created=0
+BEGIN
+    update journal
+    set created=cast((julianday('now')-2440587.5)*86400000 as integer)
+    where id=new.id;
+END; """
+
+SQL_CREATE_JOURNAL_MODIFIED_INDEX = """
+CREATE INDEX IF NOT EXISTS journal_book_modified
+ON journal(book_id, modified); """
+
+SQL_CREATE_JOURNAL_CREATED_INDEX = """
+CREATE INDEX IF NOT EXISTS journal_book_created
+ON journal(book_id, created); """
+
 SQL_INSERT_BOOK = """
 INSERT INTO book(book_name)
 VALUES(?)"""
@@ -35,10 +113,134 @@ INSERT INTO journal(book_id,parent_id,journal_name,journal_text)
 VALUES(?,?,?,?)"""
 
 SQL_READ_ALL_JOURNAL = """
-select parent_id,id,journal_name 
+with recursive tree(id) as (
+    select id from journal where book_id=? and parent_id=0
+    union all
+    select j.id from journal j join tree t on j.book_id=? and j.parent_id=t.id
+)
+select j.parent_id,j.id,j.journal_name
+from tree t join journal j on j.id=t.id
+order by j.parent_id,j.id
+"""
+
+SQL_READ_CHILD_JOURNAL = """
+select j.id, j.journal_name,
+    exists(select 1 from journal c where c.book_id=j.book_id and c.parent_id=j.id)
+from journal j
+where j.book_id=? and j.parent_id=?
+order by j.id
+"""
+
+SQL_READ_JOURNAL_PATH = """
+with recursive path(id, parent_id, depth) as (
+    select id, parent_id, 0 from journal where id=?
+    union all
+    select j.id, j.parent_id, path.depth+1 from journal j join path on j.id=path.parent_id
+)
+select id from path order by depth desc
+"""
+
+SQL_READ_ALL_JOURNAL_TEXT = """
+select id,journal_name,journal_text,chunked
+from journal
+"""
+
+# both read the index backwards and stop after the limit, skipping the orphans
+# (journals whose parent was deleted) like SQL_READ_ORPHAN_JOURNALS finds them
+SQL_READ_RECENT_JOURNALS = """
+select j.id,j.journal_name,j.created,j.modified
+from journal j
+where j.book_id=?
+    and (j.parent_id=0
+         or exists(select 1 from journal p where p.id=j.parent_id and p.book_id=j.book_id))
+order by j.modified desc
+limit ?
+"""
+
+SQL_READ_NEWEST_JOURNALS = """
+select j.id,j.journal_name,j.created,j.modified
+from journal j
+where j.book_id=?
+    and (j.parent_id=0
+         or exists(select 1 from journal p where p.id=j.parent_id and p.book_id=j.book_id))
+order by j.created desc
+limit ?
+"""
+
+SQL_READ_JOURNAL_NAME = """
+select journal_name
+from journal
+where id=?
+"""
+
+SQL_READ_ALL_BOOK = """
+select id,book_name
+from book
+"""
+
+SQL_UPDATE_BOOK_NAME = """
+update book
+set book_name=?
+where id=?
+"""
+
+SQL_UPDATE_JOURNAL = """
+update journal
+set journal_name=?,journal_text=?
+where id=?
+"""
+
+SQL_READ_METADATA = """
+select value
+from metadata
+where name=?
+"""
+
+SQL_WRITE_METADATA = """
+INSERT OR REPLACE INTO metadata(name,value)
+VALUES(?,?)"""
+
+SQL_DELETE_METADATA = """
+delete from metadata
+where name=?
+"""
+
+SQL_INIT_COUNTER = """
+INSERT OR IGNORE INTO metadata(name,value)
+VALUES(?,0)"""
+
+SQL_INCREMENT_COUNTER = """
+update metadata
+set value=value+1
+where name=?
+"""
+
+SQL_READ_BOOK_BATCH = """
+select id,book_name
+from book
+where id>?
+order by id
+limit ?
+"""
+
+SQL_COUNT_BOOKS_AFTER = """
+select count(*)
+from book
+where id>?
+"""
+
+SQL_READ_JOURNAL_BATCH = """
+select id,journal_name,journal_text
 from journal
-where book_id=?
-order by parent_id,id
+where id>?
+order by id
+limit ?
+"""
+
+SQL_COUNT_JOURNALS_AFTER = """
+select count(*)
+from journal
+where id>?
 """
 
 SQL_READ_BOOK_NAME = """
@@ -48,19 +250,167 @@ where id=?
 """
 
 SQL_READ_JOURNAL_TEXT = """
-select journal_text
+select journal_text,chunked
+from journal
+where id=?
+"""
+
+SQL_READ_JOURNAL_CHUNKED = """
+select chunked
 from journal
 where id=?
 """
 
 SQL_UPDATE_JOURNAL_TEXT = """
 update journal
-set journal_text=?
+set journal_text=?,chunked=?
+where id=?
+"""
+
+SQL_UPDATE_JOURNAL_NAME = """
+update journal
+set journal_name=?
+where id=?
+"""
+
+SQL_DELETE_JOURNAL = """
+delete from journal
 where id=?
 """
 
+SQL_READ_JOURNAL_SUBTREE = """
+with recursive subtree(id, book_id) as (
+    select id, book_id from journal where id=?
+    union all
+    select j.id, j.book_id from journal j
+    join subtree s on j.book_id=s.book_id and j.parent_id=s.id
+)
+select id from subtree
+"""
+
+SQL_READ_ORPHAN_JOURNALS = """
+select j.id
+from journal j
+where j.parent_id<>0
+    and not exists(select 1 from journal p where p.id=j.parent_id and p.book_id=j.book_id)
+"""
+
+SQL_DELETE_ORPHAN_CHUNKS = """
+delete from journal_chunk
+where journal_id not in (select id from journal)
+"""
+
+SQL_DELETE_ORPHAN_SEARCH_ROWS = """
+delete from search_index
+where journal_id in (select distinct journal_id from search_index
+                     except select id from journal)
+"""
+
+SQL_TABLE_EXISTS = """
+select 1
+from sqlite_master
+where type='table' and name=?
+"""
+
+# schema changes for databases created by older versions, entry N moves a database
+# from PRAGMA user_version N to N+1, new entries are always added at the end
+SCHEMA_MIGRATIONS = (
+    (SQL_CREATE_JOURNAL_PARENT_INDEX,),
+    (SQL_CREATE_METADATA_TABLE, search.SQL_CREATE_SEARCH_TABLE,
+     search.SQL_CREATE_SEARCH_JOURNAL_INDEX),
+    (SQL_ADD_JOURNAL_CHUNKED, chunks.SQL_CREATE_CHUNK_TABLE),
+    (revisions.SQL_CREATE_REVISION_TABLE,),
+    (attachments.SQL_CREATE_ATTACHMENT_TABLE, attachments.SQL_CREATE_ATTACHMENT_JOURNAL_INDEX,
+     attachments.SQL_CREATE_ATTACHMENT_CHUNK_TABLE),
+    sync.SCHEMA_STATEMENTS,
+    (chunks.SQL_ADD_CHUNK_VERSION, chunks.SQL_CREATE_CHUNK_INSERT_TRIGGER,
+     revisions.SQL_ADD_REVISION_VERSION, revisions.SQL_CREATE_REVISION_INSERT_TRIGGER),
+    (SQL_ADD_JOURNAL_CREATED, SQL_SET_LEGACY_JOURNAL_CREATED, SQL_CREATE_JOURNAL_CREATED_TRIGGER,
+     SQL_CREATE_JOURNAL_MODIFIED_INDEX, SQL_CREATE_JOURNAL_CREATED_INDEX),
+    (SQL_SET_LEGACY_JOURNAL_TIMES,),
+)
+
+# pragmas applied once when the session connection is opened:
+# WAL lets readers and the writer work at the same time and turns every commit
+# into an append to the -wal file, synchronous=NORMAL only syncs at checkpoints
+SQL_SESSION_PRAGMAS = (
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-8000",
+    "PRAGMA temp_store=MEMORY",
+)
+
+# metadata entries
+METADATA_SEARCH_KEY = "search_key"
+METADATA_SEARCH_INDEX_READY = "search_index_ready"
+METADATA_KDF = "kdf"
+METADATA_LAST_MAINTENANCE = "last_maintenance"
+# old key of a change of key that is not finished, encrypted with the new key,
+# and the last row encrypted again
+METADATA_REKEY_OLD_KEY = "rekey_old_key"
+METADATA_REKEY_POSITION = "rekey_position"
+# changes of the tree of journals (new, renamed and deleted journals), and the
+# encrypted snapshot of the tree with the generation it was made from
+METADATA_TREE_GENERATION = "tree_generation"
+METADATA_TREE_SNAPSHOT = "tree_snapshot"
+
+# the search for orphan rows reads whole indexes, it runs at most this often
+MAINTENANCE_INTERVAL_SECONDS = 7 * 24 * 3600
+# free pages given back to the file system by each maintenance pass
+MAINTENANCE_VACUUM_PAGES = 2000
+# databases without incremental vacuum are vacuumed once (which turns it on)
+# when this part of their pages is free
+FULL_VACUUM_FREE_PART = 0.1
+# PRAGMA auto_vacuum value of incremental vacuum
+AUTO_VACUUM_INCREMENTAL = 2
+
+# a change of key encrypts the rows again in batches of up to this many rows or bytes,
+# one transaction per batch, the position is saved with each batch to resume after a crash
+REKEY_BATCH_ROWS = 256
+REKEY_BATCH_BYTES = 4 * 1024 * 1024
+# tables encrypted again by a change of key, in order:
+# (read a batch, update a row, count the rows left, key columns, position before the first row)
+# rows are read as the key columns followed by the encrypted columns, and updated
+# with the encrypted columns followed by the key columns
+REKEY_STEPS = (
+    (SQL_READ_BOOK_BATCH, SQL_UPDATE_BOOK_NAME, SQL_COUNT_BOOKS_AFTER, 1, [0]),
+    (SQL_READ_JOURNAL_BATCH, SQL_UPDATE_JOURNAL, SQL_COUNT_JOURNALS_AFTER, 1, [0]),
+    (chunks.SQL_READ_CHUNK_BATCH, chunks.SQL_UPDATE_CHUNK_DATA, chunks.SQL_COUNT_CHUNKS_AFTER, 2,
+     [0, -1]),
+    (revisions.SQL_READ_REVISION_BATCH, revisions.SQL_UPDATE_REVISION_DATA,
+     revisions.SQL_COUNT_REVISIONS_AFTER, 2, [0, -1]),
+    (attachments.SQL_READ_ATTACHMENT_BATCH, attachments.SQL_UPDATE_ATTACHMENT_NAME,
+     attachments.SQL_COUNT_ATTACHMENTS_AFTER, 1, [0]),
+    (attachments.SQL_READ_ATTACHMENT_CHUNK_BATCH, attachments.SQL_UPDATE_ATTACHMENT_CHUNK_DATA,
+     attachments.SQL_COUNT_ATTACHMENT_CHUNKS_AFTER, 2, [0, -1]),
+)
+
 # ****************** DATABASE NAME and main operations
 DATABASE_NAME = r"maitenotas.data"
+# the application database is opened as a working copy in memory, for diaries on
+# slow media: the file is only written by flush_working_copy and on close
+WORKING_COPY = False
+# the name of book 1 is the password, it is used to verify the user key
+PASSWORD_BOOK_ID = 1
+# book of the journals shown in the tree, the tree snapshot only covers this book
+USER_BOOK_ID = 2
+
+# journals listed by list_recent_journals and by find_titles
+RECENT_JOURNALS = 20
+TITLE_RESULTS = 20
+
+# number of prepared statements kept by each connection, all the SQL of this module
+# is declared as constants so the same statement text always hits the cache
+STATEMENT_CACHE_SIZE = 64
+
+# limits of the cache of decrypted texts of each session
+CACHE_MAX_BYTES = 32 * 1024 * 1024
+CACHE_MAX_ENTRIES = 20000
+# texts bigger than this part of the budget are not cached, they would evict everything
+CACHE_MAX_ENTRY_PART = 4
+# kinds of cached texts, the cache key is (kind, id)
+CACHE_BOOK_NAME = "book"
+CACHE_JOURNAL_NAME = "name"
+CACHE_JOURNAL_TEXT = "text"
 
 def create_connection(dbfile) -> Optional[sqlite3.Connection]:
     """ create a database connection to the SQLite database
@@ -70,10 +420,11 @@ def create_connection(dbfile) -> Optional[sqlite3.Connection]:
     """
     conn = None
     try:
-        conn = sqlite3.connect(dbfile)
+        conn = sqlite3.connect(dbfile, check_same_thread=False,
+                               cached_statements=STATEMENT_CACHE_SIZE)
         return conn
     except Exception as exception:
-        print(str(exception))
+        report_exception("storage.create_connection", exception)
     return conn
 
 def create_table(conn: sqlite3.Connection, create_tablesql: str) -> None:
@@ -82,214 +433,1343 @@ def create_table(conn: sqlite3.Connection, create_tablesql: str) -> None:
         cursor = conn.cursor()
         cursor.execute(create_tablesql)
     except Exception as exception:
-        print(str(exception))
+        report_exception("storage.create_table", exception)
 
-# **************** entity operations
-def update_journal_text(user_key: Fernet, journal_id: int, new_journal_text: str) -> None:
-    """update journal table"""
-    try:
-        conn = create_connection(DATABASE_NAME)
-        if conn is not None:
-            cur = conn.cursor()
-            encrypted_data = encrypt_text_to_data(new_journal_text, user_key)
-            datas=(encrypted_data, journal_id,)
-            cur.execute(SQL_UPDATE_JOURNAL_TEXT, datas)
-            conn.commit()
-    except Exception as exception:
-        print(str(exception))
-    finally:
-        if conn:
-            conn.close()
+def upgrade_schema(cur: sqlite3.Cursor) -> None:
+    """apply the pending SCHEMA_MIGRATIONS to the database of the cursor"""
+    version = cur.execute("PRAGMA user_version").fetchone()[0]
+    for statements in SCHEMA_MIGRATIONS[version:]:
+        for statement in statements:
+            cur.execute(statement)
+    if version < len(SCHEMA_MIGRATIONS):
+        cur.execute(f"PRAGMA user_version={len(SCHEMA_MIGRATIONS)}")
 
-def update_journal_name(user_key: Fernet, journal_id: int, new_journal_name: str) -> None:
-    """update journal name"""
-    sql = """
-    update journal
-    set journal_name=?
-    where id=?
-    """
-    try:
-        conn = create_connection(DATABASE_NAME)
-        if conn is not None:
+def read_metadata(cur: sqlite3.Cursor, name: str) -> Optional[bytes]:
+    """read a value of the metadata table, None if it does not exist"""
+    row = cur.execute(SQL_READ_METADATA, (name,)).fetchone()
+    return row[0] if row is not None else None
+
+def write_metadata(cur: sqlite3.Cursor, name: str, value: bytes) -> None:
+    """create or replace a value of the metadata table"""
+    cur.execute(SQL_WRITE_METADATA, (name, value))
+
+def read_tree_generation(cur: sqlite3.Cursor) -> int:
+    """number of changes of the tree of journals"""
+    return int(read_metadata(cur, METADATA_TREE_GENERATION) or 0)
+
+def increment_tree_generation(cur: sqlite3.Cursor) -> int:
+    """count a change of the tree of journals, return the new generation"""
+    cur.execute(SQL_INIT_COUNTER, (METADATA_TREE_GENERATION,))
+    cur.execute(SQL_INCREMENT_COUNTER, (METADATA_TREE_GENERATION,))
+    return read_tree_generation(cur)
+
+def move_orphans(cur: sqlite3.Cursor) -> List[int]:
+    """move to the top of the tree the journals whose parent was deleted in the
+    other copy of a sync, return their ids"""
+    journal_ids = [row[0] for row in cur.execute(SQL_READ_ORPHAN_JOURNALS).fetchall()]
+    for journal_id in journal_ids:
+        cur.execute(sync.SQL_MOVE_JOURNAL_TO_TOP, (journal_id,))
+    return journal_ids
+
+@timed("storage.rebuild_search_index")
+def rebuild_search_index(cur: sqlite3.Cursor, user_key: Fernet, search_key: bytes) -> None:
+    """index every journal again, used for databases created before the search index"""
+    cur.execute(search.SQL_DELETE_SEARCH_ALL)
+    for journal_id, journal_name, journal_text, chunked in \
+            cur.execute(SQL_READ_ALL_JOURNAL_TEXT).fetchall():
+        search.index_journal_field(cur, search_key, journal_id, search.FIELD_NAME,
+                                   decrypt_data_to_text(journal_name, user_key))
+        if not chunked:
+            search.index_journal_field(cur, search_key, journal_id, search.FIELD_TEXT,
+                                       decrypt_data_to_text(journal_text, user_key))
+            continue
+        for stored_hash, chunk in chunks.iter_chunk_texts(cur, user_key, journal_id):
+            search.index_journal_field(cur, search_key, journal_id,
+                                       search.chunk_field(stored_hash), chunk)
+    write_metadata(cur, METADATA_SEARCH_INDEX_READY, b"1")
+
+def delete_subtree(cur: sqlite3.Cursor, journal_id: int) -> List[int]:
+    """delete a journal and all the journals under it, with their chunks and
+    search entries, return the ids deleted"""
+    journal_ids = [row[0] for row in
+                   cur.execute(SQL_READ_JOURNAL_SUBTREE, (journal_id,)).fetchall()]
+    for subtree_id in journal_ids:
+        cur.execute(SQL_DELETE_JOURNAL, (subtree_id,))
+        chunks.delete_chunks(cur, subtree_id)
+        search.remove_journal(cur, subtree_id)
+        revisions.delete_revisions(cur, subtree_id)
+        attachments.delete_journal_attachments(cur, subtree_id)
+    return journal_ids
+
+class TextCache:
+    """LRU cache of decrypted texts limited by memory and number of entries.
+    Texts are kept as UTF-8 bytearrays so evicted and invalidated entries can be
+    overwritten with zeros (best effort, the str copies given to callers remain).
+    The cache belongs to the user key that filled it, a different key empties it"""
+    def __init__(self, max_bytes: int = CACHE_MAX_BYTES, max_entries: int = CACHE_MAX_ENTRIES):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.entries: "OrderedDict[Tuple[str, int], bytearray]" = OrderedDict()
+        self.size = 0
+        self.owner: Optional[Fernet] = None
+        self.lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def get(self, user_key: Fernet, kind: str, entity_id: int) -> Optional[str]:
+        """cached text or None"""
+        with self.lock:
+            data = self.entries.get((kind, entity_id)) if self.owner is user_key else None
+            if data is None:
+                self.counters["misses"] += 1
+                return None
+            self.entries.move_to_end((kind, entity_id))
+            self.counters["hits"] += 1
+            return data.decode(encoding='UTF-8')
+
+    def put(self, user_key: Fernet, kind: str, entity_id: int, text: str) -> None:
+        """cache a text, the least recently used ones are evicted to make room"""
+        data = bytearray(text.encode(encoding='UTF-8'))
+        with self.lock:
+            if self.owner is not user_key:
+                self.clear_entries()
+                self.owner = user_key
+            self.remove_entry((kind, entity_id))
+            if len(data) > self.max_bytes // CACHE_MAX_ENTRY_PART:
+                return
+            self.entries[(kind, entity_id)] = data
+            self.size = self.size + len(data)
+            while self.size > self.max_bytes or len(self.entries) > self.max_entries:
+                self.remove_entry(next(iter(self.entries)))
+                self.counters["evictions"] += 1
+
+    def invalidate(self, kind: str, entity_id: int) -> None:
+        """forget a cached text"""
+        with self.lock:
+            self.remove_entry((kind, entity_id))
+
+    def clear(self) -> None:
+        """forget every cached text"""
+        with self.lock:
+            self.clear_entries()
+
+    def configure(self, max_bytes: int, max_entries: int) -> None:
+        """change the limits, entries over the new limits are evicted on the next put"""
+        with self.lock:
+            self.max_bytes = max_bytes
+            self.max_entries = max_entries
+
+    def statistics(self) -> Dict[str, int]:
+        """hit, miss and eviction counters and current usage"""
+        with self.lock:
+            return dict(self.counters, entries=len(self.entries), bytes=self.size,
+                        max_bytes=self.max_bytes, max_entries=self.max_entries)
+
+    def remove_entry(self, key: Tuple[str, int]) -> None:
+        """remove and wipe one entry, the cache lock must be held"""
+        data = self.entries.pop(key, None)
+        if data is not None:
+            self.size = self.size - len(data)
+            data[:] = bytes(len(data))
+
+    def clear_entries(self) -> None:
+        """remove and wipe every entry, the cache lock must be held"""
+        for data in self.entries.values():
+            data[:] = bytes(len(data))
+        self.entries.clear()
+        self.size = 0
+
+class TreeState:
+    """Tree of the user book of a session in memory: the tree snapshot, read from the
+    database or rebuilt, and the names of the tree indexed for find_titles (built on
+    first use), each with the generation of the tree it belongs to. Both are kept up
+    to date by the write paths of the session and dropped when another connection
+    changed the tree"""
+    def __init__(self, session: "StorageSession"):
+        self.session = session
+        self.snapshot: Optional[TreeSnapshot] = None
+        self.generation = 0
+        self.title_index: Optional[TitleIndex] = None
+        self.title_generation = 0
+
+    def clear(self) -> None:
+        """forget the tree in memory"""
+        self.snapshot = None
+        self.title_index = None
+
+    def changed(self, cur: sqlite3.Cursor, snapshot_updated: bool = True) -> None:
+        """count a change of the tree in the transaction of cur. The tree in memory
+        stays valid only if the caller updates it (snapshot_updated) and this session
+        made every change since it was read"""
+        generation = increment_tree_generation(cur)
+        if not snapshot_updated or generation != self.generation + 1:
+            self.snapshot = None
+        if not snapshot_updated or generation != self.title_generation + 1:
+            self.title_index = None
+        self.generation = generation
+        self.title_generation = generation
+
+    def add_leaf(self, parent_id: int, journal_id: int, journal_name: str) -> None:
+        """add a journal created by the session to the tree in memory"""
+        if self.snapshot is not None:
+            self.snapshot.add_leaf(parent_id, journal_id, journal_name)
+        if self.title_index is not None:
+            self.title_index.add_title(parent_id, journal_id, journal_name)
+
+    def rename_leaf(self, journal_id: int, journal_name: str) -> None:
+        """rename a journal of the tree in memory"""
+        if self.snapshot is not None:
+            self.snapshot.rename_leaf(journal_id, journal_name)
+        if self.title_index is not None:
+            self.title_index.rename_title(journal_id, journal_name)
+
+    def remove_leafs(self, journal_ids: List[int]) -> None:
+        """remove deleted journals from the tree in memory"""
+        if self.snapshot is not None:
+            self.snapshot.remove_leafs(journal_ids)
+        if self.title_index is not None:
+            self.title_index.remove_titles(journal_ids)
+
+    def expanded_leafs(self) -> List[int]:
+        """leafs that were expanded when the tree snapshot was stored"""
+        return self.snapshot.expanded if self.snapshot is not None else []
+
+    @timed("storage.get_tree_leafs")
+    def get_tree_leafs(self, user_key: Fernet) -> list:
+        """read tree of book + journals from database
+        for this first version the book id is always 2 (book id 1 is reserved)"""
+        leaf_list = []
+        try:
+            # journals whose parent no longer exists are not read
+            record = self.session.fetch_all(SQL_READ_ALL_JOURNAL, (USER_BOOK_ID, USER_BOOK_ID))
+            names = self.session.decrypt_journal_names(user_key,
+                                                       [(row[1], row[2]) for row in record])
+            for row in record:
+                # read columns
+                parent_id = row[0]
+                l_id = row[1]
+                leaf_element = parent_id, l_id, names[l_id]
+                leaf_list.append(leaf_element)
+        except Exception as exception:
+            report_exception("storage.get_tree_leafs", exception)
+        return leaf_list
+
+    @timed("storage.get_child_leafs")
+    def get_child_leafs(self, user_key: Fernet, book_id: int, parent_id: int) -> list:
+        """read the direct children of one leaf (parent_id 0 is the book itself),
+        each element is (id, name, has_children), from the tree snapshot when it is
+        loaded and no other connection changed the tree since"""
+        leaf_list = []
+        try:
+            if self.snapshot is not None and book_id == USER_BOOK_ID:
+                with self.session.transaction() as cur:
+                    if read_tree_generation(cur) == self.generation:
+                        return self.snapshot.child_leafs(parent_id)
+                self.snapshot = None
+            record = self.session.fetch_all(SQL_READ_CHILD_JOURNAL, (book_id, parent_id))
+            names = self.session.decrypt_journal_names(user_key,
+                                                       [(row[0], row[1]) for row in record])
+            for row in record:
+                leaf_list.append((row[0], names[row[0]], bool(row[2])))
+        except Exception as exception:
+            report_exception("storage.get_child_leafs", exception)
+        return leaf_list
+
+    @timed("storage.list_recent_journals")
+    def list_recent_journals(self, user_key: Fernet, limit: int = RECENT_JOURNALS,
+                             by_created: bool = False) -> List[Tuple[int, str, int, int]]:
+        """the journals of the user book changed (or created) last, newest first, each
+        element is (id, name, created, modified) with the times in milliseconds.
+        Only the names of the journals listed are decrypted"""
+        leaf_list = []
+        try:
+            record = self.session.fetch_all(SQL_READ_NEWEST_JOURNALS if by_created else
+                                            SQL_READ_RECENT_JOURNALS, (USER_BOOK_ID, limit))
+            names = self.session.decrypt_journal_names(user_key,
+                                                       [(row[0], row[1]) for row in record])
+            for row in record:
+                leaf_list.append((row[0], names[row[0]], row[2], row[3]))
+        except Exception as exception:
+            report_exception("storage.list_recent_journals", exception)
+        return leaf_list
+
+    @timed("storage.load_tree_snapshot")
+    def load_snapshot(self, user_key: Fernet) -> bool:
+        """read the tree of the user book with one decrypt from its snapshot, or rebuild
+        the snapshot from the journal table when it is missing or stale. From now on
+        get_child_leafs answers from memory. Return True if the snapshot was current"""
+        self.snapshot = None
+        expanded: List[int] = []
+        try:
+            with self.session.transaction() as cur:
+                generation = read_tree_generation(cur)
+                snapshot_data = read_metadata(cur, METADATA_TREE_SNAPSHOT)
+            if snapshot_data is not None:
+                snapshot_generation, tree_snapshot = decode_snapshot(
+                    decrypt_data_to_text(snapshot_data, user_key))
+                if snapshot_generation == generation:
+                    self.generation = generation
+                    self.snapshot = tree_snapshot
+                    return True
+                # the leafs that were expanded are still expanded after the rebuild
+                expanded = tree_snapshot.expanded
+        except Exception as exception:
+            report_exception("storage.load_tree_snapshot", exception)
+        try:
+            # a journal written after the generation was read makes the new snapshot
+            # stale, never wrong: save_snapshot does not store it
+            with self.session.transaction() as cur:
+                generation = read_tree_generation(cur)
+            record = self.session.fetch_all(SQL_READ_ALL_JOURNAL, (USER_BOOK_ID, USER_BOOK_ID))
+            names = self.session.decrypt_journal_names(user_key,
+                                                       [(row[1], row[2]) for row in record])
+            self.generation = generation
+            self.snapshot = TreeSnapshot(((row[0], row[1], names[row[1]]) for row in record),
+                                         expanded)
+        except Exception as exception:
+            report_exception("storage.load_tree_snapshot", exception)
+            return False
+        self.save_snapshot(user_key, self.snapshot.expanded)
+        return False
+
+    @timed("storage.save_tree_snapshot")
+    def save_snapshot(self, user_key: Fernet, expanded: List[int]) -> None:
+        """store the tree in memory with the leafs expanded in screen, nothing is
+        stored if another connection changed the tree since it was read"""
+        if self.snapshot is None:
+            return
+        try:
+            self.snapshot.expanded = expanded
+            snapshot_data = encrypt_text_to_data(self.snapshot.encode(self.generation),
+                                                 user_key)
+            with self.session.transaction() as cur:
+                if read_tree_generation(cur) == self.generation:
+                    write_metadata(cur, METADATA_TREE_SNAPSHOT, snapshot_data)
+        except Exception as exception:
+            report_exception("storage.save_tree_snapshot", exception)
+
+    @timed("storage.get_leaf_path")
+    def get_leaf_path(self, journal_id: int) -> List[int]:
+        """ids of the journals from the top of the tree down to journal_id"""
+        try:
+            return [row[0] for row in
+                    self.session.fetch_all(SQL_READ_JOURNAL_PATH, (journal_id,))]
+        except Exception as exception:
+            report_exception("storage.get_leaf_path", exception)
+        return []
+
+    @timed("storage.find_titles")
+    def find_titles(self, user_key: Fernet, query: str,
+                    limit: int = TITLE_RESULTS) -> List[Tuple[int, str, str]]:
+        """journals of the tree with a word of the name starting with each word of the
+        query (or like it, for typos), best first, each element is (id, name, path).
+        The names are indexed in memory on first use, from the tree snapshot when it
+        is loaded, and again when another connection changed the tree"""
+        try:
+            with self.session.transaction() as cur:
+                generation = read_tree_generation(cur)
+            if self.title_index is None or generation != self.title_generation:
+                leafs = self.snapshot.leafs() if self.snapshot is not None and \
+                    generation == self.generation else self.get_tree_leafs(user_key)
+                self.title_index = TitleIndex(leafs)
+                self.title_generation = generation
+            return self.title_index.find(query, limit)
+        except Exception as exception:
+            report_exception("storage.find_titles", exception)
+        return []
+
+class DatabaseFile:
+    """How the file of a session is opened: in place holding a shared lock of the
+    file, or as a working copy in memory that is written back by flush_working_copy
+    and close"""
+    def __init__(self, dbfile: str, journal_mode: str, working_copy: bool):
+        self.dbfile = dbfile
+        self.journal_mode = journal_mode
+        self.working_copy = WorkingCopy(dbfile) if working_copy else None
+        # shared lock of the file while it is open, a working copy has its own
+        # exclusive lock
+        self.file_lock: Optional[FileLock] = None
+
+    def open(self) -> Optional[sqlite3.Connection]:
+        """open a connection with the session pragmas, DatabaseLockedError if another
+        instance keeps the database in a working copy"""
+        if self.working_copy is None and self.dbfile != ":memory:":
+            self.file_lock = shared_lock(self.dbfile)
+        conn = create_connection(self.dbfile if self.working_copy is None else ":memory:")
+        if conn is None:
+            self.release()
+            return None
+        if self.working_copy is not None:
+            try:
+                self.working_copy.open(conn)
+            except DatabaseLockedError:
+                conn.close()
+                raise
+            except Exception as exception:
+                report_exception("storage.connect", exception)
+                conn.close()
+                return None
+        # transactions are handled explicitly by transaction()
+        conn.isolation_level = None
+        conn.execute("PRAGMA journal_mode=" + self.journal_mode)
+        for pragma in SQL_SESSION_PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def release(self) -> None:
+        """release the lock of the file once its connection is closed"""
+        if self.working_copy is not None:
+            self.working_copy.release()
+        if self.file_lock is not None:
+            self.file_lock.release()
+            self.file_lock = None
+
+class StorageSession:
+    """Owns one connection to a database file for the whole life of the application.
+    All entity operations run on this connection, so the cost of opening the file,
+    reading the schema and preparing statements is paid only once.
+    With working_copy the connection is a copy of the file in memory, written back
+    by flush_working_copy and close"""
+    def __init__(self, dbfile: str, journal_mode: str = "WAL", working_copy: bool = False):
+        self.dbfile = dbfile
+        self.file = DatabaseFile(dbfile, journal_mode, working_copy)
+        self.conn: Optional[sqlite3.Connection] = None
+        # the connection is shared with background threads (autosave, workers)
+        self.lock = threading.RLock()
+        # the user key and the decrypted key of the search index it reads
+        self.search_key: Optional[Tuple[Fernet, bytes]] = None
+        self.cache = TextCache()
+        self.tree = TreeState(self)
+
+    def connect(self) -> Optional[sqlite3.Connection]:
+        """open the connection on first use and apply the session pragmas.
+        DatabaseLockedError if another instance keeps the database in a working copy"""
+        with self.lock:
+            if self.conn is None:
+                conn = self.file.open()
+                if conn is None:
+                    return None
+                self.conn = conn
+                if conn.execute(SQL_TABLE_EXISTS, ("journal",)).fetchone() is not None:
+                    with self.transaction() as cur:
+                        upgrade_schema(cur)
+            return self.conn
+
+    def close(self) -> None:
+        """close the connection, a later call will open it again. A working copy
+        is written back first"""
+        self.cache.clear()
+        self.tree.clear()
+        self.flush_working_copy(force=True)
+        with self.lock:
+            if self.conn is not None:
+                try:
+                    self.conn.close()
+                except Exception as exception:
+                    report_exception("storage.close", exception)
+                self.conn = None
+                self.file.release()
+
+    @timed("storage.flush_working_copy")
+    def flush_working_copy(self, force: bool = False) -> bool:
+        """write the changes of a working copy to its file when they are due (after a
+        while without changes, or when they are old) or always with force.
+        Return False if the file could not be written"""
+        working_copy = self.file.working_copy
+        if working_copy is None:
+            return True
+        try:
+            with self.lock:
+                conn = self.conn
+                due = conn is not None and (force or working_copy.flush_due(conn))
+            if conn is not None and due:
+                working_copy.flush(conn, self.lock)
+        except Exception as exception:
+            report_exception("storage.flush_working_copy", exception)
+            return False
+        return True
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Cursor]:
+        """run the statements of the with block in one transaction,
+        commit at the end or rollback if there was an exception"""
+        with self.lock:
+            conn = self.connect()
+            if conn is None:
+                raise sqlite3.OperationalError("unable to open database " + self.dbfile)
             cur = conn.cursor()
+            cur.execute("BEGIN")
+            try:
+                yield cur
+            except BaseException:
+                cur.execute("ROLLBACK")
+                raise
+            with measure("sqlite.commit"):
+                cur.execute("COMMIT")
+
+    @timed("sqlite.fetch_all")
+    def fetch_all(self, sql: str, parameters: tuple = ()) -> list:
+        """run a select and return all the rows"""
+        with self.lock:
+            conn = self.connect()
+            if conn is None:
+                return []
+            return conn.execute(sql, parameters).fetchall()
+
+    def get_search_key(self, cur: sqlite3.Cursor, user_key: Fernet) -> bytes:
+        """key of the search index, it is created the first time it is needed"""
+        if self.search_key is not None and self.search_key[0] is user_key:
+            return self.search_key[1]
+        encrypted_key = read_metadata(cur, METADATA_SEARCH_KEY)
+        if encrypted_key is None:
+            # not cached until the transaction that stores it is committed
+            search_key = os.urandom(search.SEARCH_KEY_LENGTH)
+            write_metadata(cur, METADATA_SEARCH_KEY, user_key.encrypt(search_key))
+            return search_key
+        search_key = user_key.decrypt(encrypted_key)
+        self.search_key = (user_key, search_key)
+        return search_key
+
+    def write_journal_text(self, cur: sqlite3.Cursor, user_key: Fernet, journal_id: int,
+                           journal_text: str) -> bool:
+        """store and index a journal text, big texts go to chunks and only the chunks
+        that changed are encrypted and indexed, return False if the journal does not exist"""
+        search_key = self.get_search_key(cur, user_key)
+        if len(journal_text) < chunks.CHUNKED_MIN_CHARS:
+            encrypted_data = encrypt_text_to_data(journal_text, user_key)
+            cur.execute(SQL_UPDATE_JOURNAL_TEXT, (encrypted_data, 0, journal_id,))
+            # a journal deleted meanwhile must not get chunks or search entries
+            if cur.rowcount <= 0:
+                return False
+            chunks.delete_chunks(cur, journal_id)
+            search.remove_journal_chunk_fields(cur, journal_id)
+            search.index_journal_field(cur, search_key, journal_id, search.FIELD_TEXT,
+                                       journal_text)
+            return True
+        cur.execute(SQL_UPDATE_JOURNAL_TEXT, (b'', 1, journal_id,))
+        if cur.rowcount <= 0:
+            return False
+        search.remove_journal_field(cur, journal_id, search.FIELD_TEXT)
+        added_chunks, removed_hashes = chunks.write_chunks(cur, user_key, search_key,
+                                                           journal_id, journal_text)
+        for stored_hash in removed_hashes:
+            search.remove_journal_field(cur, journal_id, search.chunk_field(stored_hash))
+        for stored_hash, chunk in added_chunks.items():
+            search.index_journal_field(cur, search_key, journal_id,
+                                       search.chunk_field(stored_hash), chunk)
+        return True
+
+    def decrypt_journal_names(self, user_key: Fernet,
+                              rows: List[Tuple[int, bytes]]) -> Dict[int, str]:
+        """decrypt many (id, journal_name) read from the database, cached names are
+        not decrypted again and the others are decrypted in one batch"""
+        names = {}
+        missing = []
+        for journal_id, journal_name in rows:
+            cached_name = self.cache.get(user_key, CACHE_JOURNAL_NAME, journal_id)
+            if cached_name is None:
+                missing.append((journal_id, journal_name))
+            else:
+                names[journal_id] = cached_name
+        decrypted_names = decrypt_data_batch_to_text([journal_name for _, journal_name in missing],
+                                                     user_key)
+        for (journal_id, _), name in zip(missing, decrypted_names):
+            names[journal_id] = name
+            self.cache.put(user_key, CACHE_JOURNAL_NAME, journal_id, name)
+        return names
+
+    # **************** entity operations
+    @timed("storage.update_journal_text")
+    def update_journal_text(self, user_key: Fernet, journal_id: int,
+                            new_journal_text: str) -> bool:
+        """update journal table, the text replaced is kept as a revision. If the text
+        replaced cannot be read the new text is saved without a revision, a revision
+        of an empty text would lose the real one. Return False if the text could not
+        be written, a journal deleted meanwhile is not an error"""
+        try:
+            # usually in the cache, the text was read to show it
+            old_journal_text = self.cache.get(user_key, CACHE_JOURNAL_TEXT, journal_id)
+            if old_journal_text is None:
+                try:
+                    old_journal_text = "".join(self.iter_journal_text(user_key, journal_id))
+                except Exception as exception:
+                    report_exception("storage.update_journal_text", exception)
+            self.cache.invalidate(CACHE_JOURNAL_TEXT, journal_id)
+            with self.transaction() as cur:
+                updated = self.write_journal_text(cur, user_key, journal_id, new_journal_text)
+                if updated and old_journal_text is not None and \
+                        old_journal_text != new_journal_text:
+                    revisions.add_revision(cur, user_key, journal_id, old_journal_text,
+                                           new_journal_text, saved_at=int(time.time()))
+            if updated:
+                self.cache.put(user_key, CACHE_JOURNAL_TEXT, journal_id, new_journal_text)
+        except Exception as exception:
+            report_exception("storage.update_journal_text", exception)
+            return False
+        return True
+
+    @timed("storage.update_journal_name")
+    def update_journal_name(self, user_key: Fernet, journal_id: int,
+                            new_journal_name: str) -> None:
+        """update journal name"""
+        try:
             encrypted_data = encrypt_text_to_data(new_journal_name, user_key)
-            data_forsql=(encrypted_data, journal_id)
-            cur.execute(sql, data_forsql)
-            conn.commit()
-    except Exception as exception:
-        print(str(exception))
-    finally:
-        if conn:
-            conn.close()
+            self.cache.invalidate(CACHE_JOURNAL_NAME, journal_id)
+            with self.transaction() as cur:
+                cur.execute(SQL_UPDATE_JOURNAL_NAME, (encrypted_data, journal_id))
+                # a journal deleted meanwhile must not get search entries
+                updated = cur.rowcount > 0
+                if updated:
+                    search.index_journal_field(cur, self.get_search_key(cur, user_key),
+                                               journal_id, search.FIELD_NAME, new_journal_name)
+                    self.tree.changed(cur)
+            if updated:
+                self.cache.put(user_key, CACHE_JOURNAL_NAME, journal_id, new_journal_name)
+                self.tree.rename_leaf(journal_id, new_journal_name)
+        except Exception as exception:
+            report_exception("storage.update_journal_name", exception)
+
+    def invalidate_journals(self, journal_ids: List[int]) -> None:
+        """remove deleted journals from the cache and from the tree"""
+        for journal_id in journal_ids:
+            self.cache.invalidate(CACHE_JOURNAL_NAME, journal_id)
+            self.cache.invalidate(CACHE_JOURNAL_TEXT, journal_id)
+        self.tree.remove_leafs(journal_ids)
+
+    @timed("storage.delete_journal")
+    def delete_journal(self, journal_id: int) -> List[int]:
+        """delete journal and its children, return the ids deleted"""
+        journal_ids: List[int] = []
+        try:
+            with self.transaction() as cur:
+                journal_ids = delete_subtree(cur, journal_id)
+                if journal_ids:
+                    self.tree.changed(cur)
+            self.invalidate_journals(journal_ids)
+        except Exception as exception:
+            report_exception("storage.delete_journal", exception)
+        return journal_ids
+
+    @timed("storage.get_book_name")
+    def get_book_name(self, user_key: Fernet, book_id: int) -> str:
+        """read book name, it will become the tree name in the user interface"""
+        book_name = text_labels.BOOK_NAME
+        cached_name = self.cache.get(user_key, CACHE_BOOK_NAME, book_id)
+        if cached_name is not None:
+            return cached_name
+        try:
+            for row in self.fetch_all(SQL_READ_BOOK_NAME, (book_id,)):
+                book_name = decrypt_data_to_text(row[0], user_key)
+                self.cache.put(user_key, CACHE_BOOK_NAME, book_id, book_name)
+        except Exception as exception:
+            report_exception("storage.get_book_name", exception)
+        return book_name
+
+    @timed("storage.get_journal_text")
+    def get_journal_text(self, user_key: Fernet, journal_id) -> str:
+        """get journal text"""
+        journal_text = self.cache.get(user_key, CACHE_JOURNAL_TEXT, journal_id)
+        if journal_text is not None:
+            return journal_text
+        journal_text = ""
+        try:
+            journal_text = "".join(self.iter_journal_text(user_key, journal_id))
+            self.cache.put(user_key, CACHE_JOURNAL_TEXT, journal_id, journal_text)
+        except Exception as exception:
+            report_exception("storage.get_journal_text", exception)
+        return journal_text
+
+    def iter_journal_text(self, user_key: Fernet, journal_id) -> Iterator[str]:
+        """journal text in pieces, big texts are read and decrypted a few chunks at a time"""
+        for journal_text, chunked in self.fetch_all(SQL_READ_JOURNAL_TEXT, (journal_id,)):
+            if chunked:
+                yield from chunks.iter_chunks(self.fetch_all, user_key, journal_id)
+            else:
+                yield decrypt_data_to_text(journal_text, user_key)
+
+    def is_journal_chunked(self, journal_id: int) -> bool:
+        """True for big journal texts, the ones stored in chunks"""
+        for row in self.fetch_all(SQL_READ_JOURNAL_CHUNKED, (journal_id,)):
+            return bool(row[0])
+        return False
+
+    @timed("storage.search_journals")
+    def search_journals(self, user_key: Fernet, query: str) -> list:
+        """journals whose name or text contains all the words of the query,
+        each element is (id, name), only the names of the results are decrypted"""
+        result_list = []
+        try:
+            with self.transaction() as cur:
+                search_key = self.get_search_key(cur, user_key)
+                if read_metadata(cur, METADATA_SEARCH_INDEX_READY) is None:
+                    rebuild_search_index(cur, user_key, search_key)
+                journal_ids = search.find_journals(cur, search_key, query)
+            rows = [(journal_id, row[0]) for journal_id in journal_ids
+                    for row in self.fetch_all(SQL_READ_JOURNAL_NAME, (journal_id,))]
+            names = self.decrypt_journal_names(user_key, rows)
+            result_list = [(journal_id, names[journal_id]) for journal_id, _ in rows]
+        except Exception as exception:
+            report_exception("storage.search_journals", exception)
+        return result_list
+
+    @timed("storage.create_book")
+    def create_book(self, user_key: Fernet, book_name: str) -> int:
+        """create book"""
+        try:
+            encrypted_data = encrypt_text_to_data(book_name, user_key)
+            with self.transaction() as cur:
+                cur.execute(SQL_INSERT_BOOK, (encrypted_data,))
+                book_id = cur.lastrowid or 0
+            self.cache.put(user_key, CACHE_BOOK_NAME, book_id, book_name)
+            return book_id
+        except Exception as exception:
+            report_exception("storage.create_book", exception)
+        return 0
+
+    @timed("storage.create_journal")
+    def create_journal(self, user_key: Fernet, book_id: int, parent_leaf_id: int,
+                       journal_name: str, journal_text: str) -> int:
+        """create journal"""
+        try:
+            encrypted_data_journal_name = encrypt_text_to_data(journal_name, user_key)
+            big_text = len(journal_text) >= chunks.CHUNKED_MIN_CHARS
+            encrypted_data_journal_text = b'' if big_text else \
+                encrypt_text_to_data(journal_text, user_key)
+            data_tobe_inserted=(book_id, parent_leaf_id, encrypted_data_journal_name,
+                                encrypted_data_journal_text,)
+            with self.transaction() as cur:
+                cur.execute(SQL_INSERT_JOURNAL, data_tobe_inserted)
+                journal_id = cur.lastrowid or 0
+                search_key = self.get_search_key(cur, user_key)
+                search.index_journal_field(cur, search_key, journal_id, search.FIELD_NAME,
+                                           journal_name)
+                if big_text:
+                    self.write_journal_text(cur, user_key, journal_id, journal_text)
+                else:
+                    search.index_journal_field(cur, search_key, journal_id, search.FIELD_TEXT,
+                                               journal_text)
+                self.tree.changed(cur, book_id == USER_BOOK_ID)
+            self.cache.put(user_key, CACHE_JOURNAL_NAME, journal_id, journal_name)
+            if book_id == USER_BOOK_ID:
+                self.tree.add_leaf(parent_leaf_id, journal_id, journal_name)
+            return journal_id
+        except Exception as exception:
+            report_exception("storage.create_journal", exception)
+        return 0
+
+    @timed("storage.create_database")
+    def create_database(self, user_key: Fernet, user_password: str,
+                        kdf_parameters: Optional[KdfParameters] = None) -> bool:
+        """create databaase, kdf_parameters are the ones used to derive user_key"""
+        try:
+            conn = self.connect()
+            if conn is not None:
+                # the mode is stored by VACUUM, it is instant on an empty database
+                conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+                conn.execute("VACUUM")
+            with self.transaction() as cur:
+                # create tables
+                cur.execute(SQL_CREATE_BOOK_TABLE)
+                cur.execute(SQL_CREATE_JOURNAL_TABLE)
+                upgrade_schema(cur)
+                # insert first book (this is a special book not for the user)
+                encrypted_data = encrypt_text_to_data(user_password, user_key)
+                cur.execute(SQL_INSERT_BOOK, (encrypted_data,))
+                # the search index of a new database is complete from the start
+                self.get_search_key(cur, user_key)
+                write_metadata(cur, METADATA_SEARCH_INDEX_READY, b"1")
+                if kdf_parameters is not None:
+                    write_metadata(cur, METADATA_KDF, encode_kdf_parameters(kdf_parameters))
+        except Exception as exception:
+            report_exception("storage.create_database", exception)
+            return False
+        return True
+
+class RevisionHistory:
+    """Older texts of the journals of a session, kept by update_journal_text"""
+    def __init__(self, session: StorageSession):
+        self.session = session
+
+    @timed("storage.list_revisions")
+    def list_revisions(self, journal_id: int) -> List[Tuple[int, int, int, int]]:
+        """(revision, saved_at, kind, stored bytes) of the older texts of a journal,
+        newest first"""
+        try:
+            with self.session.transaction() as cur:
+                return revisions.list_revisions(cur, journal_id)
+        except Exception as exception:
+            report_exception("storage.list_revisions", exception)
+        return []
+
+    @timed("storage.get_revision_text")
+    def get_revision_text(self, user_key: Fernet, journal_id: int,
+                          revision: int) -> Optional[str]:
+        """text of a journal as it was in a revision, None if it can not be read"""
+        try:
+            with self.session.transaction() as cur:
+                current_text = None
+                if revisions.needs_current_text(cur, journal_id, revision):
+                    current_text = self.session.get_journal_text(user_key, journal_id)
+                return revisions.revision_text(cur, user_key, journal_id, revision,
+                                               current_text)
+        except Exception as exception:
+            report_exception("storage.get_revision_text", exception)
+        return None
+
+    def restore_revision(self, user_key: Fernet, journal_id: int,
+                         revision: int) -> Optional[str]:
+        """make the text of a revision the current one (the replaced text becomes a
+        revision too, so a restore can be undone), return the text restored"""
+        journal_text = self.get_revision_text(user_key, journal_id, revision)
+        if journal_text is not None and \
+                not self.session.update_journal_text(user_key, journal_id, journal_text):
+            return None
+        return journal_text
+
+class AttachmentStore:
+    """Files attached to the journals of a session"""
+    def __init__(self, session: StorageSession):
+        self.session = session
 
-def delete_journal(journal_id: int) -> None:
-    """delete journal"""
+    @timed("storage.add_attachment")
+    def add_attachment(self, user_key: Fernet, journal_id: int, file_name: str,
+                       progress: Optional[Callable[[int, int], None]] = None) -> int:
+        """attach a file to a journal, it is read, encrypted and stored a few chunks at
+        a time, each batch in its own transaction so other operations can run between
+        them. progress(bytes done, bytes) is called after every batch. Return the
+        attachment id, 0 on error"""
+        attachment_id = 0
+        try:
+            size = os.path.getsize(file_name)
+            with self.session.transaction() as cur:
+                attachment_id = attachments.insert_attachment(cur, user_key, journal_id,
+                                                              os.path.basename(file_name))
+            with open(file_name, "rb") as attached_file:
+                seq = 0
+                written = 0
+                chunk = attached_file.read(attachments.CHUNK_BYTES)
+                last = False
+                while not last:
+                    chunk_rows: List[Tuple[int, bytes]] = []
+                    while not last and len(chunk_rows) < attachments.WRITE_BATCH_SIZE:
+                        next_chunk = attached_file.read(attachments.CHUNK_BYTES)
+                        last = not next_chunk
+                        chunk_rows.append((seq, attachments.encrypt_chunk(
+                            user_key, attachment_id, seq, last, chunk)))
+                        written = written + len(chunk)
+                        seq = seq + 1
+                        chunk = next_chunk
+                    with self.session.transaction() as cur:
+                        attachments.insert_chunks(cur, attachment_id, chunk_rows)
+                        if last:
+                            attachments.complete_attachment(cur, attachment_id, written)
+                    if progress is not None:
+                        progress(written, max(size, written))
+            return attachment_id
+        except Exception as exception:
+            report_exception("storage.add_attachment", exception)
+            if attachment_id:
+                self.remove_attachment(attachment_id)
+        return 0
+
+    @timed("storage.list_attachments")
+    def list_attachments(self, user_key: Fernet, journal_id: int) -> List[Tuple[int, str, int]]:
+        """(id, name, size) of the attachments of a journal"""
+        try:
+            return [(attachment_id, decrypt_data_to_text(attachment_name, user_key), size)
+                    for attachment_id, attachment_name, size in
+                    self.session.fetch_all(attachments.SQL_READ_ATTACHMENTS, (journal_id,))]
+        except Exception as exception:
+            report_exception("storage.list_attachments", exception)
+        return []
+
+    @timed("storage.export_attachment")
+    def export_attachment(self, user_key: Fernet, attachment_id: int, file_name: str,
+                          progress: Optional[Callable[[int, int], None]] = None) -> bool:
+        """write an attachment to a file, streaming its chunks. The data goes to a
+        temporary file renamed at the end, so a failed export leaves no partial file"""
+        temporary_name = file_name + ".part"
+        try:
+            size_rows = self.session.fetch_all(attachments.SQL_READ_ATTACHMENT_SIZE,
+                                               (attachment_id,))
+            if not size_rows:
+                raise KeyError("attachment " + str(attachment_id))
+            size = size_rows[0][0]
+            written = 0
+            with open(temporary_name, "wb") as exported_file:
+                for chunk in attachments.iter_attachment(self.session.fetch_all, user_key,
+                                                         attachment_id):
+                    exported_file.write(chunk)
+                    written = written + len(chunk)
+                    if progress is not None:
+                        progress(written, max(size, written))
+            os.replace(temporary_name, file_name)
+            return True
+        except Exception as exception:
+            report_exception("storage.export_attachment", exception)
+            if os.path.exists(temporary_name):
+                os.remove(temporary_name)
+        return False
+
+    @timed("storage.remove_attachment")
+    def remove_attachment(self, attachment_id: int) -> None:
+        """delete an attachment"""
+        try:
+            with self.session.transaction() as cur:
+                attachments.delete_attachment(cur, attachment_id)
+        except Exception as exception:
+            report_exception("storage.remove_attachment", exception)
+
+class DatabaseKey:
+    """Password and key of the database of a session: the key derivation parameters,
+    the check of the password and the change of key"""
+    def __init__(self, session: StorageSession):
+        self.session = session
+
+    def read_kdf_parameters(self) -> Optional[KdfParameters]:
+        """key derivation parameters of the database, None for databases of older versions
+        (their salt is the password itself)"""
+        try:
+            for row in self.session.fetch_all(SQL_READ_METADATA, (METADATA_KDF,)):
+                return decode_kdf_parameters(row[0])
+        except Exception as exception:
+            report_exception("storage.read_kdf_parameters", exception)
+        return None
+
+    @timed("storage.start_user_key_change")
+    def start_user_key_change(self, old_key: UserKey, new_key: UserKey,
+                              kdf_parameters: KdfParameters,
+                              new_password: Optional[str] = None) -> Optional[RotatingKey]:
+        """start moving the database to new_key derived with kdf_parameters: from now on
+        the password (new_password when it is not the password of old_key) opens the
+        database with new_key, and the old key is kept until resume_user_key_change
+        has encrypted every row again. Return the key to use meanwhile, None on error"""
+        try:
+            with self.session.transaction() as cur:
+                if read_metadata(cur, METADATA_REKEY_OLD_KEY) is not None:
+                    raise ValueError("the previous change of key is not finished")
+                for row in cur.execute(SQL_READ_BOOK_NAME, (PASSWORD_BOOK_ID,)).fetchall():
+                    clear_data = decrypt_data(row[0], old_key)
+                    if new_password is not None:
+                        clear_data = new_password.encode(encoding='UTF-8')
+                    cur.execute(SQL_UPDATE_BOOK_NAME, (encrypt_data(clear_data, new_key),
+                                                       PASSWORD_BOOK_ID))
+                encrypted_key = read_metadata(cur, METADATA_SEARCH_KEY)
+                if encrypted_key is not None:
+                    write_metadata(cur, METADATA_SEARCH_KEY,
+                                   new_key.encrypt(old_key.decrypt(encrypted_key)))
+                write_metadata(cur, METADATA_KDF, encode_kdf_parameters(kdf_parameters))
+                # names encrypted with the old key, it is written again on close
+                cur.execute(SQL_DELETE_METADATA, (METADATA_TREE_SNAPSHOT,))
+                write_metadata(cur, METADATA_REKEY_OLD_KEY, new_key.encrypt(old_key.key))
+                write_metadata(cur, METADATA_REKEY_POSITION,
+                               json.dumps([0, REKEY_STEPS[0][4]]).encode(encoding='UTF-8'))
+            self.session.search_key = None
+        except Exception as exception:
+            report_exception("storage.start_user_key_change", exception)
+            return None
+        return RotatingKey(new_key, old_key)
+
+    def pending_user_key(self, user_key: UserKey) -> UserKey:
+        """user_key, or the key that reads both keys if a change of key from an older
+        key is not finished (resume it with resume_user_key_change)"""
+        try:
+            for row in self.session.fetch_all(SQL_READ_METADATA, (METADATA_REKEY_OLD_KEY,)):
+                return RotatingKey(user_key, UserKey(user_key.decrypt(row[0])))
+        except Exception as exception:
+            report_exception("storage.pending_user_key", exception)
+        return user_key
+
+    @timed("storage.resume_user_key_change")
+    def resume_user_key_change(self, rotating_key: RotatingKey,
+                               progress: Optional[Callable[[int, int], None]] = None) -> bool:
+        """encrypt again with the new key every row still encrypted with the old one,
+        from the saved position, in batches so memory does not grow with the database and
+        other operations can run between them. progress(rows done, rows) is called after
+        every batch that encrypted rows. At the end the old key is forgotten"""
+        try:
+            for row in self.session.fetch_all(SQL_READ_METADATA, (METADATA_REKEY_POSITION,)):
+                step, position = json.loads(bytes(row[0]).decode(encoding='UTF-8'))
+                break
+            else:
+                return True
+            rows = sum(self.session.fetch_all(REKEY_STEPS[later_step][2],
+                                              tuple(position if later_step == step else
+                                                    REKEY_STEPS[later_step][4]))[0][0]
+                       for later_step in range(step, len(REKEY_STEPS)))
+            rows_done = 0
+            while step < len(REKEY_STEPS):
+                read_sql, update_sql, _, key_columns, _ = REKEY_STEPS[step]
+                with self.session.transaction() as cur:
+                    updates = []
+                    batch_bytes = 0
+                    for row in cur.execute(read_sql, (*position, REKEY_BATCH_ROWS)):
+                        blobs = [rotate_data(blob, rotating_key) for blob in row[key_columns:]]
+                        updates.append((*blobs, *row[:key_columns]))
+                        batch_bytes = batch_bytes + sum(len(blob) for blob in blobs)
+                        if batch_bytes >= REKEY_BATCH_BYTES:
+                            break
+                    cur.executemany(update_sql, updates)
+                    if updates:
+                        position = list(updates[-1][-key_columns:])
+                    if len(updates) < REKEY_BATCH_ROWS and batch_bytes < REKEY_BATCH_BYTES:
+                        step = step + 1
+                        if step < len(REKEY_STEPS):
+                            position = REKEY_STEPS[step][4]
+                    if step < len(REKEY_STEPS):
+                        write_metadata(cur, METADATA_REKEY_POSITION,
+                                       json.dumps([step, position]).encode(encoding='UTF-8'))
+                    else:
+                        cur.execute(SQL_DELETE_METADATA, (METADATA_REKEY_POSITION,))
+                        cur.execute(SQL_DELETE_METADATA, (METADATA_REKEY_OLD_KEY,))
+                rows_done = rows_done + len(updates)
+                # the steps of the tables with no rows left are not shown
+                if progress is not None and updates:
+                    progress(rows_done, rows)
+        except Exception as exception:
+            report_exception("storage.resume_user_key_change", exception)
+            return False
+        return True
+
+    @timed("storage.change_user_key")
+    def change_user_key(self, old_key: UserKey, new_key: UserKey,
+                        kdf_parameters: KdfParameters, new_password: Optional[str] = None,
+                        progress: Optional[Callable[[int, int], None]] = None) -> bool:
+        """encrypt every book, journal and secret of the database with a new key derived
+        with kdf_parameters, see start_user_key_change and resume_user_key_change"""
+        rotating_key = self.start_user_key_change(old_key, new_key, kdf_parameters,
+                                                  new_password)
+        return rotating_key is not None and \
+            self.resume_user_key_change(rotating_key, progress)
+
+    @timed("storage.verify_database_password")
+    def verify_database_password(self, user_key: Fernet, user_password: str) -> bool:
+        """verify db pass"""
+        try:
+            # read book name from the first record
+            for row in self.session.fetch_all(SQL_READ_BOOK_NAME, (PASSWORD_BOOK_ID,)):
+                # do decrypt and validate
+                decrypted_text = decrypt_data_to_text(row[0], user_key)
+                if decrypted_text != user_password:
+                    print ("stored password does not match with provided pass")
+                    return False
+        except Exception as exception:
+            report_exception("storage.verify_database_password", exception)
+            return False
+        return True
+
+class Maintenance:
+    """Removal of the rows left behind in the database of a session and of its free pages"""
+    def __init__(self, session: StorageSession):
+        self.session = session
+
+    @timed("storage.run_maintenance")
+    def run_maintenance(self, force: bool = False) -> Dict[str, int]:
+        """remove the rows left by older versions (journals whose parent was deleted,
+        chunks and search entries of deleted journals) and give free pages back to the
+        file system, the search for those rows runs at most every
+        MAINTENANCE_INTERVAL_SECONDS unless force is True, return what was removed"""
+        result = {"journals": 0, "chunks": 0, "search_rows": 0, "revisions": 0,
+                  "attachments": 0, "pages_freed": 0}
+        try:
+            now = int(time.time())
+            journal_ids: List[int] = []
+            with self.session.transaction() as cur:
+                last_maintenance = read_metadata(cur, METADATA_LAST_MAINTENANCE)
+                full_pass = force or last_maintenance is None or \
+                    now - int(last_maintenance) >= MAINTENANCE_INTERVAL_SECONDS
+                if full_pass:
+                    for orphan_row in cur.execute(SQL_READ_ORPHAN_JOURNALS).fetchall():
+                        journal_ids.extend(delete_subtree(cur, orphan_row[0]))
+                    if journal_ids:
+                        self.session.tree.changed(cur)
+                    result["journals"] = len(journal_ids)
+                    cur.execute(SQL_DELETE_ORPHAN_CHUNKS)
+                    result["chunks"] = cur.rowcount
+                    cur.execute(SQL_DELETE_ORPHAN_SEARCH_ROWS)
+                    result["search_rows"] = cur.rowcount
+                    cur.execute(revisions.SQL_DELETE_ORPHAN_REVISIONS)
+                    result["revisions"] = cur.rowcount + revisions.prune_revisions(cur, now)
+                    result["attachments"] = attachments.delete_orphan_attachments(cur)
+                    write_metadata(cur, METADATA_LAST_MAINTENANCE,
+                                   str(now).encode(encoding='UTF-8'))
+            self.session.invalidate_journals(journal_ids)
+            result["pages_freed"] = self.reclaim_free_pages(full_pass)
+        except Exception as exception:
+            report_exception("storage.run_maintenance", exception)
+        return result
+
+    def reclaim_free_pages(self, allow_full_vacuum: bool) -> int:
+        """give up to MAINTENANCE_VACUUM_PAGES free pages back to the file system,
+        a database without incremental vacuum is vacuumed completely (which turns it
+        on) if allow_full_vacuum and enough of it is free, return the pages freed"""
+        with self.session.lock:
+            conn = self.session.connect()
+            if conn is None:
+                return 0
+            free_pages = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            if free_pages == 0:
+                return 0
+            if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == AUTO_VACUUM_INCREMENTAL:
+                # execute() steps a statement without result rows only once, which frees
+                # only one page, executescript() runs it to the end
+                conn.executescript(f"PRAGMA incremental_vacuum({MAINTENANCE_VACUUM_PAGES})")
+            elif allow_full_vacuum and free_pages >= \
+                    conn.execute("PRAGMA page_count").fetchone()[0] * FULL_VACUUM_FREE_PART:
+                conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+                conn.execute("VACUUM")
+            else:
+                return 0
+            return free_pages - conn.execute("PRAGMA freelist_count").fetchone()[0]
+
+def apply_sync_changes(session: StorageSession, cur: sqlite3.Cursor, user_key: Fernet,
+                       changes: List[sync.Change]) -> Tuple[List[int], int, int]:
+    """apply the changes of another copy to the database of session in the transaction
+    of cur, return the journals changed or deleted, the changes ignored and the version
+    of the database once they are applied (before the orphans are moved, that move
+    is a change of this copy)"""
+    applier = sync.ChangeApplier(cur, user_key, session.get_search_key(cur, user_key),
+                                 int(time.time()))
+    ignored = applier.apply(changes)
+    version = sync.read_change_counter(cur)
+    journal_ids = applier.journal_ids + move_orphans(cur)
+    if journal_ids:
+        session.tree.changed(cur, snapshot_updated=False)
+    return journal_ids, ignored, version
+
+@timed("storage.sync_database")
+def sync_sessions(session: StorageSession, other: StorageSession,
+                  user_key: Fernet) -> Optional[Dict[str, int]]:
+    """exchange the rows changed since the last sync between the databases of two
+    sessions, both must be opened by user_key. Each copy is written in one
+    transaction, session first: until the other copy commits, session does not
+    count its changes as sent, an interrupted sync sends them again and the
+    changes already applied are ignored. Return the changes received, sent and
+    ignored, None if the sync failed"""
     try:
-        conn = create_connection(DATABASE_NAME)
-        if conn is not None:
-            cur = conn.cursor()
-            cur.execute("delete from journal where id=?", (journal_id,))
-            conn.commit()
+        user_password = None
+        for copy in (session, other):
+            if copy.fetch_all(SQL_READ_METADATA, (METADATA_REKEY_OLD_KEY,)):
+                raise ValueError("a change of password is not finished in " + copy.dbfile)
+            # the other copy must be readable with the key of this one
+            rows = copy.fetch_all(SQL_READ_BOOK_NAME, (PASSWORD_BOOK_ID,))
+            if not rows:
+                raise ValueError("not a diary " + copy.dbfile)
+            copy_password = decrypt_data_to_text(rows[0][0], user_key)
+            if user_password is not None and copy_password != user_password:
+                raise ValueError("the databases do not have the same password")
+            user_password = copy_password
+        with session.transaction() as cur:
+            replica_id = sync.read_replica_id(cur)
+        with other.transaction() as other_cur:
+            other_replica_id = sync.read_replica_id(other_cur)
+            if other_replica_id == replica_id:
+                other_replica_id = sync.new_replica_id(other_cur)
+        with other.transaction() as other_cur:
+            incoming = sync.read_changes(other_cur,
+                                         sync.read_sent_version(other_cur, replica_id))
+            with session.transaction() as cur:
+                outgoing = sync.read_changes(cur, sync.read_sent_version(cur,
+                                                                        other_replica_id))
+                received_ids, ignored, sent_version = apply_sync_changes(session, cur,
+                                                                         user_key, incoming)
+            # the changes of the other copy read above are in this copy now
+            sent_ids, other_ignored, other_sent_version = apply_sync_changes(
+                other, other_cur, user_key, outgoing)
+            sync.write_sent_version(other_cur, replica_id, other_sent_version)
+        with session.transaction() as cur:
+            sync.write_sent_version(cur, other_replica_id, sent_version)
+        session.invalidate_journals(received_ids)
+        other.invalidate_journals(sent_ids)
     except Exception as exception:
-        print(str(exception))
-    finally:
-        if conn:
-            conn.close()
+        report_exception("storage.sync_database", exception)
+        return None
+    return {"received": len(incoming) - ignored, "sent": len(outgoing) - other_ignored,
+            "ignored": ignored + other_ignored}
+
+# one session per database file, created on first use
+SESSIONS: Dict[str, StorageSession] = {}
+
+def get_session(dbfile: Optional[str] = None) -> StorageSession:
+    """get the session of a database file, by default the application database"""
+    if dbfile is None:
+        dbfile = DATABASE_NAME
+    session = SESSIONS.get(dbfile)
+    if session is None:
+        session = StorageSession(dbfile, working_copy=WORKING_COPY)
+        SESSIONS[dbfile] = session
+    return session
+
+def close_session(dbfile: Optional[str] = None) -> None:
+    """close the session of a database file, by default the application database"""
+    session = SESSIONS.pop(dbfile if dbfile is not None else DATABASE_NAME, None)
+    if session is not None:
+        session.close()
+
+# **************** module level operations over the application session
+def update_journal_text(user_key: Fernet, journal_id: int, new_journal_text: str) -> bool:
+    """update journal table, return False if the text could not be written"""
+    return get_session().update_journal_text(user_key, journal_id, new_journal_text)
+
+def update_journal_name(user_key: Fernet, journal_id: int, new_journal_name: str) -> None:
+    """update journal name"""
+    get_session().update_journal_name(user_key, journal_id, new_journal_name)
+
+def delete_journal(journal_id: int) -> List[int]:
+    """delete journal and its children, return the ids deleted"""
+    return get_session().delete_journal(journal_id)
 
 def get_book_name(user_key: Fernet, book_id: int) -> str:
     """read book name, it will become the tree name in the user interface"""
-    book_name = text_labels.BOOK_NAME
-    try:
-        conn = create_connection(DATABASE_NAME)
-        if conn is not None:
-            cur = conn.cursor()
-            cur.execute(SQL_READ_BOOK_NAME, (book_id,))
-            record = cur.fetchall()
-            for row in record:
-                # read columns
-                book_name = decrypt_data_to_text(row[0], user_key)
-    except Exception as exception:
-        print(str(exception))
-    finally:
-        if conn:
-            conn.close()
-    return book_name
+    return get_session().get_book_name(user_key, book_id)
 
 def get_journal_text(user_key: Fernet, journal_id) -> str:
     """get journal text"""
-    journal_text = ""
-    try:
-        conn = create_connection(DATABASE_NAME)
-        if conn is not None:
-            cur = conn.cursor()
-            cur.execute(SQL_READ_JOURNAL_TEXT, (journal_id,))
-            record = cur.fetchall()
-            for row in record:
-                # read columns
-                journal_text = decrypt_data_to_text(row[0], user_key)
-    except Exception as exception:
-        print(str(exception))
-    finally:
-        if conn:
-            conn.close()
-    return journal_text
+    return get_session().get_journal_text(user_key, journal_id)
+
+def iter_journal_text(user_key: Fernet, journal_id) -> Iterator[str]:
+    """journal text in pieces, big texts are read and decrypted a few chunks at a time"""
+    return get_session().iter_journal_text(user_key, journal_id)
+
+def list_revisions(journal_id: int) -> List[Tuple[int, int, int, int]]:
+    """older texts of a journal, newest first"""
+    return RevisionHistory(get_session()).list_revisions(journal_id)
+
+def get_revision_text(user_key: Fernet, journal_id: int, revision: int) -> Optional[str]:
+    """text of a journal as it was in a revision"""
+    return RevisionHistory(get_session()).get_revision_text(user_key, journal_id, revision)
+
+def restore_revision(user_key: Fernet, journal_id: int, revision: int) -> Optional[str]:
+    """make the text of a revision the current one"""
+    return RevisionHistory(get_session()).restore_revision(user_key, journal_id, revision)
+
+def add_attachment(user_key: Fernet, journal_id: int, file_name: str,
+                   progress: Optional[Callable[[int, int], None]] = None) -> int:
+    """attach a file to a journal, return the attachment id"""
+    return AttachmentStore(get_session()).add_attachment(user_key, journal_id, file_name, progress)
+
+def list_attachments(user_key: Fernet, journal_id: int) -> List[Tuple[int, str, int]]:
+    """(id, name, size) of the attachments of a journal"""
+    return AttachmentStore(get_session()).list_attachments(user_key, journal_id)
+
+def export_attachment(user_key: Fernet, attachment_id: int, file_name: str,
+                      progress: Optional[Callable[[int, int], None]] = None) -> bool:
+    """write an attachment to a file"""
+    return AttachmentStore(get_session()).export_attachment(user_key, attachment_id, file_name,
+                                                            progress)
+
+def remove_attachment(attachment_id: int) -> None:
+    """delete an attachment"""
+    AttachmentStore(get_session()).remove_attachment(attachment_id)
+
+def is_journal_chunked(journal_id: int) -> bool:
+    """True for big journal texts, the ones stored in chunks"""
+    return get_session().is_journal_chunked(journal_id)
+
+def get_cache_statistics() -> Dict[str, int]:
+    """hit, miss and eviction counters of the cache of decrypted texts"""
+    return get_session().cache.statistics()
+
+def flush_working_copy(force: bool = False) -> bool:
+    """write the changes of the working copy of the application database"""
+    return get_session().flush_working_copy(force)
+
+def get_working_copy_statistics() -> Dict[str, int]:
+    """flushes of the working copy and bytes written, empty without working copy"""
+    working_copy = get_session().file.working_copy
+    return dict(working_copy.counters) if working_copy is not None else {}
+
+def configure_cache(max_bytes: int, max_entries: int) -> None:
+    """change the limits of the cache of decrypted texts"""
+    get_session().cache.configure(max_bytes, max_entries)
+
+def load_tree_snapshot(user_key: Fernet) -> bool:
+    """read the tree of journals from its snapshot"""
+    return get_session().tree.load_snapshot(user_key)
+
+def save_tree_snapshot(user_key: Fernet, expanded: List[int]) -> None:
+    """store the tree of journals and the leafs expanded in screen"""
+    get_session().tree.save_snapshot(user_key, expanded)
+
+def get_expanded_leafs() -> List[int]:
+    """leafs that were expanded when the tree snapshot was stored"""
+    return get_session().tree.expanded_leafs()
 
 def get_tree_leafs(user_key: Fernet) -> list:
     """read tree of book + journals from database
     for this first version the book id is always 2 (book id 1 is reserved)"""
-    leaf_list = []
-    try:
-        conn = create_connection(DATABASE_NAME)
-        if conn is not None:
-            cur = conn.cursor()
-            cur.execute(SQL_READ_ALL_JOURNAL, (2,))
-            record = cur.fetchall()
-            for row in record:
-                # read columns
-                parent_id = row[0]
-                l_id = row[1]
-                journal_name = decrypt_data_to_text(row[2], user_key)
-                leaf_element = parent_id, l_id, journal_name
-                leaf_list.append(leaf_element)
-    except Exception as exception:
-        print(str(exception))
-    finally:
-        if conn:
-            conn.close()
-    return leaf_list
+    return get_session().tree.get_tree_leafs(user_key)
+
+def get_child_leafs(user_key: Fernet, book_id: int, parent_id: int) -> list:
+    """read the direct children of one leaf, each element is (id, name, has_children)"""
+    return get_session().tree.get_child_leafs(user_key, book_id, parent_id)
+
+def list_recent_journals(user_key: Fernet, limit: int = RECENT_JOURNALS,
+                         by_created: bool = False) -> List[Tuple[int, str, int, int]]:
+    """the journals changed (or created) last, each element is (id, name, created, modified)"""
+    return get_session().tree.list_recent_journals(user_key, limit, by_created)
+
+def get_leaf_path(journal_id: int) -> List[int]:
+    """ids of the journals from the top of the tree down to journal_id"""
+    return get_session().tree.get_leaf_path(journal_id)
+
+def search_journals(user_key: Fernet, query: str) -> list:
+    """journals whose name or text contains all the words of the query"""
+    return get_session().search_journals(user_key, query)
+
+def find_titles(user_key: Fernet, query: str,
+                limit: int = TITLE_RESULTS) -> List[Tuple[int, str, str]]:
+    """journals of the tree whose names match the query, each element is (id, name, path)"""
+    return get_session().tree.find_titles(user_key, query, limit)
 
 def create_book(user_key: Fernet, book_name: str) -> int:
     """create book"""
-    try:
-        conn = create_connection(DATABASE_NAME)
-        if conn is not None:
-            cur = conn.cursor()
-            encrypted_data = encrypt_text_to_data(book_name, user_key)
-            data_tobe_inserted=(encrypted_data,)
-            cur.execute(SQL_INSERT_BOOK, data_tobe_inserted)
-            conn.commit()
-            last_row_id = cur.lastrowid
-            return last_row_id
-    except Exception as exception:
-        print(str(exception))
-    finally:
-        if conn:
-            conn.close()
-    return 0
+    return get_session().create_book(user_key, book_name)
 
 def create_journal(user_key: Fernet, book_id: int, parent_leaf_id: int,
                   journal_name: str, journal_text: str) -> int:
     """create journal"""
-    try:
-        conn = create_connection(DATABASE_NAME)
-        if conn is not None:
-            cur = conn.cursor()
-            encrypted_data_journal_name = encrypt_text_to_data(journal_name, user_key)
-            encrypted_data_journal_text = encrypt_text_to_data(journal_text, user_key)
-            data_tobe_inserted=(book_id, parent_leaf_id, encrypted_data_journal_name,
-                              encrypted_data_journal_text,)
-            cur.execute(SQL_INSERT_JOURNAL, data_tobe_inserted)
-            conn.commit()
-            last_row_id = cur.lastrowid
-            return last_row_id
-    except Exception as exception:
-        print(str(exception))
-    finally:
-        if conn:
-            conn.close()
-    return 0
+    return get_session().create_journal(user_key, book_id, parent_leaf_id,
+                                        journal_name, journal_text)
 
-def create_database(user_key: Fernet, user_password: str) -> bool:
+def create_database(user_key: Fernet, user_password: str,
+                    kdf_parameters: Optional[KdfParameters] = None) -> bool:
     """create databaase"""
-    try:
-        # create a database connection
-        conn = create_connection(DATABASE_NAME)
-        # create tables
-        if conn is not None:
-            # create tables
-            create_table(conn, SQL_CREATE_BOOK_TABLE)
-            create_table(conn, SQL_CREATE_JOURNAL_TABLE)
-            # insert first book (this is a special book not for the user)
-            cur = conn.cursor()
-            encrypted_data = encrypt_text_to_data(user_password, user_key)
-            data_tobe_inserted=(encrypted_data,)
-            cur.execute(SQL_INSERT_BOOK, data_tobe_inserted)
-            conn.commit()
-        else:
-            return False
-    except Exception as exception:
-        print(str(exception))
-        return False
-    finally:
-        if conn:
-            conn.close()
-    return True
+    return get_session().create_database(user_key, user_password, kdf_parameters)
+
+def read_kdf_parameters() -> Optional[KdfParameters]:
+    """key derivation parameters of the database, None for databases of older versions"""
+    return DatabaseKey(get_session()).read_kdf_parameters()
+
+def change_user_key(old_key: UserKey, new_key: UserKey, kdf_parameters: KdfParameters,
+                    new_password: Optional[str] = None,
+                    progress: Optional[Callable[[int, int], None]] = None) -> bool:
+    """encrypt the whole database with a new key"""
+    return DatabaseKey(get_session()).change_user_key(old_key, new_key, kdf_parameters,
+                                                      new_password, progress)
+
+def start_user_key_change(old_key: UserKey, new_key: UserKey, kdf_parameters: KdfParameters,
+                          new_password: Optional[str] = None) -> Optional[RotatingKey]:
+    """start moving the database to a new key"""
+    return DatabaseKey(get_session()).start_user_key_change(old_key, new_key, kdf_parameters,
+                                                            new_password)
+
+def pending_user_key(user_key: UserKey) -> UserKey:
+    """key that reads both keys while a change of key is not finished"""
+    return DatabaseKey(get_session()).pending_user_key(user_key)
+
+def resume_user_key_change(rotating_key: RotatingKey,
+                           progress: Optional[Callable[[int, int], None]] = None) -> bool:
+    """encrypt the rows left with the new key"""
+    return DatabaseKey(get_session()).resume_user_key_change(rotating_key, progress)
+
+def run_maintenance(force: bool = False) -> Dict[str, int]:
+    """remove the rows of deleted journals and give free pages back to the file system"""
+    return Maintenance(get_session()).run_maintenance(force)
+
+def sync_database(other_dbfile: str, user_key: Fernet) -> Optional[Dict[str, int]]:
+    """exchange the changes of the application database and another copy of it"""
+    return sync_sessions(get_session(), get_session(other_dbfile), user_key)
 
 def verify_database_password(user_key: Fernet, user_password: str) -> bool:
     """verify db pass"""
-    try:
-        # create a database connection
-        conn = create_connection(DATABASE_NAME)
-        # create tables
-        if conn is not None:
-            # read book name from the first record
-            cur = conn.cursor()
-            cur.execute("SELECT book_name from book where id = ?", (1,))
-            record = cur.fetchall()
-            for row in record:
-                # get encrypted blob
-                encrypted_data = row[0]
-                # do decrypt and validate
-                decrypted_text = decrypt_data_to_text(encrypted_data, user_key)
-                if decrypted_text != user_password:
-                    print ("stored password does not match with provided pass")
-                    return False
-        else:
-            return False
-    except Exception as exception:
-        print(str(exception))
-        return False
-    finally:
-        if conn:
-            conn.close()
-    return True
+    return DatabaseKey(get_session()).verify_database_password(user_key, user_password)
@@ -0,0 +1,105 @@
+"""
+Application: Maitenotas
+Made by Taksan Tong
+https://github.com/maitelab/maitenotas
+
+Storage requests of the user interface run in a worker thread """
+import threading
+from collections import deque
+from concurrent.futures import Future
+from typing import Any, Callable, Deque, Dict, Hashable, List, Optional
+from instrument import report_exception
+
+class StorageRequest:
+    """one queued call, the futures of the requests it replaced get its result too"""
+    def __init__(self, function: Callable[[], Any], callback: Optional[Callable[[Any], None]],
+                 coalesce_key: Optional[Hashable]):
+        self.function = function
+        self.callback = callback
+        self.coalesce_key = coalesce_key
+        self.futures: List[Future] = [Future()]
+
+class StorageWorker:
+    """Runs storage calls in one worker thread, in the order they were submitted, so
+    the event handlers never wait for the disk or for decryption.
+    A call submitted with the coalesce_key of a call still queued replaces it: the
+    older call never runs (its future gets the result of the newer one, its callback
+    is not called) and the newer one goes to the end of the queue.
+    The callback of a call gets its result through deliver_function(callback, result),
+    wx.CallAfter in the application so the callback runs in the GUI thread"""
+    def __init__(self, deliver_function: Callable[..., Any]):
+        self.deliver_function = deliver_function
+        self.condition = threading.Condition()
+        self.queue: Deque[StorageRequest] = deque()
+        self.busy = False
+        self.running = True
+        # calls run, calls replaced by a newer one and calls that failed
+        self.counters = {"run": 0, "coalesced": 0, "failed": 0}
+        self.worker = threading.Thread(target=self.run, name="storage", daemon=True)
+        self.worker.start()
+
+    def submit(self, function: Callable[[], Any],
+               callback: Optional[Callable[[Any], None]] = None,
+               coalesce_key: Optional[Hashable] = None) -> Future:
+        """queue a call, return the future of its result"""
+        request = StorageRequest(function, callback, coalesce_key)
+        with self.condition:
+            if not self.running:
+                raise RuntimeError("the storage worker is stopped")
+            if coalesce_key is not None:
+                for queued in list(self.queue):
+                    if queued.coalesce_key == coalesce_key:
+                        self.queue.remove(queued)
+                        request.futures.extend(queued.futures)
+                        self.counters["coalesced"] += 1
+            self.queue.append(request)
+            self.condition.notify_all()
+        return request.futures[0]
+
+    def flush(self) -> None:
+        """wait until every queued call has run"""
+        with self.condition:
+            while self.queue or self.busy:
+                self.condition.wait()
+
+    def stop(self) -> None:
+        """run everything queued and end the worker thread, the callbacks of the calls
+        still queued are not delivered, the receiver may be gone"""
+        with self.condition:
+            self.running = False
+            for request in self.queue:
+                request.callback = None
+            self.condition.notify_all()
+        self.worker.join()
+
+    def statistics(self) -> Dict[str, int]:
+        """counters and calls waiting"""
+        with self.condition:
+            return dict(self.counters, queued=len(self.queue))
+
+    def run(self) -> None:
+        """worker thread loop"""
+        while True:
+            with self.condition:
+                while self.running and not self.queue:
+                    self.condition.wait()
+                if not self.queue:
+                    return
+                request = self.queue.popleft()
+                self.busy = True
+            try:
+                result = request.function()
+            except Exception as exception:
+                report_exception("storageworker.run", exception)
+                self.counters["failed"] += 1
+                for future in request.futures:
+                    future.set_exception(exception)
+            else:
+                self.counters["run"] += 1
+                for future in request.futures:
+                    future.set_result(result)
+                if request.callback is not None:
+                    self.deliver_function(request.callback, result)
+            with self.condition:
+                self.busy = False
+                self.condition.notify_all()
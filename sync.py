@@ -0,0 +1,576 @@
+"""
+Application: Maitenotas
+Made by Taksan Tong
+https://github.com/maitelab/maitenotas
+
+Row level sync between two copies of a diary, for example one on a laptop and one
+on a USB stick. Every book and journal has a uid that is the same in every copy,
+and triggers stamp each change of a row with a version (a counter of the changes
+of the copy), the time of the change and the replica id of the copy that made it.
+A deleted journal leaves a tombstone with the same stamp. A sync sends each copy
+only the rows changed since the last sync between both, encrypted as they are
+stored, so both copies must use the same key. When both copies changed a row the
+newest change wins, by time, then by replica id and then by a digest of the
+change, so both copies keep the same one; a text replaced by the sync stays in the
+revision history """
+import hashlib
+import sqlite3
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
+from cryptography.fernet import Fernet
+from crypto import decrypt_data_to_text
+import attachments
+import chunks
+import revisions
+import search
+
+# ***************** SQL
+# schema: stamp columns, uids of the rows of older versions, tombstones and the
+# last version sent to every other copy
+SQL_ADD_BOOK_UID = """
+ALTER TABLE book ADD COLUMN uid text; """
+
+SQL_ADD_BOOK_VERSION = """
+ALTER TABLE book ADD COLUMN version integer NOT NULL DEFAULT 0; """
+
+SQL_ADD_BOOK_MODIFIED = """
+ALTER TABLE book ADD COLUMN modified integer NOT NULL DEFAULT 0; """
+
+SQL_ADD_BOOK_ORIGIN = """
+ALTER TABLE book ADD COLUMN origin text NOT NULL DEFAULT ''; """
+
+SQL_ADD_JOURNAL_UID = """
+ALTER TABLE journal ADD COLUMN uid text; """
+
+SQL_ADD_JOURNAL_VERSION = """
+ALTER TABLE journal ADD COLUMN version integer NOT NULL DEFAULT 0; """
+
+SQL_ADD_JOURNAL_MODIFIED = """
+ALTER TABLE journal ADD COLUMN modified integer NOT NULL DEFAULT 0; """
+
+SQL_ADD_JOURNAL_ORIGIN = """
+ALTER TABLE journal ADD COLUMN origin text NOT NULL DEFAULT ''; """
+
+# the uid of a row of an older version is made from its id and the random part of
+# its encrypted values: copies of the same file get the same uids, and a row
+# changed in both copies before the upgrade gets two uids, both versions are kept
+SQL_SET_LEGACY_BOOK_UIDS = """
+update book
+set uid=printf('%d-',id)||lower(hex(substr(book_name,12,16)))
+where uid is null
+"""
+
+SQL_SET_LEGACY_JOURNAL_UIDS = """
+update journal
+set uid=printf('%d-',id)||lower(hex(substr(journal_name,12,16)))||
+    lower(hex(substr(journal_text,12,16)))
+where uid is null
+"""
+
+SQL_CREATE_BOOK_UID_INDEX = """
+CREATE UNIQUE INDEX IF NOT EXISTS book_uid
+ON book(uid); """
+
+SQL_CREATE_BOOK_VERSION_INDEX = """
+CREATE INDEX IF NOT EXISTS book_version
+ON book(version); """
+
+SQL_CREATE_JOURNAL_UID_INDEX = """
+CREATE UNIQUE INDEX IF NOT EXISTS journal_uid
+ON journal(uid); """
+
+SQL_CREATE_JOURNAL_VERSION_INDEX = """
+CREATE INDEX IF NOT EXISTS journal_version
+ON journal(version); """
+
+SQL_CREATE_TOMBSTONE_TABLE = """
+CREATE TABLE IF NOT EXISTS tombstone (
+    uid text PRIMARY KEY,
+    version integer NOT NULL,
+    modified integer NOT NULL,
+    origin text NOT NULL
+) WITHOUT ROWID; """
+
+SQL_CREATE_TOMBSTONE_VERSION_INDEX = """
+CREATE INDEX IF NOT EXISTS tombstone_version
+ON tombstone(version); """
+
+SQL_CREATE_SYNC_PEER_TABLE = """
+CREATE TABLE IF NOT EXISTS sync_peer (
+    replica_id text PRIMARY KEY,
+    sent_version integer NOT NULL
+) WITHOUT ROWID; """
+
+SQL_INIT_REPLICA_ID = """
+INSERT OR IGNORE INTO metadata(name,value)
+VALUES('replica_id',lower(hex(randomblob(16))))"""
+
+SQL_INIT_CHANGE_COUNTER = """
+INSERT OR IGNORE INTO metadata(name,value)
+VALUES('change_counter',0)"""
+
+# the triggers stamp every write path of the application, the rows encrypted again
+# by a change of key (while rekey_old_key exists) and the password book are not changes
+SQL_CREATE_BOOK_INSERT_TRIGGER = """
+CREATE TRIGGER IF NOT EXISTS book_inserted AFTER INSERT ON book
+BEGIN
+    update metadata set value=value+1 where name='change_counter';
+    update book
+    set uid=coalesce(new.uid,lower(hex(randomblob(16)))),
+        version=(select value from metadata where name='change_counter'),
+        modified=cast((julianday('now')-2440587.5)*86400000 as integer),
+        origin=(select value from metadata where name='replica_id')
+    where id=new.id;
+END; """
+
+SQL_CREATE_BOOK_UPDATE_TRIGGER = """
+CREATE TRIGGER IF NOT EXISTS book_updated AFTER UPDATE OF book_name ON book
+WHEN new.id<>1 and not exists(select 1 from metadata where name='rekey_old_key')
+BEGIN
+    update metadata set value=value+1 where name='change_counter';
+    update book
+    set version=(select value from metadata where name='change_counter'),
+        modified=cast((julianday('now')-2440587.5)*86400000 as integer),
+        origin=(select value from metadata where name='replica_id')
+    where id=new.id;
+END; """
+
+SQL_CREATE_JOURNAL_INSERT_TRIGGER = """
+CREATE TRIGGER IF NOT EXISTS journal_inserted AFTER INSERT ON journal
+BEGIN
+    update metadata set value=value+1 where name='change_counter';
+    update journal
+    set uid=coalesce(new.uid,lower(hex(randomblob(16)))),
+        version=(select value from metadata where name='change_counter'),
+        modified=cast((julianday('now')-2440587.5)*86400000 as integer),
+        origin=(select value from metadata where name='replica_id')
+    where id=new.id;
+END; """
+
+SQL_CREATE_JOURNAL_UPDATE_TRIGGER = """
+CREATE TRIGGER IF NOT EXISTS journal_updated
+AFTER UPDATE OF book_id,parent_id,journal_name,journal_text,chunked ON journal
+WHEN not exists(select 1 from metadata where name='rekey_old_key')
+BEGIN
+    update metadata set value=value+1 where name='change_counter';
+    update journal
+    set version=(select value from metadata where name='change_counter'),
+        modified=cast((julianday('now')-2440587.5)*86400000 as integer),
+        origin=(select value from metadata where name='replica_id')
+    where id=new.id;
+END; """
+
+SQL_CREATE_JOURNAL_DELETE_TRIGGER = """
+CREATE TRIGGER IF NOT EXISTS journal_deleted AFTER DELETE ON journal
+BEGIN
+    update metadata set value=value+1 where name='change_counter';
+    INSERT OR REPLACE INTO tombstone(uid,version,modified,origin)
+    VALUES(old.uid,
+           (select value from metadata where name='change_counter'),
+           cast((julianday('now')-2440587.5)*86400000 as integer),
+           (select value from metadata where name='replica_id'));
+END; """
+
+# sync
+SQL_READ_REPLICA_ID = """
+select value
+from metadata
+where name='replica_id'
+"""
+
+SQL_NEW_REPLICA_ID = """
+update metadata
+set value=lower(hex(randomblob(16)))
+where name='replica_id'
+"""
+
+SQL_READ_CHANGE_COUNTER = """
+select value
+from metadata
+where name='change_counter'
+"""
+
+SQL_INCREMENT_CHANGE_COUNTER = """
+update metadata
+set value=value+1
+where name='change_counter'
+"""
+
+SQL_READ_SENT_VERSION = """
+select sent_version
+from sync_peer
+where replica_id=?
+"""
+
+SQL_WRITE_SENT_VERSION = """
+INSERT OR REPLACE INTO sync_peer(replica_id,sent_version)
+VALUES(?,?)"""
+
+SQL_READ_CHANGED_BOOKS = """
+select uid,modified,origin,book_name
+from book
+where version>? and id<>1
+order by version
+"""
+
+SQL_READ_CHANGED_JOURNALS = """
+select j.id,j.uid,j.modified,j.origin,b.uid,p.uid,j.journal_name,j.journal_text,j.chunked,
+    j.created
+from journal j
+left join book b on b.id=j.book_id
+left join journal p on p.id=j.parent_id
+where j.version>?
+order by j.version
+"""
+
+SQL_READ_CHANGED_TOMBSTONES = """
+select uid,modified,origin
+from tombstone
+where version>?
+order by version
+"""
+
+SQL_READ_CHUNK_ROWS = """
+select seq,chunk_hash,chunk_data
+from journal_chunk
+where journal_id=?
+order by seq
+"""
+
+SQL_READ_BOOK_STAMP = """
+select id,modified,origin,book_name
+from book
+where uid=?
+"""
+
+SQL_READ_JOURNAL_STAMP = """
+select j.id,j.modified,j.origin,j.journal_text,j.chunked,j.journal_name,b.uid,p.uid
+from journal j
+left join book b on b.id=j.book_id
+left join journal p on p.id=j.parent_id
+where j.uid=?
+"""
+
+SQL_READ_TOMBSTONE_STAMP = """
+select modified,origin
+from tombstone
+where uid=?
+"""
+
+SQL_INSERT_SYNCED_BOOK = """
+INSERT INTO book(book_name,uid)
+VALUES(?,?)"""
+
+SQL_UPDATE_SYNCED_BOOK = """
+update book
+set book_name=?
+where id=?
+"""
+
+SQL_STAMP_BOOK = """
+update book
+set modified=?,origin=?
+where id=?
+"""
+
+SQL_INSERT_SYNCED_JOURNAL = """
+INSERT INTO journal(book_id,parent_id,journal_name,journal_text,chunked,uid,created)
+VALUES(?,0,?,?,?,?,?)"""
+
+SQL_UPDATE_SYNCED_JOURNAL = """
+update journal
+set book_id=?,journal_name=?,journal_text=?,chunked=?
+where id=?
+"""
+
+SQL_UPDATE_SYNCED_PARENT = """
+update journal
+set parent_id=coalesce((select p.id from journal p
+                        where p.uid=? and p.book_id=journal.book_id), 0)
+where id=?
+"""
+
+SQL_STAMP_JOURNAL = """
+update journal
+set modified=?,origin=?
+where id=?
+"""
+
+SQL_DELETE_SYNCED_JOURNAL = """
+delete from journal
+where id=?
+"""
+
+SQL_WRITE_TOMBSTONE = """
+INSERT OR REPLACE INTO tombstone(uid,version,modified,origin)
+VALUES(?,(select value from metadata where name='change_counter'),?,?)"""
+
+SQL_DELETE_TOMBSTONE = """
+delete from tombstone
+where uid=?
+"""
+
+SQL_MOVE_JOURNAL_TO_TOP = """
+update journal
+set parent_id=0
+where id=?
+"""
+
+# entry of storage.SCHEMA_MIGRATIONS
+SCHEMA_STATEMENTS = (
+    SQL_ADD_BOOK_UID, SQL_ADD_BOOK_VERSION, SQL_ADD_BOOK_MODIFIED, SQL_ADD_BOOK_ORIGIN,
+    SQL_ADD_JOURNAL_UID, SQL_ADD_JOURNAL_VERSION, SQL_ADD_JOURNAL_MODIFIED,
+    SQL_ADD_JOURNAL_ORIGIN, SQL_SET_LEGACY_BOOK_UIDS, SQL_SET_LEGACY_JOURNAL_UIDS,
+    SQL_CREATE_BOOK_UID_INDEX, SQL_CREATE_BOOK_VERSION_INDEX, SQL_CREATE_JOURNAL_UID_INDEX,
+    SQL_CREATE_JOURNAL_VERSION_INDEX, SQL_CREATE_TOMBSTONE_TABLE,
+    SQL_CREATE_TOMBSTONE_VERSION_INDEX, SQL_CREATE_SYNC_PEER_TABLE, SQL_INIT_REPLICA_ID,
+    SQL_INIT_CHANGE_COUNTER, SQL_CREATE_BOOK_INSERT_TRIGGER, SQL_CREATE_BOOK_UPDATE_TRIGGER,
+    SQL_CREATE_JOURNAL_INSERT_TRIGGER, SQL_CREATE_JOURNAL_UPDATE_TRIGGER,
+    SQL_CREATE_JOURNAL_DELETE_TRIGGER,
+)
+
+# kinds of changes
+KIND_BOOK = 0
+KIND_JOURNAL = 1
+KIND_TOMBSTONE = 2
+# the rows of older versions have version 0, the first sync with a copy sends them too
+NEVER_SENT = -1
+
+class Change(NamedTuple):
+    """a changed row as it is sent to the other copy, with the encrypted values"""
+    kind: int
+    uid: str
+    modified: int
+    origin: str
+    book_uid: Optional[str] = None
+    parent_uid: Optional[str] = None
+    name: bytes = b''
+    text: bytes = b''
+    chunked: int = 0
+    chunk_rows: Sequence[Tuple[int, bytes, bytes]] = ()
+    created: int = 0
+
+def change_digest(change: Change) -> bytes:
+    """digest of what a change writes, computed the same way in both copies from
+    the encrypted values they exchange"""
+    digest = hashlib.sha256(bytes([change.kind]))
+    for value in (change.book_uid or "", change.parent_uid or ""):
+        digest.update(value.encode(encoding='UTF-8') + b"\0")
+    for data in (change.name, change.text):
+        digest.update(len(data).to_bytes(8, "big") + data)
+    for seq, chunk_hash, chunk_data in change.chunk_rows:
+        digest.update(seq.to_bytes(8, "big") + chunk_hash + len(chunk_data).to_bytes(8, "big") +
+                      chunk_data)
+    return digest.digest()
+
+def read_replica_id(cur: sqlite3.Cursor) -> str:
+    """id of the copy of the database"""
+    return str(cur.execute(SQL_READ_REPLICA_ID).fetchone()[0])
+
+def new_replica_id(cur: sqlite3.Cursor) -> str:
+    """give the database a new replica id, for a copy made after the upgrade
+    that still has the id of the file it was copied from"""
+    cur.execute(SQL_NEW_REPLICA_ID)
+    return read_replica_id(cur)
+
+def read_change_counter(cur: sqlite3.Cursor) -> int:
+    """version of the last change of the database"""
+    return int(cur.execute(SQL_READ_CHANGE_COUNTER).fetchone()[0])
+
+def read_sent_version(cur: sqlite3.Cursor, replica_id: str) -> int:
+    """last version of this database that the other copy has"""
+    row = cur.execute(SQL_READ_SENT_VERSION, (replica_id,)).fetchone()
+    return row[0] if row is not None else NEVER_SENT
+
+def write_sent_version(cur: sqlite3.Cursor, replica_id: str, version: int) -> None:
+    """remember the last version of this database that the other copy has"""
+    cur.execute(SQL_WRITE_SENT_VERSION, (replica_id, version))
+
+def read_chunk_rows(cur: sqlite3.Cursor, journal_id: int) -> List[Tuple[int, bytes, bytes]]:
+    """(seq, hash, encrypted data) of the chunks of a journal"""
+    return [(seq, bytes(chunk_hash), bytes(chunk_data)) for seq, chunk_hash, chunk_data
+            in cur.execute(SQL_READ_CHUNK_ROWS, (journal_id,)).fetchall()]
+
+def read_changes(cur: sqlite3.Cursor, since: int) -> List[Change]:
+    """rows changed after version since: books first, then journals and tombstones.
+    The chunks of chunked texts are read in the same transaction as their journal"""
+    changes = [Change(KIND_BOOK, uid, modified, origin, name=bytes(book_name))
+               for uid, modified, origin, book_name in
+               cur.execute(SQL_READ_CHANGED_BOOKS, (since,)).fetchall()]
+    for journal_id, uid, modified, origin, book_uid, parent_uid, journal_name, journal_text, \
+            chunked, created in cur.execute(SQL_READ_CHANGED_JOURNALS, (since,)).fetchall():
+        changes.append(Change(KIND_JOURNAL, uid, modified, origin, book_uid, parent_uid,
+                              bytes(journal_name), bytes(journal_text), chunked,
+                              read_chunk_rows(cur, journal_id) if chunked else [], created))
+    changes.extend(Change(KIND_TOMBSTONE, uid, modified, origin) for uid, modified, origin in
+                   cur.execute(SQL_READ_CHANGED_TOMBSTONES, (since,)).fetchall())
+    return changes
+
+def read_text(cur: sqlite3.Cursor, user_key: Fernet, journal_id: int, journal_text: bytes,
+              chunked: int) -> str:
+    """decrypted text of a journal, from its row or from its chunks"""
+    if not chunked:
+        return decrypt_data_to_text(journal_text, user_key)
+    return "".join(chunk for _, chunk in chunks.iter_chunk_texts(cur, user_key, journal_id))
+
+def index_text(cur: sqlite3.Cursor, user_key: Fernet, search_key: bytes, journal_id: int,
+               change: Change) -> None:
+    """index the text of a journal written by a change"""
+    search.remove_journal_chunk_fields(cur, journal_id)
+    search.remove_journal_field(cur, journal_id, search.FIELD_TEXT)
+    if not change.chunked:
+        search.index_journal_field(cur, search_key, journal_id, search.FIELD_TEXT,
+                                   decrypt_data_to_text(change.text, user_key))
+        return
+    for stored_hash, chunk in chunks.iter_chunk_texts(cur, user_key, journal_id):
+        search.index_journal_field(cur, search_key, journal_id,
+                                   search.chunk_field(stored_hash), chunk)
+
+class ChangeApplier:
+    """Applies the changes of the other copy in the transaction of cur. A change is
+    ignored if the row (or tombstone) it replaces has the same or a newer stamp.
+    The writes fire the triggers like any other change, so the rows get a version of
+    this copy (and reach the copies synced with it later), and the stamp of the
+    change is written back over the local one at the end"""
+    def __init__(self, cur: sqlite3.Cursor, user_key: Fernet, search_key: bytes, now: int):
+        self.cur = cur
+        self.user_key = user_key
+        self.search_key = search_key
+        self.now = now
+        self.journal_ids: List[int] = []
+        self.parents: List[Tuple[int, str]] = []
+        # stamps of the books and journals changed, by kind
+        self.stamps: Dict[int, Dict[int, Tuple[int, str]]] = {KIND_BOOK: {}, KIND_JOURNAL: {}}
+
+    def apply(self, changes: List[Change]) -> int:
+        """apply changes read by read_changes, return the number of changes ignored"""
+        ignored = 0
+        for change in changes:
+            if change.kind == KIND_BOOK:
+                applied = self.apply_book(change)
+            elif change.kind == KIND_JOURNAL:
+                applied = self.apply_journal(change)
+            else:
+                applied = self.apply_tombstone(change)
+            if not applied:
+                ignored += 1
+        # a journal may come before its parent, parents are set once all exist
+        for journal_id, parent_uid in self.parents:
+            self.cur.execute(SQL_UPDATE_SYNCED_PARENT, (parent_uid, journal_id))
+        for sql, kind in ((SQL_STAMP_BOOK, KIND_BOOK), (SQL_STAMP_JOURNAL, KIND_JOURNAL)):
+            self.cur.executemany(sql, [(modified, origin, row_id) for
+                                       row_id, (modified, origin) in self.stamps[kind].items()])
+        return ignored
+
+    def journal_stamp(self, uid: str) -> Tuple[Optional[tuple], Optional[Tuple[int, str]]]:
+        """local row of a journal uid and its stamp, or the stamp of its tombstone"""
+        row = self.cur.execute(SQL_READ_JOURNAL_STAMP, (uid,)).fetchone()
+        if row is not None:
+            return row, (row[1], row[2])
+        tombstone = self.cur.execute(SQL_READ_TOMBSTONE_STAMP, (uid,)).fetchone()
+        return None, (tombstone[0], tombstone[1]) if tombstone is not None else None
+
+    def local_journal(self, uid: str, row: Optional[tuple],
+                      stamp: Tuple[int, str]) -> Change:
+        """the local row (or tombstone) of a journal as a change"""
+        if row is None:
+            return Change(KIND_TOMBSTONE, uid, stamp[0], stamp[1])
+        return Change(KIND_JOURNAL, uid, row[1], row[2], row[6], row[7], bytes(row[5]),
+                      bytes(row[3]), row[4], read_chunk_rows(self.cur, row[0]) if row[4] else [])
+
+    def is_older(self, change: Change, stamp: Optional[Tuple[int, str]],
+                 local_change: Callable[[Tuple[int, str]], Change]) -> bool:
+        """True if the local stamp wins over the change. Copies made by
+        copying the file share their replica id until they are synced, two changes of
+        a row with the same time and replica id are ordered by change_digest so both
+        copies keep the same one"""
+        if stamp is None:
+            return False
+        if (change.modified, change.origin) == tuple(stamp):
+            return change_digest(change) <= change_digest(local_change(stamp))
+        return (change.modified, change.origin) < tuple(stamp)
+
+    def apply_book(self, change: Change) -> bool:
+        """create or rename a book, False if the change is ignored"""
+        row = self.cur.execute(SQL_READ_BOOK_STAMP, (change.uid,)).fetchone()
+        if self.is_older(change, (row[1], row[2]) if row is not None else None,
+                         lambda stamp: Change(KIND_BOOK, change.uid, stamp[0], stamp[1],
+                                              name=bytes(row[3]))):
+            return False
+        if row is None:
+            self.cur.execute(SQL_INSERT_SYNCED_BOOK, (change.name, change.uid))
+            book_id = self.cur.lastrowid or 0
+        else:
+            book_id = row[0]
+            self.cur.execute(SQL_UPDATE_SYNCED_BOOK, (change.name, book_id))
+        self.stamps[KIND_BOOK][book_id] = (change.modified, change.origin)
+        return True
+
+    def apply_journal(self, change: Change) -> bool:
+        """create or replace a journal, the text it replaces is kept as a revision.
+        False if the change is ignored"""
+        row, stamp = self.journal_stamp(change.uid)
+        if self.is_older(change, stamp,
+                         lambda local_stamp: self.local_journal(change.uid, row, local_stamp)):
+            return False
+        book = self.cur.execute(SQL_READ_BOOK_STAMP, (change.book_uid,)).fetchone()
+        if book is None:
+            return False
+        old_text: Optional[str] = None
+        if row is None:
+            self.cur.execute(SQL_INSERT_SYNCED_JOURNAL, (book[0], change.name, change.text,
+                                                         change.chunked, change.uid,
+                                                         change.created))
+            journal_id = self.cur.lastrowid or 0
+            self.cur.execute(SQL_DELETE_TOMBSTONE, (change.uid,))
+            text_changed = True
+        else:
+            journal_id = row[0]
+            text_changed = bytes(row[3]) != change.text or row[4] != change.chunked or \
+                read_chunk_rows(self.cur, journal_id) != list(change.chunk_rows)
+            if text_changed:
+                old_text = read_text(self.cur, self.user_key, journal_id, row[3], row[4])
+            self.cur.execute(SQL_UPDATE_SYNCED_JOURNAL, (book[0], change.name, change.text,
+                                                         change.chunked, journal_id))
+        search.index_journal_field(self.cur, self.search_key, journal_id, search.FIELD_NAME,
+                                   decrypt_data_to_text(change.name, self.user_key))
+        if text_changed:
+            chunks.delete_chunks(self.cur, journal_id)
+            self.cur.executemany(chunks.SQL_INSERT_CHUNK,
+                                 [(journal_id, seq, chunk_hash, chunk_data)
+                                  for seq, chunk_hash, chunk_data in change.chunk_rows])
+            index_text(self.cur, self.user_key, self.search_key, journal_id, change)
+            if old_text is not None:
+                new_text = read_text(self.cur, self.user_key, journal_id, change.text,
+                                     change.chunked)
+                if new_text != old_text:
+                    revisions.add_revision(self.cur, self.user_key, journal_id, old_text,
+                                           new_text, saved_at=self.now)
+        if change.parent_uid is not None:
+            self.parents.append((journal_id, change.parent_uid))
+        else:
+            self.cur.execute(SQL_MOVE_JOURNAL_TO_TOP, (journal_id,))
+        self.journal_ids.append(journal_id)
+        self.stamps[KIND_JOURNAL][journal_id] = (change.modified, change.origin)
+        return True
+
+    def apply_tombstone(self, change: Change) -> bool:
+        """delete a journal (not the journals under it, they are moved to the top
+        by storage.move_orphans if nothing else was done with them) and keep its
+        tombstone. False if the change is ignored"""
+        row, stamp = self.journal_stamp(change.uid)
+        if self.is_older(change, stamp,
+                         lambda local_stamp: self.local_journal(change.uid, row, local_stamp)):
+            return False
+        if row is not None:
+            journal_id = row[0]
+            self.cur.execute(SQL_DELETE_SYNCED_JOURNAL, (journal_id,))
+            chunks.delete_chunks(self.cur, journal_id)
+            search.remove_journal(self.cur, journal_id)
+            revisions.delete_revisions(self.cur, journal_id)
+            attachments.delete_journal_attachments(self.cur, journal_id)
+            self.journal_ids.append(journal_id)
+            self.stamps[KIND_JOURNAL].pop(journal_id, None)
+        # the tombstone gets a version of this copy to reach the copies synced later
+        self.cur.execute(SQL_INCREMENT_CHANGE_COUNTER)
+        self.cur.execute(SQL_WRITE_TOMBSTONE, (change.uid, change.modified, change.origin))
+        return True
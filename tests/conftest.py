@@ -0,0 +1,61 @@
+"""
+Application: Maitenotas
+Made by Taksan Tong
+https://github.com/maitelab/maitenotas
+
+Fixtures of the tests: a diary in a temporary directory with the user book, opened
+by a key derived with few iterations so the tests run fast """
+import os
+import sys
+from typing import Dict, Iterator, List, Tuple
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# pylint: disable=wrong-import-position
+import storage
+from crypto import KdfParameters, UserKey, derive_user_key, new_kdf_parameters
+
+PASSWORD = "test password"
+TEST_ITERATIONS = 1000
+
+@pytest.fixture(name="kdf_parameters")
+def fixture_kdf_parameters() -> KdfParameters:
+    """parameters stored in the test diaries"""
+    return new_kdf_parameters(TEST_ITERATIONS)
+
+@pytest.fixture(name="user_key")
+def fixture_user_key(kdf_parameters: KdfParameters) -> UserKey:
+    """key of the test diaries"""
+    return derive_user_key(PASSWORD, kdf_parameters)
+
+def new_diary(dbfile: str, user_key: UserKey,
+              kdf_parameters: KdfParameters) -> storage.StorageSession:
+    """session of a new diary with the user book"""
+    session = storage.StorageSession(dbfile)
+    assert session.create_database(user_key, PASSWORD, kdf_parameters)
+    assert session.create_book(user_key, "journals") == storage.USER_BOOK_ID
+    return session
+
+@pytest.fixture(name="diary")
+def fixture_diary(tmp_path, user_key: UserKey,
+                  kdf_parameters: KdfParameters) -> Iterator[storage.StorageSession]:
+    """session of a new diary with the user book"""
+    session = new_diary(str(tmp_path / "diary.data"), user_key, kdf_parameters)
+    yield session
+    session.close()
+
+def journal_texts(session: storage.StorageSession, user_key: UserKey) -> Dict[str, str]:
+    """text of every journal of the user book by name"""
+    return {journal_name: session.get_journal_text(user_key, journal_id)
+            for _, journal_id, journal_name in session.tree.get_tree_leafs(user_key)}
+
+def journal_tree(session: storage.StorageSession,
+                 user_key: UserKey) -> List[Tuple[str, str, str]]:
+    """(parent name, name, text) of every journal of the user book"""
+    leafs = session.tree.get_tree_leafs(user_key)
+    names = {journal_id: journal_name for _, journal_id, journal_name in leafs}
+    return sorted((names.get(parent_id, ""), journal_name,
+                   session.get_journal_text(user_key, journal_id))
+                  for parent_id, journal_id, journal_name in leafs)
@@ -0,0 +1,129 @@
+"""
+Application: Maitenotas
+Made by Taksan Tong
+https://github.com/maitelab/maitenotas
+
+Autosave engine: texts queued while a save runs are coalesced, a text already saved
+is skipped and a text that could not be saved stays queued until it is saved """
+import threading
+import time
+from typing import Iterator, List, Tuple
+
+import pytest
+
+import autosave
+
+class Saver:
+    """save function that records the texts, fails while failing is set and can be
+    held inside a save until release is set"""
+    def __init__(self) -> None:
+        self.saved: List[Tuple[int, str]] = []
+        self.failing = False
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.release.set()
+
+    def __call__(self, journal_id: int, text: str) -> bool:
+        self.started.set()
+        self.release.wait()
+        if self.failing:
+            return False
+        self.saved.append((journal_id, text))
+        return True
+
+@pytest.fixture(name="saver")
+def fixture_saver() -> Saver:
+    """a save function that works"""
+    return Saver()
+
+@pytest.fixture(name="engine")
+def fixture_engine(saver: Saver) -> Iterator[autosave.AutosaveEngine]:
+    """an engine saving with saver"""
+    engine = autosave.AutosaveEngine(saver)
+    yield engine
+    saver.failing = False
+    saver.release.set()
+    engine.stop()
+
+def test_texts_queued_during_a_save_are_coalesced(engine, saver):
+    """only the last of the texts submitted while a save runs is written"""
+    saver.release.clear()
+    engine.submit(1, "first")
+    assert saver.started.wait(5)
+    for text in ("second", "third", "fourth"):
+        engine.submit(1, text)
+    engine.submit(2, "other journal")
+    saver.release.set()
+    assert engine.flush()
+    assert saver.saved == [(1, "first"), (1, "fourth"), (2, "other journal")]
+    assert engine.counters["saved"] == 3
+
+def test_unchanged_text_is_skipped(engine, saver):
+    """a text equal to the one read or saved last is not written"""
+    engine.mark_saved(1, "as read")
+    engine.submit(1, "as read")
+    engine.submit(2, "new")
+    assert engine.flush()
+    engine.submit(2, "new")
+    assert engine.flush()
+    assert saver.saved == [(2, "new")]
+    assert engine.counters["skipped"] == 2
+
+def test_failed_text_is_saved_by_the_next_flush(engine, saver):
+    """a text that could not be saved is not taken as saved: the flush reports it
+    and the next flush writes it"""
+    saver.failing = True
+    engine.submit(1, "lost?")
+    assert not engine.flush()
+    assert engine.counters["failed"] >= 1
+    saver.failing = False
+    assert engine.flush()
+    assert saver.saved == [(1, "lost?")]
+    engine.submit(1, "lost?")
+    assert engine.flush()
+    assert saver.saved == [(1, "lost?")]
+
+def test_failed_text_submitted_again_is_written(engine, saver):
+    """the text that failed is still dirty when it is submitted again"""
+    saver.failing = True
+    engine.submit(1, "text")
+    engine.wait(1)
+    saver.failing = False
+    engine.submit(1, "text")
+    assert engine.flush()
+    assert saver.saved == [(1, "text")]
+
+def test_failed_text_is_retried_by_the_worker(engine, saver, monkeypatch):
+    """with nothing else to do the worker tries the failed texts again"""
+    monkeypatch.setattr(autosave, "RETRY_SECONDS", 0.05)
+    saver.failing = True
+    engine.submit(1, "text")
+    engine.wait(1)
+    saver.failing = False
+    deadline = time.monotonic() + 5
+    while not saver.saved and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert saver.saved == [(1, "text")]
+
+def test_exception_is_a_failure(saver):
+    """a save function that raises leaves the text dirty like one that returns False"""
+    def broken_save(journal_id: int, text: str) -> bool:
+        raise OSError("disk full " + str(journal_id) + text)
+    engine = autosave.AutosaveEngine(broken_save)
+    engine.submit(1, "text")
+    assert not engine.stop()
+    assert engine.failed == {1: "text"}
+    assert not saver.saved
+
+def test_stop_saves_the_queued_texts(saver):
+    """stop writes every text queued before the worker ends"""
+    engine = autosave.AutosaveEngine(saver)
+    saver.release.clear()
+    engine.submit(1, "first")
+    assert saver.started.wait(5)
+    engine.submit(1, "last")
+    engine.submit(2, "second journal")
+    saver.release.set()
+    assert engine.stop()
+    assert not engine.worker.is_alive()
+    assert saver.saved == [(1, "first"), (1, "last"), (2, "second journal")]
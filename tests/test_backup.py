@@ -0,0 +1,126 @@
+"""
+Application: Maitenotas
+Made by Taksan Tong
+https://github.com/maitelab/maitenotas
+
+Backups: a full backup followed by incremental ones restores the diary as it was,
+metadata deleted between two backups is deleted by the restore and a changed file
+of the chain stops the restore """
+import os
+
+import pytest
+from conftest import journal_tree, TEST_ITERATIONS
+
+import backup
+import storage
+from crypto import derive_user_key, new_kdf_parameters
+
+def fill_diary(diary: storage.StorageSession, user_key) -> int:
+    """journals with children, a big text and a revision, return the id of the first"""
+    first_id = diary.create_journal(user_key, storage.USER_BOOK_ID, 0, "first", "first text")
+    diary.create_journal(user_key, storage.USER_BOOK_ID, first_id, "child", "child text")
+    diary.create_journal(user_key, storage.USER_BOOK_ID, 0, "big",
+                         "".join(f"line {number} of a big text\n" for number in range(20000)))
+    diary.update_journal_text(user_key, first_id, "first text, edited")
+    return first_id
+
+def restored_tree(file_name: str, user_key):
+    """journals of a restored diary"""
+    session = storage.StorageSession(file_name)
+    try:
+        return journal_tree(session, user_key)
+    finally:
+        session.close()
+
+def test_full_then_incremental_restores_the_diary(diary, user_key, tmp_path):
+    """the last backup of a chain gives the diary as it was when it was taken"""
+    backup_dir = str(tmp_path / "backups")
+    first_id = fill_diary(diary, user_key)
+    assert backup.backup_database(diary, backup_dir)["kind"] == backup.KIND_FULL
+    full_tree = journal_tree(diary, user_key)
+    diary.update_journal_text(user_key, first_id, "first text, edited again")
+    diary.create_journal(user_key, storage.USER_BOOK_ID, first_id, "new child", "new text")
+    diary.delete_journal(diary.create_journal(user_key, storage.USER_BOOK_ID, 0, "gone", ""))
+    assert backup.backup_database(diary, backup_dir)["kind"] == backup.KIND_INCREMENTAL
+    last_tree = journal_tree(diary, user_key)
+    assert backup.backup_database(diary, backup_dir)["file"] is None
+    restored = str(tmp_path / "restored.data")
+    assert backup.restore_backup(backup_dir, restored)["files"] == 2
+    assert restored_tree(restored, user_key) == last_tree
+    restored_full = str(tmp_path / "restored_full.data")
+    backup.restore_backup(backup_dir, restored_full, sequence=1)
+    assert restored_tree(restored_full, user_key) == full_tree
+
+def test_changed_file_of_the_chain_stops_the_restore(diary, user_key, tmp_path):
+    """a backup that depends on a changed file is not restored, the ones before it are"""
+    backup_dir = str(tmp_path / "backups")
+    first_id = fill_diary(diary, user_key)
+    backup.backup_database(diary, backup_dir)
+    full_tree = journal_tree(diary, user_key)
+    diary.update_journal_text(user_key, first_id, "changed after the full backup")
+    incremental = backup.backup_database(diary, backup_dir)["file"]
+    with open(os.path.join(backup_dir, incremental), "r+b") as backup_file:
+        backup_file.seek(os.path.getsize(backup_file.name) // 2)
+        data = backup_file.read(1)
+        backup_file.seek(-1, os.SEEK_CUR)
+        backup_file.write(bytes([data[0] ^ 0xff]))
+    restored = str(tmp_path / "restored.data")
+    with pytest.raises(ValueError):
+        backup.restore_backup(backup_dir, restored)
+    assert not os.path.exists(restored)
+    backup.restore_backup(backup_dir, restored, sequence=1)
+    assert restored_tree(restored, user_key) == full_tree
+
+def restored_metadata(file_name: str):
+    """names of the metadata of a restored diary"""
+    session = storage.StorageSession(file_name)
+    try:
+        return {row[0] for row in session.fetch_all("select name from metadata")}
+    finally:
+        session.close()
+
+def test_metadata_deleted_after_the_previous_backup(diary, user_key, tmp_path):
+    """a metadata value deleted between two backups is not in the restored diary"""
+    backup_dir = str(tmp_path / "backups")
+    first_id = fill_diary(diary, user_key)
+    with diary.transaction() as cur:
+        storage.write_metadata(cur, "deleted_later", b"value")
+    backup.backup_database(diary, backup_dir)
+    with diary.transaction() as cur:
+        cur.execute(storage.SQL_DELETE_METADATA, ("deleted_later",))
+    diary.update_journal_text(user_key, first_id, "changed after the full backup")
+    assert backup.backup_database(diary, backup_dir)["kind"] == backup.KIND_INCREMENTAL
+    restored = str(tmp_path / "restored.data")
+    backup.restore_backup(backup_dir, restored)
+    assert "deleted_later" not in restored_metadata(restored)
+    assert storage.METADATA_KDF in restored_metadata(restored)
+    restored_full = str(tmp_path / "restored_full.data")
+    backup.restore_backup(backup_dir, restored_full, sequence=1)
+    assert "deleted_later" in restored_metadata(restored_full)
+
+def test_change_of_password_finished_between_backups(diary, user_key, tmp_path, monkeypatch):
+    """a change of password interrupted at the first backup and finished before the
+    next one leaves a restored diary that opens with the new key alone"""
+    monkeypatch.setattr(storage, "REKEY_BATCH_ROWS", 1)
+    backup_dir = str(tmp_path / "backups")
+    fill_diary(diary, user_key)
+    kdf_parameters = new_kdf_parameters(TEST_ITERATIONS)
+    new_key = derive_user_key("new password", kdf_parameters)
+    database_key = storage.DatabaseKey(diary)
+    rotating_key = database_key.start_user_key_change(user_key, new_key, kdf_parameters,
+                                                      "new password")
+    assert rotating_key is not None
+    def interrupt_in_the_journals(done: int, _: int) -> None:
+        if done >= 4:
+            raise InterruptedError()
+    assert not database_key.resume_user_key_change(rotating_key, interrupt_in_the_journals)
+    backup.backup_database(diary, backup_dir)
+    assert database_key.resume_user_key_change(rotating_key)
+    backup.backup_database(diary, backup_dir)
+    last_tree = journal_tree(diary, new_key)
+    restored = str(tmp_path / "restored.data")
+    backup.restore_backup(backup_dir, restored)
+    names = restored_metadata(restored)
+    assert storage.METADATA_REKEY_OLD_KEY not in names
+    assert storage.METADATA_REKEY_POSITION not in names
+    assert restored_tree(restored, new_key) == last_tree
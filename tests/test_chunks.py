@@ -0,0 +1,75 @@
+"""
+Application: Maitenotas
+Made by Taksan Tong
+https://github.com/maitelab/maitenotas
+
+Big texts stored in chunks: they read back whole, an edit writes only the chunks
+around it, their words are found and a text that shrinks leaves its chunks """
+import random
+
+import chunks
+import storage
+
+SQL_READ_CHUNK_DATA = "select chunk_data from journal_chunk where journal_id=? order by seq"
+
+def big_text(seed: int = 3) -> str:
+    """a text of random lines well over CHUNKED_MIN_CHARS"""
+    rng = random.Random(seed)
+    return "".join(f"{rng.random()} {rng.random()}\n" for _ in range(16000))
+
+def chunk_data(diary: storage.StorageSession, journal_id: int):
+    """the encrypted chunks of a journal"""
+    return [bytes(row[0]) for row in diary.fetch_all(SQL_READ_CHUNK_DATA, (journal_id,))]
+
+def test_split_text_gives_back_the_text():
+    """joined chunks are the text, no chunk is bigger than CHUNK_MAX_CHARS, and a
+    line longer than a chunk is cut"""
+    for text in (big_text(), "x" * (3 * chunks.CHUNK_MAX_CHARS + 5), ""):
+        chunk_list = chunks.split_text(text)
+        assert "".join(chunk_list) == text
+        assert all(len(chunk) <= chunks.CHUNK_MAX_CHARS for chunk in chunk_list)
+
+def test_big_text_reads_back(diary, user_key):
+    """a big text is chunked and reads back whole or in pieces"""
+    text = big_text()
+    assert len(text) >= chunks.CHUNKED_MIN_CHARS
+    journal_id = diary.create_journal(user_key, storage.USER_BOOK_ID, 0, "big", text)
+    assert diary.is_journal_chunked(journal_id)
+    assert len(chunk_data(diary, journal_id)) > 1
+    diary.cache.clear()
+    assert diary.get_journal_text(user_key, journal_id) == text
+    assert "".join(diary.iter_journal_text(user_key, journal_id)) == text
+
+def test_edit_writes_only_the_chunks_around_it(diary, user_key):
+    """chunk boundaries follow the content, so an edit in the middle of a big text
+    leaves the other chunks as they were"""
+    text = big_text()
+    journal_id = diary.create_journal(user_key, storage.USER_BOOK_ID, 0, "big", text)
+    before = chunk_data(diary, journal_id)
+    middle = text.index("\n", len(text) // 2) + 1
+    edited = text[:middle] + "an inserted line\n" + text[middle:]
+    diary.update_journal_text(user_key, journal_id, edited)
+    after = chunk_data(diary, journal_id)
+    assert len(set(after) - set(before)) <= 2
+    diary.cache.clear()
+    assert diary.get_journal_text(user_key, journal_id) == edited
+
+def test_words_of_chunks_are_found(diary, user_key):
+    """the words of every chunk are indexed, and the words removed are forgotten"""
+    text = big_text()
+    middle = text.index("\n", len(text) // 2) + 1
+    journal_id = diary.create_journal(user_key, storage.USER_BOOK_ID, 0, "big",
+                                      text[:middle] + "needle\n" + text[middle:])
+    assert diary.search_journals(user_key, "needle") == [(journal_id, "big")]
+    diary.update_journal_text(user_key, journal_id, text[:middle] + "thread\n" + text[middle:])
+    assert diary.search_journals(user_key, "needle") == []
+    assert diary.search_journals(user_key, "thread") == [(journal_id, "big")]
+
+def test_shrunk_text_leaves_its_chunks(diary, user_key):
+    """a text that becomes small is stored in the journal row again"""
+    journal_id = diary.create_journal(user_key, storage.USER_BOOK_ID, 0, "big", big_text())
+    diary.update_journal_text(user_key, journal_id, "small now")
+    assert not diary.is_journal_chunked(journal_id)
+    assert not chunk_data(diary, journal_id)
+    diary.cache.clear()
+    assert diary.get_journal_text(user_key, journal_id) == "small now"
@@ -0,0 +1,83 @@
+"""
+Application: Maitenotas
+Made by Taksan Tong
+https://github.com/maitelab/maitenotas
+
+Blobs: plain Fernet tokens of older versions are still read, new blobs are an
+envelope with a version and a codec byte, compressed from COMPRESS_MIN_BYTES """
+import base64
+import os
+import zlib
+
+import pytest
+from cryptography.fernet import Fernet
+
+import crypto
+
+@pytest.fixture(name="key")
+def fixture_key() -> Fernet:
+    """a key made from random bytes, no derivation needed"""
+    return Fernet(Fernet.generate_key())
+
+def test_legacy_token_is_read(key):
+    """a base64 Fernet token, as older versions stored every blob, is decrypted as is"""
+    token = key.encrypt("written by an older version".encode(encoding='UTF-8'))
+    assert token[:1] == b"g"
+    assert crypto.decrypt_data_to_text(token, key) == "written by an older version"
+    assert crypto.decrypt_data_to_text(memoryview(token), key) == "written by an older version"
+
+def test_small_data_is_not_compressed(key):
+    """data under COMPRESS_MIN_BYTES gets an envelope with CODEC_NONE"""
+    data = b"x" * (crypto.COMPRESS_MIN_BYTES - 1)
+    blob = crypto.encrypt_data(data, key)
+    assert blob[0] == crypto.ENVELOPE_VERSION
+    assert blob[1] == crypto.CODEC_NONE
+    assert key.decrypt(base64.urlsafe_b64encode(blob[2:])) == data
+    assert crypto.decrypt_data(blob, key) == data
+
+def test_big_data_is_compressed(key):
+    """data from COMPRESS_MIN_BYTES is compressed with zlib inside the token, and
+    the envelope is smaller than the data"""
+    for size in (crypto.COMPRESS_MIN_BYTES, crypto.FAST_COMPRESS_MIN_BYTES + 1):
+        data = b"a line of a journal that repeats\n" * (size // 33 + 1)
+        blob = crypto.encrypt_data(data, key)
+        assert blob[0] == crypto.ENVELOPE_VERSION
+        assert blob[1] == crypto.CODEC_ZLIB
+        assert len(blob) < len(data)
+        assert zlib.decompress(key.decrypt(base64.urlsafe_b64encode(blob[2:]))) == data
+        assert crypto.decrypt_data(blob, key) == data
+
+def test_incompressible_data_is_not_compressed(key):
+    """data that zlib makes bigger is stored as it is"""
+    data = os.urandom(1000)
+    blob = crypto.encrypt_data(data, key)
+    assert blob[1] == crypto.CODEC_NONE
+    assert crypto.decrypt_data(blob, key) == data
+
+def test_unknown_envelope_is_rejected(key):
+    """a version byte that is not the envelope one and not the start of a token, or
+    a codec this version does not know, fail instead of returning garbage"""
+    blob = crypto.encrypt_data(b"y" * 1000, key)
+    with pytest.raises(ValueError, match="version"):
+        crypto.decrypt_data(bytes((crypto.ENVELOPE_VERSION + 1,)) + blob[1:], key)
+    with pytest.raises(ValueError, match="version"):
+        crypto.rotate_data(bytes((crypto.ENVELOPE_VERSION + 1,)) + blob[1:],
+                           crypto.RotatingKey(crypto.UserKey(Fernet.generate_key()),
+                                              crypto.UserKey(Fernet.generate_key())))
+    with pytest.raises(ValueError, match="codec"):
+        crypto.decrypt_data(bytes((crypto.ENVELOPE_VERSION, 7)) + blob[2:], key)
+
+def test_rotate_keeps_the_format():
+    """a blob encrypted again with a new key keeps its envelope and its codec, and a
+    legacy token stays a legacy token"""
+    new_key = crypto.UserKey(Fernet.generate_key())
+    old_key = crypto.UserKey(Fernet.generate_key())
+    rotating_key = crypto.RotatingKey(new_key, old_key)
+    data = b"z" * 1000
+    blob = crypto.encrypt_data(data, old_key)
+    rotated = crypto.rotate_data(blob, rotating_key)
+    assert rotated[:2] == blob[:2]
+    assert crypto.decrypt_data(rotated, new_key) == data
+    token = old_key.encrypt(data)
+    assert crypto.decrypt_data(crypto.rotate_data(token, rotating_key), new_key) == data
+    assert crypto.rotate_data(token, rotating_key)[:1] == b"g"
@@ -0,0 +1,75 @@
+"""
+Application: Maitenotas
+Made by Taksan Tong
+https://github.com/maitelab/maitenotas
+
+Key derivation: a diary of an older version, whose key is derived with the password
+as salt, is moved to a random salt and calibrated iterations stored in the diary,
+and from then on only the stored parameters open it """
+from typing import Iterator
+
+import pytest
+from cryptography.fernet import InvalidToken
+from conftest import PASSWORD, journal_texts
+
+import maitenotas_cli
+import storage
+from crypto import KdfParameters, UserKey, calibrate_iterations, decrypt_data,\
+    derive_user_key, legacy_kdf_parameters, new_kdf_parameters, MIN_ITERATIONS
+
+SQL_WRITE_LEGACY_JOURNAL = "update journal set journal_name=?, journal_text=? where id=?"
+
+@pytest.fixture(name="legacy_key")
+def fixture_legacy_key() -> UserKey:
+    """key derived the way older versions did"""
+    return derive_user_key(PASSWORD, legacy_kdf_parameters(PASSWORD))
+
+@pytest.fixture(name="legacy_diary")
+def fixture_legacy_diary(tmp_path, legacy_key: UserKey) -> Iterator[storage.StorageSession]:
+    """a diary without stored parameters or search index, with a journal written as
+    plain Fernet tokens like every row of older versions"""
+    session = storage.StorageSession(str(tmp_path / "legacy.data"))
+    assert session.create_database(legacy_key, PASSWORD)
+    assert session.create_book(legacy_key, "journals") == storage.USER_BOOK_ID
+    session.create_journal(legacy_key, storage.USER_BOOK_ID, 0, "new format", "a new text")
+    journal_id = session.create_journal(legacy_key, storage.USER_BOOK_ID, 0, "", "")
+    with session.transaction() as cur:
+        cur.execute(SQL_WRITE_LEGACY_JOURNAL,
+                    (legacy_key.encrypt("old format".encode(encoding='UTF-8')),
+                     legacy_key.encrypt("an old text".encode(encoding='UTF-8')), journal_id))
+        # older versions had no search index, it is built by the first search
+        cur.execute("delete from search_index")
+        cur.execute(storage.SQL_DELETE_METADATA, (storage.METADATA_SEARCH_INDEX_READY,))
+        cur.execute(storage.SQL_DELETE_METADATA, (storage.METADATA_SEARCH_KEY,))
+    session.cache.clear()
+    session.close()
+    yield session
+    session.close()
+
+def test_legacy_diary_is_upgraded(legacy_diary, legacy_key):
+    """the legacy key opens the diary, the upgrade stores new parameters, the diary
+    opens with them and keeps every text, and the legacy key no longer opens it"""
+    database_key = storage.DatabaseKey(legacy_diary)
+    assert database_key.read_kdf_parameters() is None
+    user_key = maitenotas_cli.unlock_database(legacy_diary, PASSWORD)
+    texts = journal_texts(legacy_diary, user_key)
+    assert texts == {"new format": "a new text", "old format": "an old text"}
+    iterations = calibrate_iterations(0.01)
+    assert iterations >= MIN_ITERATIONS and iterations % 1000 == 0
+    kdf_parameters = new_kdf_parameters(iterations)
+    new_key = derive_user_key(PASSWORD, kdf_parameters)
+    assert database_key.change_user_key(user_key, new_key, kdf_parameters)
+    legacy_diary.close()
+    stored_parameters = database_key.read_kdf_parameters()
+    assert stored_parameters == kdf_parameters
+    assert isinstance(stored_parameters, KdfParameters)
+    assert stored_parameters.salt != PASSWORD.encode(encoding='UTF-8')
+    reopened_key = maitenotas_cli.unlock_database(legacy_diary, PASSWORD)
+    assert reopened_key.key == new_key.key
+    legacy_diary.cache.clear()
+    assert journal_texts(legacy_diary, reopened_key) == texts
+    assert legacy_diary.search_journals(reopened_key, "old text")
+    assert not database_key.verify_database_password(legacy_key, PASSWORD)
+    for (journal_text,) in legacy_diary.fetch_all("select journal_text from journal"):
+        with pytest.raises(InvalidToken):
+            decrypt_data(journal_text, legacy_key)
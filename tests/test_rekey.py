@@ -0,0 +1,97 @@
+"""
+Application: Maitenotas
+Made by Taksan Tong
+https://github.com/maitelab/maitenotas
+
+Change of password: a change interrupted between two batches leaves a diary that
+opens with the new password, and resuming it finishes with every row readable """
+from typing import Tuple
+
+import pytest
+from conftest import journal_texts, PASSWORD, TEST_ITERATIONS
+
+import maitenotas_cli
+import storage
+from crypto import RotatingKey, UserKey, derive_user_key, new_kdf_parameters
+
+NEW_PASSWORD = "new password"
+
+class Interrupted(Exception):
+    """stops a change of password between two batches"""
+
+@pytest.fixture(name="texts")
+def fixture_texts(diary: storage.StorageSession, user_key, monkeypatch):
+    """journals spread over many small batches"""
+    monkeypatch.setattr(storage, "REKEY_BATCH_ROWS", 3)
+    for number in range(20):
+        diary.create_journal(user_key, storage.USER_BOOK_ID, 0, f"journal {number}",
+                             f"text of journal {number}")
+    diary.create_journal(user_key, storage.USER_BOOK_ID, 0, "big",
+                         "".join(f"line {number} of a big text\n" for number in range(20000)))
+    return journal_texts(diary, user_key)
+
+def start_change(diary: storage.StorageSession, user_key) -> Tuple[RotatingKey, UserKey]:
+    """start moving the diary to a key of NEW_PASSWORD"""
+    kdf_parameters = new_kdf_parameters(TEST_ITERATIONS)
+    new_key = derive_user_key(NEW_PASSWORD, kdf_parameters)
+    rotating_key = storage.DatabaseKey(diary).start_user_key_change(user_key, new_key,
+                                                                    kdf_parameters,
+                                                                    NEW_PASSWORD)
+    assert rotating_key is not None
+    return rotating_key, new_key
+
+def test_interrupted_change_resumes(diary, user_key, texts):
+    """the diary opened again after an interruption reads both keys, and the
+    change finishes from where it stopped"""
+    rotating_key, new_key = start_change(diary, user_key)
+    database_key = storage.DatabaseKey(diary)
+    interrupted = []
+    def interrupt_after_first_batch(done: int, rows: int) -> None:
+        interrupted.append((done, rows))
+        raise Interrupted(f"{done}/{rows}")
+    assert not database_key.resume_user_key_change(rotating_key, interrupt_after_first_batch)
+    diary.close()
+    assert database_key.verify_database_password(new_key, NEW_PASSWORD)
+    pending_key = database_key.pending_user_key(new_key)
+    assert isinstance(pending_key, RotatingKey)
+    assert journal_texts(diary, pending_key) == texts
+    progress = []
+    assert database_key.resume_user_key_change(
+        pending_key, lambda done, rows: progress.append((done, rows)))
+    # only the rows left are encrypted again
+    done, rows = interrupted[0]
+    assert progress[-1] == (rows - done, rows - done)
+    diary.close()
+    assert database_key.pending_user_key(new_key) is new_key
+    assert journal_texts(diary, new_key) == texts
+    assert not database_key.verify_database_password(user_key, NEW_PASSWORD)
+
+def test_finished_change_needs_no_resume(diary, user_key, texts):
+    """a change that was not interrupted leaves nothing to resume"""
+    rotating_key, new_key = start_change(diary, user_key)
+    database_key = storage.DatabaseKey(diary)
+    assert database_key.resume_user_key_change(rotating_key)
+    assert database_key.pending_user_key(new_key) is new_key
+    assert database_key.resume_user_key_change(rotating_key)
+    diary.close()
+    assert journal_texts(diary, new_key) == texts
+
+def test_progress_is_shown_once_per_batch(diary, user_key, texts, monkeypatch, capsys):
+    """progress grows with every batch, the tables with no rows left add nothing,
+    and the command line ends the progress line once"""
+    progress = []
+    rotating_key, new_key = start_change(diary, user_key)
+    assert storage.DatabaseKey(diary).resume_user_key_change(
+        rotating_key, lambda done, rows: progress.append((done, rows)))
+    assert [done for done, _ in progress] == sorted({done for done, _ in progress})
+    rows = progress[-1][1]
+    assert progress[-1] == (rows, rows)
+    diary.close()
+    assert journal_texts(diary, new_key) == texts
+    diary.close()
+    monkeypatch.setenv(maitenotas_cli.PASSWORD_VARIABLE, NEW_PASSWORD)
+    monkeypatch.setenv(maitenotas_cli.NEW_PASSWORD_VARIABLE, PASSWORD)
+    assert maitenotas_cli.main(["rekey", "--database", diary.dbfile]) == 0
+    shown = capsys.readouterr().err
+    assert shown.count("\n") == 1
+    assert shown.endswith(f"\r{rows}/{rows} rows\n")
@@ -0,0 +1,80 @@
+"""
+Application: Maitenotas
+Made by Taksan Tong
+https://github.com/maitelab/maitenotas
+
+Revisions stored as reverse deltas: every older text is rebuilt from the current
+one, small edits are kept as small deltas and long chains get a snapshot """
+import random
+
+import revisions
+import storage
+
+def edited_texts(count: int):
+    """a text of many lines and count versions of it, each one with a line changed"""
+    rng = random.Random(7)
+    lines = [f"line {number} of the journal\n" for number in range(300)]
+    texts = ["".join(lines)]
+    for version in range(count):
+        lines[rng.randrange(len(lines))] = f"line changed by edit {version}\n"
+        texts.append("".join(lines))
+    return texts
+
+def test_delta_gives_back_the_source():
+    """the delta kept with a revision turns the new text back into the old one"""
+    for old_text, new_text in (("", "new text"), ("old text", ""),
+                               ("abc\ndef\n", "abc\nxyz\n"), ("same", "same"),
+                               ("a\nb\nc\n" * 50, "a\nc\n" * 50)):
+        assert revisions.apply_delta(new_text, revisions.make_delta(new_text, old_text)) == \
+            old_text
+
+def test_every_revision_is_rebuilt(diary, user_key):
+    """each text replaced by an edit is a revision, newest first"""
+    texts = edited_texts(12)
+    journal_id = diary.create_journal(user_key, storage.USER_BOOK_ID, 0, "edited", texts[0])
+    for text in texts[1:]:
+        diary.update_journal_text(user_key, journal_id, text)
+    history = storage.RevisionHistory(diary)
+    revision_list = history.list_revisions(journal_id)
+    assert len(revision_list) == len(texts) - 1
+    diary.cache.clear()
+    for (revision, _, _, _), old_text in zip(revision_list, reversed(texts[:-1])):
+        assert history.get_revision_text(user_key, journal_id, revision) == old_text
+
+def test_small_edits_are_small_deltas(diary, user_key):
+    """an edit of one line is stored as a delta much smaller than the text"""
+    texts = edited_texts(5)
+    journal_id = diary.create_journal(user_key, storage.USER_BOOK_ID, 0, "edited", texts[0])
+    for text in texts[1:]:
+        diary.update_journal_text(user_key, journal_id, text)
+    revision_list = storage.RevisionHistory(diary).list_revisions(journal_id)
+    for _, _, kind, stored_bytes in revision_list:
+        assert kind == revisions.REVISION_DELTA
+        assert stored_bytes < len(texts[0]) // 10
+
+def test_long_chains_get_snapshots(diary, user_key):
+    """texts rewritten whole make the chain grow fast, some revisions are stored
+    whole so rebuilding one never reads more than a few copies of the text"""
+    rng = random.Random(11)
+    texts = ["".join(f"{rng.random()}\n" for _ in range(200)) for _ in range(10)]
+    journal_id = diary.create_journal(user_key, storage.USER_BOOK_ID, 0, "rewritten", texts[0])
+    for text in texts[1:]:
+        diary.update_journal_text(user_key, journal_id, text)
+    history = storage.RevisionHistory(diary)
+    revision_list = history.list_revisions(journal_id)
+    assert revisions.REVISION_SNAPSHOT in [kind for _, _, kind, _ in revision_list]
+    for (revision, _, _, _), old_text in zip(revision_list, reversed(texts[:-1])):
+        assert history.get_revision_text(user_key, journal_id, revision) == old_text
+
+def test_restore_can_be_undone(diary, user_key):
+    """restoring a revision keeps the replaced text as the newest revision"""
+    texts = edited_texts(3)
+    journal_id = diary.create_journal(user_key, storage.USER_BOOK_ID, 0, "edited", texts[0])
+    for text in texts[1:]:
+        diary.update_journal_text(user_key, journal_id, text)
+    history = storage.RevisionHistory(diary)
+    oldest = history.list_revisions(journal_id)[-1][0]
+    assert history.restore_revision(user_key, journal_id, oldest) == texts[0]
+    assert diary.get_journal_text(user_key, journal_id) == texts[0]
+    newest = history.list_revisions(journal_id)[0][0]
+    assert history.get_revision_text(user_key, journal_id, newest) == texts[-1]
@@ -0,0 +1,119 @@
+"""
+Application: Maitenotas
+Made by Taksan Tong
+https://github.com/maitelab/maitenotas
+
+Storage worker: calls run in order, a call replaced by a newer one with the same
+coalesce key never runs and its future gets the newer result, and stop runs the
+calls still queued without delivering their callbacks """
+import threading
+import time
+from typing import Any, Callable, Iterator, List, Tuple
+
+import pytest
+
+from storageworker import StorageWorker
+
+class Deliveries:
+    """deliver function that records the callbacks called and their results"""
+    def __init__(self) -> None:
+        self.delivered: List[Tuple[str, Any]] = []
+
+    def __call__(self, callback: Callable[[Any], None], result: Any) -> None:
+        callback(result)
+
+    def callback(self, name: str) -> Callable[[Any], None]:
+        """a callback that records its name and the result"""
+        return lambda result: self.delivered.append((name, result))
+
+@pytest.fixture(name="deliveries")
+def fixture_deliveries() -> Deliveries:
+    """callbacks delivered in the worker thread"""
+    return Deliveries()
+
+@pytest.fixture(name="worker")
+def fixture_worker(deliveries: Deliveries) -> Iterator[StorageWorker]:
+    """a running worker"""
+    worker = StorageWorker(deliveries)
+    yield worker
+    if worker.worker.is_alive():
+        worker.stop()
+
+def hold(worker: StorageWorker) -> threading.Event:
+    """keep the worker busy until the event returned is set"""
+    started = threading.Event()
+    release = threading.Event()
+    def held_call() -> None:
+        started.set()
+        release.wait(5)
+    worker.submit(held_call)
+    assert started.wait(5)
+    return release
+
+def recorded(calls: List[Any], value: Any) -> Callable[[], Any]:
+    """a call that records value when it runs and returns it"""
+    def call() -> Any:
+        calls.append(value)
+        return value
+    return call
+
+def test_calls_run_in_order(worker, deliveries) -> None:
+    """every call runs once, in the order submitted, and its callback gets the result"""
+    calls: List[Any] = []
+    futures = [worker.submit(recorded(calls, number),
+                             deliveries.callback(f"call {number}")) for number in range(5)]
+    worker.flush()
+    assert calls == list(range(5))
+    assert [future.result(5) for future in futures] == list(range(5))
+    assert deliveries.delivered == [(f"call {number}", number) for number in range(5)]
+
+def test_coalesced_call_gets_the_newer_result(worker, deliveries) -> None:
+    """a queued call replaced by a newer one never runs, its future gets the newer
+    result and only the callback of the newer one is delivered"""
+    release = hold(worker)
+    calls: List[Any] = []
+    older = worker.submit(recorded(calls, "older result"),
+                          deliveries.callback("older"), coalesce_key="flush")
+    other = worker.submit(recorded(calls, "other result"),
+                          deliveries.callback("other"))
+    newer = worker.submit(recorded(calls, "newer result"),
+                          deliveries.callback("newer"), coalesce_key="flush")
+    release.set()
+    worker.flush()
+    assert calls == ["other result", "newer result"]
+    assert older.result(5) == newer.result(5) == "newer result"
+    assert other.result(5) == "other result"
+    assert deliveries.delivered == [("other", "other result"), ("newer", "newer result")]
+    assert worker.statistics()["coalesced"] == 1
+
+def test_failed_call_sets_the_exception(worker, deliveries) -> None:
+    """a call that raises fails its future, skips its callback and the next calls run"""
+    def broken() -> None:
+        raise ValueError("broken call")
+    failed = worker.submit(broken, deliveries.callback("broken"))
+    after = worker.submit(lambda: "after", deliveries.callback("after"))
+    assert after.result(5) == "after"
+    with pytest.raises(ValueError):
+        failed.result(5)
+    assert deliveries.delivered == [("after", "after")]
+    assert worker.statistics()["failed"] == 1
+
+def test_stop_runs_the_queued_calls(worker, deliveries) -> None:
+    """the writes queued when stop is called still run, their callbacks are not
+    delivered, and nothing is accepted afterwards"""
+    release = hold(worker)
+    written: List[Any] = []
+    futures = [worker.submit(recorded(written, number),
+                             deliveries.callback(f"write {number}")) for number in range(3)]
+    stopper = threading.Thread(target=worker.stop)
+    stopper.start()
+    while worker.running:
+        time.sleep(0.01)
+    release.set()
+    stopper.join(5)
+    assert not worker.worker.is_alive()
+    assert written == [0, 1, 2]
+    assert all(future.done() for future in futures)
+    assert not deliveries.delivered
+    with pytest.raises(RuntimeError):
+        worker.submit(lambda: None)
@@ -0,0 +1,115 @@
+"""
+Application: Maitenotas
+Made by Taksan Tong
+https://github.com/maitelab/maitenotas
+
+Sync of two copies of a diary: changes made on both sides, a deletion against an
+edit, two changes with the same stamp and a second sync with nothing to send """
+import shutil
+import sqlite3
+from typing import Iterator, Tuple
+
+import pytest
+from conftest import journal_texts
+
+import storage
+
+@pytest.fixture(name="copies")
+def fixture_copies(diary: storage.StorageSession, user_key,
+                   tmp_path) -> Iterator[Tuple[storage.StorageSession, storage.StorageSession]]:
+    """the diary with two journals and a copy of its file"""
+    diary.create_journal(user_key, storage.USER_BOOK_ID, 0, "first", "first text")
+    diary.create_journal(user_key, storage.USER_BOOK_ID, 0, "second", "second text")
+    diary.close()
+    other_file = str(tmp_path / "copy.data")
+    shutil.copyfile(diary.dbfile, other_file)
+    other = storage.StorageSession(other_file)
+    yield diary, other
+    other.close()
+
+def journal_id(session: storage.StorageSession, user_key, journal_name: str) -> int:
+    """id of a journal of the user book by name"""
+    for _, leaf_id, leaf_name in session.tree.get_tree_leafs(user_key):
+        if leaf_name == journal_name:
+            return leaf_id
+    raise KeyError(journal_name)
+
+def set_modified(session: storage.StorageSession, journal_name: str, user_key,
+                 modified: int) -> None:
+    """give a journal the change time of a stamp, like a change made at that time"""
+    leaf_id = journal_id(session, user_key, journal_name)
+    session.close()
+    conn = sqlite3.connect(session.dbfile)
+    try:
+        conn.execute("update journal set modified=? where id=?", (modified, leaf_id))
+        conn.commit()
+    finally:
+        conn.close()
+
+def test_changes_of_both_sides_meet(copies, user_key):
+    """each copy gets the journal changed in the other one"""
+    diary, other = copies
+    diary.update_journal_text(user_key, journal_id(diary, user_key, "first"), "first, edited")
+    other.update_journal_text(user_key, journal_id(other, user_key, "second"),
+                              "second, edited")
+    other.create_journal(user_key, storage.USER_BOOK_ID, 0, "third", "third text")
+    result = storage.sync_sessions(diary, other, user_key)
+    # the rows both copies had before are sent too the first time, and ignored
+    assert result is not None and (result["received"], result["sent"]) == (2, 1)
+    expected = {"first": "first, edited", "second": "second, edited", "third": "third text"}
+    assert journal_texts(diary, user_key) == expected
+    assert journal_texts(other, user_key) == expected
+
+def test_newest_edit_of_a_journal_wins(copies, user_key):
+    """the same journal changed in both copies keeps the latest text in both"""
+    diary, other = copies
+    diary.update_journal_text(user_key, journal_id(diary, user_key, "first"), "older")
+    other.update_journal_text(user_key, journal_id(other, user_key, "first"), "newer")
+    set_modified(diary, "first", user_key, 1000)
+    set_modified(other, "first", user_key, 2000)
+    assert storage.sync_sessions(diary, other, user_key) is not None
+    assert journal_texts(diary, user_key)["first"] == "newer"
+    assert journal_texts(other, user_key)["first"] == "newer"
+
+def test_delete_newer_than_edit(copies, user_key):
+    """a journal deleted after the other copy edited it stays deleted"""
+    diary, other = copies
+    other.update_journal_text(user_key, journal_id(other, user_key, "first"), "edited")
+    set_modified(other, "first", user_key, 1000)
+    diary.delete_journal(journal_id(diary, user_key, "first"))
+    assert storage.sync_sessions(diary, other, user_key) is not None
+    assert "first" not in journal_texts(diary, user_key)
+    assert "first" not in journal_texts(other, user_key)
+
+def test_edit_newer_than_delete(copies, user_key):
+    """a journal edited after the other copy deleted it comes back"""
+    diary, other = copies
+    diary.delete_journal(journal_id(diary, user_key, "first"))
+    other.update_journal_text(user_key, journal_id(other, user_key, "first"), "edited")
+    set_modified(other, "first", user_key, 2 ** 50)
+    assert storage.sync_sessions(diary, other, user_key) is not None
+    assert journal_texts(diary, user_key)["first"] == "edited"
+    assert journal_texts(other, user_key)["first"] == "edited"
+
+def test_changes_with_the_same_stamp_converge(copies, user_key):
+    """copies of one file share their replica id, two edits made in the same
+    millisecond have the same stamp and both copies must keep the same one"""
+    diary, other = copies
+    diary.update_journal_text(user_key, journal_id(diary, user_key, "first"), "from diary")
+    other.update_journal_text(user_key, journal_id(other, user_key, "first"), "from copy")
+    set_modified(diary, "first", user_key, 5000)
+    set_modified(other, "first", user_key, 5000)
+    assert storage.sync_sessions(diary, other, user_key) is not None
+    assert journal_texts(diary, user_key) == journal_texts(other, user_key)
+    assert journal_texts(diary, user_key)["first"] in ("from diary", "from copy")
+
+def test_second_sync_has_nothing_to_send(copies, user_key):
+    """a sync right after another one changes nothing"""
+    diary, other = copies
+    diary.update_journal_text(user_key, journal_id(diary, user_key, "first"), "edited")
+    other.delete_journal(journal_id(other, user_key, "second"))
+    assert storage.sync_sessions(diary, other, user_key) is not None
+    texts = journal_texts(diary, user_key)
+    assert storage.sync_sessions(diary, other, user_key) == \
+        {"received": 0, "sent": 0, "ignored": 0}
+    assert journal_texts(diary, user_key) == texts == journal_texts(other, user_key)
@@ -0,0 +1,124 @@
+"""
+Application: Maitenotas
+Made by Taksan Tong
+https://github.com/maitelab/maitenotas
+
+Text loader: the pieces of a text are handed over in order and a few at a time, and
+a load that is cancelled or replaced by a newer one hands over nothing more """
+import threading
+import time
+from typing import Iterator, List, Tuple
+
+import pytest
+
+import textloader
+from textloader import TextLoader
+
+TEXTS = {1: ["one ", "two ", "three"], 2: ["other"], 3: [], 4: [f"{n} " for n in range(20)]}
+
+class Receiver:
+    """deliver function that records the pieces, acknowledging them unless told not to"""
+    def __init__(self) -> None:
+        self.loader: TextLoader
+        self.pieces: List[Tuple[int, int, str, bool]] = []
+        self.acknowledging = True
+        self.finished = threading.Event()
+
+    def __call__(self, generation: int, journal_id: int, piece: str, finished: bool) -> None:
+        self.pieces.append((generation, journal_id, piece, finished))
+        if self.acknowledging:
+            self.loader.acknowledge(generation)
+        if finished:
+            self.finished.set()
+
+    def text(self, generation: int) -> str:
+        """pieces handed over for a load, joined"""
+        return "".join(piece for piece_generation, _, piece, _ in self.pieces
+                       if piece_generation == generation)
+
+class Reader:
+    """read function over TEXTS that waits for gate before its first piece"""
+    def __init__(self) -> None:
+        self.gate = threading.Event()
+        self.gate.set()
+        self.reading = threading.Event()
+
+    def __call__(self, journal_id: int) -> Iterator[str]:
+        self.reading.set()
+        self.gate.wait(5)
+        yield from TEXTS[journal_id]
+
+@pytest.fixture(name="reader")
+def fixture_reader() -> Reader:
+    """a read function that does not wait"""
+    return Reader()
+
+@pytest.fixture(name="receiver")
+def fixture_receiver(reader: Reader) -> Iterator[Receiver]:
+    """a receiver with its loader, stopped at the end"""
+    receiver = Receiver()
+    receiver.loader = TextLoader(reader, receiver)
+    yield receiver
+    reader.gate.set()
+    receiver.loader.stop()
+
+def wait_for(condition) -> None:
+    """wait until condition() is true, at most a few seconds"""
+    deadline = time.monotonic() + 5
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert condition()
+
+def test_pieces_arrive_in_order(receiver) -> None:
+    """the pieces of a text are handed over in order, the last one finishes it"""
+    generation = receiver.loader.load(1)
+    assert receiver.finished.wait(5)
+    assert receiver.pieces == [(generation, 1, "one ", False), (generation, 1, "two ", False),
+                               (generation, 1, "three", True)]
+
+def test_empty_text_is_one_finished_piece(receiver) -> None:
+    """a text without pieces is handed over as an empty finished piece"""
+    generation = receiver.loader.load(3)
+    assert receiver.finished.wait(5)
+    assert receiver.pieces == [(generation, 3, "", True)]
+
+def test_cancelled_load_hands_over_nothing(receiver, reader) -> None:
+    """pieces read after cancel are not handed over, the next load is"""
+    reader.gate.clear()
+    receiver.loader.load(1)
+    assert reader.reading.wait(5)
+    receiver.loader.cancel()
+    reader.gate.set()
+    generation = receiver.loader.load(2)
+    assert receiver.finished.wait(5)
+    assert receiver.pieces == [(generation, 2, "other", True)]
+
+def test_pieces_wait_for_the_receiver(receiver, monkeypatch) -> None:
+    """without acknowledgements only MAX_PIECES_IN_FLIGHT pieces are handed over, a
+    newer load drops the rest of the text"""
+    monkeypatch.setattr(textloader, "MAX_PIECES_IN_FLIGHT", 2)
+    receiver.acknowledging = False
+    first = receiver.loader.load(4)
+    wait_for(lambda: len(receiver.pieces) == 2)
+    time.sleep(0.05)
+    assert len(receiver.pieces) == 2
+    receiver.acknowledging = True
+    second = receiver.loader.load(1)
+    assert receiver.finished.wait(5)
+    assert receiver.text(first) == "0 1 "
+    assert receiver.text(second) == "one two three"
+    assert not receiver.loader.is_current(first)
+    assert receiver.loader.is_current(second)
+
+def test_stop_ends_the_worker(receiver, reader) -> None:
+    """stop cancels the text being read and the worker ends"""
+    reader.gate.clear()
+    receiver.loader.load(1)
+    assert reader.reading.wait(5)
+    stopper = threading.Thread(target=receiver.loader.stop)
+    stopper.start()
+    wait_for(lambda: not receiver.loader.running)
+    reader.gate.set()
+    stopper.join(5)
+    assert not receiver.loader.worker.is_alive()
+    assert not receiver.pieces
@@ -0,0 +1,147 @@
+"""
+Application: Maitenotas
+Made by Taksan Tong
+https://github.com/maitelab/maitenotas
+
+Title index of the quick switcher: prefixes and mistyped words find the journals,
+and an index changed by adds, renames and removals of subtrees is the same as an
+index built from scratch with the journals left """
+import random
+from typing import Dict, List, Tuple
+
+import titleindex
+
+WORDS = ["canción", "cancion", "viaje", "viajes", "notas", "nota", "diario", "día", "a",
+         "ideas", "idea", "trabajo", "casa", "cosas", "2023", "x"]
+
+Leafs = Dict[int, Tuple[int, str]]
+
+def built_from(leafs: Leafs) -> titleindex.TitleIndex:
+    """index of the journals of leafs built in one go"""
+    return titleindex.TitleIndex((parent_id, journal_id, journal_name)
+                                 for journal_id, (parent_id, journal_name) in leafs.items())
+
+def assert_same_as_built(index: titleindex.TitleIndex, leafs: Leafs) -> None:
+    """the arrays, maps and trigram index are the ones of an index built from leafs"""
+    expected = built_from(leafs)
+    assert index.entry_words == expected.entry_words
+    assert index.entry_ids == expected.entry_ids
+    assert list(zip(index.entry_words, index.entry_ids)) == \
+        sorted(zip(index.entry_words, index.entry_ids))
+    assert index.names == expected.names
+    assert index.keys == expected.keys
+    assert index.parents == expected.parents
+    assert index.lengths == expected.lengths
+    assert index.word_postings == expected.word_postings
+
+def random_name(rng: random.Random) -> str:
+    """a name of one to four words, some of them shared with other names"""
+    return " ".join(rng.choice(WORDS).capitalize() if rng.random() < 0.3 else rng.choice(WORDS)
+                    for _ in range(rng.randint(1, 4)))
+
+def random_tree(rng: random.Random, count: int) -> Leafs:
+    """count journals, each under an earlier one or at the top"""
+    leafs: Leafs = {}
+    for journal_id in range(1, count + 1):
+        parent_id = rng.choice([0, *leafs]) if leafs else 0
+        leafs[journal_id] = (parent_id, random_name(rng))
+    return leafs
+
+def subtree(leafs: Leafs, journal_id: int) -> List[int]:
+    """journal_id and every journal under it"""
+    journal_ids = [journal_id]
+    for current in journal_ids:
+        journal_ids.extend(child_id for child_id, (parent_id, _) in leafs.items()
+                           if parent_id == current)
+    return journal_ids
+
+def test_prefix_finds_the_journals() -> None:
+    """every word of the query starts a word of the name, accents and case do not
+    count, and the names starting with the query come first"""
+    index = built_from({1: (0, "Canción de viaje"), 2: (0, "Viaje a la costa"),
+                        3: (2, "Notas del viaje"), 4: (0, "Cancelado"), 5: (0, "Viajes")})
+    assert [journal_id for journal_id, _, _ in index.find("via", 10)] == [5, 2, 3, 1]
+    assert [journal_id for journal_id, _, _ in index.find("CANC", 10)] == [4, 1]
+    assert index.find("cancion viaj", 10) == [(1, "Canción de viaje", "Canción de viaje")]
+    assert index.find("notas", 10) == [(3, "Notas del viaje",
+                                        "Viaje a la costa / Notas del viaje")]
+    assert index.find("viaje", 2) == [(5, "Viajes", "Viajes"),
+                                      (2, "Viaje a la costa", "Viaje a la costa")]
+    assert not index.find("cancion costa", 10)
+
+def test_mistyped_word_finds_similar_words() -> None:
+    """a word that starts no word is replaced by the words sharing its trigrams"""
+    index = built_from({1: (0, "Canción de viaje"), 2: (0, "Trabajo"), 3: (0, "Ideas")})
+    assert [journal_id for journal_id, _, _ in index.find("cancoin", 10)] == [1]
+    assert [journal_id for journal_id, _, _ in index.find("trabjo", 10)] == [2]
+    assert not index.find("zzzz", 10)
+
+def test_added_titles_are_the_built_index() -> None:
+    """journals added one by one in any order give the index built in one go"""
+    rng = random.Random(5)
+    leafs = random_tree(rng, 200)
+    index = built_from({})
+    journal_ids = list(leafs)
+    rng.shuffle(journal_ids)
+    added: Leafs = {}
+    for journal_id in journal_ids:
+        index.add_title(leafs[journal_id][0], journal_id, leafs[journal_id][1])
+        added[journal_id] = leafs[journal_id]
+    assert_same_as_built(index, added)
+
+def test_renamed_titles_are_the_built_index() -> None:
+    """a rename keeps the parent and moves the entries of the words"""
+    rng = random.Random(6)
+    leafs = random_tree(rng, 150)
+    index = built_from(leafs)
+    for journal_id in rng.sample(list(leafs), 60):
+        new_name = random_name(rng)
+        index.rename_title(journal_id, new_name)
+        leafs[journal_id] = (leafs[journal_id][0], new_name)
+        assert_same_as_built(index, leafs)
+    index.rename_title(10 ** 6, "not in the index")
+    assert_same_as_built(index, leafs)
+    index.rename_title(1, "Nuevo nombre único")
+    assert [journal_id for journal_id, _, _ in index.find("unico", 10)] == [1]
+
+def remove_subtrees(leafs: Leafs, index: titleindex.TitleIndex, bulk: bool,
+                    rng: random.Random) -> None:
+    """remove subtrees of the size asked until the tree is empty, checking the index
+    after every removal"""
+    while leafs:
+        candidates = [(len(subtree(leafs, journal_id)), journal_id) for journal_id in leafs]
+        if bulk:
+            big_ones = [journal_id for size, journal_id in candidates
+                        if size >= titleindex.BULK_REMOVE_TITLES]
+            if not big_ones:
+                return
+            journal_ids = subtree(leafs, rng.choice(big_ones))
+        else:
+            journal_ids = subtree(leafs, rng.choice([journal_id for size, journal_id in
+                                                     candidates if size < 20]))
+        index.remove_titles(journal_ids)
+        for journal_id in journal_ids:
+            del leafs[journal_id]
+        assert_same_as_built(index, leafs)
+
+def test_small_subtrees_removed_are_the_built_index() -> None:
+    """subtrees removed one journal at a time"""
+    rng = random.Random(7)
+    leafs = random_tree(rng, 150)
+    index = built_from(leafs)
+    remove_subtrees(leafs, index, False, rng)
+    assert not index.entry_words and not index.word_postings
+
+def test_big_subtrees_removed_are_the_built_index() -> None:
+    """subtrees from BULK_REMOVE_TITLES journals removed in one pass, the journals
+    left keep their entries and the words no name has leave the trigram index"""
+    rng = random.Random(8)
+    leafs: Leafs = {journal_id: (0 if journal_id == 1 else rng.randint(1, journal_id - 1),
+                                 random_name(rng)) for journal_id in range(1, 400)}
+    leafs[400] = (0, "Palabra solitaria")
+    index = built_from(leafs)
+    count_before = len(leafs)
+    remove_subtrees(leafs, index, True, rng)
+    assert len(leafs) < count_before
+    index.remove_titles(list(leafs))
+    assert_same_as_built(index, {})
@@ -0,0 +1,128 @@
+"""
+Application: Maitenotas
+Made by Taksan Tong
+https://github.com/maitelab/maitenotas
+
+Export and import from the command line: an archive or a directory written by export
+gives the same tree back, and an import that fails adds nothing """
+from typing import Iterator
+
+import pytest
+from conftest import PASSWORD, journal_tree, new_diary
+
+import maitenotas_cli
+import storage
+import transfer
+from crypto import decode_kdf_parameters
+
+ARCHIVE_PASSWORD = "archive password"
+
+@pytest.fixture(name="other")
+def fixture_other(tmp_path, user_key, kdf_parameters) -> Iterator[storage.StorageSession]:
+    """a second diary with the same password, where the journals are imported"""
+    session = new_diary(str(tmp_path / "other.data"), user_key, kdf_parameters)
+    session.create_journal(user_key, storage.USER_BOOK_ID, 0, "already there", "kept")
+    yield session
+    session.close()
+
+@pytest.fixture(name="passwords", autouse=True)
+def fixture_passwords(monkeypatch) -> None:
+    """the commands read the passwords from the environment"""
+    monkeypatch.setenv(maitenotas_cli.PASSWORD_VARIABLE, PASSWORD)
+    monkeypatch.setenv(maitenotas_cli.ARCHIVE_PASSWORD_VARIABLE, ARCHIVE_PASSWORD)
+
+def fill_diary(diary: storage.StorageSession, user_key) -> None:
+    """journals three levels deep, an empty one and a chunked one"""
+    first_id = diary.create_journal(user_key, storage.USER_BOOK_ID, 0, "first", "first text")
+    child_id = diary.create_journal(user_key, storage.USER_BOOK_ID, first_id, "child",
+                                    "child text\r\nwith two lines")
+    diary.create_journal(user_key, storage.USER_BOOK_ID, child_id, "grandchild", "deep")
+    diary.create_journal(user_key, storage.USER_BOOK_ID, 0, "empty", "")
+    diary.create_journal(user_key, storage.USER_BOOK_ID, 0, "big",
+                         "".join(f"line {number} of a big text\n" for number in range(20000)))
+    diary.close()
+
+def run_command(*argv: str) -> int:
+    """exit code of a command of maitenotas_cli"""
+    return maitenotas_cli.main(list(argv))
+
+@pytest.mark.parametrize("archive", [True, False])
+def test_export_then_import_gives_the_tree_back(diary, other, user_key, tmp_path, archive):
+    """the journals imported in another diary have the names, texts and parents
+    they had when they were exported"""
+    fill_diary(diary, user_key)
+    exported = journal_tree(diary, user_key)
+    before = journal_tree(other, user_key)
+    other.close()
+    destination = str(tmp_path / ("journals.archive" if archive else "journals"))
+    option = ["--archive"] if archive else []
+    assert run_command("export", "--database", diary.dbfile, destination, *option) == 0
+    assert run_command("import", "--database", other.dbfile, destination, *option) == 0
+    assert journal_tree(other, user_key) == sorted(before + exported)
+    assert other.search_journals(user_key, "grandchild")
+
+def test_import_under_a_journal(diary, other, user_key, tmp_path):
+    """--parent puts the top journals of the archive under a journal"""
+    fill_diary(diary, user_key)
+    parent_id = other.create_journal(user_key, storage.USER_BOOK_ID, 0, "imported", "")
+    other.close()
+    archive_file = str(tmp_path / "journals.archive")
+    assert run_command("export", "--database", diary.dbfile, "--archive", archive_file) == 0
+    assert run_command("import", "--database", other.dbfile, "--archive",
+                       "--parent", str(parent_id), archive_file) == 0
+    parents = {name: parent_name for parent_name, name, _ in journal_tree(other, user_key)}
+    assert parents["first"] == parents["empty"] == parents["big"] == "imported"
+    assert parents["grandchild"] == "child"
+
+def test_wrong_archive_password_adds_nothing(diary, other, user_key, tmp_path, monkeypatch):
+    """an archive opened with another password fails and the diary is not changed"""
+    fill_diary(diary, user_key)
+    before = journal_tree(other, user_key)
+    other.close()
+    archive_file = str(tmp_path / "journals.archive")
+    assert run_command("export", "--database", diary.dbfile, "--archive", archive_file) == 0
+    monkeypatch.setenv(maitenotas_cli.ARCHIVE_PASSWORD_VARIABLE, "wrong password")
+    assert run_command("import", "--database", other.dbfile, "--archive",
+                       archive_file) == maitenotas_cli.EXIT_ERROR
+    assert journal_tree(other, user_key) == before
+
+def test_truncated_archive_is_rolled_back(diary, other, user_key, tmp_path, monkeypatch):
+    """batches already inserted when the end of the archive is found missing are
+    rolled back with the rest"""
+    monkeypatch.setattr(transfer, "IMPORT_BATCH_SIZE", 2)
+    fill_diary(diary, user_key)
+    before = journal_tree(other, user_key)
+    archive_file = str(tmp_path / "journals.archive")
+    assert run_command("export", "--database", diary.dbfile, "--archive", archive_file) == 0
+    with open(archive_file, "rb") as archive:
+        archive_data = archive.read()
+    with open(archive_file, "wb") as archive:
+        archive.write(archive_data[:-10])
+    with pytest.raises(ValueError):
+        transfer.import_archive(other, user_key, storage.USER_BOOK_ID, 0, archive_file,
+                                archive_password=ARCHIVE_PASSWORD)
+    assert journal_tree(other, user_key) == before
+
+def archive_iterations(archive_file: str) -> int:
+    """iterations of the key of an archive"""
+    with open(archive_file, "rb") as archive:
+        archive.read(len(transfer.ARCHIVE_MAGIC))
+        parameters_data = transfer.read_record(archive)
+    assert parameters_data is not None
+    return decode_kdf_parameters(parameters_data).iterations
+
+def test_export_does_not_calibrate(diary, user_key, kdf_parameters, tmp_path, monkeypatch):
+    """the archive key takes the iterations of the diary, or the ones given"""
+    def no_calibration(*_) -> int:
+        raise AssertionError("calibrated on export")
+    monkeypatch.setattr(transfer, "calibrate_iterations", no_calibration)
+    fill_diary(diary, user_key)
+    archive_file = str(tmp_path / "journals.archive")
+    transfer.export_archive(diary, user_key, storage.USER_BOOK_ID, 0, archive_file,
+                            archive_password=ARCHIVE_PASSWORD)
+    assert archive_iterations(archive_file) == kdf_parameters.iterations
+    transfer.export_archive(diary, user_key, storage.USER_BOOK_ID, 0, archive_file,
+                            archive_password=ARCHIVE_PASSWORD, iterations=2000)
+    assert archive_iterations(archive_file) == 2000
+    assert transfer.import_archive(diary, user_key, storage.USER_BOOK_ID, 0, archive_file,
+                                   archive_password=ARCHIVE_PASSWORD) == 5
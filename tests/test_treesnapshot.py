@@ -0,0 +1,105 @@
+"""
+Application: Maitenotas
+Made by Taksan Tong
+https://github.com/maitelab/maitenotas
+
+Tree snapshot: the tree read from the snapshot follows the changes of the session,
+and a snapshot made stale by a sync, an import or another connection is not used """
+import shutil
+from typing import List
+
+import pytest
+
+import storage
+import transfer
+
+def children(session: storage.StorageSession, user_key, parent_id: int = 0) -> List[tuple]:
+    """children of a journal as the tree shows them"""
+    return session.tree.get_child_leafs(user_key, storage.USER_BOOK_ID, parent_id)
+
+def database_children(dbfile: str, user_key, parent_id: int = 0) -> List[tuple]:
+    """children of a journal read from the journal table by a new session"""
+    session = storage.StorageSession(dbfile)
+    try:
+        return children(session, user_key, parent_id)
+    finally:
+        session.close()
+
+@pytest.fixture(name="loaded")
+def fixture_loaded(diary: storage.StorageSession, user_key) -> storage.StorageSession:
+    """the diary with a few journals and its tree snapshot in memory"""
+    first_id = diary.create_journal(user_key, storage.USER_BOOK_ID, 0, "first", "")
+    diary.create_journal(user_key, storage.USER_BOOK_ID, first_id, "child", "")
+    diary.create_journal(user_key, storage.USER_BOOK_ID, 0, "second", "")
+    diary.tree.load_snapshot(user_key)
+    assert diary.tree.snapshot is not None
+    return diary
+
+def test_changes_of_the_session_keep_the_snapshot(loaded, user_key):
+    """created, renamed and deleted journals update the snapshot in memory"""
+    first_id = children(loaded, user_key)[0][0]
+    loaded.create_journal(user_key, storage.USER_BOOK_ID, first_id, "new child", "")
+    loaded.update_journal_name(user_key, first_id, "first, renamed")
+    second_id = [leaf[0] for leaf in children(loaded, user_key) if leaf[1] == "second"][0]
+    loaded.delete_journal(second_id)
+    assert loaded.tree.snapshot is not None
+    assert children(loaded, user_key) == database_children(loaded.dbfile, user_key)
+    assert children(loaded, user_key, first_id) == \
+        database_children(loaded.dbfile, user_key, first_id)
+    assert [leaf[1] for leaf in children(loaded, user_key)] == ["first, renamed"]
+
+def test_another_connection_makes_the_snapshot_stale(loaded, user_key):
+    """a journal created by another session on the same file is shown"""
+    other = storage.StorageSession(loaded.dbfile)
+    try:
+        other.create_journal(user_key, storage.USER_BOOK_ID, 0, "from elsewhere", "")
+    finally:
+        other.close()
+    assert "from elsewhere" in [leaf[1] for leaf in children(loaded, user_key)]
+    assert children(loaded, user_key) == database_children(loaded.dbfile, user_key)
+
+def test_sync_makes_the_snapshot_stale(loaded, user_key, tmp_path):
+    """journals received by a sync are shown, in memory and after a restart"""
+    loaded.close()
+    other_file = str(tmp_path / "copy.data")
+    shutil.copyfile(loaded.dbfile, other_file)
+    other = storage.StorageSession(other_file)
+    try:
+        other.create_journal(user_key, storage.USER_BOOK_ID, 0, "from the copy", "")
+        loaded.tree.load_snapshot(user_key)
+        assert storage.sync_sessions(loaded, other, user_key) is not None
+    finally:
+        other.close()
+    assert "from the copy" in [leaf[1] for leaf in children(loaded, user_key)]
+    loaded.close()
+    loaded.tree.load_snapshot(user_key)
+    assert children(loaded, user_key) == database_children(loaded.dbfile, user_key)
+
+def test_import_makes_the_snapshot_stale(loaded, user_key, tmp_path):
+    """journals added by an import are shown under their parent"""
+    directory = tmp_path / "import"
+    (directory / "imported").mkdir(parents=True)
+    (directory / "imported.md").write_text("parent text", encoding="UTF-8")
+    (directory / "imported" / "inside.txt").write_text("child text", encoding="UTF-8")
+    assert transfer.import_directory(loaded, user_key, storage.USER_BOOK_ID, 0,
+                                     str(directory)) == 2
+    imported = [leaf for leaf in children(loaded, user_key) if leaf[1] == "imported"]
+    assert imported and imported[0][2]
+    assert [leaf[1] for leaf in children(loaded, user_key, imported[0][0])] == ["inside"]
+
+def test_stale_stored_snapshot_is_rebuilt(loaded, user_key):
+    """a snapshot stored before another session changed the tree is not used on the
+    next start, the tree is read again and stored"""
+    loaded.tree.save_snapshot(user_key, [])
+    loaded.close()
+    other = storage.StorageSession(loaded.dbfile)
+    try:
+        first_id = children(other, user_key)[0][0]
+        other.create_journal(user_key, storage.USER_BOOK_ID, first_id, "late child", "")
+    finally:
+        other.close()
+    assert not loaded.tree.load_snapshot(user_key)
+    assert "late child" in [leaf[1] for leaf in children(loaded, user_key, first_id)]
+    loaded.close()
+    assert loaded.tree.load_snapshot(user_key)
+    assert "late child" in [leaf[1] for leaf in children(loaded, user_key, first_id)]
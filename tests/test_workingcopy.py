@@ -0,0 +1,111 @@
+"""
+Application: Maitenotas
+Made by Taksan Tong
+https://github.com/maitelab/maitenotas
+
+Working copy: while it holds the lock file no other session opens the diary, and a
+flush that fails leaves the diary file as it was and no temporary file behind """
+import os
+import sqlite3
+import threading
+
+import pytest
+
+import storage
+import workingcopy
+from workingcopy import DatabaseLockedError, WorkingCopy
+
+pytestmark = pytest.mark.skipif(workingcopy.fcntl is None and workingcopy.msvcrt is None,
+                                reason="no file locks on this system")
+
+@pytest.fixture(name="dbfile")
+def fixture_dbfile(diary: storage.StorageSession, user_key) -> str:
+    """file of a diary with a journal, closed"""
+    diary.create_journal(user_key, storage.USER_BOOK_ID, 0, "first", "first text")
+    diary.close()
+    return diary.dbfile
+
+def file_bytes(file_name: str) -> bytes:
+    """content of a file"""
+    with open(file_name, "rb") as read_file:
+        return read_file.read()
+
+def media_removed(*_) -> None:
+    """a write to the media that fails"""
+    raise OSError("media removed")
+
+def test_working_copy_keeps_other_sessions_out(dbfile):
+    """a session, the command line or a second working copy can not open the diary
+    while a working copy has it, and can once it is closed"""
+    copy_session = storage.StorageSession(dbfile, working_copy=True)
+    assert copy_session.connect() is not None
+    try:
+        with pytest.raises(DatabaseLockedError):
+            storage.StorageSession(dbfile).connect()
+        with pytest.raises(DatabaseLockedError):
+            storage.StorageSession(dbfile, working_copy=True).connect()
+    finally:
+        copy_session.close()
+    other = storage.StorageSession(dbfile)
+    try:
+        assert other.connect() is not None
+    finally:
+        other.close()
+
+def test_open_diary_keeps_the_working_copy_out(dbfile):
+    """a working copy is refused while another session has the file open, sessions
+    that open the file itself share it"""
+    session = storage.StorageSession(dbfile)
+    assert session.connect() is not None
+    second = storage.StorageSession(dbfile)
+    try:
+        assert second.connect() is not None
+        with pytest.raises(DatabaseLockedError):
+            storage.StorageSession(dbfile, working_copy=True).connect()
+    finally:
+        second.close()
+        session.close()
+
+@pytest.mark.parametrize("failing", ["fsync", "replace"])
+def test_failed_flush_leaves_the_file(dbfile, monkeypatch, failing):
+    """the file keeps the previous version and the temporary file is removed when
+    writing the new one fails, the changes stay in memory for the next flush"""
+    conn = sqlite3.connect(":memory:")
+    conn_lock = threading.Lock()
+    working_copy = WorkingCopy(dbfile)
+    working_copy.open(conn)
+    try:
+        before = file_bytes(dbfile)
+        conn.execute("create table written_later(value)")
+        conn.execute("insert into written_later values(1)")
+        conn.commit()
+        with monkeypatch.context() as patch:
+            patch.setattr(workingcopy.os, failing, media_removed)
+            with pytest.raises(OSError):
+                working_copy.flush(conn, conn_lock)
+        assert file_bytes(dbfile) == before
+        assert not os.path.exists(dbfile + workingcopy.TEMPORARY_SUFFIX)
+        assert working_copy.flush(conn, conn_lock)
+    finally:
+        working_copy.release()
+        conn.close()
+    written = sqlite3.connect(dbfile)
+    try:
+        assert written.execute("select value from written_later").fetchall() == [(1,)]
+    finally:
+        written.close()
+
+def test_session_reports_a_failed_flush(dbfile, user_key, monkeypatch):
+    """flush_working_copy returns False and the next one writes the changes"""
+    session = storage.StorageSession(dbfile, working_copy=True)
+    try:
+        session.create_journal(user_key, storage.USER_BOOK_ID, 0, "second", "second text")
+        before = file_bytes(dbfile)
+        with monkeypatch.context() as patch:
+            patch.setattr(workingcopy.os, "replace", media_removed)
+            assert not session.flush_working_copy(force=True)
+        assert file_bytes(dbfile) == before
+        assert session.flush_working_copy(force=True)
+        assert file_bytes(dbfile) != before
+    finally:
+        session.close()
@@ -21,11 +21,48 @@ LEAF_ONE_OF = "Leaf 1 of "
 LEAF_TWO_OF = "Leaf 2 of "
 SAMPLE_TEXT_1 = "sample text 1 of "
 SAMPLE_TEXT_2 = "sample text 2 of "
+PLEASE_WAIT = "Please wait"
+CREATING_KEY = "Creating encryption key"
+UPGRADING_DIARY = "Upgrading diary encryption"
 INVALID_PASSWORD = "Invalid password"
 TEXT_ABOUT = "&About"
+TEXT_DIAGNOSTICS = "&Diagnostics"
+DIAGNOSTICS = "Diagnostics"
+REFRESH = "Refresh"
+SAVE_TO_FILE = "Save to file"
+TEXT_CHANGE_PASSWORD = "&Change password"
+CHANGE_PASSWORD = "Change password"
+PASSWORD_CHANGED = "The password was changed"
+ENCRYPTING_DIARY = "Encrypting diary with the new password"
 TEXT_QUIT = "&Quit\tCtrl+Q"
 TEXT_ADD_LEAF = "&Add leaf\tCtrl+A"
 TEXT_REMOVE_LEAF = "&Remove leaf\tCtrl+D"
 TEXT_RENAME_LEAF = "&Rename leaf\tCtrl+R"
+TEXT_HISTORY = "&History\tCtrl+H"
+HISTORY = "History"
+CHOOSE_REVISION = "Older versions of the text"
+NO_REVISIONS = "There are no older versions of this leaf"
+RESTORE_REVISION = "Replace the text with this version? The current text stays in the history"
+TEXT_ATTACH_FILE = "A&ttach file..."
+TEXT_SAVE_ATTACHMENT = "&Save attachment..."
+TEXT_REMOVE_ATTACHMENT = "Remo&ve attachment..."
+ATTACH_FILE = "Attach file"
+ATTACHMENTS = "Attachments"
+NO_ATTACHMENTS = "This leaf has no attached files"
+CHOOSE_ATTACHMENT_TO_SAVE = "File to save"
+CHOOSE_ATTACHMENT_TO_REMOVE = "File to remove"
+REMOVE_ATTACHMENT = "Remove the attached file from the diary?"
+ENCRYPTING_FILE = "Encrypting file"
+DECRYPTING_FILE = "Decrypting file"
+ATTACHMENT_FAILED = "The file could not be processed"
+DIARY_IN_USE = "The diary is open in another window"
+WRITING_DIARY = "Writing the diary"
+DIARY_NOT_WRITTEN = "The last changes could not be written to the diary file, try again?"
+TEXT_NOT_SAVED = "The text of a leaf could not be saved, try again?"
+RECENTLY_EDITED = "Recently edited"
+TEXT_JUMP_TO_LEAF = "&Jump to leaf...\tCtrl+P"
+JUMP_TO_LEAF = "Jump to leaf"
+TYPE_LEAF_NAME = "Type words of the name of the leaf"
 TEXT_APPLICATION = "&Application"
+SEARCH = "Search"
 TEXT_TREE ="&Tree"
@@ -21,11 +21,48 @@ LEAF_ONE_OF = "hoja 1 de "
 LEAF_TWO_OF = "hoja 1 de "
 SAMPLE_TEXT_1 = "texto ejemplo de hoja 1 de "
 SAMPLE_TEXT_2 = "texto ejemplo de hoja 2 de "
+PLEASE_WAIT = "Por favor espere"
+CREATING_KEY = "Creando llave de cifrado"
+UPGRADING_DIARY = "Actualizando cifrado del diario"
 INVALID_PASSWORD = "Contraseña inválida"
 TEXT_ABOUT = "&Acerca de"
+TEXT_DIAGNOSTICS = "&Diagnóstico"
+DIAGNOSTICS = "Diagnóstico"
+REFRESH = "Actualizar"
+SAVE_TO_FILE = "Guardar en archivo"
+TEXT_CHANGE_PASSWORD = "&Cambiar contraseña"
+CHANGE_PASSWORD = "Cambiar contraseña"
+PASSWORD_CHANGED = "La contraseña fue cambiada"
+ENCRYPTING_DIARY = "Cifrando el diario con la nueva contraseña"
 TEXT_QUIT = "&Salir\tCtrl+Q"
 TEXT_ADD_LEAF = "&Agregar hoja\tCtrl+A"
 TEXT_REMOVE_LEAF = "&Remover hoja\tCtrl+D"
 TEXT_RENAME_LEAF = "&Renombrar hoja\tCtrl+R"
+TEXT_HISTORY = "&Historial\tCtrl+H"
+HISTORY = "Historial"
+CHOOSE_REVISION = "Versiones anteriores del texto"
+NO_REVISIONS = "No hay versiones anteriores de esta hoja"
+RESTORE_REVISION = "¿Reemplazar el texto con esta versión? El texto actual queda en el historial"
+TEXT_ATTACH_FILE = "Ad&juntar archivo..."
+TEXT_SAVE_ATTACHMENT = "&Guardar adjunto..."
+TEXT_REMOVE_ATTACHMENT = "&Quitar adjunto..."
+ATTACH_FILE = "Adjuntar archivo"
+ATTACHMENTS = "Adjuntos"
+NO_ATTACHMENTS = "Esta hoja no tiene archivos adjuntos"
+CHOOSE_ATTACHMENT_TO_SAVE = "Archivo a guardar"
+CHOOSE_ATTACHMENT_TO_REMOVE = "Archivo a quitar"
+REMOVE_ATTACHMENT = "¿Quitar el archivo adjunto del diario?"
+ENCRYPTING_FILE = "Cifrando el archivo"
+DECRYPTING_FILE = "Descifrando el archivo"
+ATTACHMENT_FAILED = "No se pudo procesar el archivo"
+DIARY_IN_USE = "El diario está abierto en otra ventana"
+WRITING_DIARY = "Escribiendo el diario"
+DIARY_NOT_WRITTEN = "No se pudieron escribir los últimos cambios en el diario, ¿intentar de nuevo?"
+TEXT_NOT_SAVED = "No se pudo guardar el texto de una hoja, ¿intentar de nuevo?"
+RECENTLY_EDITED = "Editado recientemente"
+TEXT_JUMP_TO_LEAF = "&Ir a la hoja...\tCtrl+P"
+JUMP_TO_LEAF = "Ir a la hoja"
+TYPE_LEAF_NAME = "Escriba palabras del nombre de la hoja"
 TEXT_APPLICATION = "&Aplicación"
+SEARCH = "Buscar"
 TEXT_TREE ="&Arbol"
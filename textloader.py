@@ -0,0 +1,111 @@
+"""
+Application: Maitenotas
+Made by Taksan Tong
+https://github.com/maitelab/maitenotas
+
+Background loading of big journal texts """
+import threading
+from typing import Callable, Iterator, Optional
+from instrument import report_exception
+
+# pieces handed over and not yet shown, the worker waits instead of decrypting
+# the whole text ahead of the screen
+MAX_PIECES_IN_FLIGHT = 2
+
+class TextLoader:
+    """Reads journal texts in a worker thread and hands them over a piece at a time,
+    so the first screen of a big text is shown at once and the rest follows.
+    Only the latest load is worked on: a new load, or cancel, makes the worker drop
+    the text it was reading. deliver_function(generation, journal_id, piece, finished)
+    runs in the worker thread, the receiver calls is_current to ignore the pieces of
+    a cancelled load and acknowledge when a piece was used"""
+    def __init__(self, read_function: Callable[[int], Iterator[str]],
+                 deliver_function: Callable[[int, int, str, bool], None]):
+        self.deliver_function = deliver_function
+        self.condition = threading.Condition()
+        # every load and cancel starts a new generation
+        self.generation = 0
+        self.pending_journal_id: Optional[int] = None
+        self.pieces_in_flight = 0
+        self.running = True
+        self.worker = threading.Thread(target=self.run, args=(read_function,), name="textloader",
+                                       daemon=True)
+        self.worker.start()
+
+    def load(self, journal_id: int) -> int:
+        """start reading a journal text, cancelling the one being read, return its generation"""
+        with self.condition:
+            self.generation = self.generation + 1
+            self.pending_journal_id = journal_id
+            self.pieces_in_flight = 0
+            self.condition.notify_all()
+            return self.generation
+
+    def cancel(self) -> None:
+        """stop reading the current text, its pieces still on the way are not current"""
+        with self.condition:
+            self.generation = self.generation + 1
+            self.pending_journal_id = None
+            self.pieces_in_flight = 0
+            self.condition.notify_all()
+
+    def is_current(self, generation: int) -> bool:
+        """True if the pieces of generation belong to the latest load"""
+        with self.condition:
+            return generation == self.generation
+
+    def acknowledge(self, generation: int) -> None:
+        """the receiver used a piece, the worker can hand over the next one"""
+        with self.condition:
+            if generation == self.generation and self.pieces_in_flight > 0:
+                self.pieces_in_flight = self.pieces_in_flight - 1
+                self.condition.notify_all()
+
+    def stop(self) -> None:
+        """cancel the current text and end the worker thread"""
+        with self.condition:
+            self.generation = self.generation + 1
+            self.pending_journal_id = None
+            self.running = False
+            self.condition.notify_all()
+        self.worker.join()
+
+    def hand_over(self, generation: int, journal_id: int, piece: str, finished: bool) -> bool:
+        """deliver a piece when the receiver has room for it, False if the load was
+        cancelled meanwhile"""
+        with self.condition:
+            while generation == self.generation and \
+                    self.pieces_in_flight >= MAX_PIECES_IN_FLIGHT:
+                self.condition.wait()
+            if generation != self.generation:
+                return False
+            self.pieces_in_flight = self.pieces_in_flight + 1
+        self.deliver_function(generation, journal_id, piece, finished)
+        return True
+
+    def run(self, read_function: Callable[[int], Iterator[str]]) -> None:
+        """worker thread loop"""
+        while True:
+            with self.condition:
+                while self.running and self.pending_journal_id is None:
+                    self.condition.wait()
+                if not self.running or self.pending_journal_id is None:
+                    return
+                journal_id = self.pending_journal_id
+                self.pending_journal_id = None
+                generation = self.generation
+            try:
+                pieces = read_function(journal_id)
+                piece = next(pieces, None)
+                if piece is None:
+                    self.hand_over(generation, journal_id, "", True)
+                    continue
+                while True:
+                    # the next piece is decrypted while the receiver shows this one
+                    next_piece = next(pieces, None)
+                    if not self.hand_over(generation, journal_id, piece, next_piece is None) \
+                            or next_piece is None:
+                        break
+                    piece = next_piece
+            except Exception as exception:
+                report_exception("textloader.load", exception)
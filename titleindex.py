@@ -0,0 +1,202 @@
+"""
+Application: Maitenotas
+Made by Taksan Tong
+https://github.com/maitelab/maitenotas
+
+Index of the names of the journals of the tree for the quick switcher. The names
+are kept in memory, decrypted, with a sorted array of (word, journal id) for every
+word of every name: the journals with a word starting with a prefix are one range
+of the array, found with two binary searches. A word of the query that starts no
+word of any name is taken as a typo and replaced by the words of the names that
+share most of its trigrams, found in a trigram index of the distinct words """
+import heapq
+import math
+import re
+import sys
+import unicodedata
+from bisect import bisect_left, bisect_right
+from collections import Counter
+from typing import Dict, Iterable, List, Sequence, Set, Tuple
+
+# part of the trigrams of a mistyped word that a word must have to replace it
+MIN_SIMILARITY = 0.5
+# words tried in place of a mistyped word
+MAX_SIMILAR_WORDS = 5
+# the journals matching a query are ranked by the length of their name, only this
+# many times the number of results are ranked again by the whole order
+SHORTLIST_FACTOR = 10
+# subtrees of this many journals are removed in one pass over the arrays
+BULK_REMOVE_TITLES = 100
+PATH_SEPARATOR = " / "
+WORD_PATTERN = re.compile(r"\w+")
+# after the last character of any word, the end of the range of a prefix
+PREFIX_END = "\U0010ffff"
+
+def normalize(text: str) -> str:
+    """lower case without accents, so "cancion" finds "Canción" and the other way"""
+    text = text.casefold()
+    if text.isascii():
+        return text
+    decomposed = unicodedata.normalize("NFKD", text)
+    return "".join(char for char in decomposed if not unicodedata.combining(char))
+
+def name_words(key: str) -> Set[str]:
+    """distinct words of a normalized name, interned: the same word of many names
+    is one string"""
+    return {sys.intern(word) for word in WORD_PATTERN.findall(key)}
+
+def word_trigrams(word: str) -> Set[str]:
+    """trigrams of a word padded with spaces (like pg_trgm), so words of one or two
+    letters still have trigrams and the start of a word weighs more"""
+    padded = "  " + word + " "
+    return {padded[position:position + 3] for position in range(len(padded) - 2)}
+
+class TitleIndex:
+    """Names, parents and words of the journals of the tree"""
+    def __init__(self, leafs: Iterable[Sequence]):
+        self.names: Dict[int, str] = {}
+        self.keys: Dict[int, str] = {}
+        self.parents: Dict[int, int] = {}
+        # length of each name, the first order of the journals found
+        self.lengths: Dict[int, int] = {}
+        entries: List[Tuple[str, int]] = []
+        for parent_id, journal_id, journal_name in leafs:
+            key = normalize(journal_name)
+            self.names[journal_id] = journal_name
+            self.keys[journal_id] = key
+            self.parents[journal_id] = parent_id
+            self.lengths[journal_id] = len(key)
+            entries.extend((word, journal_id) for word in name_words(key))
+        entries.sort()
+        # the array of (word, journal id) as two lists, the ranges of ids are slices
+        self.entry_words: List[str] = [word for word, _ in entries]
+        self.entry_ids: List[int] = [journal_id for _, journal_id in entries]
+        self.word_postings: Dict[str, Set[str]] = {}
+        for word in set(self.entry_words):
+            self.add_word(word)
+
+    def add_word(self, word: str) -> None:
+        """add a distinct word to the trigram index"""
+        for trigram in word_trigrams(word):
+            self.word_postings.setdefault(trigram, set()).add(word)
+
+    def remove_word(self, word: str) -> None:
+        """remove a distinct word that no name has anymore from the trigram index"""
+        for trigram in word_trigrams(word):
+            postings = self.word_postings[trigram]
+            postings.discard(word)
+            if not postings:
+                del self.word_postings[trigram]
+
+    def word_range(self, word: str) -> Tuple[int, int]:
+        """range of the entries of a word"""
+        return bisect_left(self.entry_words, word), bisect_right(self.entry_words, word)
+
+    def add_title(self, parent_id: int, journal_id: int, journal_name: str) -> None:
+        """add a journal under parent_id (0 for the top of the tree)"""
+        key = normalize(journal_name)
+        self.names[journal_id] = journal_name
+        self.keys[journal_id] = key
+        self.parents[journal_id] = parent_id
+        self.lengths[journal_id] = len(key)
+        for word in name_words(key):
+            low, high = self.word_range(word)
+            if low == high:
+                self.add_word(word)
+            position = bisect_left(self.entry_ids, journal_id, low, high)
+            self.entry_words.insert(position, word)
+            self.entry_ids.insert(position, journal_id)
+
+    def remove_title(self, journal_id: int) -> None:
+        """forget a journal, the journals under it keep their parent"""
+        key = self.keys.pop(journal_id, None)
+        if key is None:
+            return
+        for word in name_words(key):
+            low, high = self.word_range(word)
+            position = bisect_left(self.entry_ids, journal_id, low, high)
+            if position < high and self.entry_ids[position] == journal_id:
+                del self.entry_words[position]
+                del self.entry_ids[position]
+                if high - low == 1:
+                    self.remove_word(word)
+        del self.names[journal_id]
+        del self.parents[journal_id]
+        del self.lengths[journal_id]
+
+    def rename_title(self, journal_id: int, journal_name: str) -> None:
+        """change the name of a journal"""
+        if journal_id in self.keys:
+            parent_id = self.parents[journal_id]
+            self.remove_title(journal_id)
+            self.add_title(parent_id, journal_id, journal_name)
+
+    def remove_titles(self, journal_ids: List[int]) -> None:
+        """forget deleted journals, journal_ids is a whole subtree. Each removal moves
+        the end of the arrays, a big subtree is removed in one pass instead"""
+        if len(journal_ids) < BULK_REMOVE_TITLES:
+            for journal_id in journal_ids:
+                self.remove_title(journal_id)
+            return
+        removed = set(journal_ids)
+        for journal_id in removed & self.keys.keys():
+            del self.names[journal_id]
+            del self.keys[journal_id]
+            del self.parents[journal_id]
+            del self.lengths[journal_id]
+        entries = [(word, journal_id) for word, journal_id in
+                   zip(self.entry_words, self.entry_ids) if journal_id not in removed]
+        for word in set(self.entry_words).difference(word for word, _ in entries):
+            self.remove_word(word)
+        self.entry_words = [word for word, _ in entries]
+        self.entry_ids = [journal_id for _, journal_id in entries]
+
+    def path(self, journal_id: int) -> str:
+        """names of the journals from the top of the tree down to journal_id"""
+        names: List[str] = []
+        while journal_id in self.names and len(names) <= len(self.names):
+            names.append(self.names[journal_id])
+            journal_id = self.parents[journal_id]
+        return PATH_SEPARATOR.join(reversed(names))
+
+    def similar_words(self, word: str) -> List[str]:
+        """the words of the names that share most of the trigrams of a mistyped word"""
+        trigrams = word_trigrams(word)
+        counts: Counter = Counter()
+        for trigram in trigrams:
+            counts.update(self.word_postings.get(trigram, ()))
+        needed = math.ceil(len(trigrams) * MIN_SIMILARITY)
+        return [similar_word for similar_word, count in counts.most_common(MAX_SIMILAR_WORDS)
+                if count >= needed]
+
+    def word_matches(self, word: str) -> Set[int]:
+        """journals with a word starting with word, or with a word like it"""
+        low = bisect_left(self.entry_words, word)
+        high = bisect_right(self.entry_words, word + PREFIX_END, low)
+        if low < high:
+            return set(self.entry_ids[low:high])
+        found: Set[int] = set()
+        for similar_word in self.similar_words(word):
+            low, high = self.word_range(similar_word)
+            found.update(self.entry_ids[low:high])
+        return found
+
+    def find(self, query: str, limit: int) -> List[Tuple[int, str, str]]:
+        """(id, name, path) of up to limit journals with a word starting with each
+        word of the query. Names starting with the query come first, then the
+        shortest names"""
+        key = normalize(query)
+        found: Set[int] = set()
+        for position, word in enumerate(sorted(set(WORD_PATTERN.findall(key)), key=len,
+                                               reverse=True)):
+            # the longest words first, they have the fewest journals
+            word_found = self.word_matches(word)
+            found = word_found if position == 0 else found & word_found
+            if not found:
+                return []
+        shortlist = heapq.nsmallest(limit * SHORTLIST_FACTOR, found,
+                                    key=self.lengths.__getitem__)
+        shortlist.sort(key=lambda journal_id: (not self.keys[journal_id].startswith(key),
+                                               len(self.keys[journal_id]), journal_id))
+        return [(journal_id, self.names[journal_id], self.path(journal_id))
+                for journal_id in shortlist[:limit]]
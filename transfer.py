@@ -0,0 +1,318 @@
+"""
+Application: Maitenotas
+Made by Taksan Tong
+https://github.com/maitelab/maitenotas
+
+Bulk export and import of a whole book or of the leafs under one journal, to an
+encrypted archive file or to a directory of plain text files. Both directions
+stream the journals, so the memory used does not grow with the size of the book """
+import json
+import os
+import re
+import struct
+from typing import BinaryIO, Dict, Iterator, List, Optional, Set, Tuple
+from cryptography.fernet import Fernet
+from crypto import encrypt_text_to_data, decrypt_data_to_text, encrypt_data, decrypt_data,\
+    derive_user_key, calibrate_iterations, new_kdf_parameters, encode_kdf_parameters,\
+    decode_kdf_parameters
+import chunks
+import search
+import storage
+
+# ***************** SQL
+SQL_READ_SUBTREE = """
+with recursive subtree(id, parent_id, depth) as (
+    select id, parent_id, 0 from journal where book_id=? and parent_id=?
+    union all
+    select j.id, j.parent_id, s.depth + 1
+    from journal j join subtree s on j.parent_id=s.id
+    where j.book_id=?
+)
+select id, parent_id
+from subtree
+order by depth, id
+"""
+
+SQL_READ_EXPORT_JOURNAL = """
+select journal_name,journal_text,chunked
+from journal
+where id=?
+"""
+
+SQL_READ_NEXT_JOURNAL_ID = """
+select max(coalesce((select seq from sqlite_sequence where name='journal'), 0),
+           coalesce((select max(id) from journal), 0)) + 1
+"""
+
+SQL_INSERT_JOURNAL_WITH_ID = """
+INSERT INTO journal(id,book_id,parent_id,journal_name,journal_text)
+VALUES(?,?,?,?,?)"""
+
+# archive file: ARCHIVE_MAGIC, the key derivation parameters of the archive password
+# and then records, every length is a 4 bytes big endian integer
+#   length + parameters (json, not encrypted)
+#   length + record encrypted with the archive key, one per journal and text piece
+# the last record counts the journals, a truncated archive is detected with it
+ARCHIVE_MAGIC = b"MAITENOTAS-ARCHIVE-1\n"
+LENGTH_FORMAT = ">I"
+LENGTH_SIZE = struct.calcsize(LENGTH_FORMAT)
+
+# extension of the files written by export_directory, import_directory also reads .txt
+TEXT_EXTENSION = ".md"
+IMPORT_EXTENSIONS = (".md", ".txt")
+# characters not allowed in file names on some of the supported systems
+UNSAFE_NAME_PATTERN = re.compile(r'[\\/:*?"<>|\x00-\x1f]')
+MAX_FILE_NAME_CHARS = 120
+
+# journals imported are inserted this many at a time, or earlier if their texts
+# reach IMPORT_BATCH_CHARS, that bounds the memory used by an import
+IMPORT_BATCH_SIZE = 512
+IMPORT_BATCH_CHARS = 8 * 1024 * 1024
+
+def iter_subtree(session: storage.StorageSession, user_key: Fernet, cur,
+                 book_id: int, parent_id: int) -> Iterator[Tuple[int, int, str, Iterator[str]]]:
+    """(id, parent_id, name, text pieces) of every journal under parent_id (0 for the
+    whole book), parents always come before their children, only the ids of the
+    subtree are kept in memory, texts are read when their pieces are consumed"""
+    structure = cur.execute(SQL_READ_SUBTREE, (book_id, parent_id, book_id)).fetchall()
+    for journal_id, journal_parent_id in structure:
+        for journal_name, journal_text, chunked in \
+                cur.execute(SQL_READ_EXPORT_JOURNAL, (journal_id,)).fetchall():
+            name = session.decrypt_journal_names(user_key, [(journal_id, journal_name)])[journal_id]
+            if chunked:
+                pieces = chunks.iter_chunks(
+                    lambda sql, parameters: cur.execute(sql, parameters).fetchall(),
+                    user_key, journal_id)
+            else:
+                pieces = iter([decrypt_data_to_text(journal_text, user_key)])
+            yield journal_id, journal_parent_id, name, pieces
+
+def write_record(archive: BinaryIO, record_data: bytes) -> None:
+    """write one length prefixed record"""
+    archive.write(struct.pack(LENGTH_FORMAT, len(record_data)))
+    archive.write(record_data)
+
+def read_record(archive: BinaryIO) -> Optional[bytes]:
+    """read one length prefixed record, None at the end of the file"""
+    length_data = archive.read(LENGTH_SIZE)
+    if not length_data:
+        return None
+    if len(length_data) < LENGTH_SIZE:
+        raise ValueError("truncated archive")
+    length = struct.unpack(LENGTH_FORMAT, length_data)[0]
+    record_data = archive.read(length)
+    if len(record_data) < length:
+        raise ValueError("truncated archive")
+    return record_data
+
+def export_archive(session: storage.StorageSession, user_key: Fernet, book_id: int,
+                   parent_id: int, archive_file: str, *, archive_password: str,
+                   iterations: Optional[int] = None) -> int:
+    """write the journals under parent_id (0 for the whole book) to an archive
+    encrypted with its own password, return the number of journals written. The
+    archive key is derived with iterations, by default the ones of the diary, so an
+    export does not calibrate them again"""
+    if iterations is None:
+        diary_parameters = storage.DatabaseKey(session).read_kdf_parameters()
+        iterations = diary_parameters.iterations if diary_parameters is not None else \
+            calibrate_iterations()
+    kdf_parameters = new_kdf_parameters(iterations)
+    archive_key = derive_user_key(archive_password, kdf_parameters)
+    journal_count = 0
+    with open(archive_file, "wb") as archive:
+        archive.write(ARCHIVE_MAGIC)
+        write_record(archive, encode_kdf_parameters(kdf_parameters))
+        # one read transaction, the archive is a consistent snapshot
+        with session.transaction() as cur:
+            for journal_id, journal_parent_id, name, pieces in \
+                    iter_subtree(session, user_key, cur, book_id, parent_id):
+                record = {"id": journal_id, "parent": journal_parent_id, "name": name}
+                write_record(archive, encrypt_data(json.dumps(record).encode(encoding='UTF-8'),
+                                                   archive_key))
+                for piece in pieces:
+                    write_record(archive, encrypt_text_to_data(
+                        json.dumps({"id": journal_id, "text": piece}), archive_key))
+                journal_count = journal_count + 1
+        write_record(archive, encrypt_text_to_data(json.dumps({"end": journal_count}),
+                                                   archive_key))
+    return journal_count
+
+def iter_archive(archive_file: str, archive_password: str) -> Iterator[Tuple[int, int, str, str]]:
+    """(archive id, archive parent id, name, text) of every journal of an archive"""
+    with open(archive_file, "rb") as archive:
+        if archive.read(len(ARCHIVE_MAGIC)) != ARCHIVE_MAGIC:
+            raise ValueError("not a maitenotas archive " + archive_file)
+        parameters_data = read_record(archive)
+        if parameters_data is None:
+            raise ValueError("truncated archive")
+        archive_key = derive_user_key(archive_password, decode_kdf_parameters(parameters_data))
+        current: Optional[Dict] = None
+        pieces: List[str] = []
+        while True:
+            record_data = read_record(archive)
+            if record_data is None:
+                raise ValueError("truncated archive")
+            record = json.loads(decrypt_data(record_data, archive_key).decode(encoding='UTF-8'))
+            if "text" in record:
+                pieces.append(record["text"])
+                continue
+            if current is not None:
+                yield current["id"], current["parent"], current["name"], "".join(pieces)
+            if "end" in record:
+                return
+            current, pieces = record, []
+
+def safe_file_name(name: str, used_names: Set[str]) -> str:
+    """file name for a journal name, unique among its siblings"""
+    base_name = UNSAFE_NAME_PATTERN.sub("_", name).strip(" .")[:MAX_FILE_NAME_CHARS] or "_"
+    file_name = base_name
+    counter = 1
+    while file_name.lower() in used_names:
+        counter = counter + 1
+        file_name = f"{base_name} ({counter})"
+    used_names.add(file_name.lower())
+    return file_name
+
+def export_directory(session: storage.StorageSession, user_key: Fernet, book_id: int,
+                     parent_id: int, directory: str) -> int:
+    """write the journals under parent_id (0 for the whole book) as text files,
+    a journal with children also gets a directory with the same name holding them,
+    return the number of journals written"""
+    os.makedirs(directory, exist_ok=True)
+    # directory of each exported journal and names already used in each directory
+    journal_paths: Dict[int, str] = {parent_id: directory}
+    used_names: Dict[str, Set[str]] = {}
+    journal_count = 0
+    with session.transaction() as cur:
+        for journal_id, journal_parent_id, name, pieces in \
+                iter_subtree(session, user_key, cur, book_id, parent_id):
+            parent_path = journal_paths[journal_parent_id]
+            os.makedirs(parent_path, exist_ok=True)
+            file_name = safe_file_name(name, used_names.setdefault(parent_path, set()))
+            with open(os.path.join(parent_path, file_name + TEXT_EXTENSION), "w",
+                      encoding='UTF-8', newline='') as text_file:
+                for piece in pieces:
+                    text_file.write(piece)
+            journal_paths[journal_id] = os.path.join(parent_path, file_name)
+            journal_count = journal_count + 1
+    return journal_count
+
+def iter_directory(directory: str) -> Iterator[Tuple[str, str, str, bool]]:
+    """(path, parent path, name, is directory) of the journals of a directory tree,
+    parents before their children, path is the directory of the journal or its text file"""
+    pending = [directory]
+    while pending:
+        current = pending.pop()
+        with os.scandir(current) as entries:
+            entry_list = sorted(entries, key=lambda entry: entry.name.lower())
+        directory_names = {entry.name for entry in entry_list if entry.is_dir()}
+        for entry in entry_list:
+            name, extension = os.path.splitext(entry.name)
+            if entry.is_dir():
+                yield entry.path, current, entry.name, True
+                pending.append(entry.path)
+            elif extension.lower() in IMPORT_EXTENSIONS and name not in directory_names:
+                yield entry.path, current, name, False
+
+def read_journal_file(journal_path: str) -> str:
+    """text of a journal found by iter_directory, a directory takes the text of the
+    file with its name next to it"""
+    if os.path.isdir(journal_path):
+        for extension in IMPORT_EXTENSIONS:
+            if os.path.isfile(journal_path + extension):
+                journal_path = journal_path + extension
+                break
+        else:
+            return ""
+    with open(journal_path, "r", encoding='UTF-8', newline='') as text_file:
+        return text_file.read()
+
+class JournalImporter:
+    """Inserts many new journals in the transaction of cur. Journal ids are given
+    before the insert so the rows are written in batches with executemany"""
+    def __init__(self, session: storage.StorageSession, user_key: Fernet, cur, book_id: int):
+        self.session = session
+        self.user_key = user_key
+        self.cur = cur
+        self.book_id = book_id
+        # hashes of the words indexed, many journals share most of their words. None
+        # for a database without a complete index, it is indexed again on the first search
+        self.hash_cache: Optional[Dict[str, bytes]] = None
+        if storage.read_metadata(cur, storage.METADATA_SEARCH_INDEX_READY) is not None:
+            self.hash_cache = {}
+        self.batch: List[Tuple[int, int, str, str]] = []
+        self.batch_chars = 0
+
+    def add(self, parent_id: int, journal_name: str, journal_text: str) -> int:
+        """queue a new journal, return the id it will have"""
+        # the ids of a batch follow the last id in the database
+        journal_id = self.batch[-1][0] + 1 if self.batch else \
+            self.cur.execute(SQL_READ_NEXT_JOURNAL_ID).fetchone()[0]
+        self.batch.append((journal_id, parent_id, journal_name, journal_text))
+        self.batch_chars = self.batch_chars + len(journal_text)
+        if len(self.batch) >= IMPORT_BATCH_SIZE or self.batch_chars >= IMPORT_BATCH_CHARS:
+            self.flush()
+        return journal_id
+
+    def flush(self) -> None:
+        """insert the queued journals"""
+        rows = []
+        big_texts = []
+        for journal_id, parent_id, journal_name, journal_text in self.batch:
+            if len(journal_text) >= chunks.CHUNKED_MIN_CHARS:
+                encrypted_text = b''
+                big_texts.append((journal_id, journal_text))
+            else:
+                encrypted_text = encrypt_text_to_data(journal_text, self.user_key)
+            rows.append((journal_id, self.book_id, parent_id,
+                         encrypt_text_to_data(journal_name, self.user_key), encrypted_text))
+        self.cur.executemany(SQL_INSERT_JOURNAL_WITH_ID, rows)
+        # the tree in memory does not have the imported journals, it is read again
+        self.session.tree.changed(self.cur, snapshot_updated=False)
+        for journal_id, journal_text in big_texts:
+            self.session.write_journal_text(self.cur, self.user_key, journal_id, journal_text)
+        if self.hash_cache is not None:
+            fields = [(journal_id, search.FIELD_NAME, journal_name)
+                      for journal_id, _, journal_name, _ in self.batch]
+            fields.extend((journal_id, search.FIELD_TEXT, journal_text)
+                          for journal_id, _, _, journal_text in self.batch
+                          if len(journal_text) < chunks.CHUNKED_MIN_CHARS)
+            search.index_new_fields(self.cur, self.session.get_search_key(self.cur, self.user_key),
+                                    fields, self.hash_cache)
+        self.batch = []
+        self.batch_chars = 0
+
+def import_archive(session: storage.StorageSession, user_key: Fernet, book_id: int,
+                   parent_id: int, archive_file: str, *, archive_password: str) -> int:
+    """add the journals of an archive under parent_id (0 for the top of the book),
+    all or nothing, return the number of journals added"""
+    with session.transaction() as cur:
+        importer = JournalImporter(session, user_key, cur, book_id)
+        new_ids: Dict[int, int] = {}
+        journal_count = 0
+        for archive_id, archive_parent_id, name, text in \
+                iter_archive(archive_file, archive_password):
+            new_ids[archive_id] = importer.add(new_ids.get(archive_parent_id, parent_id),
+                                               name, text)
+            journal_count = journal_count + 1
+        importer.flush()
+    return journal_count
+
+def import_directory(session: storage.StorageSession, user_key: Fernet, book_id: int,
+                     parent_id: int, directory: str) -> int:
+    """add the text files (.md and .txt) of a directory tree under parent_id (0 for the
+    top of the book), sub directories become journals with children, all or nothing,
+    return the number of journals added"""
+    with session.transaction() as cur:
+        importer = JournalImporter(session, user_key, cur, book_id)
+        # only directories can be parents
+        new_ids = {directory: parent_id}
+        journal_count = 0
+        for journal_path, parent_path, name, is_directory in iter_directory(directory):
+            journal_id = importer.add(new_ids[parent_path], name,
+                                      read_journal_file(journal_path))
+            journal_count = journal_count + 1
+            if is_directory:
+                new_ids[journal_path] = journal_id
+        importer.flush()
+    return journal_count
@@ -0,0 +1,62 @@
+"""
+Application: Maitenotas
+Made by Taksan Tong
+https://github.com/maitelab/maitenotas
+
+Snapshot of the tree of journals: ids, parents and names of every journal and the
+leafs expanded in screen. It is stored as one encrypted blob, so opening the diary
+reads and decrypts one value instead of every journal name. The snapshot keeps the
+generation of the tree it was made from, the write paths count every change of the
+tree and a snapshot of an older generation is rebuilt from the journal table """
+import json
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+class TreeSnapshot:
+    """Journals of the tree in memory, children in the order of their ids"""
+    def __init__(self, leafs: Iterable[Sequence], expanded: Iterable[int] = ()):
+        self.names: Dict[int, str] = {}
+        self.children: Dict[int, List[int]] = {}
+        for parent_id, journal_id, journal_name in sorted(leafs, key=lambda leaf: leaf[1]):
+            self.add_leaf(parent_id, journal_id, journal_name)
+        self.expanded = [journal_id for journal_id in expanded if journal_id in self.names]
+
+    def add_leaf(self, parent_id: int, journal_id: int, journal_name: str) -> None:
+        """add a journal under parent_id (0 for the top of the tree)"""
+        self.names[journal_id] = journal_name
+        self.children.setdefault(parent_id, []).append(journal_id)
+
+    def rename_leaf(self, journal_id: int, journal_name: str) -> None:
+        """change the name of a journal"""
+        if journal_id in self.names:
+            self.names[journal_id] = journal_name
+
+    def remove_leafs(self, journal_ids: List[int]) -> None:
+        """remove deleted journals, journal_ids is a whole subtree"""
+        removed = set(journal_ids)
+        for journal_id in journal_ids:
+            self.names.pop(journal_id, None)
+            self.children.pop(journal_id, None)
+        for parent_id, child_ids in self.children.items():
+            if any(child_id in removed for child_id in child_ids):
+                self.children[parent_id] = [child_id for child_id in child_ids
+                                            if child_id not in removed]
+
+    def child_leafs(self, parent_id: int) -> List[Tuple[int, str, bool]]:
+        """(id, name, has_children) of the direct children of a journal"""
+        return [(child_id, self.names[child_id], bool(self.children.get(child_id)))
+                for child_id in self.children.get(parent_id, [])]
+
+    def leafs(self) -> List[List]:
+        """[parent id, id, name] of every journal"""
+        return [[parent_id, child_id, self.names[child_id]]
+                for parent_id, child_ids in self.children.items() for child_id in child_ids]
+
+    def encode(self, generation: int) -> str:
+        """text of the snapshot, it is encrypted by storage"""
+        return json.dumps({"generation": generation, "leafs": self.leafs(),
+                           "expanded": self.expanded}, ensure_ascii=False)
+
+def decode_snapshot(snapshot_text: str) -> Tuple[int, TreeSnapshot]:
+    """generation and snapshot of a text made by encode"""
+    values = json.loads(snapshot_text)
+    return values["generation"], TreeSnapshot(values["leafs"], values["expanded"])
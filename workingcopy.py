@@ -0,0 +1,198 @@
+"""
+Application: Maitenotas
+Made by Taksan Tong
+https://github.com/maitelab/maitenotas
+
+Working copy of a database in memory, for diaries kept on slow or removable
+media (network shares, USB sticks). The file is copied to memory when it is
+opened, every read and write runs in memory and the changes are written back
+as a whole new file renamed over the old one, so the file on the media is
+always either the previous version or the new one. A lock file, shared by the
+sessions that open the file itself, keeps any other instance from opening the
+same diary meanwhile """
+import os
+import random
+import sqlite3
+import threading
+import time
+from typing import IO, Optional
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None # type: ignore
+try:
+    import msvcrt
+except ImportError:
+    msvcrt = None # type: ignore
+
+# the changes are written back when nothing changed for this many seconds
+IDLE_FLUSH_SECONDS = 5.0
+# or when they are this old, even while the user keeps writing
+MAX_FLUSH_SECONDS = 60.0
+# names of the lock file and of the new file before it replaces the database
+LOCK_SUFFIX = ".lock"
+TEMPORARY_SUFFIX = ".tmp"
+# pages copied by each step of a backup
+BACKUP_PAGES = 1024
+# bytes of the lock file locked on Windows, and free ones tried by a shared lock
+LOCK_SLOTS = 1024
+SHARED_LOCK_TRIES = 32
+
+class DatabaseLockedError(Exception):
+    """another instance has the working copy of the database open"""
+
+class FileLock:
+    """Lock file of a database. A working copy locks it exclusively, the other
+    sessions share it, so a working copy never replaces a file that another session
+    is writing and nobody writes a file kept in memory by a working copy. The
+    operating system releases the lock if the process dies, so a lock file left
+    behind does not block anybody. Windows has no shared locks: the exclusive lock
+    covers LOCK_SLOTS bytes and every shared lock takes one of them"""
+    def __init__(self, lock_name: str, shared: bool = False):
+        self.shared = shared
+        self.position = 0
+        # pylint: disable-next=consider-using-with
+        self.handle: Optional[IO[bytes]] = open(lock_name, "a+b")
+        try:
+            if fcntl is not None:
+                fcntl.flock(self.handle.fileno(),
+                            (fcntl.LOCK_SH if shared else fcntl.LOCK_EX) | fcntl.LOCK_NB)
+            elif msvcrt is not None:
+                self.lock_windows()
+            if not shared:
+                self.handle.seek(0)
+                self.handle.truncate()
+                self.handle.write(str(os.getpid()).encode(encoding='UTF-8'))
+                self.handle.flush()
+        except OSError as exception:
+            self.handle.close()
+            self.handle = None
+            raise DatabaseLockedError("the diary is open in another instance that keeps it "
+                                      "in memory (" + lock_name + ")" if shared else
+                                      "the diary is open in another instance: " +
+                                      lock_name) from exception
+
+    def lock_windows(self) -> None:
+        """lock all the slots, or one free slot for a shared lock"""
+        assert self.handle is not None
+        if not self.shared:
+            self.handle.seek(0)
+            msvcrt.locking(self.handle.fileno(), msvcrt.LK_NBLCK, LOCK_SLOTS) # type: ignore
+            return
+        for position in random.sample(range(1, LOCK_SLOTS), SHARED_LOCK_TRIES):
+            self.handle.seek(position)
+            try:
+                msvcrt.locking(self.handle.fileno(), msvcrt.LK_NBLCK, 1) # type: ignore
+            except OSError:
+                continue
+            self.position = position
+            return
+        raise OSError("no free slot in the lock file")
+
+    def release(self) -> None:
+        """release the lock, the file stays: removing it could let the next two
+        instances lock two different files"""
+        if self.handle is None:
+            return
+        if fcntl is not None:
+            fcntl.flock(self.handle.fileno(), fcntl.LOCK_UN)
+        elif msvcrt is not None:
+            self.handle.seek(self.position)
+            msvcrt.locking(self.handle.fileno(), msvcrt.LK_UNLCK, # type: ignore
+                           1 if self.shared else LOCK_SLOTS)
+        self.handle.close()
+        self.handle = None
+
+def shared_lock(dbfile: str) -> Optional[FileLock]:
+    """shared lock of a database file opened by a session, DatabaseLockedError while
+    a working copy of another instance has it. None on read only media, where no
+    working copy could take the lock either"""
+    try:
+        return FileLock(dbfile + LOCK_SUFFIX, shared=True)
+    except OSError:
+        return None
+
+class WorkingCopy:
+    """Loads a database file into a memory connection and writes it back.
+    Changes are counted with total_changes of the connection: they are written
+    back after IDLE_FLUSH_SECONDS without changes or MAX_FLUSH_SECONDS after the
+    first change not written"""
+    def __init__(self, dbfile: str):
+        self.dbfile = dbfile
+        self.file_lock: Optional[FileLock] = None
+        # one flush at a time, the copy to the file runs without the session lock
+        self.flush_lock = threading.Lock()
+        # (total changes, monotonic time) when the file was last written, and when the
+        # number of changes was last seen to grow
+        self.flushed = (0, time.monotonic())
+        self.seen = self.flushed
+        self.counters = {"flushes": 0, "bytes_written": 0}
+
+    def open(self, conn: sqlite3.Connection) -> None:
+        """lock the database file and copy it into conn, an empty memory connection"""
+        self.file_lock = FileLock(self.dbfile + LOCK_SUFFIX)
+        try:
+            if os.path.exists(self.dbfile):
+                source = sqlite3.connect(self.dbfile)
+                try:
+                    source.backup(conn, pages=BACKUP_PAGES)
+                finally:
+                    source.close()
+        except BaseException:
+            self.release()
+            raise
+        self.flushed = self.seen = (conn.total_changes, time.monotonic())
+
+    def flush_due(self, conn: sqlite3.Connection) -> bool:
+        """True if the changes of conn should be written now, called periodically"""
+        now = time.monotonic()
+        changes = conn.total_changes
+        if changes != self.seen[0]:
+            self.seen = (changes, now)
+        if changes == self.flushed[0]:
+            self.flushed = (changes, now)
+            return False
+        return now - self.seen[1] >= IDLE_FLUSH_SECONDS or \
+            now - self.flushed[1] >= MAX_FLUSH_SECONDS
+
+    def flush(self, conn: sqlite3.Connection, conn_lock) -> bool:
+        """write the changes of conn to a new file renamed over the database file.
+        conn is copied in memory holding conn_lock, the lock of its users, and the
+        slow write to the media runs without it. Return False if nothing changed"""
+        with self.flush_lock:
+            with conn_lock:
+                changes = conn.total_changes
+                if changes == self.flushed[0]:
+                    return False
+                copy = sqlite3.connect(":memory:")
+                conn.backup(copy)
+            temporary_name = self.dbfile + TEMPORARY_SUFFIX
+            try:
+                if os.path.exists(temporary_name):
+                    os.remove(temporary_name)
+                target = sqlite3.connect(temporary_name)
+                try:
+                    copy.backup(target, pages=BACKUP_PAGES)
+                finally:
+                    target.close()
+                # the data must be on the media before the rename makes it the database
+                with open(temporary_name, "rb+") as temporary_file:
+                    os.fsync(temporary_file.fileno())
+                self.counters["bytes_written"] += os.path.getsize(temporary_name)
+                os.replace(temporary_name, self.dbfile)
+            except BaseException:
+                if os.path.exists(temporary_name):
+                    os.remove(temporary_name)
+                raise
+            finally:
+                copy.close()
+            self.flushed = (changes, time.monotonic())
+            self.counters["flushes"] += 1
+        return True
+
+    def release(self) -> None:
+        """release the lock of the database file"""
+        if self.file_lock is not None:
+            self.file_lock.release()
+            self.file_lock = None